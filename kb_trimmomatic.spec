@@ -5,6 +5,8 @@ This module contains two methods
 runTrimmomatic() to backend a KBase App, potentially operating on ReadSets
 execTrimmomatic() the local method that handles overloading Trimmomatic to run on a set or a single library
 execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
+execTrimmomaticBatch() trims many libraries, each with its own params, in one call
+sweepTrimmomatic() compares trimming parameter sets on a subsample of a library
 */
 
 module kb_trimmomatic {
@@ -25,7 +27,7 @@ module kb_trimmomatic {
     } SlidingWindow_Options;
 
     typedef structure {
-        string adapterFa;
+        string adapterFa;  /* file in the Trimmomatic adapters dir, or auto to detect from the reads */
         int seed_mismatches;
         int palindrome_clip_threshold;
         int simple_clip_threshold;
@@ -46,7 +48,7 @@ module kb_trimmomatic {
 	data_obj_name output_reads_name;
 
         string                read_type;
-        string                quality_encoding;
+        string                quality_encoding;  /* phred33, phred64, or auto to detect from the reads */
 	AdapterClip_Options   adapter_clip;
 	SlidingWindow_Options sliding_window;
         int leading_min_quality;
@@ -54,6 +56,28 @@ module kb_trimmomatic {
         int crop_length;
         int head_crop_length;
         int min_length;
+        int run_qc;  /* 1 to compute read QC metrics for inputs and outputs and plot them in the report */
+        int preview;  /* 1 to trim only a subsample and report predicted results, without saving reads */
+        int preview_reads;  /* subsample size for preview, default 100000 */
+        string preview_mode;  /* first or random, default first */
+        string engine;  /* jar (default) runs Trimmomatic, native runs the numpy implementation of the quality steps,
+                          chunked runs it on batches of the reads in worker processes on every core; native and
+                          chunked only where verified against the jar (verified-engines); auto picks the verified
+                          engine with the lowest estimated run time */
+        int fail_soft;  /* 1 to leave libraries that keep failing out of the output sets instead of failing the run */
+        int library_retries;  /* retries per failed library, with backoff; default 2 with fail_soft, otherwise 0 */
+        int max_child_jobs;  /* for a ReadsSet, run the libraries as up to this many concurrent child jobs
+                                when that is estimated to finish sooner; default 0 runs them all in this job */
+        int num_threads;  /* for a ReadsSet, libraries trimmed at once in this job, within the scratch and memory
+                             limits and sharing the cores by their size, default 1 */
+        string no_trim_output;  /* when trimming keeps every read whole: upload (default) saves the output as usual,
+                                   reuse returns the input reads as the output, copy saves a workspace copy of
+                                   the input object that shares its reads files */
+        int merge_unpaired;  /* 1 to save the unpaired forward and reverse reads of a PE library as one
+                                SingleEndLibrary, <output_reads_name>_unpaired */
+        int min_unpaired_reads;  /* unpaired outputs with fewer reads than this aren't saved, default 0 */
+        int interleaved;  /* 1 to trim a PE library from its interleaved file, without splitting the mates, and
+                             upload the paired output interleaved when the engine can write it so (native, chunked) */
     } runTrimmomaticInput;
 
     typedef structure {
@@ -88,13 +112,38 @@ module kb_trimmomatic {
         int crop_length;
         int head_crop_length;
         int min_length;
+        int run_qc;
+        int preview;
+        int preview_reads;
+        string preview_mode;
+        string engine;
+        int fail_soft;
+        int library_retries;
+        int max_child_jobs;
+        int num_threads;
+        int threads;  /* cores for this library's trimming engine, set for each library when libraries are
+                         trimmed side by side; default lets the engine use every core */
+        string no_trim_output;
+        int merge_unpaired;
+        int min_unpaired_reads;
+        int interleaved;
     } execTrimmomaticInput;
 
+    /* a library a fail-soft run gave up on */
+    typedef structure {
+        data_obj_ref input_reads_ref;
+        string name;
+        string error;
+        int attempts;
+    } LibraryFailure;
+
     typedef structure {
         data_obj_ref output_filtered_ref;
 	data_obj_ref output_unpaired_fwd_ref;
 	data_obj_ref output_unpaired_rev_ref;
 	string       report;
+	mapping<data_obj_ref, UnspecifiedObject> library_stats;  /* per input library: qc, ... */
+	list<LibraryFailure> failed_libraries;
     } execTrimmomaticOutput;
 
     funcdef execTrimmomatic(execTrimmomaticInput input_params) 
@@ -104,4 +153,63 @@ module kb_trimmomatic {
     funcdef execTrimmomaticSingleLibrary(execTrimmomaticInput input_params) 
         returns (execTrimmomaticOutput output) 
         authentication required;
+
+
+    /* execTrimmomaticBatch()
+    **
+    ** trim many libraries, each with its own params, in one call sharing clients and a thread pool, with one combined report
+    */
+    typedef structure {
+        data_obj_ref input_reads_ref;  /* may be either PairedEndLibrary, or SingleEndLibrary */
+        data_obj_name output_reads_name;
+        mapping<string, UnspecifiedObject> params;  /* trimming params as in execTrimmomaticInput, read_type required */
+    } BatchLibraryInput;
+
+    typedef structure {
+        list<BatchLibraryInput> inputs;
+        workspace_name output_ws;
+        int num_threads;  /* libraries trimmed at once within the scratch and memory limits, default number of cores */
+        int fail_soft;
+        int library_retries;
+    } execTrimmomaticBatchInput;
+
+    typedef structure {
+        list<execTrimmomaticOutput> results;  /* per input, in input order */
+        list<LibraryFailure> failed_libraries;
+        string report;
+        string report_name;
+        string report_ref;
+    } execTrimmomaticBatchOutput;
+
+    funcdef execTrimmomaticBatch(execTrimmomaticBatchInput input_params)
+        returns (execTrimmomaticBatchOutput output)
+        authentication required;
+
+
+    /* sweepTrimmomatic()
+    **
+    ** trim one shared subsample of a read library with each of a grid of parameter sets
+    ** to compare survival and read lengths before choosing settings for a full run
+    */
+    typedef structure {
+        data_obj_ref input_reads_ref;  /* may be either PairedEndLibrary, or SingleEndLibrary */
+        string read_type;
+        string quality_encoding;
+        int sample_reads;  /* subsample size, default 100000 */
+        string sample_mode;  /* first or random, default first */
+        int num_threads;  /* parameter sets run at once, default number of cores */
+        string engine;  /* trimming engine for every candidate, as in runTrimmomaticInput; a candidate's own engine wins */
+        list<mapping<string, UnspecifiedObject>> param_grid;  /* trimming params as in execTrimmomaticInput, one set per candidate */
+    } sweepTrimmomaticInput;
+
+    typedef structure {
+        int sampled_reads;
+        int total_reads;
+        list<UnspecifiedObject> results;  /* per candidate: params, trimmomatic_steps, counts, survival, output length histograms */
+        string report;
+    } sweepTrimmomaticOutput;
+
+    funcdef sweepTrimmomatic(sweepTrimmomaticInput input_params)
+        returns (sweepTrimmomaticOutput output)
+        authentication required;
 };
\ No newline at end of file
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Adapter auto-detection from overrepresented k-mers at the 3' end of reads
+
+A sample of reads is reduced to 2-bit packed k-mers over the last TAIL_LENGTH
+bases of each read. The fraction of reads carrying a k-mer from each adapter
+FASTA (or its reverse complement) decides the adapter file. If no known file
+explains the tails but some k-mers are still heavily overrepresented, they are
+greedily assembled, for each mate, into a custom adapter FASTA. A k-mer only
+seeds an adapter if it is part of a known adapter, or if the reads carrying it
+go on as its assembled sequence all the way to the read end, as adapter
+read-through does (a repeat in the genome carries on into other sequence).
+
+For paired end reads the adapters of the two mates are written as
+PrefixAuto<n>/1 and PrefixAuto<n>/2, the reverse complements of the
+read-through seen in the reverse and forward reads, which Trimmomatic takes
+as the prefix pair for palindrome clipping, as with the PrefixPE pair of
+TruSeq3-PE.fa. Adapters found in only one mate are written as they are read,
+for simple clipping.
+"""
+import os
+
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import iter_fastq, pack_padded, SEQ
+
+KMER_LENGTH = 12          # 2 bits per base, fits a uint32
+TAIL_LENGTH = 40
+DEFAULT_SAMPLE_READS = 200000
+MIN_ADAPTER_READ_FRACTION = 0.005
+MIN_CUSTOM_KMER_FRACTION = 0.01
+MAX_CUSTOM_ADAPTERS = 4
+MAX_CUSTOM_ADAPTER_LENGTH = 64
+# reads carrying a seed k-mer that must follow its assembled sequence to the read end, and the
+# mismatches (sequencing errors) allowed on the way
+MIN_CONSISTENT_READ_FRACTION = 0.8
+# share of a k-mer's reads the leading base before it needs to extend a sequence back towards the insert
+MIN_LEADING_BASE_FRACTION = 0.75
+MAX_EXTENSION_MISMATCH_FRACTION = 0.1
+
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _c, _v in zip('ACGTacgt', [0, 1, 2, 3, 0, 1, 2, 3]):
+    _BASE_CODES[ord(_c)] = _v
+_CODE_BASES = 'ACGT'
+_COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
+
+
+def reverse_complement(seq):
+    return "".join([_COMPLEMENT.get(c, 'N') for c in reversed(seq.upper())])
+
+
+def packed_kmers(seqs, k=KMER_LENGTH):
+    # returns (kmers, valid) matrices of shape (n_seqs, max_len - k + 1); k-mers spanning an N or
+    # the end of a shorter sequence are marked invalid
+    if not len(seqs):
+        return np.zeros((0, 0), dtype=np.uint32), np.zeros((0, 0), dtype=bool)
+    mat, _ = pack_padded(seqs)
+    return packed_code_kmers(_BASE_CODES[mat], k)
+
+
+def base_codes(mat):
+    # uint8 matrix of sequence bytes -> 0-3 for ACGT, 4 for anything else (N, padding)
+    return _BASE_CODES[mat]
+
+
+def packed_code_kmers(codes, k=KMER_LENGTH):
+    # packed_kmers() for a matrix of base_codes(); k up to 16 fits the uint32
+    n_pos = codes.shape[1] - k + 1
+    if n_pos < 1:
+        return np.zeros((codes.shape[0], 0), dtype=np.uint32), np.zeros((codes.shape[0], 0), dtype=bool)
+    kmers = np.zeros((codes.shape[0], n_pos), dtype=np.uint32)
+    invalid = np.zeros((codes.shape[0], n_pos), dtype=bool)
+    for j in range(k):
+        col = codes[:, j:j + n_pos]
+        kmers = (kmers << 2) | (col & 3)
+        invalid |= col > 3
+    return kmers, ~invalid
+
+
+def decode_kmer(kmer, k=KMER_LENGTH):
+    return "".join([_CODE_BASES[(int(kmer) >> (2 * (k - 1 - j))) & 3] for j in range(k)])
+
+
+def read_fasta(path):
+    records = []
+    name = None
+    seq_lines = []
+    with open(path, 'r') as fh:
+        for line in fh:
+            line = line.strip()
+            if line.startswith('>'):
+                if name is not None:
+                    records.append((name, "".join(seq_lines)))
+                name = line[1:]
+                seq_lines = []
+            elif line:
+                seq_lines.append(line)
+    if name is not None:
+        records.append((name, "".join(seq_lines)))
+    return records
+
+
+def adapter_file_kmers(path, k=KMER_LENGTH):
+    seqs = []
+    for name, seq in read_fasta(path):
+        seqs.append(seq.upper())
+        seqs.append(reverse_complement(seq))
+    kmers, valid = packed_kmers([s.encode('ascii') for s in seqs], k)
+    return np.unique(kmers[valid])
+
+
+def read_tails(path, n_reads=DEFAULT_SAMPLE_READS, tail_length=TAIL_LENGTH):
+    # padded matrix of the last tail_length bases of the first n_reads reads of a file
+    for batch in iter_fastq(path, n_reads):
+        lengths = batch.lengths(SEQ)
+        return batch.padded(SEQ, start=np.maximum(lengths - tail_length, 0))[0]
+    return np.zeros((0, 0), dtype=np.uint8)
+
+
+def stack_tails(tails):
+    tails = [t for t in tails if len(t)]
+    if not tails:
+        return np.zeros((0, 0), dtype=np.uint8)
+    width = max([t.shape[1] for t in tails])
+    return np.vstack([np.pad(t, ((0, 0), (0, width - t.shape[1])), 'constant') for t in tails])
+
+
+def sample_read_tails(paths, n_reads=DEFAULT_SAMPLE_READS, tail_length=TAIL_LENGTH):
+    # read_tails() of each file, stacked
+    return stack_tails([read_tails(path, n_reads, tail_length) for path in paths])
+
+
+def mate_tails(paths, interleaved=False, n_reads=DEFAULT_SAMPLE_READS, tail_length=TAIL_LENGTH):
+    # read_tails() of each mate: one per file, or the alternate records of one interleaved file
+    tails = [read_tails(path, n_reads, tail_length) for path in paths]
+    if interleaved and len(tails) == 1:
+        return [tails[0][0::2], tails[0][1::2]]
+    return tails
+
+
+def kmer_read_counts(kmers, valid, k=KMER_LENGTH):
+    # (k-mers, number of reads carrying each, order of most carried first) over a packed_code_kmers() matrix
+    n_reads = kmers.shape[0]
+    # dedupe (read, k-mer) pairs packed into one uint64
+    read_index = np.broadcast_to(np.arange(n_reads, dtype=np.uint64)[:, None], kmers.shape)
+    pairs = np.unique((read_index[valid] << np.uint64(2 * k)) | kmers[valid].astype(np.uint64))
+    uniq, counts = np.unique(pairs & np.uint64((1 << (2 * k)) - 1), return_counts=True)
+    return uniq, counts, np.argsort(-counts, kind='mergesort')
+
+
+def _is_low_complexity(kmer_seq):
+    return len(set(kmer_seq)) < 3
+
+
+def _assemble_from_kmers(seed, counts, min_count, k=KMER_LENGTH, max_length=MAX_CUSTOM_ADAPTER_LENGTH):
+    # greedy extension of a seed k-mer through the most frequent overlapping k-mers, first back to where
+    # no base clearly leads (the insert end, for read-through); returns (contig, k-mers used, seed offset)
+    mask = (1 << (2 * k)) - 1
+    used = set([seed])
+    contig = decode_kmer(seed, k)
+
+    kmer = seed
+    seed_offset = 0
+    while len(contig) < max_length:
+        candidates = [(kmer >> 2) | (b << (2 * (k - 1))) for b in range(4)]
+        best = max(candidates, key=lambda c: counts.get(c, 0))
+        if counts.get(best, 0) < max(min_count, MIN_LEADING_BASE_FRACTION * counts.get(kmer, 0)) or best in used:
+            break
+        used.add(best)
+        contig = _CODE_BASES[best >> (2 * (k - 1))] + contig
+        seed_offset += 1
+        kmer = best
+
+    kmer = seed
+    while len(contig) < max_length:
+        candidates = [((kmer << 2) & mask) | b for b in range(4)]
+        best = max(candidates, key=lambda c: counts.get(c, 0))
+        if counts.get(best, 0) < min_count or best in used:
+            break
+        used.add(best)
+        contig += _CODE_BASES[best & 3]
+        kmer = best
+    return contig, used, seed_offset
+
+
+def _follows_to_read_end(tails, kmers, valid, seed, contig, seed_offset):
+    # whether the reads whose tails carry seed go on as contig does, with few mismatches, up to the read end
+    hit = (kmers == seed) & valid
+    rows = np.flatnonzero(hit.any(axis=1))
+    if not len(rows):
+        return False
+    starts = hit[rows].argmax(axis=1)[:, None]
+    codes = base_codes(tails[rows])
+    lengths = (tails[rows] != 0).sum(axis=1)[:, None]
+    contig_codes = base_codes(np.frombuffer(contig.encode('ascii'), dtype=np.uint8))
+    cols = np.arange(tails.shape[1])[None, :]
+    in_read = (cols >= starts) & (cols < lengths)
+    contig_pos = seed_offset + cols - starts
+    in_contig = contig_pos < len(contig)
+    mismatch = in_read & in_contig & (codes < 4) & (codes != contig_codes[np.clip(contig_pos, 0, len(contig) - 1)])
+    consistent = (in_contig | ~in_read).all(axis=1) & \
+        (mismatch.sum(axis=1) <= MAX_EXTENSION_MISMATCH_FRACTION * in_read.sum(axis=1))
+    return consistent.mean() >= MIN_CONSISTENT_READ_FRACTION
+
+
+def assemble_custom_adapters(tails, known_kmers, k=KMER_LENGTH):
+    """
+    the overrepresented sequences in one mate's read tails, in read orientation, each grown from a
+    seed k-mer that is part of a known adapter (known_kmers) or that its reads follow to the read end
+    """
+    kmers, valid = packed_code_kmers(base_codes(tails), k)
+    if not kmers.shape[1]:
+        return []
+    uniq, counts, order = kmer_read_counts(kmers, valid, k)
+    min_count = MIN_CUSTOM_KMER_FRACTION * len(tails)
+    count_of = dict((int(uniq[i]), int(counts[i])) for i in order[:5000] if counts[i] >= min_count)
+    custom_seqs = []
+    used = set()
+    for i in order:
+        if counts[i] < min_count or len(custom_seqs) >= MAX_CUSTOM_ADAPTERS:
+            break
+        seed = int(uniq[i])
+        seed_seq = decode_kmer(seed, k)
+        # a k-mer one base off an accepted sequence is that sequence run on from a different base
+        if seed in used or _is_low_complexity(seed_seq) or \
+                [1 for seq in custom_seqs if seed_seq[1:] in seq or seed_seq[:-1] in seq]:
+            continue
+        contig, contig_kmers, seed_offset = _assemble_from_kmers(seed, count_of, min_count, k)
+        if seed not in known_kmers and not _follows_to_read_end(tails, kmers, valid, seed, contig, seed_offset):
+            continue
+        used |= contig_kmers
+        custom_seqs.append(contig)
+    return custom_seqs
+
+
+def custom_adapter_fasta(mate_seqs):
+    """
+    (name, sequence) records for the adapters found in each mate: with two mates, pairs of them as
+    PrefixAuto<n>/1 (reverse read-through, reverse complemented) and PrefixAuto<n>/2 (forward), the
+    rest as auto_detected_<n>
+    """
+    records = []
+    if len(mate_seqs) == 2:
+        fwd_seqs, rev_seqs = mate_seqs
+        n_pairs = min(len(fwd_seqs), len(rev_seqs))
+        for pair_i in range(n_pairs):
+            records.append(('PrefixAuto' + str(pair_i + 1) + '/1', reverse_complement(rev_seqs[pair_i])))
+            records.append(('PrefixAuto' + str(pair_i + 1) + '/2', reverse_complement(fwd_seqs[pair_i])))
+        mate_seqs = [fwd_seqs[n_pairs:], rev_seqs[n_pairs:]]
+    for seq in [seq for seqs in mate_seqs for seq in seqs]:
+        records.append(('auto_detected_' + str(len(records) + 1), seq))
+    return records
+
+
+def detect_adapters(read_paths, adapter_dir, read_type='PE', custom_adapter_path=None,
+                    n_reads=DEFAULT_SAMPLE_READS, k=KMER_LENGTH, interleaved=False):
+    """
+    returns a dict describing the evidence and the chosen adapter:
+      adapterFa - file name in adapter_dir, path of a custom FASTA, or None if no adapters were found
+      method    - 'library', 'custom' or 'none'
+    read_paths holds one file per mate, or with interleaved one file of both
+    """
+    mates = mate_tails(read_paths, interleaved=interleaved and read_type == 'PE', n_reads=n_reads)
+    tails = stack_tails(mates)
+    kmers, valid = packed_code_kmers(base_codes(tails), k)
+    n_sampled = len(tails)
+    n_pos = kmers.shape[1] if n_sampled else 0
+
+    detection = {'reads_sampled': n_sampled,
+                 'kmer_length': k,
+                 'tail_length': TAIL_LENGTH,
+                 'adapter_file_scores': {},
+                 'top_kmers': [],
+                 'adapterFa': None,
+                 'method': 'none'
+                 }
+    if not n_sampled or not n_pos:
+        return detection
+
+    # fraction of sampled reads with at least one k-mer from each known adapter file
+    best_file = None
+    best_key = None
+    known_kmers = set()
+    for adapter_file in sorted(os.listdir(adapter_dir)):
+        if not adapter_file.endswith('.fa'):
+            continue
+        file_kmers = adapter_file_kmers(os.path.join(adapter_dir, adapter_file), k)
+        known_kmers.update([int(kmer) for kmer in file_kmers])
+        hits = np.isin(kmers, file_kmers) & valid
+        fraction = float(hits.any(axis=1).sum()) / n_sampled
+        expected = n_pos * len(file_kmers) / float(4 ** k)
+        detection['adapter_file_scores'][adapter_file] = round(fraction, 6)
+        if fraction < max(MIN_ADAPTER_READ_FRACTION, 5 * expected):
+            continue
+        # prefer files made for the library type (PE files carry the palindrome prefixes) on ties
+        key = (round(fraction, 4), ('-' + read_type) in adapter_file)
+        if best_key is None or key > best_key:
+            best_key = key
+            best_file = adapter_file
+
+    uniq, counts, order = kmer_read_counts(kmers, valid, k)
+    detection['top_kmers'] = [{'kmer': decode_kmer(uniq[i], k),
+                               'read_fraction': round(float(counts[i]) / n_sampled, 6)}
+                              for i in order[:10]]
+
+    if best_file is not None:
+        detection['adapterFa'] = best_file
+        detection['method'] = 'library'
+        return detection
+
+    # nothing known explains the tails, try to assemble what is overrepresented in each mate
+    records = custom_adapter_fasta([assemble_custom_adapters(mate, known_kmers, k) for mate in mates if len(mate)])
+    if records and custom_adapter_path is not None:
+        with open(custom_adapter_path, 'w') as fh:
+            for name, seq in records:
+                fh.write('>' + name + "\n" + seq + "\n")
+        detection['adapterFa'] = custom_adapter_path
+        detection['method'] = 'custom'
+        detection['custom_sequences'] = [seq for name, seq in records]
+        detection['custom_names'] = [name for name, seq in records]
+    return detection
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Splitting the node's cores between libraries trimmed side by side
+
+A set can run many libraries at once with one core each, or one library at
+a time on every core, and neither fits a set of a few huge libraries among
+many small ones: huge libraries on one core each finish long after the rest,
+and small libraries on every core spend most of their time in the parts of
+a run that don't thread (download, FASTQ parsing, upload).
+
+CoreAllocator gives each library its share of the cores in proportion to its
+share of the work still left (its estimated seconds over those of every
+library that hasn't finished), at least one and at most the free cores and
+MAX_LIBRARY_CORES, since Trimmomatic's speedup flattens once reading and
+writing the FASTQ become the bottleneck. A library's cores are fixed when it
+starts, so as libraries finish, their cores go to the libraries started
+next, which get a bigger share of the smaller remaining work. Every decision
+is kept in decisions for the logs and the library stats.
+"""
+import threading
+import time
+
+# past this, extra Trimmomatic threads mostly wait on the single reader and writer
+MAX_LIBRARY_CORES = 8
+
+
+class CoreAllocator(object):
+
+    def __init__(self, total_cores, library_seconds, max_library_cores=MAX_LIBRARY_CORES, log=None):
+        self.total_cores = max(1, int(total_cores))
+        self.library_seconds = [max(float(seconds), 0.0) for seconds in library_seconds]
+        self.max_library_cores = max(1, int(max_library_cores))
+        self.log = log if log is not None else (lambda message: None)
+        self.allocated = {}  # library index: cores, for running libraries
+        self.finished = set()
+        self.decisions = []
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def free_cores(self):
+        with self._lock:
+            return self.total_cores - sum(self.allocated.values())
+
+    def remaining_seconds(self):
+        # estimated work of the libraries that haven't finished, running ones included
+        return sum([seconds for library_i, seconds in enumerate(self.library_seconds)
+                    if library_i not in self.finished])
+
+    def acquire(self, library_i):
+        """
+        allot cores to a library that is starting and return how many. a library that starts when
+        no core is free (only when nothing else is running, in practice) still gets one
+        """
+        with self._lock:
+            free = self.total_cores - sum(self.allocated.values())
+            remaining = self.remaining_seconds()
+            if remaining > 0:
+                share = self.total_cores * self.library_seconds[library_i] / remaining
+            else:
+                share = float(self.total_cores)
+            cores = max(1, min(int(round(share)), free, self.max_library_cores))
+            self.allocated[library_i] = cores
+            decision = {'library': library_i,
+                        'cores': cores,
+                        'share': share,
+                        'free_cores': free,
+                        'running': len(self.allocated),
+                        'remaining_seconds': remaining,
+                        'elapsed_seconds': time.time() - self._start}
+            self.decisions.append(decision)
+        self.log('Library '+str(library_i)+' gets '+str(cores)+' of '+str(free)+' free cores (share '+
+                 '{0:.2f}'.format(share)+' of '+str(self.total_cores)+')')
+        return cores
+
+    def release(self, library_i):
+        with self._lock:
+            self.allocated.pop(library_i, None)
+            self.finished.add(library_i)
+
+    def cores(self, library_i):
+        # cores allotted to a running library, or None
+        with self._lock:
+            return self.allocated.get(library_i)
+
+    def decision(self, library_i):
+        # the decision made when a library started, or None
+        with self._lock:
+            for decision in self.decisions:
+                if decision['library'] == library_i:
+                    return dict(decision)
+        return None
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Batched FASTQ reading and writing for the python-side read processing (QC, native trimming etc.)
+
+Files are read in large blocks (buffered reads, or slices of a memory map)
+and split into records with a single vectorized newline search per block, so
+there is no per-line python work. A FastqBatch holds the block as one
+contiguous uint8 buffer plus (n, 4) start and end offset arrays for the header,
+sequence, plus and quality lines of each record; the lines are never copied
+out unless a caller asks for them. write_fastq_batch() writes a selection of
+records, optionally trimmed, with a single write() per batch.
+
+read_fastq_batches() keeps the older list-of-tuples interface on top of this.
+"""
+import mmap
+
+import numpy as np
+
+DEFAULT_BATCH_SIZE = 65536
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+# output bytes gathered at a time: the byte index for them takes eight times as much, and stays in cache
+GATHER_CHUNK_BYTES = 64 * 1024
+
+HEADER, SEQ, PLUS, QUAL = range(4)
+
+_NEWLINE = ord('\n')
+_CR = ord('\r')
+_AT = ord('@')
+_PLUS = ord('+')
+
+
+class FastqBatch(object):
+
+    def __init__(self, buf, starts, ends):
+        self.buf = buf          # uint8 array shared by every record in the batch
+        self.starts = starts    # (n, 4) int64 line starts in buf
+        self.ends = ends        # (n, 4) int64 line ends in buf, line endings excluded
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lengths(self, field):
+        return self.ends[:, field] - self.starts[:, field]
+
+    def take(self, rows):
+        # subset of records sharing the same buffer
+        return FastqBatch(self.buf, self.starts[rows], self.ends[rows])
+
+    def line(self, i, field):
+        return self.buf[self.starts[i, field]:self.ends[i, field]].tobytes()
+
+    def lines(self, field):
+        return [self.buf[s:e].tobytes() for s, e in zip(self.starts[:, field], self.ends[:, field])]
+
+    def records(self):
+        return list(zip(self.lines(HEADER), self.lines(SEQ), self.lines(PLUS), self.lines(QUAL)))
+
+    def padded(self, field, pad=0, start=None, end=None):
+        # (n, max_len) uint8 matrix of one field, optionally of the [start, end) slice of each line
+        line_starts = self.starts[:, field] if start is None else self.starts[:, field] + start
+        line_ends = self.ends[:, field] if end is None else self.starts[:, field] + end
+        lengths = np.maximum(line_ends - line_starts, 0)
+        width = int(lengths.max()) if len(lengths) else 0
+        if not width:
+            return np.full((len(lengths), 0), pad, dtype=np.uint8), lengths
+        cols = np.arange(width)[None, :]
+        inside = cols < lengths[:, None]
+        src = np.where(inside, line_starts[:, None] + cols, 0)
+        return np.where(inside, self.buf[src], pad).astype(np.uint8), lengths
+
+
+def _split_records(buf, path):
+    # buf holds whole lines only; returns (starts, ends) of its 4-line records
+    newlines = np.flatnonzero(buf == _NEWLINE)
+    n_records = len(newlines) // 4
+    if len(newlines) % 4:
+        raise ValueError('Truncated FASTQ record at end of file: ' + str(path))
+    line_ends = newlines.reshape(n_records, 4).astype(np.int64)
+    line_starts = np.empty_like(line_ends)
+    if n_records:
+        flat_starts = line_starts.reshape(-1)
+        flat_starts[0] = 0
+        flat_starts[1:] = newlines[:-1] + 1
+        # drop the \r of \r\n line endings
+        has_cr = (line_ends > line_starts) & (buf[np.maximum(line_ends - 1, 0)] == _CR)
+        line_ends -= has_cr
+        if (buf[line_starts[:, HEADER]] != _AT).any() or (buf[np.minimum(line_starts[:, PLUS], len(buf) - 1)] != _PLUS).any():
+            raise ValueError('Malformed FASTQ record (expected @header and + lines) in ' + str(path))
+        if ((line_ends[:, SEQ] - line_starts[:, SEQ]) != (line_ends[:, QUAL] - line_starts[:, QUAL])).any():
+            raise ValueError('FASTQ record with sequence and quality of different lengths in ' + str(path))
+    return line_starts, line_ends
+
+
+def iter_fastq(path, batch_size=DEFAULT_BATCH_SIZE, block_size=DEFAULT_BLOCK_SIZE, use_mmap=False,
+               start=0, end=None):
+    """
+    yields FastqBatch objects of at most batch_size records. With use_mmap the batches are
+    views of a memory map of the file instead of copies from buffered reads. start and end
+    limit reading to a byte range, which must begin on a record boundary (see FastqIndex)
+    """
+    with open(path, 'rb') as fh:
+        if use_mmap:
+            try:
+                mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return  # empty file
+            whole = np.frombuffer(mapped, dtype=np.uint8)[start:end]
+            blocks = _mapped_blocks(whole, block_size)
+        else:
+            fh.seek(start)
+            blocks = _read_blocks(fh, block_size, None if end is None else end - start)
+        for block in blocks:
+            starts, ends = _split_records(block, path)
+            for first in range(0, len(starts), batch_size):
+                yield FastqBatch(block, starts[first:first + batch_size], ends[first:first + batch_size])
+
+
+def _read_blocks(fh, block_size, limit=None):
+    # blocks of whole records; the partial record at the end of each read is carried into the next
+    carry = b''
+    while True:
+        if limit is not None:
+            if limit <= 0:
+                break
+            data = fh.read(min(block_size, limit))
+            limit -= len(data)
+        else:
+            data = fh.read(block_size)
+        if not data:
+            break
+        data = carry + data if carry else data
+        cut = _last_record_end(data)
+        carry = data[cut:]
+        if cut:
+            yield np.frombuffer(data, dtype=np.uint8)[:cut]
+    if carry:
+        if not carry.endswith(b'\n'):
+            carry += b'\n'
+        yield np.frombuffer(carry, dtype=np.uint8)
+
+
+def _mapped_blocks(whole, block_size):
+    pos = 0
+    total = len(whole)
+    while pos < total:
+        end = min(total, pos + block_size)
+        if end < total:
+            cut = _last_record_end(whole[pos:end])
+            if not cut:
+                # a record longer than the block, widen it
+                block_size *= 2
+                continue
+            end = pos + cut
+        block = whole[pos:end]
+        if block[-1] != _NEWLINE:
+            block = np.append(block, np.uint8(_NEWLINE))
+        yield block
+        pos = end
+
+
+def _last_record_end(data):
+    # offset just past the last complete 4-line record in data
+    arr = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    newlines = np.flatnonzero(arr == _NEWLINE)
+    n_lines = len(newlines) - len(newlines) % 4
+    return int(newlines[n_lines - 1]) + 1 if n_lines else 0
+
+
+def parse_fastq_buffer(buf, path=None):
+    # a FastqBatch over a uint8 buffer of whole records (such as a block of shared memory)
+    starts, ends = _split_records(buf, path)
+    return FastqBatch(buf, starts, ends)
+
+
+def write_fastq_batch(fh, batch, rows=None, trim_start=None, trim_end=None):
+    """
+    write records of a batch with one write(). rows selects records (index or mask array);
+    trim_start/trim_end (per selected record, relative to the sequence start) cut the
+    sequence and quality lines down to [trim_start, trim_end)
+    """
+    out = gather_fastq_batch(batch, rows, trim_start, trim_end)
+    if len(out):
+        fh.write(out.tobytes())
+
+
+def gather_fastq_batch(batch, rows=None, trim_start=None, trim_end=None, chunk_bytes=GATHER_CHUNK_BYTES):
+    # the FASTQ text write_fastq_batch() writes, as a new uint8 array, copied about chunk_bytes at a time
+    if rows is not None:
+        batch = batch.take(rows)
+    n = len(batch)
+    if not n:
+        return np.zeros(0, dtype=np.uint8)
+    seg_starts = batch.starts.copy()
+    seg_ends = batch.ends.copy()
+    if trim_start is not None or trim_end is not None:
+        seq_len = batch.lengths(SEQ)
+        cut_start = np.zeros(n, dtype=np.int64) if trim_start is None else np.asarray(trim_start, dtype=np.int64)
+        cut_end = seq_len if trim_end is None else np.asarray(trim_end, dtype=np.int64)
+        for field in (SEQ, QUAL):
+            seg_ends[:, field] = seg_starts[:, field] + cut_end
+            seg_starts[:, field] = seg_starts[:, field] + cut_start
+    seg_starts = seg_starts.reshape(-1)
+    seg_lengths = seg_ends.reshape(-1) - seg_starts
+    # every segment is copied out of the buffer and followed by a newline
+    out_lengths = seg_lengths + 1
+    out_offsets = np.cumsum(out_lengths) - out_lengths
+    total = int(out_lengths.sum())
+    newline_at = out_offsets + seg_lengths
+    out = np.empty(total, dtype=np.uint8)
+    # whole segments per chunk; a segment longer than chunk_bytes is a chunk of its own
+    bounds = np.searchsorted(out_offsets, np.arange(0, total, max(1, int(chunk_bytes))), side='left')
+    bounds = np.unique(np.append(bounds, len(seg_starts)))
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        chunk_start = int(out_offsets[first])
+        chunk_end = int(out_offsets[last - 1] + out_lengths[last - 1])
+        src = np.arange(chunk_start, chunk_end, dtype=np.int64) + \
+            np.repeat(seg_starts[first:last] - out_offsets[first:last], out_lengths[first:last])
+        src[newline_at[first:last] - chunk_start] = 0
+        out[chunk_start:chunk_end] = batch.buf[src]
+    out[newline_at] = _NEWLINE
+    return out
+
+
+def read_fastq_batches(path, batch_size=DEFAULT_BATCH_SIZE):
+    # lists of (header, sequence, plus, quality) byte strings, line endings stripped
+    for batch in iter_fastq(path, batch_size):
+        yield batch.records()
+
+
+def pack_padded(strings, pad=0):
+    # pack a list of byte strings into a (n, max_len) uint8 matrix plus lengths
+    lengths = np.array([len(s) for s in strings], dtype=np.int64)
+    width = int(lengths.max()) if len(lengths) else 0
+    matrix = np.full((len(strings), width), pad, dtype=np.uint8)
+    if width:
+        mask = np.arange(width)[None, :] < lengths[:, None]
+        matrix[mask] = np.frombuffer(b''.join(strings), dtype=np.uint8)
+    return matrix, lengths
+
+
+def write_fastq_records(fh, records):
+    # records as returned by read_fastq_batches(), written with one write() per batch
+    fh.write(b''.join([b'\n'.join(rec) + b'\n' for rec in records]))
+
+
+def count_fastq_records(path, block_size=DEFAULT_BLOCK_SIZE):
+    # counts lines a block at a time; assumes the 4-line records download_reads produces
+    n_lines = 0
+    last = b'\n'
+    with open(path, 'rb') as fh:
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            n_lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        n_lines += 1
+    return n_lines // 4
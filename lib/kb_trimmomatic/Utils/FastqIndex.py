@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Record offset index for FASTQ files
+
+One streaming pass over a file records the byte offset of every K-th record
+and the total record count. The index is kept in memory for the rest of the
+job and written to a sidecar file next to the FASTQ (<path>.fqidx), so every
+component that needs record boundaries (counts, pair checks, chunk splitting,
+random subsampling) shares the one scan, and inputs kept on disk keep their
+index. A sidecar is only reused while the file's size and mtime match.
+"""
+import json
+import os
+
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import DEFAULT_BLOCK_SIZE
+
+DEFAULT_INDEX_INTERVAL = 16384
+INDEX_SUFFIX = '.fqidx'
+INDEX_VERSION = 1
+
+_NEWLINE = ord('\n')
+_index_cache = {}
+
+
+class FastqIndex(object):
+
+    def __init__(self, path, interval, total_records, offsets, file_size, file_mtime):
+        self.path = path
+        self.interval = interval
+        self.total_records = total_records
+        self.offsets = np.asarray(offsets, dtype=np.int64)  # offsets[j] is the start of record j * interval
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+
+    def to_dict(self):
+        return {'version': INDEX_VERSION,
+                'interval': self.interval,
+                'total_records': self.total_records,
+                'offsets': [int(o) for o in self.offsets],
+                'file_size': self.file_size,
+                'file_mtime': self.file_mtime}
+
+    def matches(self, path):
+        stat = os.stat(path)
+        return stat.st_size == self.file_size and stat.st_mtime == self.file_mtime
+
+    def seek(self, record):
+        # (byte offset of the closest indexed record at or before record, records to skip from there)
+        if record < 0 or record > self.total_records:
+            raise ValueError('Record ' + str(record) + ' out of range for ' + str(self.path))
+        if record == self.total_records:
+            return self.file_size, 0
+        j = record // self.interval
+        return int(self.offsets[j]), record - j * self.interval
+
+    def chunks(self, n_chunks):
+        # split into at most n_chunks byte ranges on indexed record boundaries:
+        # list of (start_offset, end_offset, first_record, n_records)
+        n_points = len(self.offsets)
+        if not self.total_records:
+            return []
+        n_chunks = max(1, min(n_chunks, n_points))
+        bounds = np.unique(np.linspace(0, n_points, n_chunks + 1).astype(np.int64))
+        chunks = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            first = int(lo) * self.interval
+            last = min(int(hi) * self.interval, self.total_records)
+            end = int(self.offsets[hi]) if hi < n_points else self.file_size
+            chunks.append((int(self.offsets[lo]), end, first, last - first))
+        return chunks
+
+
+def batch_offsets(path, batch_records):
+    """
+    byte offsets of records 0, batch_records, 2 * batch_records, ... followed by the file size, so
+    consecutive pairs are the byte ranges of whole-record batches. Uses the file's index when
+    batch_records is a multiple of its interval, otherwise scans for a finer one
+    """
+    index = get_fastq_index(path)
+    if batch_records % index.interval:
+        index = build_fastq_index(path, batch_records)
+    stride = batch_records // index.interval
+    return np.append(index.offsets[::stride], np.int64(index.file_size)), index.total_records
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def build_fastq_index(path, interval=DEFAULT_INDEX_INTERVAL, block_size=DEFAULT_BLOCK_SIZE):
+    # one streaming pass: newline positions per block, every (4 * interval)-th line starts an indexed record
+    stat = os.stat(path)
+    lines_per_point = 4 * interval
+    offsets = [0] if stat.st_size else []
+    n_lines = 0
+    pos = 0
+    last = b'\n'
+    with open(path, 'rb') as fh:
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == _NEWLINE)
+            # line number that starts just after each newline
+            next_line = n_lines + 1 + np.arange(len(newlines), dtype=np.int64)
+            points = newlines[next_line % lines_per_point == 0] + pos + 1
+            offsets.extend([int(o) for o in points if o < stat.st_size])
+            n_lines += len(newlines)
+            pos += len(block)
+            last = block[-1:]
+    if last != b'\n':
+        n_lines += 1
+    if n_lines % 4:
+        raise ValueError('FASTQ file does not contain whole 4-line records: ' + str(path))
+    return FastqIndex(path, interval, n_lines // 4, offsets, stat.st_size, stat.st_mtime)
+
+
+def load_fastq_index(path):
+    # the sidecar index if it is present and still describes the file, otherwise None
+    sidecar = index_path(path)
+    if not os.path.isfile(sidecar):
+        return None
+    try:
+        with open(sidecar, 'r') as fh:
+            data = json.load(fh)
+    except ValueError:
+        return None
+    if data.get('version') != INDEX_VERSION:
+        return None
+    index = FastqIndex(path, data['interval'], data['total_records'], data['offsets'],
+                       data['file_size'], data['file_mtime'])
+    return index if index.matches(path) else None
+
+
+def get_fastq_index(path, interval=DEFAULT_INDEX_INTERVAL, persist=True):
+    """
+    the index for path, from the in-process cache, the sidecar file, or a new scan (in that
+    order). New indexes are written next to the file when persist is set and the directory
+    is writable
+    """
+    key = os.path.abspath(path)
+    index = _index_cache.get(key)
+    if index is not None and index.matches(path):
+        return index
+    index = load_fastq_index(path)
+    if index is None:
+        index = build_fastq_index(path, interval)
+        if persist:
+            try:
+                with open(index_path(path), 'w') as fh:
+                    json.dump(index.to_dict(), fh)
+            except (IOError, OSError):
+                pass
+    _index_cache[key] = index
+    return index
+
+
+def check_paired_counts(fwd_path, rev_path):
+    # raise if the mates don't have the same number of records; returns the count
+    fwd = get_fastq_index(fwd_path).total_records
+    rev = get_fastq_index(rev_path).total_records
+    if fwd != rev:
+        raise ValueError('Paired read files have different numbers of records: ' +
+                         str(fwd_path) + ' (' + str(fwd) + '), ' + str(rev_path) + ' (' + str(rev) + ')')
+    return fwd
+
+
+def remove_fastq_file(path):
+    # remove a FASTQ file along with its index
+    _index_cache.pop(os.path.abspath(path), None)
+    for remove_path in (path, index_path(path)):
+        if os.path.isfile(remove_path):
+            os.remove(remove_path)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Local cache of downloaded reads libraries
+
+Trimming the same library again (another run with new settings, a sweep, a
+retry) would otherwise download the same FASTQ through ReadsUtils every time.
+The cache keeps downloaded reads files in scratch, keyed by the resolved,
+versioned object ref (wsid/objid/version), so a changed object is never
+served stale.
+
+Files enter and leave the cache as hard links, so neither put() nor get()
+copies any reads: the job's downloads are linked into the cache, and a hit is
+linked into the job's scratch directory. FASTQ index sidecars are linked
+along with their files, and since links share the file's mtime, they stay
+valid. Every file's MD5 is recorded when it is cached and checked on each
+hit; an entry that fails the check is dropped and the library downloaded
+again. The check runs on the job's links after the lock is released, so
+hashing a large library doesn't hold up the other jobs sharing the cache,
+and the links keep the files it hashes even if the entry is evicted
+meanwhile.
+
+The cache is kept under budget_bytes by evicting the least recently used
+entries after each put. An flock on <cache_dir>/.lock serialises the
+processes and threads sharing the cache.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from kb_trimmomatic.Utils.FastqIndex import index_path
+
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+CACHE_VERSION = 1
+CHECKSUM_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fh:
+        block = fh.read(CHECKSUM_BLOCK_SIZE)
+        while block:
+            md5.update(block)
+            block = fh.read(CHECKSUM_BLOCK_SIZE)
+    return md5.hexdigest()
+
+
+def _link(source, target):
+    # hard link source to target, copying only when the two are on different filesystems
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class _CacheLock(object):
+    # a thread lock and an flock on the cache's lock file, held together
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self._thread_lock = threading.Lock()
+        self._fh = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self._fh = open(self.lock_path, 'a')
+        fcntl.flock(self._fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._fh.close()
+        self._fh = None
+        self._thread_lock.release()
+        return False
+
+
+class InputCache(object):
+
+    def __init__(self, cache_dir, budget_bytes):
+        self.cache_dir = cache_dir
+        self.budget_bytes = int(budget_bytes)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'checksum_failures': 0}
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._lock = _CacheLock(os.path.join(self.cache_dir, LOCK_FILE))
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _read_meta(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, META_FILE), 'r') as fh:
+                meta = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+        return meta if meta.get('version') == CACHE_VERSION else None
+
+    def _write_meta(self, entry_dir, meta):
+        tmp_path = os.path.join(entry_dir, META_FILE + '.tmp')
+        with open(tmp_path, 'w') as fh:
+            json.dump(meta, fh)
+        os.rename(tmp_path, os.path.join(entry_dir, META_FILE))
+
+    def get(self, key, target_dir):
+        """
+        link the cached files for key into target_dir. returns (files, info): files maps each name
+        put() was given to its path in target_dir, info is what put() stored with them; None on a miss
+        """
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            meta = self._read_meta(entry_dir)
+            if meta is None or meta['key'] != key or \
+                    not all([os.path.isfile(os.path.join(entry_dir, cached['file_name']))
+                             for cached in meta['files'].values()]):
+                self.stats['misses'] += 1
+                return None
+            # link the files into the job first: the links hold on to them for the check below
+            files = dict()
+            for name, cached in meta['files'].items():
+                cached_path = os.path.join(entry_dir, cached['file_name'])
+                files[name] = os.path.join(target_dir, cached['file_name'])
+                _link(cached_path, files[name])
+                if os.path.isfile(index_path(cached_path)):
+                    _link(index_path(cached_path), index_path(files[name]))
+            meta['last_used'] = time.time()
+            self._write_meta(entry_dir, meta)
+
+        corrupt = [name for name, cached in meta['files'].items() if file_md5(files[name]) != cached['md5']]
+        with self._lock:
+            if not corrupt:
+                self.stats['hits'] += 1
+                return files, meta['info']
+            self.stats['checksum_failures'] += 1
+            self.stats['misses'] += 1
+            # drop the entry, unless a put() has replaced it with other files since
+            current = self._read_meta(entry_dir)
+            if current is not None and current['files'] == meta['files']:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+        for path in files.values():
+            for link_path in [path, index_path(path)]:
+                if os.path.isfile(link_path):
+                    os.remove(link_path)
+        return None
+
+    def put(self, key, files, info=None):
+        """
+        cache the files (name: path) for key, with info (json-able) to hand back on a hit. the files
+        and their FASTQ index sidecars are linked, not copied, and stay where they are
+        """
+        entry_dir = self._entry_dir(key)
+        checksums = dict((name, file_md5(path)) for name, path in files.items())
+        with self._lock:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.makedirs(entry_dir)
+            meta = {'version': CACHE_VERSION, 'key': key, 'info': info, 'files': {},
+                    'bytes': 0, 'last_used': time.time()}
+            for name, path in files.items():
+                file_name = name + '_' + os.path.basename(path)
+                cached_path = os.path.join(entry_dir, file_name)
+                _link(path, cached_path)
+                if os.path.isfile(index_path(path)):
+                    _link(index_path(path), index_path(cached_path))
+                meta['files'][name] = {'file_name': file_name, 'md5': checksums[name]}
+                meta['bytes'] += os.path.getsize(cached_path)
+            self._write_meta(entry_dir, meta)
+            self._evict(keep=entry_dir)
+
+    def _evict(self, keep=None):
+        # with the lock held: drop least recently used entries until the cache is under budget
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(entry_dir):
+                continue
+            meta = self._read_meta(entry_dir)
+            if meta is None:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            entries.append((meta['last_used'], entry_dir, meta['bytes']))
+        total = sum([entry[2] for entry in entries])
+        for last_used, entry_dir, n_bytes in sorted(entries):
+            if total <= self.budget_bytes:
+                break
+            if entry_dir == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= n_bytes
+            self.stats['evictions'] += 1
+        if total > self.budget_bytes and keep is not None:
+            # the new entry is over budget on its own
+            shutil.rmtree(keep, ignore_errors=True)
+            self.stats['evictions'] += 1
+
+    def size(self):
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            meta = self._read_meta(os.path.join(self.cache_dir, name))
+            if meta is not None:
+                total += meta['bytes']
+        return total
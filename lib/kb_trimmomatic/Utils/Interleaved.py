@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Interleaved paired end FASTQ
+
+KBase stores a paired end library as one interleaved file (forward and
+reverse mates of each pair in consecutive records): download_reads splits it
+into two files unless asked for it interleaved, and upload_reads interleaves
+two files again before storing them. The interleaved path skips both passes.
+
+The native engines read an interleaved file directly, in batches of whole
+pairs taken from the record index (the index interval is even, so batch
+boundaries never split a pair), and can write their paired output the same
+way. For programs that read the mates from two files (the Trimmomatic jar),
+MateStreams splits the file while it streams: each mate goes through a named
+pipe, fed by its own thread, so no split files are written and neither pipe
+can stall the other.
+"""
+import errno
+import io
+import os
+import threading
+
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import parse_fastq_buffer, write_fastq_batch, FastqBatch
+from kb_trimmomatic.Utils.FastqIndex import get_fastq_index, batch_offsets, DEFAULT_INDEX_INTERVAL
+
+_NEWLINE = ord('\n')
+_JOIN_SECONDS = 0.1
+
+
+def check_interleaved_count(path):
+    # raise if the file doesn't hold whole pairs; returns the number of pairs
+    total = get_fastq_index(path).total_records
+    if total % 2:
+        raise ValueError('Interleaved read file has an odd number of records: ' + str(path) + ' (' + str(total) + ')')
+    return total // 2
+
+
+def interleaved_offsets(path, batch_records=DEFAULT_INDEX_INTERVAL):
+    # batch_offsets() for batches of whole pairs
+    if batch_records % 2:
+        raise ValueError('Interleaved batches must hold an even number of records, got ' + str(batch_records))
+    check_interleaved_count(path)
+    return batch_offsets(path, batch_records)[0]
+
+
+def split_mates(batch):
+    # the forward and reverse mates of a batch of whole pairs, sharing its buffer
+    if len(batch) % 2:
+        raise ValueError('Interleaved batch holds an odd number of records')
+    return batch.take(slice(0, None, 2)), batch.take(slice(1, None, 2))
+
+
+def interleave_mates(fwd, rev):
+    # a batch alternating the records of fwd and rev, which must share a buffer (as from split_mates())
+    if fwd.buf is not rev.buf or len(fwd) != len(rev):
+        raise ValueError('Only mates of the same interleaved batch can be interleaved again')
+    starts = np.empty((2 * len(fwd), 4), dtype=np.int64)
+    ends = np.empty((2 * len(fwd), 4), dtype=np.int64)
+    starts[0::2], starts[1::2] = fwd.starts, rev.starts
+    ends[0::2], ends[1::2] = fwd.ends, rev.ends
+    return FastqBatch(fwd.buf, starts, ends)
+
+
+def interleave_intervals(fwd, rev):
+    # per-record values of two mates in interleaved order
+    out = np.empty(2 * len(fwd), dtype=np.asarray(fwd).dtype)
+    out[0::2], out[1::2] = fwd, rev
+    return out
+
+
+def read_range(fh, start, end, path=None):
+    # the whole records in [start, end) of an open file, as a FastqBatch
+    buf = np.empty(end - start + 1, dtype=np.uint8)
+    fh.seek(start)
+    filled = 0
+    while filled < end - start:
+        n_read = fh.readinto(buf[filled:end - start])
+        if not n_read:
+            raise ValueError('Unexpected end of file reading ' + str(path))
+        filled += n_read
+    if filled and buf[filled - 1] != _NEWLINE:
+        buf[filled] = _NEWLINE  # a last record without its newline
+        filled += 1
+    return parse_fastq_buffer(buf[:filled], path)
+
+
+def iter_interleaved(path, batch_records=DEFAULT_INDEX_INTERVAL):
+    # (fwd batch, rev batch) for each batch of whole pairs in an interleaved file
+    offsets = interleaved_offsets(path, batch_records)
+    with io.open(path, 'rb', buffering=0) as fh:
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield split_mates(read_range(fh, int(start), int(end), path))
+
+
+def _feed_mate(path, mate, fifo_path, errors):
+    # write one mate of every pair to a named pipe
+    try:
+        with open(fifo_path, 'wb') as out:
+            for mates in iter_interleaved(path):
+                write_fastq_batch(out, mates[mate])
+    except (IOError, OSError) as e:
+        if e.errno != errno.EPIPE:  # the reader went away, it reports its own failure
+            errors.append(str(e))
+    except ValueError as e:
+        errors.append(str(e))
+
+
+class MateStreams(object):
+    """
+    with MateStreams(interleaved_path, fifo_dir) as streams: streams.paths are named pipes carrying
+    the forward and reverse mates, for a program that reads the mates from two files
+    """
+
+    def __init__(self, path, fifo_dir):
+        self.path = path
+        base = os.path.join(fifo_dir, os.path.basename(path))
+        self.paths = [base + '.fwd.pipe', base + '.rev.pipe']
+        self.errors = []
+        self._threads = []
+
+    def __enter__(self):
+        check_interleaved_count(self.path)  # indexed once, before both threads need it
+        for fifo_path in self.paths:
+            if os.path.exists(fifo_path):
+                os.remove(fifo_path)
+            os.mkfifo(fifo_path)
+        for mate, fifo_path in enumerate(self.paths):
+            thread = threading.Thread(target=_feed_mate, args=(self.path, mate, fifo_path, self.errors))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        for fifo_path, thread in zip(self.paths, self._threads):
+            while thread.is_alive():
+                # the reader stopped early or never opened the pipe: open and close it, so the
+                # feeding thread gets past its open() and fails its next write
+                try:
+                    os.close(os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK))
+                except OSError:
+                    pass
+                thread.join(_JOIN_SECONDS)
+        for fifo_path in self.paths:
+            if os.path.exists(fifo_path):
+                os.remove(fifo_path)
+        if exc_type is None and self.errors:
+            raise ValueError('Unable to split interleaved reads ' + str(self.path) + ': ' + '; '.join(self.errors))
+        return False
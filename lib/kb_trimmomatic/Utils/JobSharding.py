@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Sharding ReadsSet members across child jobs
+
+For sets too large for one node, execTrimmomatic can run its libraries in
+child jobs submitted through the callback server (BaseClient.run_job). The
+members are split into shards, and each shard runs as one child
+execTrimmomaticBatch job carrying all of its libraries (shard_batch_params()),
+which retries each library itself. unpack_batch_output() turns the child's
+output back into a (result, failure) per library.
+
+plan_shards() is the cost model. A library's run time is estimated from its
+input bytes, and every child job pays a fixed overhead for scheduling,
+container start and client setup that a library run in this job does not.
+The libraries are balanced over the shards largest first, and the set is
+only sharded when the slowest shard is expected to finish before the whole
+set would finish here.
+"""
+import heapq
+
+CHILD_JOB_METHOD = 'kb_trimmomatic.execTrimmomaticBatch'
+# scheduling and container start of a child job, on top of the library's own download, trim and upload
+CHILD_JOB_OVERHEAD_SECONDS = 60.0
+# download, trim and upload throughput of one library, for estimates before anything has run
+LIBRARY_BYTES_PER_SECOND = 15.0e6
+
+
+def estimate_library_seconds(input_bytes, bytes_per_second=LIBRARY_BYTES_PER_SECOND):
+    return float(input_bytes) / bytes_per_second
+
+
+def balance_shards(library_seconds, n_shards, job_overhead_seconds=CHILD_JOB_OVERHEAD_SECONDS):
+    """
+    assign libraries to n_shards, largest first, each to the shard that finishes soonest; each shard is one
+    child job and pays job_overhead_seconds once.
+    returns (list of shards, each a list of library indices in run order, estimated seconds per shard)
+    """
+    order = sorted(range(len(library_seconds)), key=lambda i: (-library_seconds[i], i))
+    loads = [(job_overhead_seconds, shard_i) for shard_i in range(n_shards)]
+    shards = [[] for _ in range(n_shards)]
+    for library_i in order:
+        load, shard_i = heapq.heappop(loads)
+        shards[shard_i].append(library_i)
+        heapq.heappush(loads, (load + library_seconds[library_i], shard_i))
+    shard_seconds = [0.0] * n_shards
+    for load, shard_i in loads:
+        shard_seconds[shard_i] = load
+    return shards, shard_seconds
+
+
+def plan_shards(library_bytes, max_jobs, job_overhead_seconds=CHILD_JOB_OVERHEAD_SECONDS,
+                bytes_per_second=LIBRARY_BYTES_PER_SECOND):
+    """
+    split libraries with these input sizes over at most max_jobs child job slots.
+    returns (shards, estimate) where shards is [] when running the set in this job is expected to be
+    faster, and estimate has the local and sharded run time estimates in seconds
+    """
+    library_seconds = [estimate_library_seconds(n_bytes, bytes_per_second) for n_bytes in library_bytes]
+    local_seconds = sum(library_seconds)
+    n_shards = min(int(max_jobs or 0), len(library_seconds))
+    estimate = {'local_seconds': local_seconds, 'sharded_seconds': None, 'shards': 0}
+    if n_shards < 2:
+        return [], estimate
+    shards, shard_seconds = balance_shards(library_seconds, n_shards, job_overhead_seconds)
+    estimate['sharded_seconds'] = max(shard_seconds)
+    if estimate['sharded_seconds'] >= local_seconds:
+        return [], estimate
+    estimate['shards'] = n_shards
+    estimate['shard_seconds'] = shard_seconds
+    return shards, estimate
+
+
+def shard_batch_params(library_params, output_ws, fail_soft=False, library_retries=None):
+    # execTrimmomaticBatch params for a shard, from the execTrimmomaticSingleLibrary params of its libraries
+    inputs = []
+    for params in library_params:
+        params = dict(params)
+        batch_input = {'input_reads_ref': params.pop('input_reads_ref'),
+                       'output_reads_name': params.pop('output_reads_name')}
+        params.pop('output_ws', None)
+        batch_input['params'] = params
+        inputs.append(batch_input)
+    batch_params = {'inputs': inputs, 'output_ws': output_ws, 'fail_soft': 1 if fail_soft else 0}
+    if library_retries is not None:
+        batch_params['library_retries'] = library_retries
+    return batch_params
+
+
+def unpack_batch_output(output, library_refs):
+    """
+    (result, failure) per library, in shard order, from a child execTrimmomaticBatch output: the library's
+    execTrimmomaticSingleLibrary result, or the failure of a library a fail-soft child gave up on
+    """
+    results = (output or {}).get('results') or []
+    if len(results) != len(library_refs):
+        raise ValueError('Child job for ' + ", ".join([str(ref) for ref in library_refs]) +
+                         ' finished without a result for each library')
+    unpacked = []
+    for result in results:
+        failures = result.get('failed_libraries') or []
+        unpacked.append((None, failures[0]) if failures else (result, None))
+    return unpacked
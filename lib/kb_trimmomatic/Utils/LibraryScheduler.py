@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Scratch- and memory-aware scheduling of libraries trimmed side by side
+
+Each library needs scratch for its downloaded FASTQ plus, at worst, outputs
+as large as its inputs, and memory for one trimming engine. Reads objects
+only record the size of their stored (usually gzipped) files, so FASTQ bytes
+are estimated with a ratio that starts at DEFAULT_FASTQ_RATIO and is replaced
+by the ratio seen in libraries that have finished.
+
+LibraryScheduler.run() starts libraries largest first, on up to n_workers
+threads, and only while the estimated needs of the running libraries stay
+under the scratch and memory limits. When the next library doesn't fit it
+tries smaller ones, and a library that is bigger than the limits on its own
+still runs once nothing else is running, so the schedule can't deadlock.
+
+With a CoreAllocator, a library also needs a free core to start, and gets
+its cores from the allocator as it starts; cores(library_i) tells the
+running library how many it has.
+"""
+import os
+import sys
+import threading
+
+SCRATCH_LIMIT_FRACTION = 0.9
+MEMORY_LIMIT_FRACTION = 0.8
+# uncompressed FASTQ bytes per stored reads file byte, until a library has been seen
+DEFAULT_FASTQ_RATIO = 4.0
+# trimmed outputs never hold more bases than the inputs
+OUTPUT_RATIO = 1.0
+# one trimming engine: the jar's JVM, or the native engine's read batches and numpy work arrays
+MEMORY_PER_LIBRARY = 2 * 1024 ** 3
+
+
+def projected_scratch_bytes(stored_bytes, fastq_ratio=DEFAULT_FASTQ_RATIO, output_ratio=OUTPUT_RATIO):
+    # peak scratch of one library: its FASTQ and, at worst, outputs as large
+    return int(stored_bytes * fastq_ratio * (1 + output_ratio))
+
+
+def default_limits(scratch_dir):
+    # (scratch bytes, memory bytes) available to libraries: most of the free scratch space and physical memory
+    stat = os.statvfs(scratch_dir)
+    scratch_limit = int(stat.f_bavail * stat.f_frsize * SCRATCH_LIMIT_FRACTION)
+    memory_limit = int(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * MEMORY_LIMIT_FRACTION)
+    return scratch_limit, memory_limit
+
+
+class LibraryScheduler(object):
+
+    def __init__(self, library_bytes, scratch_limit, memory_limit, n_workers, log=None, allocator=None):
+        self.library_bytes = list(library_bytes)
+        self.scratch_limit = scratch_limit
+        self.memory_limit = memory_limit
+        self.n_workers = max(1, int(n_workers))
+        self.log = log if log is not None else (lambda message: None)
+        self.allocator = allocator
+        self.observed = []  # (stored bytes, FASTQ bytes) of finished libraries
+        self.peak = {'running': 0, 'scratch': 0, 'memory': 0}
+        self._cond = threading.Condition()
+
+    def fastq_ratio(self):
+        stored = sum([observed[0] for observed in self.observed])
+        if not stored:
+            return DEFAULT_FASTQ_RATIO
+        return float(sum([observed[1] for observed in self.observed])) / stored
+
+    def estimate(self, library_i):
+        # (peak scratch bytes, peak memory bytes) of one library
+        return projected_scratch_bytes(self.library_bytes[library_i], self.fastq_ratio()), MEMORY_PER_LIBRARY
+
+    def observe(self, library_i, fastq_bytes):
+        # the FASTQ size a finished library actually had, to refine the estimates of the rest
+        if fastq_bytes and self.library_bytes[library_i]:
+            with self._cond:
+                self.observed.append((self.library_bytes[library_i], fastq_bytes))
+
+    def cores(self, library_i):
+        # cores allotted to a running library, or None without an allocator
+        if self.allocator is None:
+            return None
+        return self.allocator.cores(library_i)
+
+    def run(self, run_library):
+        """
+        call run_library(library_i) for every library and return the results in library order.
+        the first error stops new libraries from starting and is re-raised once the running ones finish
+        """
+        n_libraries = len(self.library_bytes)
+        pending = sorted(range(n_libraries), key=lambda i: (-self.library_bytes[i], i))
+        running = {}
+        results = [None] * n_libraries
+        errors = []
+
+        def admit():
+            # with the lock held: the largest pending library that fits, or any library when nothing is running
+            if running and self.allocator is not None and self.allocator.free_cores() < 1:
+                return None
+            used_scratch = sum([need[0] for need in running.values()])
+            used_memory = sum([need[1] for need in running.values()])
+            for library_i in pending:
+                scratch, memory = self.estimate(library_i)
+                if not running or (used_scratch + scratch <= self.scratch_limit and
+                                   used_memory + memory <= self.memory_limit):
+                    if running and library_i != pending[0]:
+                        self.log('Library '+str(library_i)+' starts ahead of larger ones that would exceed the limits')
+                    elif not running and (scratch > self.scratch_limit or memory > self.memory_limit):
+                        self.log('Library '+str(library_i)+' alone exceeds the limits, running it by itself')
+                    pending.remove(library_i)
+                    running[library_i] = (scratch, memory)
+                    if self.allocator is not None:
+                        self.allocator.acquire(library_i)
+                    self.peak['running'] = max(self.peak['running'], len(running))
+                    self.peak['scratch'] = max(self.peak['scratch'], used_scratch + scratch)
+                    self.peak['memory'] = max(self.peak['memory'], used_memory + memory)
+                    return library_i
+            return None
+
+        def worker():
+            while True:
+                with self._cond:
+                    library_i = None
+                    while library_i is None:
+                        if errors or not pending:
+                            return
+                        library_i = admit()
+                        if library_i is None:
+                            self._cond.wait()
+                try:
+                    results[library_i] = run_library(library_i)
+                except Exception:
+                    with self._cond:
+                        errors.append(sys.exc_info()[1])
+                finally:
+                    with self._cond:
+                        del running[library_i]
+                        if self.allocator is not None:
+                            self.allocator.release(library_i)
+                        self._cond.notify_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.n_workers, n_libraries))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Native (numpy) implementation of the Trimmomatic trimming steps
+
+Takes the same step string parse_trimmomatic_steps() builds for the jar and
+applies LEADING, TRAILING, SLIDINGWINDOW, CROP, HEADCROP and MINLEN to
+batches of reads; ILLUMINACLIP is left to the jar. Each read is tracked as a
+[start, end) interval over a padded quality matrix and every step is a
+handful of vectorized masks, so the cost per batch is independent of the
+number of python-level reads. As in
+Trimmomatic, N bases count as quality 0, quality strings are written back in
+their input encoding and a read trimmed to nothing is dropped.
+
+run_native_trimmomatic() writes the same output files as the jar and returns
+console lines in the jar's format, so callers parse the counts the same way.
+It can also fold every batch into the QC (QCUtil) of its input and output
+files as it goes, so QC needs no second read of either.
+Paired end reads may also come from one interleaved file, and the paired
+output may go to one interleaved file (see Interleaved).
+"""
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import (iter_fastq, pack_padded, write_fastq_batch, gather_fastq_batch,
+                                          DEFAULT_BATCH_SIZE, SEQ, QUAL)
+from kb_trimmomatic.Utils.FastqIndex import DEFAULT_INDEX_INTERVAL
+from kb_trimmomatic.Utils.Interleaved import iter_interleaved, interleave_mates, interleave_intervals
+from kb_trimmomatic.Utils.QCUtil import FastqQC
+
+PHRED_OFFSETS = {'phred33': 33, 'phred64': 64}
+NATIVE_STEPS = ('LEADING', 'TRAILING', 'SLIDINGWINDOW', 'CROP', 'HEADCROP', 'MINLEN')
+
+_N = ord('N')
+
+
+def parse_steps(step_string):
+    # 'LEADING:3 SLIDINGWINDOW:4:15' -> [('LEADING', [3]), ('SLIDINGWINDOW', [4, 15])]
+    steps = []
+    for token in step_string.split():
+        fields = token.split(':')
+        name = fields[0].upper()
+        if name not in NATIVE_STEPS:
+            raise ValueError('Trimming step not supported by the native engine: ' + token)
+        try:
+            args = [int(arg) for arg in fields[1:]]
+        except ValueError:
+            raise ValueError('Bad arguments for trimming step: ' + token)
+        n_args = 2 if name == 'SLIDINGWINDOW' else 1
+        if len(args) != n_args:
+            raise ValueError('Trimming step ' + name + ' takes ' + str(n_args) + ' argument(s): ' + token)
+        steps.append((name, args))
+    return steps
+
+
+def quality_matrix(seqs, quals, phred_offset=33):
+    # padded (n, max_len) sequence bytes and int32 phred scores with N bases zeroed
+    seq_mat, lengths = pack_padded(seqs)
+    qual_mat, _ = pack_padded(quals, pad=phred_offset)
+    scores = qual_mat.astype(np.int32) - phred_offset
+    scores[seq_mat == _N] = 0
+    return seq_mat, scores, lengths
+
+
+def batch_matrices(batch, phred_offset=33):
+    # quality_matrix() for a FastqIO.FastqBatch
+    seq_mat, lengths = batch.padded(SEQ)
+    qual_mat, _ = batch.padded(QUAL, pad=phred_offset)
+    scores = qual_mat.astype(np.int32) - phred_offset
+    scores[seq_mat == _N] = 0
+    return seq_mat, scores, lengths
+
+
+def _first_true(mask):
+    # index of the first True per row and whether the row has any
+    if not mask.shape[1]:
+        return np.zeros(mask.shape[0], dtype=np.int64), np.zeros(mask.shape[0], dtype=bool)
+    return mask.argmax(axis=1), mask.any(axis=1)
+
+
+def _last_true(mask):
+    width = mask.shape[1]
+    if not width:
+        return np.zeros(mask.shape[0], dtype=np.int64), np.zeros(mask.shape[0], dtype=bool)
+    return width - 1 - mask[:, ::-1].argmax(axis=1), mask.any(axis=1)
+
+
+def trim_intervals(steps, scores, lengths, intervals=None):
+    """
+    apply the single read steps to a batch and return (start, end, keep) arrays; surviving read i
+    is sequence[start[i]:end[i]]. intervals continues from an earlier (start, end, keep).
+    """
+    n, width = scores.shape
+    if intervals is None:
+        start = np.zeros(n, dtype=np.int64)
+        end = lengths.astype(np.int64)
+        keep = np.ones(n, dtype=bool)
+    else:
+        start, end, keep = [a.copy() for a in intervals]
+    cols = np.arange(width)[None, :]
+
+    for name, args in steps:
+        if not keep.any():
+            break
+        if name == 'CROP':
+            end = np.minimum(end, start + args[0])
+
+        elif name == 'HEADCROP':
+            keep &= (end - start) > args[0]
+            start = np.where(keep, start + args[0], start)
+
+        elif name == 'MINLEN':
+            keep &= (end - start) >= args[0]
+
+        elif name == 'LEADING':
+            in_read = (cols >= start[:, None]) & (cols < end[:, None])
+            first, found = _first_true((scores >= args[0]) & in_read)
+            keep &= found
+            start = np.where(keep, first, start)
+
+        elif name == 'TRAILING':
+            in_read = (cols >= start[:, None]) & (cols < end[:, None])
+            last, found = _last_true((scores >= args[0]) & in_read)
+            keep &= found
+            end = np.where(keep, last + 1, end)
+
+        elif name == 'SLIDINGWINDOW':
+            window, min_quality = args
+            required = window * min_quality
+            cumulative = np.zeros((n, width + 1), dtype=np.int64)
+            np.cumsum(scores, axis=1, out=cumulative[:, 1:])
+            length = end - start
+            rows = np.arange(n)
+
+            # reads shorter than the window are judged on their mean as a whole
+            short = keep & (length < window)
+            short_total = cumulative[rows, end] - cumulative[rows, start]
+            keep &= ~(short & (short_total * window < required * length))
+
+            new_end = end.copy()
+            if 0 < window <= width:
+                window_sums = cumulative[:, window:] - cumulative[:, :-window]
+                failing = window_sums < required
+                starts = np.arange(width - window + 1)[None, :]
+                long_reads = keep & ~short
+                first_window = window_sums[rows, np.minimum(start, width - window)]
+                keep &= ~(long_reads & (first_window < required))
+                # the first failing window after the first keeps everything up to, not including,
+                # its last base
+                later = failing & (starts > start[:, None]) & (starts <= (end - window)[:, None])
+                fail_at, found = _first_true(later)
+                new_end = np.where(keep & ~short & found, fail_at + window - 1, end)
+
+            # then trim back the low quality bases left at the end
+            in_read = (cols >= start[:, None]) & (cols < new_end[:, None])
+            last, found = _last_true((scores >= min_quality) & in_read)
+            keep &= found
+            end = np.where(keep, last + 1, end)
+
+    return start, end, keep
+
+
+def trim_batch(steps, mates):
+    """
+    mates: one (seq_mat, scores, lengths) per mate, as from quality_matrix()
+    returns one (start, end, keep) per mate
+    """
+    return [trim_intervals(steps, scores, lengths) for seq_mat, scores, lengths in mates]
+
+
+def write_trimmed(fh, batch, start, end, rows):
+    # the selected records of a batch cut down to their surviving intervals
+    write_fastq_batch(fh, batch, rows, start[rows], end[rows])
+
+
+def check_layout(read_type, input_paths, output_paths):
+    """
+    (interleaved input, interleaved output) for the paths given: PE reads from [fwd, rev] or one interleaved
+    file, and writes [fwd_paired, fwd_unpaired, rev_paired, rev_unpaired] or, from interleaved input only,
+    [interleaved paired, fwd_unpaired, rev_unpaired]
+    """
+    if read_type != 'PE':
+        return False, False
+    interleaved_input = len(input_paths) == 1
+    interleaved_output = len(output_paths) == 3
+    if interleaved_output and not interleaved_input:
+        raise ValueError('Interleaved paired output needs interleaved input')
+    return interleaved_input, interleaved_output
+
+
+def gather_outputs(batches, mate_outputs, interleaved_output=False):
+    # the FASTQ text of each output file for a batch, in output_paths order
+    if interleaved_output:
+        (fwd_start, fwd_end, (both, fwd_only)), (rev_start, rev_end, (_, rev_only)) = mate_outputs
+        paired = interleave_mates(batches[0].take(both), batches[1].take(both))
+        return [gather_fastq_batch(paired, None, interleave_intervals(fwd_start[both], rev_start[both]),
+                                   interleave_intervals(fwd_end[both], rev_end[both])),
+                gather_fastq_batch(batches[0], fwd_only, fwd_start[fwd_only], fwd_end[fwd_only]),
+                gather_fastq_batch(batches[1], rev_only, rev_start[rev_only], rev_end[rev_only])]
+    return [gather_fastq_batch(batch, rows, start[rows], end[rows])
+            for batch, (start, end, selections) in zip(batches, mate_outputs) for rows in selections]
+
+
+def select_outputs(read_type, intervals):
+    """
+    route the trimmed reads of a batch to the output files. returns, per mate, (start, end,
+    [rows for each output file of the mate]) in output_paths order, and the batch's counts
+    """
+    if read_type == 'PE':
+        (fwd_start, fwd_end, fwd_keep), (rev_start, rev_end, rev_keep) = intervals
+        both = fwd_keep & rev_keep
+        fwd_only = fwd_keep & ~rev_keep
+        rev_only = rev_keep & ~fwd_keep
+        counts = {'input': len(both), 'both': int(both.sum()),
+                  'fwd_only': int(fwd_only.sum()), 'rev_only': int(rev_only.sum())}
+        return [(fwd_start, fwd_end, [both, fwd_only]), (rev_start, rev_end, [both, rev_only])], counts
+    start, end, keep = intervals[0]
+    return [(start, end, [keep])], {'input': len(keep), 'both': int(keep.sum()), 'fwd_only': 0, 'rev_only': 0}
+
+
+def count_bases(batches, mate_outputs):
+    # (bases read, bases written) for a batch: what the jar's read counts leave out
+    input_bases = sum([int(batch.lengths(SEQ).sum()) for batch in batches])
+    output_bases = sum([int((end - start)[rows].sum())
+                        for start, end, selections in mate_outputs for rows in selections])
+    return input_bases, output_bases
+
+
+def new_qc(phred_offset, input_paths, output_paths):
+    # (input QC, output QC), one FastqQC per file
+    return [FastqQC(phred_offset) for path in input_paths], [FastqQC(phred_offset) for path in output_paths]
+
+
+def add_batch_qc(input_qcs, output_qcs, batches, mate_outputs, interleaved_output=False):
+    # fold a batch into the QC of each input file and, cut to its trimmed intervals, of each output file
+    for mate, batch in enumerate(batches):
+        # an interleaved input holds both mates
+        input_qcs[mate if len(input_qcs) > 1 else 0].add_fastq_batch(batch)
+    mate_slices = [[(batch, start, end, rows) for rows in selections]
+                   for batch, (start, end, selections) in zip(batches, mate_outputs)]
+    if interleaved_output:
+        output_slices = [[mate_slices[0][0], mate_slices[1][0]], [mate_slices[0][1]], [mate_slices[1][1]]]
+    else:
+        output_slices = [[s] for slices in mate_slices for s in slices]
+    for qc, slices in zip(output_qcs, output_slices):
+        for batch, start, end, rows in slices:
+            qc.add_fastq_batch(batch, rows, start[rows], end[rows])
+
+
+def qc_summaries(input_qcs, output_qcs):
+    return {'inputs': [qc.summary() for qc in input_qcs], 'outputs': [qc.summary() for qc in output_qcs]}
+
+
+def new_counts():
+    return {'input': 0, 'both': 0, 'fwd_only': 0, 'rev_only': 0, 'input_bases': 0, 'surviving_bases': 0}
+
+
+def _percent(count, total):
+    return '(' + ('%.2f' % (100.0 * count / total if total else 0.0)) + '%)'
+
+
+def console_header(read_type, quality_encoding, input_paths, output_paths, step_string):
+    program = 'TrimmomaticPE' if read_type == 'PE' else 'TrimmomaticSE'
+    return [program + ': Started with arguments:',
+            ' '.join(['-' + quality_encoding] + list(input_paths) + list(output_paths) + step_string.split())]
+
+
+def console_summary(read_type, counts):
+    # the jar's closing count and completion lines
+    total = counts['input']
+    if read_type == 'PE':
+        dropped = total - counts['both'] - counts['fwd_only'] - counts['rev_only']
+        summary = ('Input Read Pairs: ' + str(total) +
+                   ' Both Surviving: ' + str(counts['both']) + ' ' + _percent(counts['both'], total) +
+                   ' Forward Only Surviving: ' + str(counts['fwd_only']) + ' ' + _percent(counts['fwd_only'], total) +
+                   ' Reverse Only Surviving: ' + str(counts['rev_only']) + ' ' + _percent(counts['rev_only'], total) +
+                   ' Dropped: ' + str(dropped) + ' ' + _percent(dropped, total))
+        program = 'TrimmomaticPE'
+    else:
+        dropped = total - counts['both']
+        summary = ('Input Reads: ' + str(total) +
+                   ' Surviving: ' + str(counts['both']) + ' ' + _percent(counts['both'], total) +
+                   ' Dropped: ' + str(dropped) + ' ' + _percent(dropped, total))
+        program = 'TrimmomaticSE'
+    return [summary, program + ': Completed successfully']
+
+
+def check_native_inputs(quality_encoding):
+    if quality_encoding not in PHRED_OFFSETS:
+        raise ValueError('quality_encoding must be phred33 or phred64 for the native engine')
+    return PHRED_OFFSETS[quality_encoding]
+
+
+def run_native_trimmomatic(read_type, quality_encoding, input_paths, output_paths, step_string,
+                           batch_size=DEFAULT_BATCH_SIZE, totals=None, qc=None):
+    """
+    PE: input_paths is [fwd, rev], output_paths is [fwd_paired, fwd_unpaired, rev_paired, rev_unpaired]
+        (or interleaved, see check_layout())
+    SE: input_paths is [fwd], output_paths is [fwd]
+    returns console lines in the format Trimmomatic prints. totals, if given, is updated with
+    the run's read counts and its input and surviving bases (new_counts()); qc, if given, with
+    the QC summaries of the input and output files (qc_summaries())
+    """
+    phred_offset = check_native_inputs(quality_encoding)
+    steps = parse_steps(step_string)
+    interleaved_input, interleaved_output = check_layout(read_type, input_paths, output_paths)
+    lines = console_header(read_type, quality_encoding, input_paths, output_paths, step_string)
+
+    if interleaved_input:
+        # batches of whole pairs from the index, split into mates sharing the batch's buffer
+        pairs = iter_interleaved(input_paths[0], DEFAULT_INDEX_INTERVAL)
+    else:
+        readers = [iter_fastq(path, batch_size) for path in input_paths]
+    out_handles = [open(path, 'wb') for path in output_paths]
+    counts = new_counts()
+    if qc is not None:
+        input_qcs, output_qcs = new_qc(phred_offset, input_paths, output_paths)
+    try:
+        while True:
+            if interleaved_input:
+                batches = list(next(pairs, (None, None)))
+            else:
+                batches = [next(reader, None) for reader in readers]
+            if batches[0] is None:
+                if any([b is not None for b in batches]):
+                    raise ValueError('Paired read files have different numbers of records: ' + ", ".join(input_paths))
+                break
+            if any([b is None or len(b) != len(batches[0]) for b in batches]):
+                raise ValueError('Paired read files have different numbers of records: ' + ", ".join(input_paths))
+
+            intervals = trim_batch(steps, [batch_matrices(batch, phred_offset) for batch in batches])
+            mate_outputs, batch_counts = select_outputs(read_type, intervals)
+            batch_counts['input_bases'], batch_counts['surviving_bases'] = count_bases(batches, mate_outputs)
+            for fh, out in zip(out_handles, gather_outputs(batches, mate_outputs, interleaved_output)):
+                if len(out):
+                    fh.write(out.tobytes())
+            if qc is not None:
+                add_batch_qc(input_qcs, output_qcs, batches, mate_outputs, interleaved_output)
+            for key in counts:
+                counts[key] += batch_counts[key]
+    finally:
+        for fh in out_handles:
+            fh.close()
+
+    if totals is not None:
+        totals.update(counts)
+    if qc is not None:
+        qc.update(qc_summaries(input_qcs, output_qcs))
+    return lines + console_summary(read_type, counts)
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Multiprocess pipeline for the native trimming engine
+
+The native engine is vectorized per batch but a single process is still
+bound to one core. Here one reader process copies whole-record batches of
+the input files (byte ranges from the FastqIndex) straight into slots of a
+shared memory ring, N worker processes parse and trim the batch in their
+slot and write the output records back into the same slot, and the writer
+(the calling process) appends the slots to the output files in input order.
+Only slot numbers and counts travel over the queues; reads are never
+pickled. With QC on, each worker folds its batches into QC of its own and
+sends it once at the end, for the writer to merge.
+
+An interleaved paired end input is read as batches of whole pairs into one
+region per slot, and split into mates by the workers.
+
+The ring is an anonymous shared mmap created before the processes fork
+(multiprocessing.shared_memory needs python 3.8), so the worker processes
+also inherit the parsed steps. It is kept within MAX_RING_BYTES and half the
+available memory by using fewer slots (and then fewer workers).
+
+Forking copies every lock of the parent in its current state, and python 2
+has no way to start processes without forking. A child forked while another
+thread holds a lock (logging, a queue feeder thread, the library scheduler
+and QC pools of the service) can deadlock on it. So the pipeline only forks
+from a process with no other threads: when the caller has any, it runs in a
+fresh helper process (python -m kb_trimmomatic.Utils.ParallelTrimmer) and
+the results come back over its stdout.
+"""
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+import numpy as np
+
+try:
+    from queue import Empty
+except ImportError:  # python 2
+    from Queue import Empty
+
+from kb_trimmomatic.Utils.FastqIO import parse_fastq_buffer
+from kb_trimmomatic.Utils.FastqIndex import batch_offsets, check_paired_counts, DEFAULT_INDEX_INTERVAL
+from kb_trimmomatic.Utils.Interleaved import interleaved_offsets, split_mates
+from kb_trimmomatic.Utils.LibraryScheduler import MEMORY_PER_LIBRARY
+from kb_trimmomatic.Utils.NativeTrimmer import (parse_steps, batch_matrices, trim_batch, select_outputs, gather_outputs,
+                                                count_bases, new_counts, new_qc, add_batch_qc, qc_summaries,
+                                                check_layout, check_native_inputs, console_header, console_summary)
+
+_NEWLINE = ord('\n')
+_POLL_SECONDS = 1.0
+# the ring gets half of what the library scheduler budgets for one engine; the workers' arrays need the rest
+MAX_RING_BYTES = MEMORY_PER_LIBRARY // 2
+AVAILABLE_MEMORY_FRACTION = 0.5
+
+
+def default_workers():
+    # the reader and writer mostly wait on I/O, so every core but one trims
+    return max(1, multiprocessing.cpu_count() - 1)
+
+
+def available_memory():
+    # bytes of memory available to new allocations, or None when the system doesn't say
+    try:
+        with open('/proc/meminfo') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def ring_bytes_limit(max_ring_bytes=None):
+    limit = int(max_ring_bytes or MAX_RING_BYTES)
+    available = available_memory()
+    if available is not None:
+        limit = min(limit, int(available * AVAILABLE_MEMORY_FRACTION))
+    return limit
+
+
+def _fork_context():
+    # workers must fork to share the ring and the parsed steps
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+class _Ring(object):
+    # n_slots slots, each with one region per input file sized for that file's largest batch
+
+    def __init__(self, n_slots, region_sizes):
+        # one spare byte per region for a newline the last record of a file may lack
+        self.region_sizes = [int(size) + 1 for size in region_sizes]
+        self.slot_size = sum(self.region_sizes)
+        self.memory = mmap.mmap(-1, max(1, n_slots * self.slot_size))
+        self.array = np.frombuffer(self.memory, dtype=np.uint8)
+
+    def region(self, slot, mate):
+        offset = slot * self.slot_size + sum(self.region_sizes[:mate])
+        return self.array[offset:offset + self.region_sizes[mate]]
+
+    def close(self):
+        self.array = None
+        try:
+            self.memory.close()
+        except BufferError:
+            pass  # a view is still referenced, the mapping goes with it
+
+
+class _StageTimer(object):
+    # busy time of a pipeline stage, everything else is time spent waiting on the other stages
+
+    def __init__(self):
+        self.started = time.time()
+        self.busy = 0.0
+        self._mark = None
+
+    def start(self):
+        self._mark = time.time()
+
+    def stop(self):
+        self.busy += time.time() - self._mark
+
+    def report(self):
+        return self.busy, time.time() - self.started
+
+
+def _reader(ring, input_paths, offsets, n_slots, free_slots, tasks, results, n_workers):
+    timer = _StageTimer()
+    try:
+        handles = [io.open(path, 'rb', buffering=0) for path in input_paths]
+        for batch_i in range(len(offsets[0]) - 1):
+            # every slot starts out free, so the writer only queues the slots it frees
+            slot = batch_i if batch_i < n_slots else free_slots.get()
+            timer.start()
+            lengths = []
+            for mate, (fh, mate_offsets) in enumerate(zip(handles, offsets)):
+                start, end = int(mate_offsets[batch_i]), int(mate_offsets[batch_i + 1])
+                region = ring.region(slot, mate)
+                fh.seek(start)
+                filled = 0
+                while filled < end - start:
+                    n_read = fh.readinto(region[filled:end - start])
+                    if not n_read:
+                        raise ValueError('Unexpected end of file reading ' + input_paths[mate])
+                    filled += n_read
+                lengths.append(filled)
+            timer.stop()
+            tasks.put((batch_i, slot, lengths))
+        for fh in handles:
+            fh.close()
+        for _ in range(n_workers):
+            tasks.put(None)
+        results.put(('stats', 'reader') + timer.report())
+    except Exception:
+        results.put(('error', 'reader', traceback.format_exc()))
+
+
+def _worker(ring, read_type, layout, steps, phred_offset, input_paths, output_paths, with_qc, tasks, results):
+    timer = _StageTimer()
+    input_qcs, output_qcs = new_qc(phred_offset, input_paths, output_paths) if with_qc else (None, None)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            timer.start()
+            batch_i, slot, lengths = task
+            batches = []
+            for mate, length in enumerate(lengths):
+                region = ring.region(slot, mate)
+                if length and region[length - 1] != _NEWLINE:
+                    region[length] = _NEWLINE
+                    length += 1
+                batches.append(parse_fastq_buffer(region[:length], input_paths[mate]))
+            interleaved_input, interleaved_output = layout
+            if interleaved_input:
+                batches = list(split_mates(batches[0]))
+            if any([len(batch) != len(batches[0]) for batch in batches]):
+                raise ValueError('Paired read files have different numbers of records: ' + ", ".join(input_paths))
+
+            intervals = trim_batch(steps, [batch_matrices(batch, phred_offset) for batch in batches])
+            mate_outputs, counts = select_outputs(read_type, intervals)
+            counts['input_bases'], counts['surviving_bases'] = count_bases(batches, mate_outputs)
+            # the output of a mate is never longer than its input, so it goes back into the same region
+            # (every output of an interleaved input into its one region)
+            outputs = gather_outputs(batches, mate_outputs, interleaved_output)
+            if with_qc:
+                add_batch_qc(input_qcs, output_qcs, batches, mate_outputs, interleaved_output)
+            region_outputs = [outputs] if len(lengths) == 1 else [outputs[:2], outputs[2:]]
+            out_lengths = []
+            for region_i, outputs in enumerate(region_outputs):
+                region = ring.region(slot, region_i)
+                pos = 0
+                for out in outputs:
+                    region[pos:pos + len(out)] = out
+                    pos += len(out)
+                out_lengths.append([len(out) for out in outputs])
+            timer.stop()
+            results.put(('batch', batch_i, slot, out_lengths, counts))
+        if with_qc:
+            # ahead of the stats, which the writer waits for
+            results.put(('qc', input_qcs, output_qcs))
+        results.put(('stats', 'worker') + timer.report())
+    except Exception:
+        results.put(('error', 'worker', traceback.format_exc()))
+
+
+def _utilization_lines(stats, writer_stats, n_workers, wall):
+    def percent(busy, total):
+        return '%.0f%%' % (100.0 * busy / total if total else 0.0)
+    reader = stats.get('reader', [(0.0, wall)])[0]
+    workers = stats.get('worker', [])
+    worker_busy = sum([busy for busy, _ in workers])
+    return ['Pipeline: ' + str(n_workers) + ' worker processes, ' + ('%.1f' % wall) + ' s',
+            'Pipeline utilization: reader ' + percent(reader[0], reader[1]) +
+            ', workers ' + percent(worker_busy, sum([total for _, total in workers])) +
+            ', writer ' + percent(writer_stats[0], writer_stats[1])]
+
+
+def run_parallel_trimmomatic(read_type, quality_encoding, input_paths, output_paths, step_string,
+                             n_workers=None, batch_records=DEFAULT_INDEX_INTERVAL, n_slots=None, max_ring_bytes=None,
+                             totals=None, qc=None):
+    """
+    same inputs, outputs, console lines, totals and qc as NativeTrimmer.run_native_trimmomatic(),
+    plus per-stage utilization lines. n_workers defaults to all cores but one, n_slots (the
+    number of batches in flight) to two per worker, as far as the ring fits in max_ring_bytes
+    (MAX_RING_BYTES) and half the available memory
+    """
+    args = [read_type, quality_encoding, list(input_paths), list(output_paths), step_string,
+            n_workers, batch_records, n_slots, max_ring_bytes, qc is not None]
+    if threading.active_count() > 1:
+        lines, counts, summaries = _run_in_helper(args)
+    else:
+        lines, counts, summaries = _run_pipeline(*args)
+    if totals is not None:
+        totals.update(counts)
+    if qc is not None:
+        qc.update(summaries)
+    return lines
+
+
+def _run_in_helper(args):
+    # the pipeline in a fresh single-threaded process; python 2's subprocess execs right after forking
+    lib_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([lib_dir] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    process = subprocess.Popen([sys.executable, '-m', 'kb_trimmomatic.Utils.ParallelTrimmer'], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    stdout, stderr = process.communicate(json.dumps(args).encode('utf-8'))
+    try:
+        result = json.loads(stdout.decode('utf-8'))
+    except ValueError:
+        raise ValueError('Native trimming pipeline helper exited with return code ' + str(process.returncode) +
+                         ':\n' + stderr.decode('utf-8', 'replace'))
+    if 'error' in result:
+        raise ValueError(result['error'])
+    return result['lines'], result['counts'], result['qc']
+
+
+def _run_pipeline(read_type, quality_encoding, input_paths, output_paths, step_string, n_workers, batch_records,
+                  n_slots, max_ring_bytes, with_qc=False):
+    phred_offset = check_native_inputs(quality_encoding)
+    steps = parse_steps(step_string)
+    layout = check_layout(read_type, input_paths, output_paths)
+    lines = console_header(read_type, quality_encoding, input_paths, output_paths, step_string)
+    if len(input_paths) == 2:
+        check_paired_counts(input_paths[0], input_paths[1])
+    if layout[0]:
+        offsets = [interleaved_offsets(input_paths[0], batch_records)]
+    else:
+        offsets = [batch_offsets(path, batch_records)[0] for path in input_paths]
+    n_batches = len(offsets[0]) - 1
+    n_workers = max(1, min(int(n_workers or default_workers()), max(n_batches, 1)))
+    n_slots = int(n_slots or 2 * n_workers)
+    region_sizes = [np.diff(mate_offsets).max() if n_batches else 0 for mate_offsets in offsets]
+    # fewer batches in flight when the ring would be too large, and no more workers than slots to work on
+    slot_bytes = sum([int(size) + 1 for size in region_sizes])
+    n_slots = max(1, min(n_slots, ring_bytes_limit(max_ring_bytes) // slot_bytes))
+    n_workers = min(n_workers, n_slots)
+
+    ring = _Ring(n_slots, region_sizes)
+    context = _fork_context()
+    free_slots = context.Queue()
+    tasks = context.Queue()
+    results = context.Queue()
+
+    started = time.time()
+    processes = [context.Process(target=_reader,
+                                 args=(ring, input_paths, offsets, n_slots, free_slots, tasks, results, n_workers))]
+    processes += [context.Process(target=_worker,
+                                  args=(ring, read_type, layout, steps, phred_offset, input_paths, output_paths,
+                                        with_qc, tasks, results))
+                  for _ in range(n_workers)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    writer = _StageTimer()
+    out_handles = [open(path, 'wb') for path in output_paths]
+    counts = new_counts()
+    input_qcs, output_qcs = new_qc(phred_offset, input_paths, output_paths)
+    stats = {}
+    pending = {}
+    next_batch = 0
+    try:
+        while next_batch < n_batches or sum([len(v) for v in stats.values()]) < n_workers + 1:
+            try:
+                message = results.get(timeout=_POLL_SECONDS)
+            except Empty:
+                if any([process.exitcode not in (None, 0) for process in processes]):
+                    raise ValueError('Native trimming pipeline process exited unexpectedly')
+                continue
+            if message[0] == 'error':
+                raise ValueError('Native trimming pipeline ' + message[1] + ' failed:\n' + message[2])
+            if message[0] == 'stats':
+                stats.setdefault(message[1], []).append(message[2:])
+                continue
+            if message[0] == 'qc':
+                for qc, worker_qc in zip(input_qcs + output_qcs, message[1] + message[2]):
+                    qc.merge(worker_qc)
+                continue
+            pending[message[1]] = message[2:]
+            # write whatever is now next in input order
+            while next_batch in pending:
+                slot, out_lengths, batch_counts = pending.pop(next_batch)
+                writer.start()
+                handles = iter(out_handles)
+                for mate, mate_lengths in enumerate(out_lengths):
+                    region = ring.region(slot, mate)
+                    pos = 0
+                    for length in mate_lengths:
+                        next(handles).write(region[pos:pos + length].tobytes())
+                        pos += length
+                writer.stop()
+                for key in counts:
+                    counts[key] += batch_counts[key]
+                free_slots.put(slot)
+                next_batch += 1
+    finally:
+        for fh in out_handles:
+            fh.close()
+        for process in processes:
+            process.join(_POLL_SECONDS)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        # the feeder thread of the freed slots goes too, not to be inherited by the next fork
+        free_slots.close()
+        free_slots.join_thread()
+        ring.close()
+
+    lines += _utilization_lines(stats, writer.report(), n_workers, time.time() - started)
+    return (lines + console_summary(read_type, counts), counts,
+            qc_summaries(input_qcs, output_qcs) if with_qc else None)
+
+
+if __name__ == '__main__':
+    # helper process for callers with other threads running: arguments as JSON on stdin, {'lines', 'counts', 'qc'}
+    # or {'error'} out
+    try:
+        lines, counts, summaries = _run_pipeline(*json.loads(sys.stdin.read()))
+        output = {'lines': lines, 'counts': counts, 'qc': summaries}
+    except ValueError as e:
+        output = {'error': str(e)}
+    except Exception:
+        output = {'error': 'Native trimming pipeline helper failed:\n' + traceback.format_exc()}
+    sys.stdout.write(json.dumps(output))
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming FastQC-style metrics for the FASTQ files a trimming run touches
+
+Per-position mean quality, read length histogram, GC content and N rates are
+accumulated over batches of reads held as padded uint8 matrices, so the cost
+is a handful of numpy reductions per batch rather than per-read python work.
+The native trimming engines fold in the batches they trim, so their inputs
+and outputs get QC without being read again; compute_fastq_qc() reads a file
+for the jar.
+"""
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import iter_fastq, pack_padded, DEFAULT_BATCH_SIZE, SEQ, QUAL
+
+PHRED_OFFSETS = {'phred33': 33, 'phred64': 64}
+
+_G = ord('G')
+_C = ord('C')
+_N = ord('N')
+
+
+class FastqQC(object):
+
+    def __init__(self, phred_offset=33):
+        self.phred_offset = phred_offset
+        self.read_count = 0
+        self.base_count = 0
+        self.gc_count = 0
+        self.n_count = 0
+        self.qual_sum = np.zeros(0, dtype=np.int64)
+        self.pos_count = np.zeros(0, dtype=np.int64)
+        self.pos_n_count = np.zeros(0, dtype=np.int64)
+        self.length_counts = np.zeros(0, dtype=np.int64)
+        self.gc_percent_counts = np.zeros(101, dtype=np.int64)
+
+    def _grow(self, width):
+        if width <= len(self.qual_sum):
+            return
+        extra = width - len(self.qual_sum)
+        self.qual_sum = np.concatenate((self.qual_sum, np.zeros(extra, dtype=np.int64)))
+        self.pos_count = np.concatenate((self.pos_count, np.zeros(extra, dtype=np.int64)))
+        self.pos_n_count = np.concatenate((self.pos_n_count, np.zeros(extra, dtype=np.int64)))
+
+    def add_batch(self, seqs, quals):
+        if not len(seqs):
+            return
+        seq_mat, lengths = pack_padded(seqs)
+        qual_mat, _ = pack_padded(quals, pad=self.phred_offset)
+        self.add_matrices(seq_mat, qual_mat, lengths)
+
+    def add_fastq_batch(self, batch, rows=None, start=None, end=None):
+        # a FastqIO.FastqBatch, without copying the reads out into python strings; rows selects records
+        # and start/end (per selected record) cut them to their trimmed [start, end)
+        if rows is not None:
+            batch = batch.take(rows)
+        if not len(batch):
+            return
+        seq_mat, lengths = batch.padded(SEQ, start=start, end=end)
+        qual_mat, _ = batch.padded(QUAL, pad=self.phred_offset, start=start, end=end)
+        self.add_matrices(seq_mat, qual_mat, lengths)
+
+    def merge(self, other):
+        # add the counts of another FastqQC, such as one kept by a worker process
+        self._grow(len(other.qual_sum))
+        width = len(other.qual_sum)
+        self.qual_sum[:width] += other.qual_sum
+        self.pos_count[:width] += other.pos_count
+        self.pos_n_count[:width] += other.pos_n_count
+        if len(other.length_counts) > len(self.length_counts):
+            self.length_counts = np.concatenate((self.length_counts,
+                                                 np.zeros(len(other.length_counts) - len(self.length_counts),
+                                                          dtype=np.int64)))
+        self.length_counts[:len(other.length_counts)] += other.length_counts
+        self.gc_percent_counts += other.gc_percent_counts
+        self.read_count += other.read_count
+        self.base_count += other.base_count
+        self.gc_count += other.gc_count
+        self.n_count += other.n_count
+
+    def add_matrices(self, seq_mat, qual_mat, lengths):
+        width = seq_mat.shape[1]
+        self._grow(width)
+
+        valid = np.arange(width)[None, :] < lengths[:, None]
+        upper = seq_mat & 0xDF  # fold lowercase bases to upper case
+        is_gc = (upper == _G) | (upper == _C)
+        is_n = (upper == _N) & valid
+
+        self.read_count += len(lengths)
+        self.base_count += int(lengths.sum())
+        self.gc_count += int(is_gc.sum())
+        self.n_count += int(is_n.sum())
+
+        quals = qual_mat.astype(np.int64) - self.phred_offset
+        self.qual_sum[:width] += np.where(valid, quals, 0).sum(axis=0)
+        self.pos_count[:width] += valid.sum(axis=0)
+        self.pos_n_count[:width] += is_n.sum(axis=0)
+
+        length_hist = np.bincount(lengths)
+        if len(length_hist) > len(self.length_counts):
+            self.length_counts = np.concatenate((self.length_counts,
+                                                 np.zeros(len(length_hist) - len(self.length_counts), dtype=np.int64)))
+        self.length_counts[:len(length_hist)] += length_hist
+
+        called = lengths - is_n.sum(axis=1)
+        read_gc = np.where(called > 0,
+                           np.round(100.0 * is_gc.sum(axis=1) / np.maximum(called, 1)),
+                           0).astype(np.int64)
+        self.gc_percent_counts += np.bincount(read_gc, minlength=101)[:101]
+
+    def summary(self):
+        lengths = np.nonzero(self.length_counts)[0]
+        called = self.base_count - self.n_count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_qual = np.where(self.pos_count > 0, self.qual_sum / np.maximum(self.pos_count, 1).astype(float), 0.0)
+            pos_n_rate = np.where(self.pos_count > 0, self.pos_n_count / np.maximum(self.pos_count, 1).astype(float), 0.0)
+        return {'read_count': int(self.read_count),
+                'base_count': int(self.base_count),
+                'mean_length': round(float(self.base_count) / self.read_count, 2) if self.read_count else 0.0,
+                'gc_content': round(float(self.gc_count) / called, 4) if called else 0.0,
+                'n_rate': round(float(self.n_count) / self.base_count, 6) if self.base_count else 0.0,
+                'per_position_mean_quality': [round(float(q), 2) for q in mean_qual],
+                'per_position_n_rate': [round(float(r), 6) for r in pos_n_rate],
+                'length_histogram': {'lengths': [int(l) for l in lengths],
+                                     'counts': [int(self.length_counts[l]) for l in lengths]},
+                'gc_histogram': [int(c) for c in self.gc_percent_counts]
+                }
+
+
+def compute_fastq_qc(path, quality_encoding='phred33', batch_size=DEFAULT_BATCH_SIZE):
+    qc = FastqQC(PHRED_OFFSETS[quality_encoding])
+    for batch in iter_fastq(path, batch_size):
+        qc.add_fastq_batch(batch)
+    return qc.summary()
+
+
+# report plots
+#
+PLOT_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b']
+
+
+def _svg_line_plot(title, series, x_label, y_label, width=420, height=200):
+    # series is a list of (label, xs, ys); draws simple inline svg so the report needs no plotting libs
+    margin_l, margin_r, margin_t, margin_b = 50, 10, 20, 35
+    plot_w = width - margin_l - margin_r
+    plot_h = height - margin_t - margin_b
+    all_x = [x for s in series for x in s[1]] or [0]
+    all_y = [y for s in series for y in s[2]] or [0]
+    x_min, x_max = min(all_x), max(all_x)
+    y_min, y_max = min(0, min(all_y)), max(all_y)
+    if x_max == x_min:
+        x_max = x_min + 1
+    if y_max == y_min:
+        y_max = y_min + 1
+
+    def sx(x):
+        return margin_l + plot_w * float(x - x_min) / (x_max - x_min)
+
+    def sy(y):
+        return margin_t + plot_h - plot_h * float(y - y_min) / (y_max - y_min)
+
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="' + str(width) + '" height="' + str(height) + '">']
+    lines += ['<text x="' + str(width // 2) + '" y="14" font-size="12" text-anchor="middle">' + title + '</text>']
+    lines += ['<rect x="' + str(margin_l) + '" y="' + str(margin_t) + '" width="' + str(plot_w) + '" height="' + str(plot_h) +
+              '" fill="none" stroke="#999999"/>']
+    lines += ['<text x="' + str(margin_l - 4) + '" y="' + str(margin_t + 10) + '" font-size="10" text-anchor="end">' +
+              str(round(y_max, 2)) + '</text>']
+    lines += ['<text x="' + str(margin_l - 4) + '" y="' + str(margin_t + plot_h) + '" font-size="10" text-anchor="end">' +
+              str(round(y_min, 2)) + '</text>']
+    lines += ['<text x="' + str(margin_l) + '" y="' + str(height - 20) + '" font-size="10">' + str(x_min) + '</text>']
+    lines += ['<text x="' + str(margin_l + plot_w) + '" y="' + str(height - 20) + '" font-size="10" text-anchor="end">' +
+              str(x_max) + '</text>']
+    lines += ['<text x="' + str(margin_l + plot_w // 2) + '" y="' + str(height - 5) + '" font-size="10" text-anchor="middle">' +
+              x_label + '</text>']
+    lines += ['<text x="12" y="' + str(margin_t + plot_h // 2) + '" font-size="10" text-anchor="middle" transform="rotate(-90 12,' +
+              str(margin_t + plot_h // 2) + ')">' + y_label + '</text>']
+    for s_i, (label, xs, ys) in enumerate(series):
+        color = PLOT_COLORS[s_i % len(PLOT_COLORS)]
+        points = " ".join([str(round(sx(x), 1)) + ',' + str(round(sy(y), 1)) for x, y in zip(xs, ys)])
+        lines += ['<polyline fill="none" stroke="' + color + '" stroke-width="1.5" points="' + points + '"/>']
+        lines += ['<text x="' + str(margin_l + plot_w - 4) + '" y="' + str(margin_t + 12 + 11 * s_i) +
+                  '" font-size="10" text-anchor="end" fill="' + color + '">' + label + '</text>']
+    lines += ['</svg>']
+    return "\n".join(lines)
+
+
+def qc_plots_html(qc_by_file):
+    # qc_by_file maps a file label (e.g. 'input_fwd', 'output_fwd_paired') to a compute_fastq_qc() summary
+    if not qc_by_file:
+        return ''
+    labels = sorted(qc_by_file.keys())
+
+    qual_series = []
+    n_series = []
+    length_series = []
+    gc_series = []
+    for label in labels:
+        qc = qc_by_file[label]
+        if not qc['read_count']:
+            continue
+        positions = list(range(1, len(qc['per_position_mean_quality']) + 1))
+        qual_series.append((label, positions, qc['per_position_mean_quality']))
+        n_series.append((label, positions, qc['per_position_n_rate']))
+        length_series.append((label, qc['length_histogram']['lengths'], qc['length_histogram']['counts']))
+        gc_series.append((label, list(range(101)), qc['gc_histogram']))
+
+    html_lines = ['<table cellpadding=2 cellspacing=0 border=0>']
+    html_lines += ['<tr><th align=left>File</th><th align=right>Reads</th><th align=right>Bases</th>' +
+                   '<th align=right>Mean Length</th><th align=right>GC</th><th align=right>N rate</th></tr>']
+    for label in labels:
+        qc = qc_by_file[label]
+        html_lines += ['<tr><td>' + label + '</td>' +
+                       '<td align=right>' + str(qc['read_count']) + '</td>' +
+                       '<td align=right>' + str(qc['base_count']) + '</td>' +
+                       '<td align=right>' + str(qc['mean_length']) + '</td>' +
+                       '<td align=right>' + str(round(100.0 * qc['gc_content'], 2)) + '%</td>' +
+                       '<td align=right>' + str(round(100.0 * qc['n_rate'], 4)) + '%</td></tr>']
+    html_lines += ['</table>']
+    if qual_series:
+        html_lines += ['<div>']
+        html_lines += [_svg_line_plot('Per-position mean quality', qual_series, 'position (bp)', 'mean phred')]
+        html_lines += [_svg_line_plot('Read length distribution', length_series, 'length (bp)', 'reads')]
+        html_lines += ['</div><div>']
+        html_lines += [_svg_line_plot('Per-read GC content', gc_series, 'GC %', 'reads')]
+        html_lines += [_svg_line_plot('Per-position N rate', n_series, 'position (bp)', 'N fraction')]
+        html_lines += ['</div>']
+    return "\n".join(html_lines)
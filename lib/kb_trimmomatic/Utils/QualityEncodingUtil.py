@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Quality encoding (phred33 / phred64) detection from a bounded sample of a FASTQ file
+
+Only the first max_bytes of the file are read, so the cost does not depend on
+the size of the library.
+"""
+import numpy as np
+
+DEFAULT_SAMPLE_RECORDS = 10000
+DEFAULT_SAMPLE_BYTES = 4 * 1024 * 1024
+
+# phred33 qualities run from '!' (33); anything below ';' (59) can't be phred64/solexa.
+# phred64 qualities start at '@' (64); Illumina 1.8+ phred33 tops out at 'J' (74), so
+# a sample entirely >= '@' that goes above 'J' is phred64.
+PHRED64_MIN_CHAR = 59
+PHRED33_MAX_CHAR = 74
+
+
+def detect_quality_encoding(path, max_records=DEFAULT_SAMPLE_RECORDS, max_bytes=DEFAULT_SAMPLE_BYTES):
+    with open(path, 'rb') as fh:
+        head = fh.read(max_bytes)
+    lines = head.split(b'\n')
+    # the last line may be cut short by the byte limit, so only use complete records
+    n_records = min(max_records, (len(lines) - 1) // 4)
+    quals = b''.join([lines[4 * i + 3].rstrip(b'\r') for i in range(n_records)])
+
+    result = {'encoding': None,
+              'records_sampled': n_records,
+              'min_qual_char': None,
+              'max_qual_char': None
+              }
+    if not len(quals):
+        return result
+    qual_chars = np.frombuffer(quals, dtype=np.uint8)
+    min_char = int(qual_chars.min())
+    max_char = int(qual_chars.max())
+    result['min_qual_char'] = chr(min_char)
+    result['max_qual_char'] = chr(max_char)
+    if min_char < PHRED64_MIN_CHAR:
+        result['encoding'] = 'phred33'
+    elif max_char > PHRED33_MAX_CHAR:
+        result['encoding'] = 'phred64'
+    # else: every sampled quality is valid in both encodings, leave undecided
+    return result
+
+
+def resolve_quality_encoding(detections, default='phred33'):
+    # detections is a list of detect_quality_encoding() results, e.g. for the fwd and rev mates.
+    # returns the single encoding they agree on, or raises if they conflict
+    found = set([d['encoding'] for d in detections if d['encoding'] is not None])
+    if len(found) > 1:
+        raise ValueError('Quality encoding auto-detection found conflicting encodings between read files: ' +
+                         ", ".join(sorted(found)))
+    if not found:
+        return default
+    return found.pop()
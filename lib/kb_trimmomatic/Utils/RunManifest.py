@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoint manifest for execTrimmomatic runs over ReadsSets
+
+A run is keyed by a hash of its inputs (the resolved input object, the member
+libraries and every trimming parameter), and its manifest lives in scratch
+as <key>.json. Each library's progress (started, downloaded, trimmed,
+uploaded) is written to the manifest as it happens. Once a library reaches
+uploaded, its result (output refs, report, stats) is stored too, so a re-run
+with the same inputs can skip it and reuse the stored result. A library that
+a fail-soft run gave up on is marked failed, with its error, and is run again
+by the next run.
+
+Writes go to a temporary file that is renamed over the manifest, so a crash
+mid-write leaves the previous version intact.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_VERSION = 1
+LIBRARY_STATES = ('started', 'downloaded', 'trimmed', 'uploaded', 'failed')
+
+
+def manifest_key(inputs):
+    # stable hash of a json-able description of the run
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RunManifest(object):
+
+    def __init__(self, path, key, inputs, libraries=None, finished=None):
+        self.path = path
+        self.key = key
+        self.inputs = inputs
+        self.libraries = libraries if libraries is not None else {}
+        self.finished = finished
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, manifest_dir, inputs):
+        """
+        the manifest for a run with these inputs: the one an earlier run left in manifest_dir,
+        or a new, empty one
+        """
+        key = manifest_key(inputs)
+        path = os.path.join(manifest_dir, key + '.json')
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as fh:
+                    data = json.load(fh)
+            except ValueError:
+                data = None
+            if data is not None and data.get('version') == MANIFEST_VERSION and data.get('key') == key:
+                return cls(path, key, inputs, data.get('libraries', {}), data.get('finished'))
+        if not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        manifest = cls(path, key, inputs)
+        manifest.save()
+        return manifest
+
+    def state(self, library_ref):
+        entry = self.libraries.get(library_ref)
+        return entry['state'] if entry else None
+
+    def completed(self, library_ref):
+        # the stored result of a library that an earlier run uploaded, otherwise None
+        entry = self.libraries.get(library_ref)
+        if entry and entry['state'] == 'uploaded':
+            return entry['result']
+        return None
+
+    def set_state(self, library_ref, state, details=None):
+        if state not in LIBRARY_STATES:
+            raise ValueError('Unknown library state: ' + str(state))
+        with self._lock:
+            entry = self.libraries.setdefault(library_ref, {'details': {}})
+            entry['state'] = state
+            entry['updated'] = time.time()
+            if details:
+                entry['details'].update(details)
+            self._save()
+
+    def complete(self, library_ref, result):
+        # record a library as uploaded, with the result a re-run should reuse
+        with self._lock:
+            entry = self.libraries.setdefault(library_ref, {'details': {}})
+            entry['state'] = 'uploaded'
+            entry['updated'] = time.time()
+            entry['result'] = result
+            self._save()
+
+    def finish(self, outputs):
+        # record the saved set refs; later re-runs still redo the set saves
+        with self._lock:
+            self.finished = {'time': time.time(), 'outputs': outputs}
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        data = {'version': MANIFEST_VERSION,
+                'key': self.key,
+                'inputs': self.inputs,
+                'libraries': self.libraries,
+                'finished': self.finished}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(data, fh)
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Per-job scratch directories
+
+Every library run gets its own directory under <scratch>/jobs, so runs that
+share a scratch directory can't collide on file names, and everything a run
+leaves behind (after a failure too) goes when its job closes. A job holds an
+flock on a lock file in its directory while it is open; at startup,
+clean_orphans() removes the job directories nobody holds, left by runs that
+were killed. A job directory is created and locked under a NEW_PREFIX name
+and only then renamed into place (the flock stays with the lock file), so
+clean_orphans() never sees it unlocked; it leaves NEW_PREFIX directories
+alone until they are NEW_DIR_GRACE_SECONDS old.
+
+Files that only this process reads and writes (preview and sweep subsamples,
+their trimmed outputs, detected adapter files) can go on tmpfs instead, when
+the tmpfs has room for them within TMPFS_MEMORY_FRACTION of its free space.
+Files handed to ReadsUtils (downloads and uploads) stay in scratch, the only
+directory its container shares with this one.
+
+A job reports its scratch use at the checkpoints of its run, and the peak,
+through stats().
+"""
+import errno
+import fcntl
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from kb_trimmomatic.Utils.FastqIndex import remove_fastq_file
+
+JOBS_DIR = 'jobs'
+LOCK_FILE = '.lock'
+NEW_PREFIX = '.new_'
+NEW_DIR_GRACE_SECONDS = 60
+DEFAULT_TMPFS_DIR = '/dev/shm'
+# share of the tmpfs free space that jobs may reserve, leaving the rest for the trimming engines' memory
+TMPFS_MEMORY_FRACTION = 0.5
+
+
+def directory_bytes(path):
+    # bytes in the files under path
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass  # removed while walking
+    return total
+
+
+def _try_lock(lock_path):
+    # an exclusive flock on lock_path, or None if another job holds it
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        lock_file.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return lock_file
+
+
+def _make_locked_dir(path):
+    # create path with its lock file held; returns the lock file
+    new_path = os.path.join(os.path.dirname(path), NEW_PREFIX + os.path.basename(path))
+    os.makedirs(new_path)
+    lock_file = _try_lock(os.path.join(new_path, LOCK_FILE))
+    os.rename(new_path, path)
+    return lock_file
+
+
+class ScratchManager(object):
+
+    def __init__(self, scratch_dir, tmpfs_dir=DEFAULT_TMPFS_DIR, tmpfs_fraction=TMPFS_MEMORY_FRACTION):
+        self.jobs_dir = os.path.join(scratch_dir, JOBS_DIR)
+        self.tmpfs_jobs_dir = None
+        if tmpfs_dir and os.path.isdir(tmpfs_dir) and os.access(tmpfs_dir, os.W_OK):
+            self.tmpfs_jobs_dir = os.path.join(tmpfs_dir, 'kb_trimmomatic_' + JOBS_DIR)
+        self.tmpfs_fraction = tmpfs_fraction
+        self.tmpfs_reserved = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(self.jobs_dir):
+            os.makedirs(self.jobs_dir)
+
+    def clean_orphans(self):
+        # remove the job directories no open job holds; returns their paths
+        removed = []
+        for jobs_dir in [self.jobs_dir, self.tmpfs_jobs_dir]:
+            if jobs_dir is None or not os.path.isdir(jobs_dir):
+                continue
+            for name in sorted(os.listdir(jobs_dir)):
+                job_dir = os.path.join(jobs_dir, name)
+                if not os.path.isdir(job_dir):
+                    continue
+                if name.startswith(NEW_PREFIX):
+                    # still being created, unless a run was killed while creating it
+                    try:
+                        if time.time() - os.path.getmtime(job_dir) < NEW_DIR_GRACE_SECONDS:
+                            continue
+                    except OSError:
+                        continue  # renamed into place meanwhile
+                lock_file = _try_lock(os.path.join(job_dir, LOCK_FILE))
+                if lock_file is None:
+                    continue
+                try:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                finally:
+                    lock_file.close()
+                removed.append(job_dir)
+        return removed
+
+    def job(self, label='job'):
+        return ScratchJob(self, label)
+
+    def reserve_tmpfs(self, n_bytes):
+        # reserve n_bytes of tmpfs for a job's local files; False if they don't fit
+        if self.tmpfs_jobs_dir is None:
+            return False
+        stat = os.statvfs(os.path.dirname(self.tmpfs_jobs_dir))
+        available = stat.f_bavail * stat.f_frsize * self.tmpfs_fraction
+        with self._lock:
+            if self.tmpfs_reserved + n_bytes > available:
+                return False
+            self.tmpfs_reserved += n_bytes
+        return True
+
+    def release_tmpfs(self, n_bytes):
+        with self._lock:
+            self.tmpfs_reserved -= n_bytes
+
+
+class ScratchJob(object):
+
+    def __init__(self, manager, label):
+        self.manager = manager
+        self.name = label + '_' + str(uuid.uuid4())
+        self.path = os.path.join(manager.jobs_dir, self.name)
+        self._lock_file = _make_locked_dir(self.path)
+        self.tmpfs_path = None
+        self.tmpfs_bytes = 0
+        self._tmpfs_lock_file = None
+        self.outside_paths = []  # files adopted from elsewhere in scratch that couldn't be moved in
+        self.checkpoints = []
+        self.peak_bytes = 0
+        self.removed_bytes = 0
+        self._start = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def file(self, name):
+        # a path in the job's scratch directory
+        return os.path.join(self.path, name)
+
+    def local_file(self, name, n_bytes):
+        """
+        a path for a file only this process uses, on tmpfs if n_bytes (the most the file, or the files
+        named from it as a prefix, will hold) fit there, otherwise in the job's scratch directory
+        """
+        if not self.manager.reserve_tmpfs(n_bytes):
+            return self.file(name)
+        self.tmpfs_bytes += n_bytes
+        if self.tmpfs_path is None:
+            self.tmpfs_path = os.path.join(self.manager.tmpfs_jobs_dir, self.name)
+            self._tmpfs_lock_file = _make_locked_dir(self.tmpfs_path)
+        return os.path.join(self.tmpfs_path, name)
+
+    def adopt(self, path):
+        # move a file another service wrote into scratch (a download) into the job; returns its new path
+        new_path = self.file(os.path.basename(path))
+        try:
+            os.rename(path, new_path)
+        except OSError:
+            self.outside_paths.append(path)
+            return path
+        return new_path
+
+    def remove(self, *paths):
+        # remove files (and FASTQ indexes) as soon as their stage is done with them
+        for path in paths:
+            if path is not None and os.path.isfile(path):
+                self.removed_bytes += os.path.getsize(path)
+                remove_fastq_file(path)
+
+    def usage(self):
+        n_bytes = directory_bytes(self.path)
+        if self.tmpfs_path is not None:
+            n_bytes += directory_bytes(self.tmpfs_path)
+        for path in self.outside_paths:
+            if os.path.isfile(path):
+                n_bytes += os.path.getsize(path)
+        return n_bytes
+
+    def checkpoint(self, stage):
+        # record the job's scratch use at the end of a stage; returns it
+        n_bytes = self.usage()
+        self.peak_bytes = max(self.peak_bytes, n_bytes)
+        self.checkpoints.append({'stage': stage, 'bytes': n_bytes, 'seconds': round(time.time() - self._start, 2)})
+        return n_bytes
+
+    def stats(self):
+        return {'job_dir': self.path,
+                'tmpfs': self.tmpfs_path is not None,
+                'peak_bytes': self.peak_bytes,
+                'removed_bytes': self.removed_bytes,
+                'checkpoints': list(self.checkpoints)}
+
+    def close(self):
+        # remove everything the job left behind
+        self.remove(*self.outside_paths)
+        for path, lock_attr in [(self.tmpfs_path, '_tmpfs_lock_file'), (self.path, '_lock_file')]:
+            if path is None:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            lock_file = getattr(self, lock_attr, None)
+            if lock_file is not None:
+                lock_file.close()
+                setattr(self, lock_attr, None)
+        if self.tmpfs_bytes:
+            self.manager.release_tmpfs(self.tmpfs_bytes)
+            self.tmpfs_bytes = 0
+        self.tmpfs_path = None
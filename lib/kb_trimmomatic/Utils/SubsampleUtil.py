@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Subsampling of (optionally paired) FASTQ files, keeping mates in sync
+
+'first' takes the first n_reads records, 'random' takes n_reads records drawn
+uniformly without replacement, in file order, with the same records from each
+mate. Random sampling seeks with the .fqidx record offsets (FastqIndex): only
+the indexed stretches holding a drawn record are read, each up to its last
+drawn record.
+"""
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import iter_fastq, write_fastq_batch, DEFAULT_BATCH_SIZE
+from kb_trimmomatic.Utils.FastqIndex import get_fastq_index
+
+SUBSAMPLE_MODES = ('first', 'random')
+# read size after a seek: small enough not to run far past the last drawn record of a stretch
+SEEK_BLOCK_SIZE = 1024 * 1024
+
+
+def subsample_fastq(in_paths, out_paths, n_reads, mode='first', total_reads=None, seed=1,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    if mode not in SUBSAMPLE_MODES:
+        raise ValueError('subsample mode must be one of ' + ", ".join(SUBSAMPLE_MODES))
+    if mode == 'random':
+        return _subsample_random(in_paths, out_paths, n_reads, seed, batch_size)
+
+    readers = [iter_fastq(path, batch_size) for path in in_paths]
+    out_handles = [open(path, 'wb') for path in out_paths]
+    n_kept = 0
+    n_scanned = 0
+    try:
+        while n_kept < n_reads:
+            batches = [next(reader, None) for reader in readers]
+            if batches[0] is None:
+                break
+            if any([b is None or len(b) != len(batches[0]) for b in batches]):
+                raise ValueError('Paired read files have different numbers of records: ' + ", ".join(in_paths))
+            n_scanned += len(batches[0])
+            keep = np.arange(len(batches[0])) < (n_reads - n_kept)
+            for batch, fh in zip(batches, out_handles):
+                write_fastq_batch(fh, batch, keep)
+            n_kept += int(keep.sum())
+    finally:
+        for fh in out_handles:
+            fh.close()
+    return {'mode': mode,
+            'sampled_reads': n_kept,
+            'scanned_reads': n_scanned,
+            'total_reads': total_reads
+            }
+
+
+def sample_records(rng, total_records, n_records):
+    # sorted record numbers of n_records drawn without replacement, in memory proportional to n_records
+    if n_records >= total_records:
+        return np.arange(total_records, dtype=np.int64)
+    picked = np.unique(rng.randint(0, total_records, size=n_records).astype(np.int64))
+    while len(picked) < n_records:
+        more = rng.randint(0, total_records, size=n_records - len(picked)).astype(np.int64)
+        picked = np.unique(np.concatenate([picked, more]))
+    return picked
+
+
+def _subsample_random(in_paths, out_paths, n_reads, seed, batch_size):
+    indexes = [get_fastq_index(path) for path in in_paths]
+    total_reads = indexes[0].total_records
+    if any([index.total_records != total_reads for index in indexes]):
+        raise ValueError('Paired read files have different numbers of records: ' + ", ".join(in_paths))
+    picked = sample_records(np.random.RandomState(seed), total_reads, n_reads)
+    # drawn records grouped by the indexed stretch of the first file they fall in
+    interval = indexes[0].interval
+    stretch_starts, group_starts = np.unique(picked // interval * interval, return_index=True)
+    groups = np.split(picked, group_starts[1:]) if len(picked) else []
+
+    n_scanned = []
+    for index, path, out_path in zip(indexes, in_paths, out_paths):
+        with open(out_path, 'wb') as fh:
+            n_scanned.append(sum([_copy_records(index, path, fh, int(stretch_start), group, batch_size)
+                                  for stretch_start, group in zip(stretch_starts, groups)]))
+    return {'mode': 'random',
+            'sampled_reads': len(picked),
+            'scanned_reads': n_scanned[0],
+            'total_reads': total_reads
+            }
+
+
+def _copy_records(index, path, fh, first_record, records, batch_size):
+    # write records (sorted, all >= first_record) of path, reading from the indexed offset at or before
+    # first_record up to the last of them; returns the number of records read
+    offset, skip = index.seek(first_record)
+    wanted = records - first_record + skip
+    n_needed = int(wanted[-1]) + 1
+    pos = 0
+    reader = iter_fastq(path, batch_size, block_size=SEEK_BLOCK_SIZE, start=offset)
+    try:
+        for batch in reader:
+            lo, hi = np.searchsorted(wanted, [pos, pos + len(batch)])
+            write_fastq_batch(fh, batch, wanted[lo:hi] - pos)
+            pos += len(batch)
+            if pos >= n_needed:
+                return pos
+    finally:
+        reader.close()
+    raise ValueError('FASTQ file ends before its index says: ' + str(path))
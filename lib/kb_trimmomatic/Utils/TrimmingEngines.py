@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Trimming engines behind execTrimmomaticSingleLibrary
+
+Every engine takes the same inputs (read type, quality encoding, input and
+output FASTQ paths, and the step string from parse_trimmomatic_steps()),
+turns them into a plan, writes the same output files, and returns console
+lines in the jar's format plus run stats:
+
+    jar      Trimmomatic itself; pays JVM startup on every run
+    native   the numpy steps in-process (NativeTrimmer); no startup cost
+    chunked  the native steps on index batches across worker processes
+             (ParallelTrimmer); pays process startup, scales with cores
+
+The jar is the reference: the other engines are only offered once they are
+verified against it (the verified list comes from the deployment config).
+choose_engine() implements engine=auto: it estimates each engine's run time
+from the input size, a fixed startup cost and its throughput, and picks a
+verified engine over the jar only when it is estimated to finish sooner.
+Every engine has a default throughput per worker, so estimates are compared
+from the first job on. The native engines' were measured with the
+differential test's random library. The jar's is taken as the native
+engine's until the differential benchmark has been run against the jar in
+the module image (benchmark.json beside the jar fixtures). Measured runs
+replace the defaults as they complete. The native engines don't implement ILLUMINACLIP, so adapter
+clipping always runs on the jar.
+
+When a library is given a number of cores (threads), the jar gets them as
+-threads and the chunked engine as worker processes; without one the jar
+picks its own thread count and the chunked engine uses every core.
+
+Paired end input may be one interleaved file. The native engines read it
+directly and can write the paired output interleaved too
+(interleaved_output); the jar reads its mates from named pipes fed from the
+file (Interleaved.MateStreams) and writes the usual four files.
+"""
+import os
+import subprocess
+import time
+
+from kb_trimmomatic.Utils.NativeTrimmer import run_native_trimmomatic, parse_steps, new_counts, PHRED_OFFSETS
+from kb_trimmomatic.Utils.ParallelTrimmer import run_parallel_trimmomatic, default_workers
+from kb_trimmomatic.Utils.Interleaved import MateStreams
+
+AUTO_ENGINE = 'auto'
+REFERENCE_ENGINE = 'jar'
+# runs shorter than this are dominated by startup and file system noise, so they don't update throughput
+MIN_MEASURED_BYTES = 8 * 1024 * 1024
+MEASUREMENT_WEIGHT = 0.5
+
+
+def run_command(cmdstring, log):
+    # run a command line, passing each output line to log, and return the output lines
+    process = subprocess.Popen(cmdstring, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True,
+                               universal_newlines=True)
+
+    outputlines = []
+    while True:
+        line = process.stdout.readline()
+        outputlines.append(line)
+        if not line: break
+        log(line.replace('\n', ''))
+
+    process.stdout.close()
+    process.wait()
+    log('return code: ' + str(process.returncode) + '\n')
+    if process.returncode != 0:
+        raise ValueError('Error running kb_trimmomatic, return code: ' +
+                         str(process.returncode) + '\n')
+    return outputlines
+
+
+class TrimmingEngine(object):
+    name = None
+    startup_seconds = 0.0
+    bytes_per_second = None  # per worker, until a run has been measured; None when never measured
+    interleaved_output = False  # whether interleaved PE input can be trimmed to one interleaved paired output
+    qc_from_batches = False  # whether QC comes out of the run, or has to read the files again
+
+    def __init__(self):
+        self.measured_bytes_per_second = None  # per worker
+
+    def workers(self, threads=None):
+        return 1
+
+    def unsupported(self, quality_encoding, step_string):
+        # None if the engine can run these steps, otherwise the reason it can't
+        return None
+
+    def throughput(self, threads=None):
+        # bytes per second on threads cores, or None when there is nothing measured to go on
+        bytes_per_second = self.measured_bytes_per_second or self.bytes_per_second
+        if bytes_per_second is None:
+            return None
+        return bytes_per_second * self.workers(threads)
+
+    def estimate_seconds(self, input_bytes, threads=None):
+        throughput = self.throughput(threads)
+        if throughput is None:
+            return None
+        return self.startup_seconds + float(input_bytes) / throughput
+
+    def plan(self, read_type, quality_encoding, input_paths, output_paths, step_string, input_bytes=None,
+             threads=None, qc=False):
+        reason = self.unsupported(quality_encoding, step_string)
+        if reason is not None:
+            raise ValueError('The ' + self.name + ' engine cannot run these steps: ' + reason)
+        if read_type == 'PE' and len(output_paths) == 3 and not self.interleaved_output:
+            raise ValueError('The ' + self.name + ' engine cannot write interleaved paired output')
+        plan = {'engine': self.name,
+                'read_type': read_type,
+                'quality_encoding': quality_encoding,
+                'inputs': list(input_paths),
+                'outputs': list(output_paths),
+                'steps': step_string,
+                'threads': threads,
+                'workers': self.workers(threads),
+                'qc': qc}
+        if input_bytes is not None:
+            plan['input_bytes'] = input_bytes
+            plan['estimated_seconds'] = self.estimate_seconds(input_bytes, threads)
+        return plan
+
+    def run(self, plan, log):
+        """
+        write plan['outputs'] and return the console lines; stats of the run are added to plan['stats']
+        (with input_bases and surviving_bases from engines that count them) and fold into the engine's
+        measured throughput. Engines that compute QC from the batches they trim (qc_from_batches) add
+        the QC summaries of the input and output files to plan['qc_summaries'] when plan['qc'] is set
+        """
+        stats = plan['stats'] = {}
+        started = time.time()
+        lines = self._run(plan, log)
+        seconds = time.time() - started
+        stats['seconds'] = seconds
+        if 'input_bytes' in plan:
+            stats['input_bytes'] = plan['input_bytes']
+            stats['bytes_per_second'] = plan['input_bytes'] / seconds if seconds else None
+            self.record(plan['input_bytes'], seconds, plan['workers'])
+        return lines
+
+    def record(self, input_bytes, seconds, workers=1):
+        work_seconds = seconds - self.startup_seconds
+        if input_bytes < MIN_MEASURED_BYTES or work_seconds <= 0:
+            return
+        measured = input_bytes / work_seconds / workers
+        if self.measured_bytes_per_second is None:
+            self.measured_bytes_per_second = measured
+        else:
+            self.measured_bytes_per_second = (MEASUREMENT_WEIGHT * measured +
+                                              (1 - MEASUREMENT_WEIGHT) * self.measured_bytes_per_second)
+
+    def _run(self, plan, log):
+        raise NotImplementedError()
+
+
+class JarEngine(TrimmingEngine):
+    name = 'jar'
+    startup_seconds = 1.5  # JVM startup, left out of the measured throughput
+    bytes_per_second = 30.0e6  # per thread, as for the native engine until benchmark.json measures the jar
+
+    def __init__(self, command):
+        TrimmingEngine.__init__(self)
+        self.command = command
+
+    def workers(self, threads=None):
+        return threads or 1
+
+    def command_line(self, plan):
+        threads = ['-threads', str(plan['threads'])] if plan.get('threads') else []
+        return " ".join([self.command, plan['read_type']] + threads + ['-' + plan['quality_encoding']] +
+                        plan['inputs'] + plan['outputs'] + [plan['steps']])
+
+    def _run(self, plan, log):
+        if plan['read_type'] == 'PE' and len(plan['inputs']) == 1:
+            # interleaved input: the jar reads each mate from a named pipe next to the outputs
+            with MateStreams(plan['inputs'][0], os.path.dirname(os.path.abspath(plan['outputs'][0]))) as streams:
+                return run_command(self.command_line(dict(plan, inputs=streams.paths)), log)
+        return run_command(self.command_line(plan), log)
+
+
+class NativeEngine(TrimmingEngine):
+    name = 'native'
+    startup_seconds = 0.0
+    bytes_per_second = 30.0e6  # measured: 63 MB of random 150 bp pairs, LEADING/TRAILING/SLIDINGWINDOW/MINLEN
+    interleaved_output = True
+    qc_from_batches = True
+
+    def unsupported(self, quality_encoding, step_string):
+        if quality_encoding not in PHRED_OFFSETS:
+            return 'quality_encoding ' + str(quality_encoding)
+        try:
+            parse_steps(step_string)
+        except ValueError as e:
+            return str(e)
+        return None
+
+    def _run(self, plan, log):
+        totals = new_counts()
+        qc = {} if plan['qc'] else None
+        lines = run_native_trimmomatic(plan['read_type'], plan['quality_encoding'], plan['inputs'],
+                                       plan['outputs'], plan['steps'], totals=totals, qc=qc)
+        self.record_batch_stats(plan, totals, qc)
+        for line in lines:
+            log(line)
+        return lines
+
+    def record_batch_stats(self, plan, totals, qc):
+        plan['stats']['input_bases'] = totals['input_bases']
+        plan['stats']['surviving_bases'] = totals['surviving_bases']
+        if qc is not None:
+            plan['qc_summaries'] = qc
+
+
+class ChunkedEngine(NativeEngine):
+    name = 'chunked'
+    startup_seconds = 0.05  # measured: starting the workers and the shared ring
+    bytes_per_second = 30.0e6  # per worker, measured as for the native engine
+
+    def __init__(self, n_workers=None):
+        NativeEngine.__init__(self)
+        self.n_workers = n_workers
+
+    def workers(self, threads=None):
+        return threads or self.n_workers or default_workers()
+
+    def _run(self, plan, log):
+        totals = new_counts()
+        qc = {} if plan['qc'] else None
+        lines = run_parallel_trimmomatic(plan['read_type'], plan['quality_encoding'], plan['inputs'],
+                                         plan['outputs'], plan['steps'], n_workers=plan['workers'], totals=totals,
+                                         qc=qc)
+        self.record_batch_stats(plan, totals, qc)
+        for line in lines:
+            log(line)
+        return lines
+
+
+def make_engines(jar_command):
+    # one instance per engine, kept for the life of the process so measured throughput carries over
+    return {'jar': JarEngine(jar_command),
+            'native': NativeEngine(),
+            'chunked': ChunkedEngine()}
+
+
+def choose_engine(engines, input_bytes, quality_encoding, step_string, threads=None, verified=(REFERENCE_ENGINE,)):
+    """
+    the engine for engine=auto: the jar, unless a verified engine that supports the steps is estimated to finish
+    input_bytes of reads on threads cores sooner. without a throughput for the jar to compare against, the jar.
+    returns (engine name, {engine name: estimated seconds, or the reason it wasn't considered})
+    """
+    estimates = {}
+    candidates = []
+    measured = []
+    for name in sorted(engines):
+        engine = engines[name]
+        reason = engine.unsupported(quality_encoding, step_string)
+        if reason is not None:
+            estimates[name] = 'unsupported: ' + reason
+            continue
+        if name not in verified:
+            estimates[name] = 'not verified against the ' + REFERENCE_ENGINE
+            continue
+        candidates.append(name)
+        estimates[name] = engine.estimate_seconds(input_bytes, threads)
+        if estimates[name] is None:
+            estimates[name] = 'not measured'
+        else:
+            measured.append(name)
+    if not candidates:
+        raise ValueError('No trimming engine supports these steps: ' + step_string)
+    if REFERENCE_ENGINE in candidates and REFERENCE_ENGINE not in measured:
+        return REFERENCE_ENGINE, estimates
+    if not measured:
+        return candidates[0], estimates
+    return min(measured, key=lambda name: (estimates[name], name)), estimates
@@ -52,7 +52,15 @@ class kb_trimmomatic(object):
            "sliding_window_min_quality" of Long, parameter
            "leading_min_quality" of Long, parameter "trailing_min_quality" of
            Long, parameter "crop_length" of Long, parameter
-           "head_crop_length" of Long, parameter "min_length" of Long
+           "head_crop_length" of Long, parameter "min_length" of Long,
+           parameter "run_qc" of Long, parameter "preview" of Long,
+           parameter "preview_reads" of Long, parameter "preview_mode" of
+           String, parameter "engine" of String, parameter "fail_soft" of
+           Long, parameter "library_retries" of Long, parameter
+           "max_child_jobs" of Long, parameter "num_threads" of Long,
+           parameter "no_trim_output" of String, parameter "merge_unpaired"
+           of Long, parameter "min_unpaired_reads" of Long, parameter
+           "interleaved" of Long
         :returns: instance of type "runTrimmomaticOutput" -> structure:
            parameter "report_name" of String, parameter "report_ref" of String
         """
@@ -75,12 +83,25 @@ class kb_trimmomatic(object):
            "sliding_window_min_quality" of Long, parameter
            "leading_min_quality" of Long, parameter "trailing_min_quality" of
            Long, parameter "crop_length" of Long, parameter
-           "head_crop_length" of Long, parameter "min_length" of Long
+           "head_crop_length" of Long, parameter "min_length" of Long,
+           parameter "run_qc" of Long, parameter "preview" of Long,
+           parameter "preview_reads" of Long, parameter "preview_mode" of
+           String, parameter "engine" of String, parameter "fail_soft" of
+           Long, parameter "library_retries" of Long, parameter
+           "max_child_jobs" of Long, parameter "num_threads" of Long,
+           parameter "threads" of Long, parameter "no_trim_output" of
+           String, parameter "merge_unpaired" of Long, parameter
+           "min_unpaired_reads" of Long, parameter "interleaved" of Long
         :returns: instance of type "execTrimmomaticOutput" -> structure:
            parameter "output_filtered_ref" of type "data_obj_ref", parameter
            "output_unpaired_fwd_ref" of type "data_obj_ref", parameter
            "output_unpaired_rev_ref" of type "data_obj_ref", parameter
-           "report" of String
+           "report" of String, parameter "library_stats" of mapping from
+           type "data_obj_ref" to unspecified object, parameter
+           "failed_libraries" of list of type "LibraryFailure" (a library a
+           fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long
         """
         return self._client.call_method(
             'kb_trimmomatic.execTrimmomatic',
@@ -101,17 +122,87 @@ class kb_trimmomatic(object):
            "sliding_window_min_quality" of Long, parameter
            "leading_min_quality" of Long, parameter "trailing_min_quality" of
            Long, parameter "crop_length" of Long, parameter
-           "head_crop_length" of Long, parameter "min_length" of Long
+           "head_crop_length" of Long, parameter "min_length" of Long,
+           parameter "run_qc" of Long, parameter "preview" of Long,
+           parameter "preview_reads" of Long, parameter "preview_mode" of
+           String, parameter "engine" of String, parameter "fail_soft" of
+           Long, parameter "library_retries" of Long, parameter
+           "max_child_jobs" of Long, parameter "num_threads" of Long,
+           parameter "threads" of Long, parameter "no_trim_output" of
+           String, parameter "merge_unpaired" of Long, parameter
+           "min_unpaired_reads" of Long, parameter "interleaved" of Long
         :returns: instance of type "execTrimmomaticOutput" -> structure:
            parameter "output_filtered_ref" of type "data_obj_ref", parameter
            "output_unpaired_fwd_ref" of type "data_obj_ref", parameter
            "output_unpaired_rev_ref" of type "data_obj_ref", parameter
-           "report" of String
+           "report" of String, parameter "library_stats" of mapping from
+           type "data_obj_ref" to unspecified object, parameter
+           "failed_libraries" of list of type "LibraryFailure" (a library a
+           fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long
         """
         return self._client.call_method(
             'kb_trimmomatic.execTrimmomaticSingleLibrary',
             [input_params], self._service_ver, context)
 
+    def execTrimmomaticBatch(self, input_params, context=None):
+        """
+        :param input_params: instance of type "execTrimmomaticBatchInput"
+           (execTrimmomaticBatch() ** ** trim many libraries, each with its
+           own params, in one call sharing clients and a thread pool, with
+           one combined report) -> structure: parameter "inputs" of list of
+           type "BatchLibraryInput" -> structure: parameter "input_reads_ref"
+           of type "data_obj_ref", parameter "output_reads_name" of type
+           "data_obj_name", parameter "params" of mapping from String to
+           unspecified object, parameter "output_ws" of type
+           "workspace_name" (** Common types), parameter "num_threads" of
+           Long, parameter "fail_soft" of Long, parameter "library_retries"
+           of Long
+        :returns: instance of type "execTrimmomaticBatchOutput" ->
+           structure: parameter "results" of list of type
+           "execTrimmomaticOutput" -> structure: parameter
+           "output_filtered_ref" of type "data_obj_ref", parameter
+           "output_unpaired_fwd_ref" of type "data_obj_ref", parameter
+           "output_unpaired_rev_ref" of type "data_obj_ref", parameter
+           "report" of String, parameter "library_stats" of mapping from
+           type "data_obj_ref" to unspecified object, parameter
+           "failed_libraries" of list of type "LibraryFailure" (a library a
+           fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long,
+           parameter "failed_libraries" of list of type "LibraryFailure" (a
+           library a fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long,
+           parameter "report" of String, parameter "report_name" of String,
+           parameter "report_ref" of String
+        """
+        return self._client.call_method(
+            'kb_trimmomatic.execTrimmomaticBatch',
+            [input_params], self._service_ver, context)
+
+    def sweepTrimmomatic(self, input_params, context=None):
+        """
+        :param input_params: instance of type "sweepTrimmomaticInput"
+           (sweepTrimmomatic() ** ** trim one shared subsample of a read
+           library with each of a grid of parameter sets ** to compare
+           survival and read lengths before choosing settings for a full run)
+           -> structure: parameter "input_reads_ref" of type "data_obj_ref",
+           parameter "read_type" of String, parameter "quality_encoding" of
+           String, parameter "sample_reads" of Long, parameter "sample_mode"
+           of String, parameter "num_threads" of Long, parameter "engine" of
+           String, parameter "param_grid" of list of mapping from String to
+           unspecified object
+        :returns: instance of type "sweepTrimmomaticOutput" -> structure:
+           parameter "sampled_reads" of Long, parameter "total_reads" of
+           Long, parameter "results" of list of unspecified object, parameter
+           "report" of String
+        """
+        return self._client.call_method(
+            'kb_trimmomatic.sweepTrimmomatic',
+            [input_params], self._service_ver, context)
+
     def status(self, context=None):
         return self._client.call_method('kb_trimmomatic.status',
                                         [], self._service_ver, context)
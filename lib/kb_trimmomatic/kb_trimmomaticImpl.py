@@ -5,16 +5,37 @@ import traceback
 from biokbase.workspace.client import Workspace as workspaceService
 import requests
 requests.packages.urllib3.disable_warnings()
-import subprocess
 import os
 import re
+import shutil
 from pprint import pprint, pformat
 import uuid
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 ## SDK Utils
 from ReadsUtils.ReadsUtilsClient import ReadsUtils
 from SetAPI.SetAPIServiceClient import SetAPI
 from KBaseReport.KBaseReportClient import KBaseReport
+
+## local python-side read processing
+from kb_trimmomatic.Utils.QCUtil import compute_fastq_qc, qc_plots_html
+from kb_trimmomatic.Utils.QualityEncodingUtil import detect_quality_encoding, resolve_quality_encoding
+from kb_trimmomatic.Utils.AdapterUtil import detect_adapters
+from kb_trimmomatic.Utils.FastqIndex import get_fastq_index, check_paired_counts
+from kb_trimmomatic.Utils.SubsampleUtil import subsample_fastq
+from kb_trimmomatic.Utils.TrimmingEngines import make_engines, choose_engine, run_command, AUTO_ENGINE, REFERENCE_ENGINE
+from kb_trimmomatic.Utils.RunManifest import RunManifest
+from kb_trimmomatic.Utils.JobSharding import (plan_shards, estimate_library_seconds, shard_batch_params,
+                                              unpack_batch_output, CHILD_JOB_OVERHEAD_SECONDS, CHILD_JOB_METHOD)
+from kb_trimmomatic.Utils.LibraryScheduler import LibraryScheduler, default_limits, projected_scratch_bytes, DEFAULT_FASTQ_RATIO, \
+    OUTPUT_RATIO
+from kb_trimmomatic.Utils.CoreAllocator import CoreAllocator
+from kb_trimmomatic.Utils.ScratchManager import ScratchManager
+from kb_trimmomatic.Utils.InputCache import InputCache
+from kb_trimmomatic.Utils.Interleaved import check_interleaved_count
+from kb_trimmomatic.baseclient import BaseClient
 #END_HEADER
 
 
@@ -30,6 +51,8 @@ This module contains two methods
 runTrimmomatic() to backend a KBase App, potentially operating on ReadSets
 execTrimmomatic() the local method that handles overloading Trimmomatic to run on a set or a single library
 execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
+execTrimmomaticBatch() trims many libraries, each with its own params, in one call
+sweepTrimmomatic() compares trimming parameter sets on a subsample of a library
     '''
 
     ######## WARNING FOR GEVENT USERS ####### noqa
@@ -46,6 +69,16 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
     workspaceURL = None
     TRIMMOMATIC = 'java -jar /kb/module/Trimmomatic-0.36/trimmomatic-0.36.jar'
     ADAPTER_DIR = '/kb/module/Trimmomatic-0.36/adapters/'
+    ADAPTER_FILE_BYTES = 1024 * 1024  # most a detected adapter file can hold
+    PREVIEW_DEFAULT_READS = 100000
+    MANIFEST_DIR = 'run_manifests'
+    INPUT_CACHE_DIR = 'input_cache'
+    RETRY_BACKOFF_SECONDS = 10
+    FAIL_SOFT_LIBRARY_RETRIES = 2
+    CHILD_JOB_OVERHEAD_SECONDS = CHILD_JOB_OVERHEAD_SECONDS
+    CHILD_JOB_CHECK_MAX_MS = 30000
+    TRIMMING_ENGINES = (AUTO_ENGINE, 'jar', 'native', 'chunked')
+    NO_TRIM_OUTPUTS = ('upload', 'reuse', 'copy')
 
     def log(self, target, message):
         if target is not None:
@@ -53,6 +86,649 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
         print(message)
         sys.stdout.flush()
 
+    def get_bool_param(self, input_params, arg):
+        # boolean params arrive as 0/1 ints from the UI and as strings or bools from other callers
+        if arg not in input_params or input_params[arg] is None:
+            return False
+        return str(input_params[arg]).lower() not in ('', '0', 'false', 'no')
+
+    def run_trimmomatic_cmd(self, console, cmdstring):
+        # run a Trimmomatic command line, echoing its output to the console, and return the output lines
+        return run_command(cmdstring, lambda line: self.log(console, line))
+
+    def get_client(self, ctx, name):
+        # workspace or reads_utils client; reused across libraries when the caller put a cache in ctx['clients']
+        clients = ctx.get('clients')
+        if clients is not None and name in clients:
+            return clients[name]
+        if name == 'workspace':
+            client = workspaceService(self.workspaceURL, token=ctx['token'])
+        elif name == 'reads_utils':
+            client = ReadsUtils (url=self.callbackURL, token=ctx['token'])  # SDK local
+        else:
+            raise ValueError('Unknown client: '+str(name))
+        if clients is not None:
+            clients[name] = client
+        return client
+
+    def library_context(self, ctx):
+        # a shallow copy of ctx with its own provenance, for one of several libraries trimmed at once
+        library_ctx = dict(ctx)
+        provenance = ctx.get('provenance') or [{}]
+        library_ctx['provenance'] = [dict(provenance[0])] + list(provenance[1:])
+        return library_ctx
+
+    def download_reads_library(self, console, ctx, input_reads_ref, input_reads_obj_info, scratch_job,
+                               interleaved=False):
+        """
+        the download_reads entry for a reads library, with its files in the scratch job: linked from the
+        input cache when it holds this version of the object, otherwise downloaded. with interleaved, a
+        paired end library comes as one interleaved 'fwd' file. returns (entry, the cache key to put the
+        files under once they are indexed, or None)
+        """
+        [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I] = range(7)
+        cache_key = None
+        if self.input_cache is not None:
+            cache_key = '/'.join([str(input_reads_obj_info[WSID_I]), str(input_reads_obj_info[OBJID_I]),
+                                  str(input_reads_obj_info[VERSION_I])])
+            if interleaved:
+                cache_key += '/interleaved'
+            cached = self.input_cache.get(cache_key, scratch_job.path)
+            if cached is not None:
+                (files, entry) = cached
+                entry['files'].update(files)
+                self.log(console, 'Reads for '+cache_key+' linked from the input cache')
+                return entry, None
+        try:
+            readsUtils_Client = self.get_client(ctx, 'reads_utils')
+            readsLibrary = readsUtils_Client.download_reads ({'read_libraries': [input_reads_ref],
+                                                             'interleaved': 'true' if interleaved else 'false'
+                                                             })
+        except Exception as e:
+            raise ValueError('Unable to get read library object from workspace: (' + str(input_reads_ref) +")\n" + str(e))
+        entry = readsLibrary['files'][input_reads_ref]
+        for direction in ['fwd', 'rev']:
+            if entry['files'].get(direction) is not None:
+                entry['files'][direction] = scratch_job.adopt(entry['files'][direction])
+        return entry, cache_key
+
+    def cache_reads_library(self, console, cache_key, entry):
+        # keep a downloaded library's files, and the FASTQ indexes built so far, in the input cache
+        if cache_key is None:
+            return
+        files = dict((direction, entry['files'][direction]) for direction in ['fwd', 'rev'] if entry['files'].get(direction))
+        info = dict(entry)
+        info['files'] = dict((k, v) for k, v in entry['files'].items() if k not in files)
+        try:
+            self.input_cache.put(cache_key, files, info)
+        except (IOError, OSError) as e:
+            self.log(console, 'Unable to cache the reads for '+cache_key+': '+str(e))
+            return
+        self.log(console, 'Reads for '+cache_key+' kept in the input cache ('+str(self.input_cache.size())+' of '+
+                 str(self.input_cache.budget_bytes)+' bytes in use)')
+
+    def record_library_state(self, ctx, library_ref, state, details=None):
+        # checkpoint a library's progress in the run manifest execTrimmomatic put in ctx, if any
+        run_manifest = ctx.get('run_manifest')
+        if run_manifest is not None:
+            run_manifest.set_state(library_ref, state, details)
+
+    def run_library_with_retries(self, console, ctx, execTrimmomaticParams, retries):
+        # run one library, retrying with exponential backoff; the last error is re-raised once retries are spent
+        attempt = 0
+        while True:
+            try:
+                return self.execTrimmomaticSingleLibrary(ctx, dict(execTrimmomaticParams))[0]
+            except Exception as e:
+                if attempt >= retries:
+                    raise
+                backoff = self.RETRY_BACKOFF_SECONDS * 2 ** attempt
+                attempt += 1
+                self.log(console, 'Library '+str(execTrimmomaticParams['input_reads_ref'])+' failed (attempt '+
+                         str(attempt)+' of '+str(retries+1)+'): '+str(e)+'\nRetrying in '+str(backoff)+' s')
+                time.sleep(backoff)
+
+    def get_library_files(self, wsClient, library_refs):
+        # (stored bytes, gzipped) per library from its reads files (KBaseFile types), else (object size, False)
+        SIZE_I = 9
+        libs = ['lib1', 'lib2', 'lib']
+        objects = wsClient.get_objects2({'objects': [{'ref': ref, 'included': ['/'+lib+'/size' for lib in libs] +
+                                                                              ['/'+lib+'/file/file_name' for lib in libs]}
+                                                     for ref in library_refs]})['data']
+        library_files = []
+        for obj in objects:
+            reads_files = [obj['data'][lib] for lib in libs if obj['data'].get(lib)]
+            file_bytes = sum([int(reads_file.get('size') or 0) for reads_file in reads_files])
+            gzipped = bool(reads_files) and all([str((reads_file.get('file') or {}).get('file_name') or '').endswith('.gz')
+                                                 for reads_file in reads_files])
+            library_files.append((file_bytes, gzipped) if file_bytes else (obj['info'][SIZE_I], False))
+        return library_files
+
+    def get_library_input_bytes(self, wsClient, library_refs):
+        # stored reads file bytes per library
+        return [file_bytes for file_bytes, gzipped in self.get_library_files(wsClient, library_refs)]
+
+    def get_library_fastq_bytes(self, wsClient, library_ref):
+        # FASTQ bytes a library is expected to unpack to, from its object before anything is downloaded
+        file_bytes, gzipped = self.get_library_files(wsClient, [library_ref])[0]
+        return int(file_bytes * (DEFAULT_FASTQ_RATIO if gzipped else 1.0))
+
+    def preflight_scratch(self, console, library_files, library_refs, library_names, num_threads, with_outputs=True):
+        """
+        project each library's peak scratch use (its FASTQ and, with_outputs, worst-case trimmed outputs)
+        from its get_library_files() entry and check it against the free scratch before anything is downloaded.
+        raises only if a library's stored reads files alone can't fit, and warns when the projection doesn't;
+        returns the number of libraries to trim at once, 1 when the largest two can't fit side by side
+        """
+        scratch_limit = self.scratch_limit_bytes or default_limits(self.scratch)[0]
+        projected = [projected_scratch_bytes(file_bytes, DEFAULT_FASTQ_RATIO if gzipped else 1.0,
+                                             output_ratio=OUTPUT_RATIO if with_outputs else 0.0)
+                     for file_bytes, gzipped in library_files]
+        if not projected:
+            return num_threads
+        largest = sorted(range(len(projected)), key=lambda i: -projected[i])
+        gb = lambda n_bytes: '{0:.2f}'.format(n_bytes / float(1024 ** 3))+' GB'
+        self.log(console, 'Scratch preflight: '+str(len(projected))+' libraries, largest '+gb(projected[largest[0]])+
+                 ', all '+gb(sum(projected))+', '+gb(scratch_limit)+' available in '+self.scratch)
+        for library_i, (file_bytes, gzipped) in enumerate(library_files):
+            if file_bytes > scratch_limit:
+                raise ValueError('Not enough scratch space to trim '+str(library_names[library_i])+' ('+
+                                 str(library_refs[library_i])+'): its reads files alone take '+gb(file_bytes)+
+                                 ', but only '+gb(scratch_limit)+' is available in '+self.scratch)
+        # the projection is a worst case, with a guessed gzip ratio; the download finds out for sure
+        for library_i in [i for i in largest if projected[i] > scratch_limit]:
+            self.log(console, 'WARNING: '+str(library_names[library_i])+' ('+str(library_refs[library_i])+
+                     ') may not fit in scratch: about '+gb(projected[library_i])+' for its reads and trimmed outputs')
+        if num_threads > 1 and len(projected) > 1 and projected[largest[0]] + projected[largest[1]] > scratch_limit:
+            self.log(console, 'The largest libraries can\'t fit in scratch side by side, trimming one library at a time')
+            return 1
+        return num_threads
+
+    def plan_library_shards(self, console, wsClient, library_refs, max_child_jobs):
+        # shards of library indices to run as child jobs, or [] to run the set in this job
+        library_bytes = self.get_library_input_bytes(wsClient, library_refs)
+        shards, estimate = plan_shards(library_bytes, max_child_jobs, job_overhead_seconds=self.CHILD_JOB_OVERHEAD_SECONDS)
+        if shards:
+            self.log(console, 'Running '+str(len(library_refs))+' libraries as child jobs in '+str(len(shards))+
+                     ' shards of '+", ".join([str(len(shard)) for shard in shards])+' libraries (estimated '+
+                     str(int(estimate['sharded_seconds']))+' s, '+str(int(estimate['local_seconds']))+' s in this job)')
+        else:
+            self.log(console, 'Running '+str(len(library_refs))+' libraries in this job (estimated '+
+                     str(int(estimate['local_seconds']))+' s, '+str(estimate['sharded_seconds'])+' s as child jobs)')
+        return shards
+
+    def make_library_scheduler(self, console, library_bytes, n_workers):
+        """
+        schedule libraries on n_workers threads within the configured (or available) scratch and memory,
+        with the cores split between the running libraries by their estimated work
+        """
+        scratch_limit, memory_limit = default_limits(self.scratch)
+        if self.scratch_limit_bytes:
+            scratch_limit = self.scratch_limit_bytes
+        if self.memory_limit_bytes:
+            memory_limit = self.memory_limit_bytes
+        total_cores = multiprocessing.cpu_count()
+        self.log(console, 'Scheduling '+str(len(library_bytes))+' libraries on up to '+str(n_workers)+' threads and '+
+                 str(total_cores)+' cores within '+str(scratch_limit)+' scratch bytes and '+str(memory_limit)+
+                 ' memory bytes')
+        allocator = CoreAllocator(total_cores, [estimate_library_seconds(n_bytes) for n_bytes in library_bytes],
+                                  log=lambda message: self.log(console, message))
+        return LibraryScheduler(library_bytes, scratch_limit, memory_limit, n_workers,
+                                log=lambda message: self.log(console, message), allocator=allocator)
+
+    def record_core_allocation(self, scheduler, library_i, library_retVal, library_ref):
+        # keep the allocator's decision for a finished library with its stats
+        decision = scheduler.allocator.decision(library_i) if scheduler.allocator is not None else None
+        if decision is not None and library_ref in library_retVal.get('library_stats', {}):
+            library_retVal['library_stats'][library_ref]['core_allocation'] = decision
+
+    def library_fastq_bytes(self, library_retVal, library_ref):
+        # FASTQ bytes the trimming engine read for a finished library, if it recorded them
+        engine_stats = library_retVal.get('library_stats', {}).get(library_ref, {}).get('engine') or {}
+        return engine_stats.get('input_bytes')
+
+    def select_trimming_engine(self, console, requested, input_bytes, quality_encoding, trimmomatic_params,
+                               threads=None):
+        # resolve engine=auto by estimated run time for input_bytes of FASTQ (get_library_fastq_bytes()) on threads
+        # cores, among the engines verified against the jar; returns (engine name, estimates)
+        engine_name, estimates = choose_engine(self.engines, input_bytes, quality_encoding, trimmomatic_params, threads,
+                                               verified=self.verified_engines)
+        if requested != AUTO_ENGINE:
+            engine_name = requested
+        self.log(console, 'Trimming engine: '+engine_name+' (requested '+requested+', '+str(input_bytes)+
+                 ' input bytes, '+(str(threads) if threads else 'all')+' cores, estimated seconds '+
+                 pformat(estimates)+')')
+        return engine_name, estimates
+
+    def run_trimming_engine(self, console, engine_name, read_type, quality_encoding, input_file_paths,
+                            output_file_paths, trimmomatic_params, threads=None, qc=False):
+        # plan and run one library on an engine; every engine writes the same files and jar-format console lines
+        input_bytes = sum([os.path.getsize(path) for path in input_file_paths])
+        engine = self.engines[engine_name]
+        plan = engine.plan(read_type, quality_encoding, input_file_paths, output_file_paths,
+                           trimmomatic_params, input_bytes=input_bytes, threads=threads, qc=qc)
+        outputlines = engine.run(plan, lambda line: self.log(console, line))
+        self.log(console, 'Trimming engine '+engine_name+' stats: '+pformat(plan['stats']))
+        return outputlines, plan
+
+    def parse_trimmomatic_stats(self, trimmomatic_output, read_type):
+        # pull the read counts out of the Trimmomatic summary line
+        if read_type == 'PE':
+            fields = ['Input Read Pairs', 'Both Surviving', 'Forward Only Surviving', 'Reverse Only Surviving', 'Dropped']
+            match = re.search(r'Input Read Pairs: (\d+).*?Both Surviving: (\d+).*?Forward Only Surviving: (\d+).*?Reverse Only Surviving: (\d+).*?Dropped: (\d+)', trimmomatic_output)
+        else:
+            fields = ['Input Reads', 'Surviving', 'Dropped']
+            match = re.search(r'Input Reads: (\d+).*?Surviving: (\d+).*?Dropped: (\d+)', trimmomatic_output)
+        if not match:
+            raise ValueError('Unable to parse Trimmomatic read counts from output')
+        return dict(zip(fields, [int(count) for count in match.groups()]))
+
+    def collect_qc(self, qc_pool, qc_jobs, engine_plan, quality_encoding, input_labels, output_labels):
+        # QC by file label, for the input_labels and output_labels in the engine's input and output order.
+        # The native engines computed it from the batches they trimmed; for the jar, the output files are
+        # read now and the input QC started alongside it (qc_jobs) is waited for
+        qc_stats = dict()
+        if 'qc_summaries' in engine_plan:
+            for qc_label, qc in zip(input_labels, engine_plan['qc_summaries']['inputs']):
+                qc_stats[qc_label] = qc
+            for qc_label, qc in zip(output_labels, engine_plan['qc_summaries']['outputs']):
+                if qc['read_count']:
+                    qc_stats[qc_label] = qc
+        else:
+            for qc_label, qc_file_path in zip(output_labels, engine_plan['outputs']):
+                if os.path.isfile(qc_file_path) and os.path.getsize(qc_file_path) > 0:
+                    qc_jobs[qc_label] = qc_pool.apply_async(compute_fastq_qc, (qc_file_path, quality_encoding))
+            for qc_label in qc_jobs.keys():
+                qc_stats[qc_label] = qc_jobs[qc_label].get()
+        qc_pool.close()
+        return qc_stats
+
+    def untrimmed_output(self, read_type, trimmomatic_output, engine_stats, input_file_paths, output_file_paths):
+        # True when trimming kept every read whole: none dropped or unpaired, and no base trimmed.
+        # The native engines count the bases they keep; the jar doesn't, but with every read kept it
+        # writes each record as it read it less the trimmed bases, so each output is as large as its input
+        counts = self.parse_trimmomatic_stats(trimmomatic_output, read_type)
+        if read_type == 'PE':
+            kept_all = counts['Both Surviving'] == counts['Input Read Pairs']
+        else:
+            kept_all = counts['Surviving'] == counts['Input Reads']
+        if not kept_all:
+            return False
+        if 'surviving_bases' in engine_stats:
+            return engine_stats['surviving_bases'] == engine_stats['input_bases']
+        output_sizes = [os.path.getsize(path) if os.path.isfile(path) else 0 for path in output_file_paths]
+        input_sizes = [os.path.getsize(path) for path in input_file_paths]
+        if len(output_sizes) != len(input_sizes):
+            return sum(output_sizes) == sum(input_sizes)
+        return output_sizes == input_sizes
+
+    def consolidate_unpaired_outputs(self, console, scratch_job, fwd_path, rev_path, fwd_count, rev_count,
+                                     merge, min_reads):
+        """
+        with merge, append the unpaired reverse reads to the unpaired forward file, to save as one SingleEndLibrary;
+        then remove the unpaired outputs holding fewer than min_reads reads, so they aren't saved at all.
+        returns the unpaired output stats for library_stats
+        """
+        counts = {'fwd': fwd_count, 'rev': rev_count}
+        if merge:
+            if os.path.isfile(rev_path):
+                with open(fwd_path, 'ab') as fwd_fh, open(rev_path, 'rb') as rev_fh:
+                    shutil.copyfileobj(rev_fh, fwd_fh)
+                scratch_job.remove(rev_path)
+            counts = {'merged': fwd_count + rev_count}
+        skipped = []
+        for direction, path in [('fwd', fwd_path), ('rev', rev_path), ('merged', fwd_path)]:
+            if direction in counts and 0 < counts[direction] < min_reads:
+                self.log(console, 'Not saving the '+str(counts[direction])+' unpaired '+
+                         (direction+' ' if not merge else '')+'reads, fewer than min_unpaired_reads='+str(min_reads))
+                scratch_job.remove(path)
+                skipped.append(direction)
+        return {'merged': bool(merge), 'reads': counts, 'skipped': skipped}
+
+    def reads_set_labels(self, wsClient, input_items, lib_ref_lists):
+        """
+        the output ReadsSet item labels for each list of output library refs (aligned with the input set items):
+        the input item's label, or else the library's object name, looked up for every list in one call
+        """
+        NAME_I = 1
+        label_lists = []
+        lookups = []
+        for list_i, lib_refs in enumerate(lib_ref_lists):
+            labels = []
+            for i, lib_ref in enumerate(lib_refs):
+                label = None
+                if lib_ref is not None:
+                    if len(lib_refs) == len(input_items):
+                        label = input_items[i].get('label')
+                    if label is None:
+                        lookups.append((list_i, i, lib_ref))
+                labels.append(label)
+            label_lists.append(labels)
+        if lookups:
+            infos = wsClient.get_object_info_new ({'objects': [{'ref': lib_ref} for (list_i, i, lib_ref) in lookups]})
+            for (list_i, i, lib_ref), info in zip(lookups, infos):
+                label_lists[list_i][i] = info[NAME_I]
+        return label_lists
+
+    def save_output_reads_set(self, ctx, output_ws, output_name, description, lib_refs, labels):
+        # save the output libraries as a ReadsSet, skipping None; returns the set ref, or None with no libraries.
+        # each save has a SetAPI client of its own, so the output sets can be saved at once
+        items = [{'ref': lib_ref, 'label': label} for lib_ref, label in zip(lib_refs, labels) if lib_ref is not None]
+        if not items:
+            return None
+        setAPI_Client = SetAPI (url=self.serviceWizardURL, token=ctx['token'], service_ver='beta')  # for dynamic service
+        return setAPI_Client.save_reads_set_v1 ({'workspace_name': output_ws,
+                                                 'output_object_name': output_name,
+                                                 'data': {'description': description, 'items': items}
+                                                 })['set_ref']
+
+    def save_untrimmed_library(self, console, ctx, no_trim_output, input_reads_ref, output_ws, output_obj_name):
+        """
+        the output ref for a library trimming left as it was: with no_trim_output=reuse the input itself, with
+        copy a workspace copy of the input object, which shares its reads files instead of uploading them again
+        """
+        if no_trim_output == 'reuse':
+            self.log(console, 'Nothing was trimmed, returning the input reads '+str(input_reads_ref))
+            return input_reads_ref
+        self.log(console, 'Nothing was trimmed, copying the input reads '+str(input_reads_ref)+' to '+output_obj_name)
+        [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I] = range(7)
+        copy_to = {'name': output_obj_name}
+        if str(output_ws).isdigit():
+            copy_to['wsid'] = int(output_ws)
+        else:
+            copy_to['workspace'] = str(output_ws)
+        try:
+            copied_info = self.get_client(ctx, 'workspace').copy_object({'from': {'ref': input_reads_ref}, 'to': copy_to})
+        except Exception as e:
+            raise ValueError('Unable to copy read library object '+str(input_reads_ref)+' to '+output_obj_name+': '+str(e))
+        return '/'.join([str(copied_info[WSID_I]), str(copied_info[OBJID_I]), str(copied_info[VERSION_I])])
+
+    def trimmomatic_report_html(self, trimmomatic_retVal):
+        # the HTML report page for an execTrimmomatic() result: per-library counts, previews, engine, QC plots
+        # parse text report
+        report_data = []
+        report_field_order = []
+        report_lib_refs = []
+        report_lib_names = []
+        lib_i = -1
+
+        # This is some powerful brute force nonsense, but it should be okay.
+        se_report_re = re.compile('^Input Reads:\s*(\d+)\s*Surviving:\s*(\d+)\s*\(\d+\.\d+\%\)\s*Dropped:\s*(\d+)\s*\(\d+\.\d+\%\)')
+        for line in trimmomatic_retVal['report'].split("\n"):
+            if line.startswith("RUNNING"):
+                lib_i += 1
+                lib_ids = re.sub("RUNNING TRIMMOMATIC ON LIBRARY: ", '', line)
+                [ref, name] = lib_ids.split(" ")
+                report_lib_refs.append(ref)
+                report_lib_names.append(name)
+                report_data.append({})
+                report_field_order.append([])
+            elif line.startswith("-"):
+                continue
+            elif len(line) == 0:
+                continue
+            else:
+                m = se_report_re.match(line)
+                if m and len(m.groups()) == 3:
+                    report_field_order[lib_i] = ['Input Reads', 'Surviving', 'Dropped']
+                    report_data[lib_i] = dict(zip(report_field_order[lib_i], m.groups()))
+                try:
+                    [f_name, val] = line.split(': ')
+                    int_val = int(val)
+                    report_field_order[lib_i].append(f_name)
+                    report_data[lib_i][f_name] = int_val
+                except ValueError:
+                    print("Can't parse [" + line + "] (lib_i=" + str(lib_i) + ")")
+
+        # html report
+        sp = '&nbsp;'
+        text_color = "#606060"
+        bar_color = "lightblue"
+        bar_width = 100
+        bar_char = "."
+        bar_fontsize = "-2"
+        row_spacing = "-2"
+
+        html_report_lines = ['<html>']
+        html_report_lines += ['<body bgcolor="white">']
+
+#        result_data_order = ['foobarfoo', 'animalcules', 'chicken', 'applesauce']
+#        result_data = { 'foobarfoo': 197,
+#                        'animalcules': 234,
+#                        'chicken': 14,
+#                        'applesauce': 1
+#                        }
+
+        failures = dict([(failure['input_reads_ref'], failure) for failure in trimmomatic_retVal.get('failed_libraries', [])])
+        for lib_i in range(len(report_data)):
+            html_report_lines += ['<p><b><font color="'+text_color+'">TRIMMOMATIC RESULTS FOR '+str(report_lib_names[lib_i])+' (object '+str(report_lib_refs[lib_i])+')</font></b><br>'+"\n"]
+            high_val = 0
+            if report_lib_refs[lib_i] in failures:
+                failure = failures[report_lib_refs[lib_i]]
+                html_report_lines += ['<font color="'+text_color+'">FAILED after '+str(failure['attempts'])+' attempts: '+
+                                      str(failure['error'])+'</font><br>']
+                continue
+            elif not len(report_field_order[lib_i]):
+                html_report_lines += ['All reads were trimmed - no new reads object created.']
+            else:
+                html_report_lines += ['<table cellpadding=0 cellspacing=0 border=0>']
+                html_report_lines += ['<tr><td></td><td>'+sp+sp+sp+sp+'</td><td></td><td>'+sp+sp+'</td></tr>']
+                for f_name in report_field_order[lib_i]:
+                    if report_data[lib_i][f_name] > high_val:
+                        high_val = report_data[lib_i][f_name]
+                for f_name in report_field_order[lib_i]:
+
+                    percent = round(float(report_data[lib_i][f_name])/float(high_val)*100, 1)
+
+                    this_width = int(round(float(bar_width)*float(report_data[lib_i][f_name])/float(high_val), 0))
+                    #self.log(console,"this_width: "+str(this_width)+" report_data: "+str(report_data[lib_i][f_name])+" calc: "+str(float(width)*float(report_data[lib_i][f_name])/float(high_val)))  # DEBUG
+                    if this_width < 1:
+                        if report_data[lib_i][f_name] > 0:
+                            this_width = 1
+                        else:
+                            this_width = 0
+                    html_report_lines += ['<tr>']
+                    html_report_lines += ['    <td align=right><font color="'+text_color+'">'+str(f_name)+'</font></td><td></td>']
+                    html_report_lines += ['    <td align=right><font color="'+text_color+'">'+str(report_data[lib_i][f_name])+'</font></td><td></td>']
+                    html_report_lines += ['    <td align=right><font color="'+text_color+'">'+'('+str(percent)+'%)'+sp+sp+'</font></td><td></td>']
+
+                    if this_width > 0:
+                        for tic in range(this_width):
+                            html_report_lines += ['    <td bgcolor="'+bar_color+'"><font size='+bar_fontsize+' color="'+bar_color+'">'+bar_char+'</font></td>']
+                    html_report_lines += ['</tr>']
+                    html_report_lines += ['<tr><td><font size='+row_spacing+'>'+sp+'</font></td></tr>']
+
+                html_report_lines += ['</table>']
+                html_report_lines += ['<p>']
+
+            lib_stats = trimmomatic_retVal.get('library_stats', {}).get(report_lib_refs[lib_i], {})
+            if lib_stats.get('preview'):
+                preview = lib_stats['preview']
+                html_report_lines += ['<p><b><font color="'+text_color+'">PREVIEW ONLY</font></b> - counts above are predicted from '+
+                                      str(preview['sampled_reads'])+' of '+str(preview['total_reads'])+' reads ('+str(preview['mode'])+'), no reads objects were created.<br>']
+                html_report_lines += ['<table cellpadding=2 cellspacing=0 border=0>']
+                html_report_lines += ['<tr><td><font color="'+text_color+'">Predicted survival</font></td><td align=right><font color="'+text_color+'">'+str(round(100.0*preview['predicted_survival'], 2))+'%</font></td></tr>']
+                html_report_lines += ['<tr><td><font color="'+text_color+'">Estimated wall time</font></td><td align=right><font color="'+text_color+'">'+str(preview['estimated_wall_seconds'])+' s ('+str(preview.get('engine', 'jar'))+')</font></td></tr>']
+                html_report_lines += ['<tr><td><font color="'+text_color+'">Input size</font></td><td align=right><font color="'+text_color+'">'+str(preview['input_bytes'])+' bytes</font></td></tr>']
+                for output_name in sorted(preview['predicted_output_bytes'].keys()):
+                    html_report_lines += ['<tr><td><font color="'+text_color+'">Predicted '+str(output_name)+' output</font></td><td align=right><font color="'+text_color+'">'+str(preview['predicted_output_bytes'][output_name])+' bytes</font></td></tr>']
+                html_report_lines += ['</table>']
+            if lib_stats.get('engine'):
+                engine_stats = lib_stats['engine']
+                html_report_lines += ['<font color="'+text_color+'">Trimming engine: '+str(engine_stats['engine'])+
+                                      (' (auto)' if engine_stats['requested'] == 'auto' else '')+', '+
+                                      (str(engine_stats['threads'])+' cores, ' if engine_stats.get('threads') else '')+
+                                      str(round(engine_stats.get('seconds', 0.0), 1))+' s'+
+                                      (', interleaved '+(' and '.join([k for k in ['input', 'output']
+                                                                       if engine_stats['layout'][k] == 'interleaved']))
+                                       if engine_stats.get('layout', {}).get('input') == 'interleaved' else '')+
+                                      '</font><br>']
+            if lib_stats.get('untrimmed'):
+                html_report_lines += ['<font color="'+text_color+'">Nothing was trimmed: '+
+                                      ('the input reads were kept as the output' if lib_stats['untrimmed'] == 'reuse'
+                                       else 'the output is a copy of the input reads object')+'</font><br>']
+            if lib_stats.get('unpaired'):
+                unpaired_stats = lib_stats['unpaired']
+                html_report_lines += ['<font color="'+text_color+'">Unpaired reads: '+
+                                      ('forward and reverse saved as one library' if unpaired_stats['merged'] else 'saved by direction')+
+                                      (', not saved for '+", ".join(unpaired_stats['skipped'])+' (too few reads)' if unpaired_stats['skipped'] else '')+
+                                      '</font><br>']
+            if lib_stats.get('scratch'):
+                html_report_lines += ['<font color="'+text_color+'">Peak scratch use: '+
+                                      str(round(lib_stats['scratch']['peak_bytes'] / 1048576.0, 1))+' MB'+
+                                      (' (subsamples on tmpfs)' if lib_stats['scratch']['tmpfs'] else '')+'</font><br>']
+            if lib_stats.get('quality_encoding'):
+                html_report_lines += ['<font color="'+text_color+'">Quality encoding (auto-detected): '+str(lib_stats['quality_encoding']['detected'])+'</font><br>']
+
+            if lib_stats.get('adapter_detection'):
+                adapter_detection = lib_stats['adapter_detection']
+                html_report_lines += ['<font color="'+text_color+'">Adapters (auto-detected from '+str(adapter_detection['reads_sampled'])+' sampled reads): '+
+                                      str(os.path.basename(adapter_detection['adapterFa']) if adapter_detection['adapterFa'] else 'none found')+
+                                      ' ('+str(adapter_detection['method'])+')</font><br>']
+                html_report_lines += ['<table cellpadding=2 cellspacing=0 border=0>']
+                html_report_lines += ['<tr><td><font color="'+text_color+'">Adapter file</font></td><td><font color="'+text_color+'">Reads with adapter k-mers</font></td></tr>']
+                for adapter_file in sorted(adapter_detection['adapter_file_scores'].keys()):
+                    html_report_lines += ['<tr><td><font color="'+text_color+'">'+str(adapter_file)+'</font></td>'+
+                                          '<td align=right><font color="'+text_color+'">'+str(round(100.0*adapter_detection['adapter_file_scores'][adapter_file], 2))+'%</font></td></tr>']
+                for custom_name, custom_seq in zip(adapter_detection.get('custom_names', []), adapter_detection.get('custom_sequences', [])):
+                    html_report_lines += ['<tr><td><font color="'+text_color+'">'+str(custom_name)+'</font></td>'+
+                                          '<td><font color="'+text_color+'">'+str(custom_seq)+'</font></td></tr>']
+                html_report_lines += ['</table>']
+
+            # QC plots
+            if lib_stats.get('qc'):
+                html_report_lines += ['<p><b><font color="'+text_color+'">READ QC FOR '+str(report_lib_names[lib_i])+'</font></b><br>']
+                html_report_lines += [qc_plots_html(lib_stats['qc'])]
+                html_report_lines += ['<p>']
+        html_report_lines += ['</body>']
+        html_report_lines += ['</html>']
+
+        failed_libraries = trimmomatic_retVal.get('failed_libraries', [])
+        if failed_libraries:
+            html_report_lines.insert(2, '<p><b><font color="'+text_color+'">'+str(len(failed_libraries))+' of '+
+                                    str(len(report_data))+' libraries failed and were left out of the output sets</font></b><br>')
+        return "\n".join(html_report_lines)
+
+    def run_trimmomatic_preview(self, console, input_params, input_file_paths, engine, trimmomatic_params, scratch_job,
+                                threads=None):
+        # trim a subsample of the library on the chosen engine and scale the counts, output sizes and run time up to
+        # the whole library
+        read_type = input_params['read_type']
+        n_reads = int(input_params.get('preview_reads') or self.PREVIEW_DEFAULT_READS)
+        mode = input_params.get('preview_mode') or 'first'
+        total_reads = get_fastq_index(input_file_paths[0]).total_records
+        input_bytes = sum([os.path.getsize(path) for path in input_file_paths])
+        directions = ['fwd', 'rev'][:len(input_file_paths)]
+
+        # the subsamples and their outputs are small, and only read here: tmpfs if they fit
+        sample_prefix = scratch_job.local_file('preview', self.local_sample_bytes(input_bytes, total_reads, n_reads))
+        sample_file_paths = [sample_prefix+'_'+direction+'.fastq' for direction in directions]
+        sample_info = subsample_fastq(input_file_paths, sample_file_paths, n_reads, mode=mode, total_reads=total_reads)
+        sampled_reads = sample_info['sampled_reads']
+        sample_bytes = sum([os.path.getsize(path) for path in sample_file_paths])
+        if not sampled_reads:
+            raise ValueError('No reads found to preview in '+", ".join(input_file_paths))
+
+        # a second, tenth-size sample separates the engine's startup cost (the JVM's for the jar) from the per-read cost
+        head_file_paths = [sample_prefix+'_head_'+direction+'.fastq' for direction in directions]
+        head_reads = subsample_fastq(sample_file_paths, head_file_paths, max(1, sampled_reads // 10), mode='first')['sampled_reads']
+
+        if read_type == 'PE':
+            output_names = ['fwd_paired', 'fwd_unpaired', 'rev_paired', 'rev_unpaired']
+        else:
+            output_names = ['fwd']
+        runs = dict()
+        for run_label, run_input_file_paths in [('head', head_file_paths), ('sample', sample_file_paths)]:
+            output_file_paths = [sample_prefix+'_'+run_label+'_trimm_'+name+'.fastq' for name in output_names]
+            start_time = time.time()
+            outputlines = self.run_trimming_engine(console, engine, read_type, input_params['quality_encoding'],
+                                                   run_input_file_paths, output_file_paths, trimmomatic_params,
+                                                   threads)[0]
+            runs[run_label] = {'seconds': time.time() - start_time,
+                               'counts': self.parse_trimmomatic_stats("\n".join(outputlines), read_type),
+                               'output_bytes': dict((name, os.path.getsize(path) if os.path.isfile(path) else 0)
+                                                    for name, path in zip(output_names, output_file_paths))
+                               }
+            scratch_job.remove(*output_file_paths)
+        scratch_job.remove(*(head_file_paths + sample_file_paths))
+
+        # scale up
+        read_scale = float(total_reads) / sampled_reads
+        byte_scale = float(input_bytes) / sample_bytes if sample_bytes else 0.0
+        predicted_counts = dict((field, int(round(count * read_scale))) for field, count in runs['sample']['counts'].items())
+        if read_type == 'PE':
+            predicted_counts['Input Read Pairs'] = total_reads
+        else:
+            predicted_counts['Input Reads'] = total_reads
+        if sampled_reads > head_reads:
+            seconds_per_read = max(0.0, (runs['sample']['seconds'] - runs['head']['seconds']) / (sampled_reads - head_reads))
+        else:
+            seconds_per_read = runs['sample']['seconds'] / sampled_reads
+        startup_seconds = max(0.0, runs['head']['seconds'] - seconds_per_read * head_reads)
+
+        preview = {'mode': mode,
+                   'engine': engine,
+                   'sampled_reads': sampled_reads,
+                   'total_reads': total_reads,
+                   'sample_counts': runs['sample']['counts'],
+                   'predicted_counts': predicted_counts,
+                   'predicted_survival': round(float(runs['sample']['counts']['Both Surviving' if read_type == 'PE' else 'Surviving']) / sampled_reads, 4),
+                   'input_bytes': input_bytes,
+                   'predicted_output_bytes': dict((name, int(size * byte_scale)) for name, size in runs['sample']['output_bytes'].items()),
+                   'sample_seconds': round(runs['sample']['seconds'], 2),
+                   'estimated_startup_seconds': round(startup_seconds, 2),
+                   'estimated_wall_seconds': round(startup_seconds + seconds_per_read * total_reads, 1)
+                   }
+
+        # report in the same form as a full run so callers can parse it the same way
+        def pct(count):
+            return '(' + ('%.2f' % (100.0 * count / total_reads if total_reads else 0.0)) + '%)'
+        if read_type == 'PE':
+            report = "\n".join(('Input Read Pairs: '+str(predicted_counts['Input Read Pairs']),
+                                'Both Surviving: '+str(predicted_counts['Both Surviving']),
+                                'Forward Only Surviving: '+str(predicted_counts['Forward Only Surviving']),
+                                'Reverse Only Surviving: '+str(predicted_counts['Reverse Only Surviving']),
+                                'Dropped: '+str(predicted_counts['Dropped'])))
+        else:
+            report = ('Input Reads: '+str(predicted_counts['Input Reads'])+
+                      ' Surviving: '+str(predicted_counts['Surviving'])+' '+pct(predicted_counts['Surviving'])+
+                      ' Dropped: '+str(predicted_counts['Dropped'])+' '+pct(predicted_counts['Dropped']))
+        report += "\n\nPreview only: counts predicted from "+str(sampled_reads)+" sampled reads, no reads objects were created."
+        return (report, preview)
+
+    def local_sample_bytes(self, input_bytes, total_reads, sample_reads, n_outputs=1):
+        # the most a subsample of sample_reads reads and n_outputs sets of its trimmed outputs can hold
+        sample_bytes = float(input_bytes) * min(1.0, float(sample_reads) / total_reads) if total_reads else input_bytes
+        return int(sample_bytes * (2 + n_outputs))
+
+    def set_trimming_param_defaults(self, input_params):
+        # fill in defaults for the trimming params, in place
+        defaults = {
+            'quality_encoding':           'phred33',
+            'seed_mismatches':            '0', # '2',
+            'palindrome_clip_threshold':  '0', # '3',
+            'simple_clip_threshold':      '0', # '10',
+            'crop_length':                '0',
+            'head_crop_length':           '0',
+            'leading_min_quality':        '0', # '3',
+            'trailing_min_quality':       '0', # '3',
+            'sliding_window_size':        '0', # '4',
+            'sliding_window_min_quality': '0', # '15',
+            'min_length':                 '0', # '36'
+        }
+        for arg in defaults.keys():
+            if arg not in input_params or input_params[arg] is None or input_params[arg] == '':
+                input_params[arg] = defaults[arg]
+
+        # conditional arg behavior
+        arg = 'adapterFa'
+        if arg not in input_params or input_params[arg] is None or input_params[arg] == '':
+            input_params['adapterFa'] = None
+            input_params['seed_mismatches'] = None
+            input_params['palindrome_clip_threshold'] = None
+            input_params['simple_clip_threshold'] = None
+        return input_params
+
     def parse_trimmomatic_steps(self, input_params):
         # validate input parameters and return string defining trimmomatic steps
 
@@ -65,16 +741,19 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
 
         if 'quality_encoding' not in input_params and input_params['quality_encoding'] is not None:
             raise ValueError('quality_encoding not defined')
-        elif input_params['quality_encoding'] not in ('phred33', 'phred64'):
-            raise ValueError('quality_encoding must be phred33 or phred64')
+        elif input_params['quality_encoding'] not in ('phred33', 'phred64', 'auto'):
+            raise ValueError('quality_encoding must be phred33, phred64 or auto')
 
         # set adapter trimming
         if ('adapterFa' in input_params and input_params['adapterFa'] is not None and
             'seed_mismatches' in input_params and input_params['seed_mismatches'] is not None and
             'palindrome_clip_threshold' in input_params and input_params['quality_encoding'] is not None and
             'simple_clip_threshold' in input_params and input_params['simple_clip_threshold'] is not None):
-            parameter_string = ("ILLUMINACLIP:" + self.ADAPTER_DIR +
-                                ":".join((str(input_params['adapterFa']),
+            adapter_fa = str(input_params['adapterFa'])
+            if not os.path.isabs(adapter_fa):
+                adapter_fa = self.ADAPTER_DIR + adapter_fa
+            parameter_string = ("ILLUMINACLIP:" +
+                                ":".join((adapter_fa,
                                           str(input_params['seed_mismatches']),
                                           str(input_params['palindrome_clip_threshold']),
                                           str(input_params['simple_clip_threshold']))) + " ")
@@ -144,7 +823,30 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
 
         if not os.path.exists(self.scratch):
             os.makedirs(self.scratch)
-        os.chdir(self.scratch)
+
+        # every library run works in its own scratch job directory; clear out those of runs that were killed
+        self.scratch_manager = ScratchManager(self.scratch)
+        orphaned_job_dirs = self.scratch_manager.clean_orphans()
+        if orphaned_job_dirs:
+            print('Removed '+str(len(orphaned_job_dirs))+' orphaned scratch job directories')
+
+        # optional cache of downloaded reads, so trimming a library again doesn't download it again
+        self.input_cache = None
+        if config.get('input-cache-bytes'):
+            self.input_cache = InputCache(config.get('input-cache-dir') or os.path.join(self.scratch, self.INPUT_CACHE_DIR),
+                                          int(config['input-cache-bytes']))
+
+        # optional caps on the scratch and memory that libraries trimmed side by side may use
+        self.scratch_limit_bytes = int(config['scratch-limit-bytes']) if config.get('scratch-limit-bytes') else None
+        self.memory_limit_bytes = int(config['memory-limit-bytes']) if config.get('memory-limit-bytes') else None
+
+        # engines live as long as the service so their measured throughput carries across libraries
+        self.engines = make_engines(self.TRIMMOMATIC)
+        # engines verified against the jar's output (verified-engines, comma separated) are the only ones that may be
+        # requested or picked by engine=auto; the jar always is
+        verified_engines = [name.strip() for name in (config.get('verified-engines') or '').split(',')]
+        self.verified_engines = tuple(sorted(set([REFERENCE_ENGINE] + [name for name in verified_engines
+                                                                       if name in self.engines])))
         #END_CONSTRUCTOR
         pass
 
@@ -167,7 +869,15 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
            "sliding_window_min_quality" of Long, parameter
            "leading_min_quality" of Long, parameter "trailing_min_quality" of
            Long, parameter "crop_length" of Long, parameter
-           "head_crop_length" of Long, parameter "min_length" of Long
+           "head_crop_length" of Long, parameter "min_length" of Long,
+           parameter "run_qc" of Long, parameter "preview" of Long,
+           parameter "preview_reads" of Long, parameter "preview_mode" of
+           String, parameter "engine" of String, parameter "fail_soft" of
+           Long, parameter "library_retries" of Long, parameter
+           "max_child_jobs" of Long, parameter "num_threads" of Long,
+           parameter "no_trim_output" of String, parameter "merge_unpaired"
+           of Long, parameter "min_unpaired_reads" of Long, parameter
+           "interleaved" of Long
         :returns: instance of type "runTrimmomaticOutput" -> structure:
            parameter "report_name" of String, parameter "report_ref" of String
         """
@@ -259,9 +969,22 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
             execTrimmomaticParams['head_crop_length'] = input_params['head_crop_length']
         if 'min_length' in input_params:
             execTrimmomaticParams['min_length'] = input_params['min_length']
-
-        # RUN
-        trimmomatic_retVal = self.execTrimmomatic (ctx, execTrimmomaticParams)[0]
+        for arg in ['run_qc', 'preview', 'preview_reads', 'preview_mode', 'engine', 'fail_soft', 'library_retries',
+                    'max_child_jobs', 'num_threads', 'no_trim_output', 'merge_unpaired', 'min_unpaired_reads',
+                    'interleaved']:
+            if arg in input_params:
+                execTrimmomaticParams[arg] = input_params[arg]
+
+        # RUN, building the HTML report from the library results while execTrimmomatic saves the output sets
+        report_pool = ThreadPool(1)
+        html_jobs = []
+        ctx['libraries_done'] = lambda library_results: html_jobs.append(
+            report_pool.apply_async(self.trimmomatic_report_html, (library_results,)))
+        try:
+            trimmomatic_retVal = self.execTrimmomatic (ctx, execTrimmomaticParams)[0]
+        finally:
+            ctx.pop('libraries_done', None)
+            report_pool.close()
 
 
         # build report
@@ -288,102 +1011,15 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
         except:
             raise ValueError ("no report generated by execTrimmomatic()")
 
-        # parse text report
-        report_data = []
-        report_field_order = []
-        report_lib_refs = []
-        report_lib_names = []
-        lib_i = -1
-
-        # This is some powerful brute force nonsense, but it should be okay.
-        se_report_re = re.compile('^Input Reads:\s*(\d+)\s*Surviving:\s*(\d+)\s*\(\d+\.\d+\%\)\s*Dropped:\s*(\d+)\s*\(\d+\.\d+\%\)')
-        for line in trimmomatic_retVal['report'].split("\n"):
-            if line.startswith("RUNNING"):
-                lib_i += 1
-                lib_ids = re.sub("RUNNING TRIMMOMATIC ON LIBRARY: ", '', line)
-                [ref, name] = lib_ids.split(" ")
-                report_lib_refs.append(ref)
-                report_lib_names.append(name)
-                report_data.append({})
-                report_field_order.append([])
-            elif line.startswith("-"):
-                continue
-            elif len(line) == 0:
-                continue
-            else:
-                m = se_report_re.match(line)
-                if m and len(m.groups()) == 3:
-                    report_field_order[lib_i] = ['Input Reads', 'Surviving', 'Dropped']
-                    report_data[lib_i] = dict(zip(report_field_order[lib_i], m.groups()))
-                try:
-                    [f_name, val] = line.split(': ')
-                    int_val = int(val)
-                    report_field_order[lib_i].append(f_name)
-                    report_data[lib_i][f_name] = int_val
-                except ValueError:
-                    print("Can't parse [" + line + "] (lib_i=" + str(lib_i) + ")")
-
-        # html report
-        sp = '&nbsp;'
-        text_color = "#606060"
-        bar_color = "lightblue"
-        bar_width = 100
-        bar_char = "."
-        bar_fontsize = "-2"
-        row_spacing = "-2"
-
-        html_report_lines = ['<html>']
-        html_report_lines += ['<body bgcolor="white">']
-
-#        result_data_order = ['foobarfoo', 'animalcules', 'chicken', 'applesauce']
-#        result_data = { 'foobarfoo': 197,
-#                        'animalcules': 234,
-#                        'chicken': 14,
-#                        'applesauce': 1
-#                        }
-
-        for lib_i in range(len(report_data)):
-            html_report_lines += ['<p><b><font color="'+text_color+'">TRIMMOMATIC RESULTS FOR '+str(report_lib_names[lib_i])+' (object '+str(report_lib_refs[lib_i])+')</font></b><br>'+"\n"]
-            high_val = 0
-            if not len(report_field_order[lib_i]):
-                html_report_lines += ['All reads were trimmed - no new reads object created.']
-            else:
-                html_report_lines += ['<table cellpadding=0 cellspacing=0 border=0>']
-                html_report_lines += ['<tr><td></td><td>'+sp+sp+sp+sp+'</td><td></td><td>'+sp+sp+'</td></tr>']
-                for f_name in report_field_order[lib_i]:
-                    if report_data[lib_i][f_name] > high_val:
-                        high_val = report_data[lib_i][f_name]
-                for f_name in report_field_order[lib_i]:
-
-                    percent = round(float(report_data[lib_i][f_name])/float(high_val)*100, 1)
-
-                    this_width = int(round(float(bar_width)*float(report_data[lib_i][f_name])/float(high_val), 0))
-                    #self.log(console,"this_width: "+str(this_width)+" report_data: "+str(report_data[lib_i][f_name])+" calc: "+str(float(width)*float(report_data[lib_i][f_name])/float(high_val)))  # DEBUG
-                    if this_width < 1:
-                        if report_data[lib_i][f_name] > 0:
-                            this_width = 1
-                        else:
-                            this_width = 0
-                    html_report_lines += ['<tr>']
-                    html_report_lines += ['    <td align=right><font color="'+text_color+'">'+str(f_name)+'</font></td><td></td>']
-                    html_report_lines += ['    <td align=right><font color="'+text_color+'">'+str(report_data[lib_i][f_name])+'</font></td><td></td>']
-                    html_report_lines += ['    <td align=right><font color="'+text_color+'">'+'('+str(percent)+'%)'+sp+sp+'</font></td><td></td>']
-
-                    if this_width > 0:
-                        for tic in range(this_width):
-                            html_report_lines += ['    <td bgcolor="'+bar_color+'"><font size='+bar_fontsize+' color="'+bar_color+'">'+bar_char+'</font></td>']
-                    html_report_lines += ['</tr>']
-                    html_report_lines += ['<tr><td><font size='+row_spacing+'>'+sp+'</font></td></tr>']
-
-                html_report_lines += ['</table>']
-                html_report_lines += ['<p>']
-        html_report_lines += ['</body>']
-        html_report_lines += ['</html>']
-
-        reportObj['direct_html'] = "\n".join(html_report_lines)
+        if html_jobs:
+            reportObj['direct_html'] = html_jobs[0].get()
+        else:
+            reportObj['direct_html'] = self.trimmomatic_report_html(trimmomatic_retVal)
 
-        # trimmed object
-        if trimmomatic_retVal['output_filtered_ref'] != None:
+        # trimmed object (unless it is the input reads, returned as they were)
+        if trimmomatic_retVal['output_filtered_ref'] == str(input_params['input_reads_ref']):
+            self.log(console, "Nothing was trimmed, the input reads are the output")
+        elif trimmomatic_retVal['output_filtered_ref'] != None:
             try:
                 # DEBUG
                 #self.log(console,"OBJECT CREATED: '"+str(trimmomatic_retVal['output_filtered_ref'])+"'")
@@ -400,7 +1036,8 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
         if trimmomatic_retVal['output_unpaired_fwd_ref'] != None:
             try:
                 reportObj['objects_created'].append({'ref':trimmomatic_retVal['output_unpaired_fwd_ref'],
-                                                     'description':'Trimmed Unpaired Forward Reads'})
+                                                     'description':'Trimmed Unpaired Reads' if self.get_bool_param(input_params, 'merge_unpaired')
+                                                                   else 'Trimmed Unpaired Forward Reads'})
             except:
                 raise ValueError ("failure saving unpaired fwd output")
         else:
@@ -448,12 +1085,25 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
            "sliding_window_min_quality" of Long, parameter
            "leading_min_quality" of Long, parameter "trailing_min_quality" of
            Long, parameter "crop_length" of Long, parameter
-           "head_crop_length" of Long, parameter "min_length" of Long
+           "head_crop_length" of Long, parameter "min_length" of Long,
+           parameter "run_qc" of Long, parameter "preview" of Long,
+           parameter "preview_reads" of Long, parameter "preview_mode" of
+           String, parameter "engine" of String, parameter "fail_soft" of
+           Long, parameter "library_retries" of Long, parameter
+           "max_child_jobs" of Long, parameter "num_threads" of Long,
+           parameter "threads" of Long, parameter "no_trim_output" of
+           String, parameter "merge_unpaired" of Long, parameter
+           "min_unpaired_reads" of Long, parameter "interleaved" of Long
         :returns: instance of type "execTrimmomaticOutput" -> structure:
            parameter "output_filtered_ref" of type "data_obj_ref", parameter
            "output_unpaired_fwd_ref" of type "data_obj_ref", parameter
            "output_unpaired_rev_ref" of type "data_obj_ref", parameter
-           "report" of String
+           "report" of String, parameter "library_stats" of mapping from
+           type "data_obj_ref" to unspecified object, parameter
+           "failed_libraries" of list of type "LibraryFailure" (a library a
+           fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long
         """
         # ctx is the context object
         # return variables are: output
@@ -535,53 +1185,248 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
             readsSet_names_list = [input_reads_obj_info[NAME_I]]
 
 
-        # Iterate through readsLibrary members of set
+        optional_params = ['read_type',
+                           'adapterFa',
+                           'seed_mismatches',
+                           'palindrome_clip_threshold',
+                           'simple_clip_threshold',
+                           'quality_encoding',
+                           'sliding_window_size',
+                           'sliding_window_min_quality',
+                           'leading_min_quality',
+                           'trailing_min_quality',
+                           'crop_length',
+                           'head_crop_length',
+                           'min_length',
+                           'run_qc',
+                           'preview',
+                           'preview_reads',
+                           'preview_mode',
+                           'engine',
+                           'no_trim_output',
+                           'merge_unpaired',
+                           'min_unpaired_reads',
+                           'interleaved'
+                           ]
+
+        # Checkpoint manifest keyed by the exact inputs and params, so a re-run after a failure
+        # skips the libraries that were already trimmed and uploaded
         #
-        report = ''
-        trimmed_readsSet_ref       = None
-        unpaired_fwd_readsSet_ref  = None
-        unpaired_rev_readsSet_ref  = None
-        trimmed_readsSet_refs      = []
-        unpaired_fwd_readsSet_refs = []
-        unpaired_rev_readsSet_refs = []
+        run_manifest = None
+        if not self.get_bool_param(input_params, 'preview'):
+            manifest_inputs = {'input_reads_ref': '/'.join([str(input_reads_obj_info[WSID_I]),
+                                                            str(input_reads_obj_info[OBJID_I]),
+                                                            str(input_reads_obj_info[VERSION_I])]),
+                               'members': readsSet_ref_list,
+                               'output_ws': input_params['output_ws'],
+                               'output_reads_name': input_params['output_reads_name'],
+                               'params': dict([(arg, input_params.get(arg)) for arg in optional_params])}
+            run_manifest = RunManifest.open(os.path.join(self.scratch, self.MANIFEST_DIR), manifest_inputs)
+            self.log(console, 'Run manifest: '+run_manifest.path)
+        ctx['run_manifest'] = run_manifest
+
+        # Fail-soft: libraries that still fail after their retries are left out of the output sets
+        # and listed in failed_libraries, instead of failing the whole run
+        #
+        fail_soft = self.get_bool_param(input_params, 'fail_soft')
+        if input_params.get('library_retries') is not None:
+            library_retries = int(input_params['library_retries'])
+        else:
+            library_retries = self.FAIL_SOFT_LIBRARY_RETRIES if fail_soft else 0
+        if library_retries < 0:
+            raise ValueError("library_retries must be 0 or more, got: "+str(library_retries))
 
-        for reads_item_i,input_reads_library_ref in enumerate(readsSet_ref_list):
-            execTrimmomaticParams = { 'input_reads_ref': input_reads_library_ref,
+
+        # Iterate through readsLibrary members of set
+        #
+        def library_params(reads_item_i, threads=None):
+            # execTrimmomaticSingleLibrary params for one member
+            execTrimmomaticParams = { 'input_reads_ref': readsSet_ref_list[reads_item_i],
                                       'output_ws': input_params['output_ws']
                                       }
-            optional_params = ['read_type',
-                               'adapterFa',
-                               'seed_mismatches',
-                               'palindrome_clip_threshold',
-                               'simple_clip_threshold',
-                               'quality_encoding',
-                               'sliding_window_size',
-                               'sliding_window_min_quality',
-                               'leading_min_quality',
-                               'trailing_min_quality',
-                               'crop_length',
-                               'head_crop_length',
-                               'min_length'
-                               ]
             for arg in optional_params:
                 if arg in input_params:
                     execTrimmomaticParams[arg] = input_params[arg]
+            if threads:
+                execTrimmomaticParams['threads'] = threads
 
             if input_reads_obj_type not in ["KBaseSets.ReadsSet", "KBaseRNASeq.RNASeqSampleSet"]:
                 execTrimmomaticParams['output_reads_name'] = input_params['output_reads_name']
             else:
                 execTrimmomaticParams['output_reads_name'] = readsSet_names_list[reads_item_i]+'_trimm'
+            return execTrimmomaticParams
+
+        def completed_library(reads_item_i):
+            # the stored result of a library an earlier run trimmed and uploaded, if any
+            completed_retVal = run_manifest.completed(readsSet_ref_list[reads_item_i]) if run_manifest is not None else None
+            if completed_retVal is not None:
+                self.log(console, 'Skipping '+str(readsSet_ref_list[reads_item_i])+': trimmed and uploaded by an earlier run')
+            return completed_retVal
+
+        def finish_library(reads_item_i, trimmomaticSingleLibrary_retVal, failure, library_ctx):
+            # checkpoint a library's (result, failure) in the run manifest and return it
+            if failure is not None:
+                self.record_library_state(library_ctx, readsSet_ref_list[reads_item_i], 'failed',
+                                          {'error': failure['error'], 'attempts': failure['attempts']})
+            elif run_manifest is not None:
+                run_manifest.complete(readsSet_ref_list[reads_item_i], trimmomaticSingleLibrary_retVal)
+            return trimmomaticSingleLibrary_retVal, failure
+
+        def trim_library(reads_item_i, library_ctx=None, threads=None, finish_result=None):
+            # one library through the run manifest and the retries; returns (result, failure), one of them None.
+            # finish_result adds to a new result before the run manifest stores it
+            library_ctx = library_ctx if library_ctx is not None else ctx
+            completed_retVal = completed_library(reads_item_i)
+            if completed_retVal is not None:
+                return completed_retVal, None
+
+            self.record_library_state(library_ctx, readsSet_ref_list[reads_item_i], 'started')
+            try:
+                trimmomaticSingleLibrary_retVal = self.run_library_with_retries(console, library_ctx,
+                                                                                library_params(reads_item_i, threads),
+                                                                                library_retries)
+            except Exception as e:
+                if not fail_soft:
+                    raise
+                self.log(console, traceback.format_exc())
+                failure = {'input_reads_ref': readsSet_ref_list[reads_item_i],
+                           'name': readsSet_names_list[reads_item_i],
+                           'error': str(e),
+                           'attempts': library_retries+1}
+                return finish_library(reads_item_i, None, failure, library_ctx)
+            if finish_result is not None:
+                finish_result(trimmomaticSingleLibrary_retVal)
+            return finish_library(reads_item_i, trimmomaticSingleLibrary_retVal, None, library_ctx)
+
+        # Large sets fan out to child jobs when the cost model expects that to finish sooner
+        #
+        shards = []
+        num_threads = int(input_params.get('num_threads') or 1)
+        max_child_jobs = int(input_params.get('max_child_jobs') or 0)
+        if max_child_jobs > 1 and len(readsSet_ref_list) > 1:
+            shards = self.plan_library_shards(console, wsClient, readsSet_ref_list, max_child_jobs)
+
+        # Otherwise check the libraries still to trim fit in scratch before downloading any of them
+        #
+        if not shards:
+            # one metadata lookup for the preflight and the library scheduler
+            library_files = self.get_library_files(wsClient, readsSet_ref_list)
+            pending_items = [reads_item_i for reads_item_i in range(len(readsSet_ref_list))
+                             if run_manifest is None or run_manifest.completed(readsSet_ref_list[reads_item_i]) is None]
+            num_threads = self.preflight_scratch(console,
+                                                 [library_files[reads_item_i] for reads_item_i in pending_items],
+                                                 [readsSet_ref_list[reads_item_i] for reads_item_i in pending_items],
+                                                 [readsSet_names_list[reads_item_i] for reads_item_i in pending_items],
+                                                 num_threads, with_outputs=not self.get_bool_param(input_params, 'preview'))
+
+        if shards:
+            child_client = BaseClient(self.callbackURL, token=token,
+                                      async_job_check_max_time_ms=self.CHILD_JOB_CHECK_MAX_MS)
+
+            def run_shard(shard):
+                # one child execTrimmomaticBatch job for the libraries of the shard not finished by an earlier run,
+                # which retries each of them itself
+                shard_results = []
+                pending_items = []
+                for reads_item_i in shard:
+                    completed_retVal = completed_library(reads_item_i)
+                    if completed_retVal is not None:
+                        shard_results.append((reads_item_i, (completed_retVal, None)))
+                    else:
+                        pending_items.append(reads_item_i)
+                if not pending_items:
+                    return shard_results
+                pending_refs = [readsSet_ref_list[reads_item_i] for reads_item_i in pending_items]
+                for library_ref in pending_refs:
+                    self.record_library_state(ctx, library_ref, 'started')
+                batch_params = shard_batch_params([library_params(reads_item_i) for reads_item_i in pending_items],
+                                                  input_params['output_ws'], fail_soft, library_retries)
+                try:
+                    batch_retVal = child_client.run_job(CHILD_JOB_METHOD, [batch_params], service_ver=self.GIT_COMMIT_HASH)
+                    library_results = unpack_batch_output(batch_retVal, pending_refs)
+                except Exception as e:
+                    if not fail_soft:
+                        raise
+                    # the child job itself failed, so every library in it did
+                    self.log(console, traceback.format_exc())
+                    library_results = [(None, {'input_reads_ref': readsSet_ref_list[reads_item_i],
+                                               'name': readsSet_names_list[reads_item_i],
+                                               'error': 'Child job failed: '+str(e),
+                                               'attempts': 1})
+                                       for reads_item_i in pending_items]
+                for reads_item_i, (library_retVal, failure) in zip(pending_items, library_results):
+                    shard_results.append((reads_item_i, finish_library(reads_item_i, library_retVal, failure, ctx)))
+                return shard_results
+
+            shard_pool = ThreadPool(len(shards))
+            try:
+                library_results = dict([result for shard_results in shard_pool.map(run_shard, shards)
+                                        for result in shard_results])
+            finally:
+                shard_pool.close()
+        elif num_threads > 1 and len(readsSet_ref_list) > 1:
+            scheduler = self.make_library_scheduler(console, [file_bytes for file_bytes, gzipped in library_files],
+                                                    num_threads)
+
+            def run_scheduled(reads_item_i):
+                # the core allocation goes in with the result, so a resumed run reports it too
+                record_allocation = lambda retVal: self.record_core_allocation(scheduler, reads_item_i, retVal,
+                                                                               readsSet_ref_list[reads_item_i])
+                result = trim_library(reads_item_i, library_ctx=self.library_context(ctx),
+                                      threads=scheduler.cores(reads_item_i), finish_result=record_allocation)
+                if result[0] is not None:
+                    scheduler.observe(reads_item_i, self.library_fastq_bytes(result[0], readsSet_ref_list[reads_item_i]))
+                return result
+
+            library_results = dict(enumerate(scheduler.run(run_scheduled)))
+            self.log(console, 'Scheduler peak: '+pformat(scheduler.peak))
+            self.log(console, 'Core allocation: '+pformat(scheduler.allocator.decisions))
+        else:
+            library_results = dict([(reads_item_i, trim_library(reads_item_i))
+                                    for reads_item_i in range(len(readsSet_ref_list))])
+
+        report = ''
+        trimmed_readsSet_ref       = None
+        unpaired_fwd_readsSet_ref  = None
+        unpaired_rev_readsSet_ref  = None
+        trimmed_readsSet_refs      = []
+        unpaired_fwd_readsSet_refs = []
+        unpaired_rev_readsSet_refs = []
+        library_stats              = dict()
+        failed_libraries           = []
 
+        for reads_item_i,input_reads_library_ref in enumerate(readsSet_ref_list):
             report += "RUNNING TRIMMOMATIC ON LIBRARY: "+str(input_reads_library_ref)+" "+str(readsSet_names_list[reads_item_i])+"\n"
             report += "-----------------------------------------------------------------------------------\n\n"
 
-            trimmomaticSingleLibrary_retVal = self.execTrimmomaticSingleLibrary (ctx, execTrimmomaticParams)[0]
+            trimmomaticSingleLibrary_retVal, failure = library_results[reads_item_i]
+            if failure is not None:
+                failed_libraries.append(failure)
+                report += "FAILED AFTER "+str(failure['attempts'])+" ATTEMPTS: "+failure['error']+"\n\n"
+                # keep the ref lists aligned with the set items
+                trimmed_readsSet_refs.append (None)
+                unpaired_fwd_readsSet_refs.append (None)
+                unpaired_rev_readsSet_refs.append (None)
+                continue
 
             report += trimmomaticSingleLibrary_retVal['report']+"\n\n"
             trimmed_readsSet_refs.append (trimmomaticSingleLibrary_retVal['output_filtered_ref'])
             unpaired_fwd_readsSet_refs.append (trimmomaticSingleLibrary_retVal['output_unpaired_fwd_ref'])
             unpaired_rev_readsSet_refs.append (trimmomaticSingleLibrary_retVal['output_unpaired_rev_ref'])
+            library_stats.update (trimmomaticSingleLibrary_retVal.get('library_stats', {}))
 
+        if len(failed_libraries) == len(readsSet_ref_list):
+            raise ValueError ("All "+str(len(failed_libraries))+" libraries failed:\n"+
+                              "\n".join([str(f['input_reads_ref'])+": "+f['error'] for f in failed_libraries]))
+        if failed_libraries:
+            self.log(console, str(len(failed_libraries))+" of "+str(len(readsSet_ref_list))+" libraries failed: "+
+                     ", ".join([str(f['input_reads_ref']) for f in failed_libraries]))
+
+        # hand the per-library results to a caller that builds its report from them (runTrimmomatic),
+        # so the report is built while the output sets are saved
+        libraries_done = ctx.pop('libraries_done', None)
+        if libraries_done is not None:
+            libraries_done({'report': report, 'library_stats': library_stats, 'failed_libraries': failed_libraries})
 
         # Just one Library
         if input_reads_obj_type not in ["KBaseSets.ReadsSet", "KBaseRNASeq.RNASeqSampleSet"]:
@@ -591,138 +1436,69 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
                        'output_filtered_ref': trimmed_readsSet_refs[0],
                        'output_unpaired_fwd_ref': unpaired_fwd_readsSet_refs[0],
                        'output_unpaired_rev_ref': unpaired_rev_readsSet_refs[0],
+                       'library_stats': library_stats,
+                       'failed_libraries': failed_libraries
                      }
         # ReadsSet
         else:
 
-            # save trimmed readsSet
-            some_trimmed_output_created = False
-            items = []
-            for i,lib_ref in enumerate(trimmed_readsSet_refs):   # FIX: assumes order maintained
-                if lib_ref == None:
-                    #items.append(None)  # can't have 'None' items in ReadsSet
-                    continue
-                else:
-                    some_trimmed_output_created = True
-                    try:
-                        label = input_readsSet_obj['data']['items'][i]['label']
-                    except:
-                        NAME_I = 1
-                        label = wsClient.get_object_info_new ({'objects':[{'ref':lib_ref}]})[0][NAME_I]
-                    label = label + "_Trimm_paired"
-
-                    items.append({'ref': lib_ref,
-                                  'label': label
-                                  #'data_attachment': ,
-                                  #'info':
-                                      })
-            if some_trimmed_output_created:
-                if input_params['read_type'] == 'SE':
-                    reads_desc_ext = " Trimmomatic trimmed SingleEndLibrary"
-                    reads_name_ext = "_trimm"
-                else:
-                    reads_desc_ext = " Trimmomatic trimmed paired reads"
-                    reads_name_ext = "_trimm_paired"
-                output_readsSet_obj = { 'description': input_readsSet_obj['data']['description']+reads_desc_ext,
-                                        'items': items
-                                        }
-                output_readsSet_name = str(input_params['output_reads_name'])+reads_name_ext
-                trimmed_readsSet_ref = setAPI_Client.save_reads_set_v1 ({'workspace_name': input_params['output_ws'],
-                                                                         'output_object_name': output_readsSet_name,
-                                                                         'data': output_readsSet_obj
-                                                                         })['set_ref']
+            # the labels of every output set's items, looked up in one call where the input set has none
+            if self.get_bool_param(input_params, 'merge_unpaired'):
+                unpaired_fwd_ext = "_unpaired"
+                unpaired_fwd_desc_ext = " Trimmomatic unpaired reads"
             else:
+                unpaired_fwd_ext = "_unpaired_fwd"
+                unpaired_fwd_desc_ext = " Trimmomatic unpaired fwd reads"
+            if input_params['read_type'] == 'SE':
+                reads_desc_ext = " Trimmomatic trimmed SingleEndLibrary"
+                reads_name_ext = "_trimm"
+            else:
+                reads_desc_ext = " Trimmomatic trimmed paired reads"
+                reads_name_ext = "_trimm_paired"
+            output_sets = [('trimmed', trimmed_readsSet_refs, reads_name_ext, "_Trimm_paired", reads_desc_ext),
+                           ('unpaired_fwd', unpaired_fwd_readsSet_refs, '_trimm'+unpaired_fwd_ext, "_Trimm"+unpaired_fwd_ext,
+                            unpaired_fwd_desc_ext),
+                           ('unpaired_rev', unpaired_rev_readsSet_refs, '_trimm_unpaired_rev', "_Trimm_unpaired_rev",
+                            " Trimmomatic unpaired rev reads")]
+            output_labels = self.reads_set_labels(wsClient, input_readsSet_obj['data']['items'],
+                                                  [lib_refs for (kind, lib_refs, name_ext, label_ext, desc_ext) in output_sets])
+
+            # save the trimmed and unpaired readsSets at once, none needs another's ref
+            save_pool = ThreadPool(len(output_sets))
+            save_jobs = []
+            for (kind, lib_refs, name_ext, label_ext, desc_ext), labels in zip(output_sets, output_labels):
+                save_jobs.append(save_pool.apply_async(self.save_output_reads_set,
+                                                       (ctx, input_params['output_ws'],
+                                                        str(input_params['output_reads_name'])+name_ext,
+                                                        input_readsSet_obj['data']['description']+desc_ext,
+                                                        lib_refs, [label + label_ext if label is not None else None
+                                                                   for label in labels])))
+            save_pool.close()
+            save_pool.join()
+            (trimmed_readsSet_ref, unpaired_fwd_readsSet_ref, unpaired_rev_readsSet_ref) = [job.get() for job in save_jobs]
+            if trimmed_readsSet_ref is None:
                 self.log(console, "No trimmed output created")
                 # raise ValueError ("No trimmed output created")
-
-
-            # save unpaired forward readsSet
-            some_unpaired_fwd_output_created = False
-            if len(unpaired_fwd_readsSet_refs) > 0:
-                items = []
-                for i,lib_ref in enumerate(unpaired_fwd_readsSet_refs):  # FIX: assumes order maintained
-                    if lib_ref == None:
-                        #items.append(None)  # can't have 'None' items in ReadsSet
-                        continue
-                    else:
-                        some_unpaired_fwd_output_created = True
-                        try:
-                            if len(unpaired_fwd_readsSet_refs) == len(input_readsSet_obj['data']['items']):
-                                label = input_readsSet_obj['data']['items'][i]['label']
-                            else:
-                                NAME_I = 1
-                                label = wsClient.get_object_info_new ({'objects':[{'ref':lib_ref}]})[0][NAME_I]
-                        except:
-                            NAME_I = 1
-                            label = wsClient.get_object_info_new ({'objects':[{'ref':lib_ref}]})[0][NAME_I]
-                        label = label + "_Trimm_unpaired_fwd"
-
-                        items.append({'ref': lib_ref,
-                                      'label': label
-                                      #'data_attachment': ,
-                                      #'info':
-                                          })
-                if some_unpaired_fwd_output_created:
-                    output_readsSet_obj = { 'description': input_readsSet_obj['data']['description']+" Trimmomatic unpaired fwd reads",
-                                            'items': items
-                                            }
-                    output_readsSet_name = str(input_params['output_reads_name'])+'_trimm_unpaired_fwd'
-                    unpaired_fwd_readsSet_ref = setAPI_Client.save_reads_set_v1 ({'workspace_name': input_params['output_ws'],
-                                                                                  'output_object_name': output_readsSet_name,
-                                                                                  'data': output_readsSet_obj
-                                                                                  })['set_ref']
-                else:
-                    self.log (console, "no unpaired_fwd readsLibraries created")
-                    unpaired_fwd_readsSet_ref = None
-
-            # save unpaired reverse readsSet
-            some_unpaired_rev_output_created = False
-            if len(unpaired_rev_readsSet_refs) > 0:
-                items = []
-                for i,lib_ref in enumerate(unpaired_fwd_readsSet_refs):  # FIX: assumes order maintained
-                    if lib_ref == None:
-                        #item`s.append(None)  # can't have 'None' items in ReadsSet
-                        continue
-                    else:
-                        some_unpaired_rev_output_created = True
-                        try:
-                            if len(unpaired_rev_readsSet_refs) == len(input_readsSet_obj['data']['items']):
-                                label = input_readsSet_obj['data']['items'][i]['label']
-                            else:
-                                NAME_I = 1
-                                label = wsClient.get_object_info_new ({'objects':[{'ref':lib_ref}]})[0][NAME_I]
-
-                        except:
-                            NAME_I = 1
-                            label = wsClient.get_object_info_new ({'objects':[{'ref':lib_ref}]})[0][NAME_I]
-                        label = label + "_Trimm_unpaired_rev"
-
-                        items.append({'ref': lib_ref,
-                                      'label': label
-                                      #'data_attachment': ,
-                                      #'info':
-                                          })
-                if some_unpaired_rev_output_created:
-                    output_readsSet_obj = { 'description': input_readsSet_obj['data']['description']+" Trimmomatic unpaired rev reads",
-                                            'items': items
-                                            }
-                    output_readsSet_name = str(input_params['output_reads_name'])+'_trimm_unpaired_rev'
-                    unpaired_rev_readsSet_ref = setAPI_Client.save_reads_set_v1 ({'workspace_name': input_params['output_ws'],
-                                                                                  'output_object_name': output_readsSet_name,
-                                                                                  'data': output_readsSet_obj
-                                                                                  })['set_ref']
-                else:
-                    self.log (console, "no unpaired_rev readsLibraries created")
-                    unpaired_rev_readsSet_ref = None
+            if unpaired_fwd_readsSet_ref is None:
+                self.log (console, "no unpaired_fwd readsLibraries created")
+            if unpaired_rev_readsSet_ref is None:
+                self.log (console, "no unpaired_rev readsLibraries created")
 
 
             # create return output object
             output = { 'report': report,
                        'output_filtered_ref': trimmed_readsSet_ref,
                        'output_unpaired_fwd_ref': unpaired_fwd_readsSet_ref,
-                       'output_unpaired_rev_ref': unpaired_rev_readsSet_ref
+                       'output_unpaired_rev_ref': unpaired_rev_readsSet_ref,
+                       'library_stats': library_stats,
+                       'failed_libraries': failed_libraries
                      }
 
+        if run_manifest is not None:
+            run_manifest.finish(dict([(key, output[key]) for key in ['output_filtered_ref',
+                                                                      'output_unpaired_fwd_ref',
+                                                                      'output_unpaired_rev_ref']]))
+        ctx.pop('run_manifest', None)
         #END execTrimmomatic
 
         # At some point might do deeper type checking...
@@ -747,12 +1523,25 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
            "sliding_window_min_quality" of Long, parameter
            "leading_min_quality" of Long, parameter "trailing_min_quality" of
            Long, parameter "crop_length" of Long, parameter
-           "head_crop_length" of Long, parameter "min_length" of Long
+           "head_crop_length" of Long, parameter "min_length" of Long,
+           parameter "run_qc" of Long, parameter "preview" of Long,
+           parameter "preview_reads" of Long, parameter "preview_mode" of
+           String, parameter "engine" of String, parameter "fail_soft" of
+           Long, parameter "library_retries" of Long, parameter
+           "max_child_jobs" of Long, parameter "num_threads" of Long,
+           parameter "threads" of Long, parameter "no_trim_output" of
+           String, parameter "merge_unpaired" of Long, parameter
+           "min_unpaired_reads" of Long, parameter "interleaved" of Long
         :returns: instance of type "execTrimmomaticOutput" -> structure:
            parameter "output_filtered_ref" of type "data_obj_ref", parameter
            "output_unpaired_fwd_ref" of type "data_obj_ref", parameter
            "output_unpaired_rev_ref" of type "data_obj_ref", parameter
-           "report" of String
+           "report" of String, parameter "library_stats" of mapping from
+           type "data_obj_ref" to unspecified object, parameter
+           "failed_libraries" of list of type "LibraryFailure" (a library a
+           fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long
         """
         # ctx is the context object
         # return variables are: output
@@ -767,7 +1556,7 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
         retVal['output_unpaired_rev_ref'] = None
 
         token = ctx['token']
-        wsClient = workspaceService(self.workspaceURL, token=token)
+        wsClient = self.get_client(ctx, 'workspace')
         headers = {'Authorization': 'OAuth '+token}
         env = os.environ.copy()
         env['KB_AUTH_TOKEN'] = token
@@ -783,31 +1572,7 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
                 raise ValueError ("Must define required param: '"+required_param+"'")
 
         # and param defaults
-        defaults = {
-            'quality_encoding':           'phred33',
-            'seed_mismatches':            '0', # '2',
-            'palindrome_clip_threshold':  '0', # '3',
-            'simple_clip_threshold':      '0', # '10',
-            'crop_length':                '0',
-            'head_crop_length':           '0',
-            'leading_min_quality':        '0', # '3',
-            'trailing_min_quality':       '0', # '3',
-            'sliding_window_size':        '0', # '4',
-            'sliding_window_min_quality': '0', # '15',
-            'min_length':                 '0', # '36'
-        }
-        for arg in defaults.keys():
-            if arg not in input_params or input_params[arg] is None or input_params[arg] == '':
-                input_params[arg] = defaults[arg]
-
-        # conditional arg behavior
-        arg = 'adapterFa'
-        if arg not in input_params or input_params[arg] is None or input_params[arg] == '':
-            input_params['adapterFa'] = None
-            input_params['seed_mismatches'] = None
-            input_params['palindrome_clip_threshold'] = None
-            input_params['simple_clip_threshold'] = None
-
+        self.set_trimming_param_defaults(input_params)
 
         #load provenance
         provenance = [{}]
@@ -853,259 +1618,838 @@ execTrimmomaticSingleLibrary() runs Trimmomatic on a single library
         # Let's rock!
         #
         trimmomatic_params  = self.parse_trimmomatic_steps(input_params)
-        trimmomatic_options = str(input_params['read_type']) + ' -' + str(input_params['quality_encoding'])
 
         self.log(console, pformat(trimmomatic_params))
-        self.log(console, pformat(trimmomatic_options))
-
 
-        # Instatiate ReadsUtils
+        engine = input_params.get('engine') or REFERENCE_ENGINE
+        if engine not in self.TRIMMING_ENGINES:
+            raise ValueError('engine must be one of '+", ".join(self.TRIMMING_ENGINES))
+        if engine != AUTO_ENGINE and engine not in self.verified_engines:
+            # an engine is only selectable once its output has been checked against the jar's in this image
+            raise ValueError('The '+engine+' engine has not been verified against the Trimmomatic jar here; '+
+                             'verified engines: '+", ".join(self.verified_engines)+' (see verified-engines)')
+        engine_threads = int(input_params['threads']) if input_params.get('threads') else None
+        if engine_threads is not None and engine_threads < 1:
+            raise ValueError('threads must be 1 or more, got: '+str(engine_threads))
+        no_trim_output = input_params.get('no_trim_output') or 'upload'
+        if no_trim_output not in self.NO_TRIM_OUTPUTS:
+            raise ValueError('no_trim_output must be one of '+", ".join(self.NO_TRIM_OUTPUTS))
+        merge_unpaired = self.get_bool_param(input_params, 'merge_unpaired')
+        min_unpaired_reads = int(input_params.get('min_unpaired_reads') or 0)
+        if min_unpaired_reads < 0:
+            raise ValueError('min_unpaired_reads must be 0 or more, got: '+str(min_unpaired_reads))
+        # paired end reads as ReadsUtils stores them, one interleaved file, instead of splitting the mates to
+        # trim and interleaving them again to upload. preview subsamples the mates, so it keeps them split
+        interleaved = input_params['read_type'] == 'PE' and self.get_bool_param(input_params, 'interleaved')
+        if interleaved and self.get_bool_param(input_params, 'preview'):
+            self.log(console, 'Ignoring interleaved with preview, which samples the forward and reverse reads files')
+            interleaved = False
+        if engine != AUTO_ENGINE and input_params['adapterFa'] != 'auto' and input_params['quality_encoding'] != 'auto':
+            # fail before downloading if the engine can't run the steps
+            unsupported = self.engines[engine].unsupported(input_params['quality_encoding'], trimmomatic_params)
+            if unsupported is not None:
+                raise ValueError('The '+engine+' engine cannot run these steps: '+unsupported)
+        # the engine is picked on the size the object info gives, not on what the download turns out to be
+        engine_input_bytes = self.get_library_fastq_bytes(wsClient, input_params['input_reads_ref'])
+
+        # optional QC of inputs and outputs, computed while the files are hot in the page cache
+        run_qc = self.get_bool_param(input_params, 'run_qc')
+        qc_stats = dict()
+        qc_jobs = dict()
+        qc_pool = None
+        if run_qc:
+            qc_pool = ThreadPool(2)
+
+
+        # Work in a scratch directory of this run's own, removed with whatever is left in it when the run ends
         #
+        scratch_job = self.scratch_manager.job('library')
         try:
-            readsUtils_Client = ReadsUtils (url=self.callbackURL, token=ctx['token'])  # SDK local
+            # Instatiate ReadsUtils, and get the reads from the input cache or download them
+            #
+            readsUtils_Client = self.get_client(ctx, 'reads_utils')
+            (readsLibrary_entry, input_cache_key) = self.download_reads_library(console, ctx, input_params['input_reads_ref'],
+                                                                                input_reads_obj_info, scratch_job,
+                                                                                interleaved=interleaved)
+            readsLibrary = {'files': {input_params['input_reads_ref']: readsLibrary_entry}}
+            self.log(console, 'Scratch job directory: '+scratch_job.path+' ('+str(scratch_job.checkpoint('downloaded'))+' bytes)')
+            self.record_library_state(ctx, input_params['input_reads_ref'], 'downloaded')
 
-            readsLibrary = readsUtils_Client.download_reads ({'read_libraries': [input_params['input_reads_ref']],
-                                                             'interleaved': 'false'
-                                                             })
-        except Exception as e:
-            raise ValueError('Unable to get read library object from workspace: (' + str(input_params['input_reads_ref']) +")\n" + str(e))
 
+            # Detect quality encoding from a small sample of the downloaded reads
+            #
+            quality_encoding_stats = None
+            if input_params['quality_encoding'] == 'auto':
+                detections = []
+                for direction in ['fwd', 'rev']:
+                    reads_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files'].get(direction)
+                    if reads_file_path is not None:
+                        detection = detect_quality_encoding(reads_file_path)
+                        detection['file'] = direction
+                        detections.append(detection)
+                        self.log(console, 'Quality encoding detection for '+direction+' reads: '+pformat(detection))
+                input_params['quality_encoding'] = resolve_quality_encoding(detections)
+                quality_encoding_stats = {'detected': input_params['quality_encoding'],
+                                          'samples': detections}
+                self.log(console, 'Using auto-detected quality encoding: '+input_params['quality_encoding'])
+
+            trimmomatic_options = str(input_params['read_type']) + ' -' + str(input_params['quality_encoding'])
+            self.log(console, pformat(trimmomatic_options))
+
+            # Detect adapters from overrepresented k-mers at the 3' end of a sample of the reads
+            #
+            adapter_detection = None
+            custom_adapter_file_path = None
+            if input_params['adapterFa'] == 'auto':
+                reads_file_paths = []
+                for direction in ['fwd', 'rev']:
+                    reads_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files'].get(direction)
+                    if reads_file_path is not None:
+                        reads_file_paths.append(reads_file_path)
+                adapter_detection = detect_adapters(reads_file_paths, self.ADAPTER_DIR,
+                                                    read_type=input_params['read_type'],
+                                                    custom_adapter_path=scratch_job.local_file('adapters_auto.fa', self.ADAPTER_FILE_BYTES),
+                                                    interleaved=interleaved)
+                self.log(console, 'Adapter detection: '+pformat(adapter_detection))
+                if adapter_detection['adapterFa'] is None:
+                    self.log(console, 'No adapter contamination detected, skipping ILLUMINACLIP')
+                    input_params['adapterFa'] = None
+                    input_params['seed_mismatches'] = None
+                    input_params['palindrome_clip_threshold'] = None
+                    input_params['simple_clip_threshold'] = None
+                else:
+                    input_params['adapterFa'] = adapter_detection['adapterFa']
+                    if adapter_detection['method'] == 'custom':
+                        custom_adapter_file_path = adapter_detection['adapterFa']
+                trimmomatic_params = self.parse_trimmomatic_steps(input_params)
+                self.log(console, pformat(trimmomatic_params))
 
-        if input_params['read_type'] == 'PE':
 
-            # Download reads Libs to FASTQ files
-            input_fwd_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd']
-            input_rev_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files']['rev']
-            sequencing_tech     = readsLibrary['files'][input_params['input_reads_ref']]['sequencing_tech']
+            # Index record offsets once for everything that needs counts or record boundaries,
+            # and catch mates that are out of sync before trimming
+            #
+            if interleaved:
+                input_read_count = check_interleaved_count(readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd'])
+            elif input_params['read_type'] == 'PE':
+                input_read_count = check_paired_counts(readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd'],
+                                                       readsLibrary['files'][input_params['input_reads_ref']]['files']['rev'])
+            else:
+                input_read_count = get_fastq_index(readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd']).total_records
+            self.log(console, 'Input records: '+str(input_read_count))
+            self.cache_reads_library(console, input_cache_key, readsLibrary_entry)
 
+            # Pick the trimming engine now that the encoding and adapters, and so the steps, are known
+            #
+            engine_stats = {'requested': engine, 'threads': engine_threads, 'estimated_input_bytes': engine_input_bytes}
+            (engine, engine_stats['estimated_seconds']) = self.select_trimming_engine(console, engine, engine_input_bytes,
+                                                                                      input_params['quality_encoding'],
+                                                                                      trimmomatic_params, engine_threads)
+            engine_stats['engine'] = engine
+            if input_params['read_type'] == 'PE':
+                # the paired output is uploaded interleaved when the engine can write it so
+                engine_stats['layout'] = {'input': 'interleaved' if interleaved else 'split',
+                                          'output': 'interleaved' if interleaved and self.engines[engine].interleaved_output
+                                                    else 'split'}
+            provenance[0]['description'] = 'Trimmed with the '+engine+' trimming engine'
+
+
+            # Preview: trim a subsample and predict the full run, without uploading anything
+            #
+            preview_stats = None
+            unpaired_stats = None
+            if self.get_bool_param(input_params, 'preview'):
+                input_file_paths = [readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd']]
+                if input_params['read_type'] == 'PE':
+                    input_file_paths.append(readsLibrary['files'][input_params['input_reads_ref']]['files']['rev'])
+                self.log(console, 'Starting Trimmomatic preview')
+                (report, preview_stats) = self.run_trimmomatic_preview(console, input_params, input_file_paths, engine,
+                                                                       trimmomatic_params, scratch_job, engine_threads)
+                self.log(console, 'Preview: '+pformat(preview_stats))
+                if qc_pool is not None:
+                    qc_pool.close()
 
-            # DEBUG
-#            self.log (console, "FWD_INPUT\n")
-#            fwd_reads_handle = open (input_fwd_file_path, 'r')
-#            for line_i in range(20):
-#                self.log (console, fwd_reads_handle.readline())
-#            fwd_reads_handle.close ()
-#            self.log (console, "REV_INPUT\n")
-#            rev_reads_handle = open (input_rev_file_path, 'r')
-#            for line_i in range(20):
-#                self.log (console, rev_reads_handle.readline())
-#            rev_reads_handle.close ()
+                # free up disk
+                scratch_job.remove(*input_file_paths)
 
+            elif input_params['read_type'] == 'PE':
 
-            # Run Trimmomatic
-            #
-            self.log(console, 'Starting Trimmomatic')
-            input_fwd_file_path = re.sub ("\.fq$", "", input_fwd_file_path)
-            input_fwd_file_path = re.sub ("\.FQ$", "", input_fwd_file_path)
-            input_rev_file_path = re.sub ("\.fq$", "", input_rev_file_path)
-            input_rev_file_path = re.sub ("\.FQ$", "", input_rev_file_path)
-            input_fwd_file_path = re.sub ("\.fastq$", "", input_fwd_file_path)
-            input_fwd_file_path = re.sub ("\.FASTQ$", "", input_fwd_file_path)
-            input_rev_file_path = re.sub ("\.fastq$", "", input_rev_file_path)
-            input_rev_file_path = re.sub ("\.FASTQ$", "", input_rev_file_path)
-            output_fwd_paired_file_path   = input_fwd_file_path+"_trimm_fwd_paired.fastq"
-            output_fwd_unpaired_file_path = input_fwd_file_path+"_trimm_fwd_unpaired.fastq"
-            output_rev_paired_file_path   = input_rev_file_path+"_trimm_rev_paired.fastq"
-            output_rev_unpaired_file_path = input_rev_file_path+"_trimm_rev_unpaired.fastq"
-            input_fwd_file_path           = input_fwd_file_path+".fastq"
-            input_rev_file_path           = input_rev_file_path+".fastq"
-
-            cmdstring = " ".join( (self.TRIMMOMATIC, trimmomatic_options,
-                            input_fwd_file_path,
-                            input_rev_file_path,
-                            output_fwd_paired_file_path,
-                            output_fwd_unpaired_file_path,
-                            output_rev_paired_file_path,
-                            output_rev_unpaired_file_path,
-                            trimmomatic_params) )
-
-            cmdProcess = subprocess.Popen(cmdstring, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-
-            outputlines = []
-            while True:
-                line = cmdProcess.stdout.readline()
-                outputlines.append(line)
-                if not line: break
-                self.log(console, line.replace('\n', ''))
-
-            cmdProcess.stdout.close()
-            cmdProcess.wait()
-            self.log(console, 'return code: ' + str(cmdProcess.returncode) + '\n')
-            if cmdProcess.returncode != 0:
-                raise ValueError('Error running kb_trimmomatic, return code: ' +
-                                 str(cmdProcess.returncode) + '\n')
-
-
-            report += "\n".join(outputlines)
-            #report += "cmdstring: " + cmdstring + " stdout: " + stdout + " stderr " + stderr
-
-            # free up disk
-            os.remove(input_fwd_file_path)
-            os.remove(input_rev_file_path)
-
-            #get read counts
-            match = re.search(r'Input Read Pairs: (\d+).*?Both Surviving: (\d+).*?Forward Only Surviving: (\d+).*?Reverse Only Surviving: (\d+).*?Dropped: (\d+)', report)
-            input_read_count = match.group(1)
-            read_count_paired = match.group(2)
-            read_count_forward_only = match.group(3)
-            read_count_reverse_only = match.group(4)
-            read_count_dropped = match.group(5)
-
-            report = "\n".join( ('Input Read Pairs: '+ input_read_count,
-                'Both Surviving: '+ read_count_paired,
-                'Forward Only Surviving: '+ read_count_forward_only,
-                'Reverse Only Surviving: '+ read_count_reverse_only,
-                'Dropped: '+ read_count_dropped) )
-
-            # upload paired reads
-            if not os.path.isfile (output_fwd_paired_file_path) \
-                or os.path.getsize (output_fwd_paired_file_path) == 0 \
-                or not os.path.isfile (output_rev_paired_file_path) \
-                or os.path.getsize (output_rev_paired_file_path) == 0:
-                retVal['output_filtered_ref'] = None
-                report += "\n\nNo reads were trimmed, so no trimmed reads object was generated."
-            else:
-                output_obj_name = input_params['output_reads_name']+'_paired'
-                self.log(console, 'Uploading trimmed paired reads: '+output_obj_name)
-                retVal['output_filtered_ref'] = readsUtils_Client.upload_reads ({ 'wsname': str(input_params['output_ws']),
-                                                                                  'name': output_obj_name,
-                                                                                  # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
-                                                                                  #'sequencing_tech': sequencing_tech,
-                                                                                  'source_reads_ref': input_params['input_reads_ref'],
-                                                                                  'fwd_file': output_fwd_paired_file_path,
-                                                                                  'rev_file': output_rev_paired_file_path
-                                                                                  })['obj_ref']
+                # Download reads Libs to FASTQ files (an interleaved download is all in 'fwd')
+                input_fwd_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd']
+                input_rev_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files'].get('rev')
+                sequencing_tech     = readsLibrary['files'][input_params['input_reads_ref']]['sequencing_tech']
+                if interleaved:
+                    input_rev_file_path = input_fwd_file_path
+
+
+                # DEBUG
+    #            self.log (console, "FWD_INPUT\n")
+    #            fwd_reads_handle = open (input_fwd_file_path, 'r')
+    #            for line_i in range(20):
+    #                self.log (console, fwd_reads_handle.readline())
+    #            fwd_reads_handle.close ()
+    #            self.log (console, "REV_INPUT\n")
+    #            rev_reads_handle = open (input_rev_file_path, 'r')
+    #            for line_i in range(20):
+    #                self.log (console, rev_reads_handle.readline())
+    #            rev_reads_handle.close ()
+
+
+                # Run Trimmomatic
+                #
+                self.log(console, 'Starting Trimmomatic')
+                input_fwd_file_path = re.sub ("\.fq$", "", input_fwd_file_path)
+                input_fwd_file_path = re.sub ("\.FQ$", "", input_fwd_file_path)
+                input_rev_file_path = re.sub ("\.fq$", "", input_rev_file_path)
+                input_rev_file_path = re.sub ("\.FQ$", "", input_rev_file_path)
+                input_fwd_file_path = re.sub ("\.fastq$", "", input_fwd_file_path)
+                input_fwd_file_path = re.sub ("\.FASTQ$", "", input_fwd_file_path)
+                input_rev_file_path = re.sub ("\.fastq$", "", input_rev_file_path)
+                input_rev_file_path = re.sub ("\.FASTQ$", "", input_rev_file_path)
+                output_fwd_paired_file_path   = input_fwd_file_path+"_trimm_fwd_paired.fastq"
+                output_fwd_unpaired_file_path = input_fwd_file_path+"_trimm_fwd_unpaired.fastq"
+                output_rev_paired_file_path   = input_rev_file_path+"_trimm_rev_paired.fastq"
+                output_rev_unpaired_file_path = input_rev_file_path+"_trimm_rev_unpaired.fastq"
+                input_fwd_file_path           = input_fwd_file_path+".fastq"
+                input_rev_file_path           = input_rev_file_path+".fastq"
+                input_file_paths              = [input_fwd_file_path, input_rev_file_path]
+                output_paired_file_path       = None
+                output_paired_file_paths      = [output_fwd_paired_file_path, output_rev_paired_file_path]
+                output_file_paths             = [output_fwd_paired_file_path, output_fwd_unpaired_file_path,
+                                                 output_rev_paired_file_path, output_rev_unpaired_file_path]
+                if interleaved:
+                    # one input file, with both mates' outputs named after it
+                    input_file_paths = [input_fwd_file_path]
+                    if self.engines[engine].interleaved_output:
+                        output_paired_file_path = re.sub("\.fastq$", "", input_fwd_file_path)+"_trimm_paired.fastq"
+                        output_paired_file_paths = [output_paired_file_path]
+                        output_file_paths = [output_paired_file_path, output_fwd_unpaired_file_path, output_rev_unpaired_file_path]
+
+                qc_input_labels = ['input_interleaved'] if interleaved else ['input_fwd', 'input_rev']
+                if output_paired_file_path is not None:
+                    qc_output_labels = ['output_paired', 'output_fwd_unpaired', 'output_rev_unpaired']
+                else:
+                    qc_output_labels = ['output_fwd_paired', 'output_fwd_unpaired', 'output_rev_paired', 'output_rev_unpaired']
+                # for the jar, input QC runs alongside it, reading the same files
+                if run_qc and not self.engines[engine].qc_from_batches:
+                    for qc_label, qc_file_path in zip(qc_input_labels, input_file_paths):
+                        qc_jobs[qc_label] = qc_pool.apply_async(compute_fastq_qc, (qc_file_path, input_params['quality_encoding']))
+
+                (outputlines, engine_plan) = self.run_trimming_engine(console, engine, input_params['read_type'],
+                                                                      input_params['quality_encoding'],
+                                                                      input_file_paths, output_file_paths,
+                                                                      trimmomatic_params, engine_threads, run_qc)
+                engine_stats.update(engine_plan['stats'])
+                engine_stats['workers'] = engine_plan['workers']
+                scratch_job.checkpoint('trimmed')
+                self.record_library_state(ctx, input_params['input_reads_ref'], 'trimmed', {'engine': engine})
+
+
+                report += "\n".join(outputlines)
+                #report += "cmdstring: " + cmdstring + " stdout: " + stdout + " stderr " + stderr
+
+                # output QC before the outputs are uploaded and removed
+                if run_qc:
+                    qc_stats = self.collect_qc(qc_pool, qc_jobs, engine_plan, input_params['quality_encoding'],
+                                               qc_input_labels, qc_output_labels)
+
+                # a library trimming left as it was needn't be uploaded again
+                untrimmed = no_trim_output != 'upload' and \
+                    self.untrimmed_output('PE', report, engine_stats, input_file_paths, output_paired_file_paths)
 
                 # free up disk
-                os.remove(output_fwd_paired_file_path)
-                os.remove(output_rev_paired_file_path)
+                scratch_job.remove(*input_file_paths)
+
+                #get read counts
+                match = re.search(r'Input Read Pairs: (\d+).*?Both Surviving: (\d+).*?Forward Only Surviving: (\d+).*?Reverse Only Surviving: (\d+).*?Dropped: (\d+)', report)
+                input_read_count = match.group(1)
+                read_count_paired = match.group(2)
+                read_count_forward_only = match.group(3)
+                read_count_reverse_only = match.group(4)
+                read_count_dropped = match.group(5)
+
+                report = "\n".join( ('Input Read Pairs: '+ input_read_count,
+                    'Both Surviving: '+ read_count_paired,
+                    'Forward Only Surviving: '+ read_count_forward_only,
+                    'Reverse Only Surviving: '+ read_count_reverse_only,
+                    'Dropped: '+ read_count_dropped) )
+
+                # fewer, larger unpaired outputs to upload
+                if merge_unpaired or min_unpaired_reads:
+                    unpaired_stats = self.consolidate_unpaired_outputs(console, scratch_job, output_fwd_unpaired_file_path,
+                                                                       output_rev_unpaired_file_path,
+                                                                       int(read_count_forward_only), int(read_count_reverse_only),
+                                                                       merge_unpaired, min_unpaired_reads)
+
+                # upload paired reads
+                if untrimmed:
+                    retVal['output_filtered_ref'] = self.save_untrimmed_library(console, ctx, no_trim_output,
+                                                                                input_params['input_reads_ref'],
+                                                                                input_params['output_ws'],
+                                                                                input_params['output_reads_name']+'_paired')
+                    scratch_job.remove(*output_paired_file_paths)
+                elif [path for path in output_paired_file_paths
+                      if not os.path.isfile (path) or os.path.getsize (path) == 0]:
+                    retVal['output_filtered_ref'] = None
+                    report += "\n\nNo reads were trimmed, so no trimmed reads object was generated."
+                else:
+                    output_obj_name = input_params['output_reads_name']+'_paired'
+                    self.log(console, 'Uploading trimmed paired reads: '+output_obj_name)
+                    upload_params = { 'wsname': str(input_params['output_ws']),
+                                      'name': output_obj_name,
+                                      # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
+                                      #'sequencing_tech': sequencing_tech,
+                                      'source_reads_ref': input_params['input_reads_ref'],
+                                      'fwd_file': output_fwd_paired_file_path,
+                                      'rev_file': output_rev_paired_file_path
+                                    }
+                    if output_paired_file_path is not None:
+                        # already interleaved, so ReadsUtils stores it without another pass
+                        upload_params['fwd_file'] = output_paired_file_path
+                        upload_params['interleaved'] = 1
+                        del upload_params['rev_file']
+                    retVal['output_filtered_ref'] = readsUtils_Client.upload_reads (upload_params)['obj_ref']
+
+                    # free up disk
+                    scratch_job.remove(*output_paired_file_paths)
+
+
+                # upload reads forward unpaired
+                if not os.path.isfile (output_fwd_unpaired_file_path) \
+                    or os.path.getsize (output_fwd_unpaired_file_path) == 0:
+
+                    retVal['output_unpaired_fwd_ref'] = None
+                else:
+                    if merge_unpaired:
+                        output_obj_name = input_params['output_reads_name']+'_unpaired'
+                        self.log(console, '\nUploading trimmed unpaired reads: '+output_obj_name)
+                    else:
+                        output_obj_name = input_params['output_reads_name']+'_unpaired_fwd'
+                        self.log(console, '\nUploading trimmed unpaired forward reads: '+output_obj_name)
+                    retVal['output_unpaired_fwd_ref'] = readsUtils_Client.upload_reads ({ 'wsname': str(input_params['output_ws']),
+                                                                                          'name': output_obj_name,
+                                                                                          # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
+                                                                                          #'sequencing_tech': sequencing_tech,
+                                                                                          'source_reads_ref': input_params['input_reads_ref'],
+                                                                                          'fwd_file': output_fwd_unpaired_file_path
+                                                                                          })['obj_ref']
+
+                    # free up disk
+                    scratch_job.remove(output_fwd_unpaired_file_path)
+
+                # upload reads reverse unpaired
+                if not os.path.isfile (output_rev_unpaired_file_path) \
+                    or os.path.getsize (output_rev_unpaired_file_path) == 0:
+
+                    retVal['output_unpaired_rev_ref'] = None
+                else:
+                    output_obj_name = input_params['output_reads_name']+'_unpaired_rev'
+                    self.log(console, '\nUploading trimmed unpaired reverse reads: '+output_obj_name)
+                    retVal['output_unpaired_rev_ref'] = readsUtils_Client.upload_reads ({ 'wsname': str(input_params['output_ws']),
+                                                                                          'name': output_obj_name,
+                                                                                          # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
+                                                                                          #'sequencing_tech': sequencing_tech,
+                                                                                          'source_reads_ref': input_params['input_reads_ref'],
+                                                                                          'fwd_file': output_rev_unpaired_file_path
+                                                                                          })['obj_ref']
 
+                    # free up disk
+                    scratch_job.remove(output_rev_unpaired_file_path)
 
-            # upload reads forward unpaired
-            if not os.path.isfile (output_fwd_unpaired_file_path) \
-                or os.path.getsize (output_fwd_unpaired_file_path) == 0:
 
-                retVal['output_unpaired_fwd_ref'] = None
+            # SingleEndLibrary
+            #
             else:
-                output_obj_name = input_params['output_reads_name']+'_unpaired_fwd'
-                self.log(console, '\nUploading trimmed unpaired forward reads: '+output_obj_name)
-                retVal['output_unpaired_fwd_ref'] = readsUtils_Client.upload_reads ({ 'wsname': str(input_params['output_ws']),
-                                                                                      'name': output_obj_name,
-                                                                                      # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
-                                                                                      #'sequencing_tech': sequencing_tech,
-                                                                                      'source_reads_ref': input_params['input_reads_ref'],
-                                                                                      'fwd_file': output_fwd_unpaired_file_path
-                                                                                      })['obj_ref']
+                self.log(console, "Downloading Single End reads file...")
 
-                # free up disk
-                os.remove(output_fwd_unpaired_file_path)
+                # Download reads Libs to FASTQ files
+                input_fwd_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd']
+                sequencing_tech     = readsLibrary['files'][input_params['input_reads_ref']]['sequencing_tech']
 
-            # upload reads reverse unpaired
-            if not os.path.isfile (output_rev_unpaired_file_path) \
-                or os.path.getsize (output_rev_unpaired_file_path) == 0:
 
-                retVal['output_unpaired_rev_ref'] = None
-            else:
-                output_obj_name = input_params['output_reads_name']+'_unpaired_rev'
-                self.log(console, '\nUploading trimmed unpaired reverse reads: '+output_obj_name)
-                retVal['output_unpaired_rev_ref'] = readsUtils_Client.upload_reads ({ 'wsname': str(input_params['output_ws']),
-                                                                                      'name': output_obj_name,
-                                                                                      # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
-                                                                                      #'sequencing_tech': sequencing_tech,
-                                                                                      'source_reads_ref': input_params['input_reads_ref'],
-                                                                                      'fwd_file': output_rev_unpaired_file_path
-                                                                                      })['obj_ref']
+                # Run Trimmomatic
+                #
+                self.log(console, 'Starting Trimmomatic')
+                input_fwd_file_path = re.sub ("\.fq$", "", input_fwd_file_path)
+                input_fwd_file_path = re.sub ("\.FQ$", "", input_fwd_file_path)
+                input_fwd_file_path = re.sub ("\.fastq$", "", input_fwd_file_path)
+                input_fwd_file_path = re.sub ("\.FASTQ$", "", input_fwd_file_path)
+                output_fwd_file_path = input_fwd_file_path+"_trimm_fwd.fastq"
+                input_fwd_file_path  = input_fwd_file_path+".fastq"
 
-                # free up disk
-                os.remove(output_rev_unpaired_file_path)
+                # for the jar, input QC runs alongside it, reading the same file
+                if run_qc and not self.engines[engine].qc_from_batches:
+                    qc_jobs['input_fwd'] = qc_pool.apply_async(compute_fastq_qc, (input_fwd_file_path, input_params['quality_encoding']))
 
+                #report += "cmdstring: " + cmdstring
 
-        # SingleEndLibrary
-        #
-        else:
-            self.log(console, "Downloading Single End reads file...")
+                (outputlines, engine_plan) = self.run_trimming_engine(console, engine, input_params['read_type'],
+                                                                      input_params['quality_encoding'],
+                                                                      [input_fwd_file_path], [output_fwd_file_path],
+                                                                      trimmomatic_params, engine_threads, run_qc)
+                engine_stats.update(engine_plan['stats'])
+                engine_stats['workers'] = engine_plan['workers']
+                scratch_job.checkpoint('trimmed')
+                self.record_library_state(ctx, input_params['input_reads_ref'], 'trimmed', {'engine': engine})
 
-            # Download reads Libs to FASTQ files
-            input_fwd_file_path = readsLibrary['files'][input_params['input_reads_ref']]['files']['fwd']
-            sequencing_tech     = readsLibrary['files'][input_params['input_reads_ref']]['sequencing_tech']
 
+                report += "\n".join(outputlines)
 
-            # Run Trimmomatic
-            #
-            self.log(console, 'Starting Trimmomatic')
-            input_fwd_file_path = re.sub ("\.fq$", "", input_fwd_file_path)
-            input_fwd_file_path = re.sub ("\.FQ$", "", input_fwd_file_path)
-            input_fwd_file_path = re.sub ("\.fastq$", "", input_fwd_file_path)
-            input_fwd_file_path = re.sub ("\.FASTQ$", "", input_fwd_file_path)
-            output_fwd_file_path = input_fwd_file_path+"_trimm_fwd.fastq"
-            input_fwd_file_path  = input_fwd_file_path+".fastq"
+                # output QC before the output is uploaded and removed
+                if run_qc:
+                    qc_stats = self.collect_qc(qc_pool, qc_jobs, engine_plan, input_params['quality_encoding'],
+                                               ['input_fwd'], ['output_fwd'])
 
-            cmdstring = " ".join( (self.TRIMMOMATIC, trimmomatic_options,
-                            input_fwd_file_path,
-                            output_fwd_file_path,
-                            trimmomatic_params) )
+                # a library trimming left as it was needn't be uploaded again
+                untrimmed = no_trim_output != 'upload' and \
+                    self.untrimmed_output('SE', report, engine_stats, [input_fwd_file_path], [output_fwd_file_path])
 
-            cmdProcess = subprocess.Popen(cmdstring, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+                # free up disk
+                scratch_job.remove(input_fwd_file_path)
+
+                # get read count
+                match = re.search(r'Surviving: (\d+)', report)
+                readcount = match.group(1)
+
+                # upload reads
+                if untrimmed:
+                    retVal['output_filtered_ref'] = self.save_untrimmed_library(console, ctx, no_trim_output,
+                                                                                input_params['input_reads_ref'],
+                                                                                input_params['output_ws'],
+                                                                                input_params['output_reads_name'])
+                    scratch_job.remove(output_fwd_file_path)
+                elif not os.path.isfile (output_fwd_file_path) \
+                    or os.path.getsize (output_fwd_file_path) == 0:
+
+                    retVal['output_filtered_ref'] = None
+                else:
+                    output_obj_name = input_params['output_reads_name']
+                    self.log(console, 'Uploading trimmed reads: '+output_obj_name)
 
-            #report += "cmdstring: " + cmdstring
+                    retVal['output_filtered_ref'] = readsUtils_Client.upload_reads ({ 'wsname': str(input_params['output_ws']),
+                                                                                      'name': output_obj_name,
+                                                                                      # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
+                                                                                      #'sequencing_tech': sequencing_tech,
+                                                                                      'source_reads_ref': input_params['input_reads_ref'],
+                                                                                      'fwd_file': output_fwd_file_path
+                                                                                      })['obj_ref']
 
-            outputlines = []
-            while True:
-                line = cmdProcess.stdout.readline()
-                outputlines.append(line)
-                if not line: break
-                self.log(console, line.replace('\n', ''))
+                    # free up disk
+                    scratch_job.remove(output_fwd_file_path)
 
-            cmdProcess.stdout.close()
-            cmdProcess.wait()
-            self.log(console, 'return code: ' + str(cmdProcess.returncode) + '\n')
-            if cmdProcess.returncode != 0:
-                raise ValueError('Error running kb_trimmomatic, return code: ' +
-                                 str(cmdProcess.returncode) + '\n')
 
+            # per-library stats beyond the Trimmomatic summary
+            #
+            library_stats = dict()
+            if self.input_cache is not None:
+                library_stats['input_cache'] = 'miss' if input_cache_key is not None else 'hit'
+            if run_qc:
+                library_stats['qc'] = qc_stats
+            if quality_encoding_stats is not None:
+                library_stats['quality_encoding'] = quality_encoding_stats
+            if adapter_detection is not None:
+                library_stats['adapter_detection'] = adapter_detection
+            if preview_stats is not None:
+                library_stats['preview'] = preview_stats
+            else:
+                library_stats['engine'] = engine_stats
+                library_stats['untrimmed'] = no_trim_output if untrimmed else None
+            if unpaired_stats is not None:
+                library_stats['unpaired'] = unpaired_stats
+            scratch_job.remove(custom_adapter_file_path)
+            scratch_job.checkpoint('finished')
+            library_stats['scratch'] = scratch_job.stats()
+            self.log(console, 'Scratch use: '+pformat(library_stats['scratch']))
+
+            # return created objects
+            #
+            output = { 'report': report,
+                       'output_filtered_ref': retVal['output_filtered_ref'],
+                       'output_unpaired_fwd_ref': retVal['output_unpaired_fwd_ref'],
+                       'output_unpaired_rev_ref': retVal['output_unpaired_rev_ref'],
+                       'library_stats': { input_params['input_reads_ref']: library_stats }
+                     }
+        finally:
+            scratch_job.close()
+        #END execTrimmomaticSingleLibrary
 
-            report += "\n".join(outputlines)
+        # At some point might do deeper type checking...
+        if not isinstance(output, dict):
+            raise ValueError('Method execTrimmomaticSingleLibrary return value ' +
+                             'output is not type dict as required.')
+        # return the results
+        return [output]
+    def execTrimmomaticBatch(self, ctx, input_params):
+        """
+        :param input_params: instance of type "execTrimmomaticBatchInput"
+           (execTrimmomaticBatch() ** ** trim many libraries, each with its
+           own params, in one call sharing clients and a thread pool, with
+           one combined report) -> structure: parameter "inputs" of list of
+           type "BatchLibraryInput" -> structure: parameter "input_reads_ref"
+           of type "data_obj_ref", parameter "output_reads_name" of type
+           "data_obj_name", parameter "params" of mapping from String to
+           unspecified object, parameter "output_ws" of type
+           "workspace_name" (** Common types), parameter "num_threads" of
+           Long, parameter "fail_soft" of Long, parameter "library_retries"
+           of Long
+        :returns: instance of type "execTrimmomaticBatchOutput" ->
+           structure: parameter "results" of list of type
+           "execTrimmomaticOutput" -> structure: parameter
+           "output_filtered_ref" of type "data_obj_ref", parameter
+           "output_unpaired_fwd_ref" of type "data_obj_ref", parameter
+           "output_unpaired_rev_ref" of type "data_obj_ref", parameter
+           "report" of String, parameter "library_stats" of mapping from
+           type "data_obj_ref" to unspecified object, parameter
+           "failed_libraries" of list of type "LibraryFailure" (a library a
+           fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long,
+           parameter "failed_libraries" of list of type "LibraryFailure" (a
+           library a fail-soft run gave up on) -> structure: parameter
+           "input_reads_ref" of type "data_obj_ref", parameter "name" of
+           String, parameter "error" of String, parameter "attempts" of Long,
+           parameter "report" of String, parameter "report_name" of String,
+           parameter "report_ref" of String
+        """
+        # ctx is the context object
+        # return variables are: output
+        #BEGIN execTrimmomaticBatch
+        console = []
+        self.log(console, 'Running execTrimmomaticBatch with parameters: ')
+        self.log(console, "\n"+pformat(input_params))
 
-            # free up disk
-            os.remove(input_fwd_file_path)
+        # param checks
+        required_params = ['inputs',
+                           'output_ws'
+                          ]
+        for required_param in required_params:
+            if required_param not in input_params or input_params[required_param] == None:
+                raise ValueError ("Must define required param: '"+required_param+"'")
+        if not isinstance(input_params['inputs'], list) or not input_params['inputs']:
+            raise ValueError ("inputs must be a non-empty list of libraries to trim")
+        for batch_input in input_params['inputs']:
+            for required_param in ['input_reads_ref', 'output_reads_name']:
+                if not isinstance(batch_input, dict) or not batch_input.get(required_param):
+                    raise ValueError ("Each input must define '"+required_param+"': "+pformat(batch_input))
+            if not (batch_input.get('params') or {}).get('read_type'):
+                raise ValueError ("Each input must define params.read_type: "+pformat(batch_input))
+
+        fail_soft = self.get_bool_param(input_params, 'fail_soft')
+        if input_params.get('library_retries') is not None:
+            library_retries = int(input_params['library_retries'])
+        else:
+            library_retries = self.FAIL_SOFT_LIBRARY_RETRIES if fail_soft else 0
+        if library_retries < 0:
+            raise ValueError("library_retries must be 0 or more, got: "+str(library_retries))
 
-            # get read count
-            match = re.search(r'Surviving: (\d+)', report)
-            readcount = match.group(1)
+        # One context for the whole batch: the auth token, the provenance and the clients are set up once,
+        # and each library gets a shallow copy with its own provenance
+        #
+        batch_ctx = dict(ctx)
+        batch_ctx['clients'] = dict()
+        batch_ctx.pop('run_manifest', None)
+        wsClient = self.get_client(batch_ctx, 'workspace')
+        self.get_client(batch_ctx, 'reads_utils')
 
-            # upload reads
-            if not os.path.isfile (output_fwd_file_path) \
-                or os.path.getsize (output_fwd_file_path) == 0:
+        input_refs = [str(batch_input['input_reads_ref']) for batch_input in input_params['inputs']]
+        try:
+            NAME_I = 1
+            input_names = [info[NAME_I] for info in
+                           wsClient.get_object_info_new ({'objects': [{'ref': ref} for ref in input_refs]})]
+        except Exception as e:
+            raise ValueError('Unable to get read library objects from workspace: ' + str(e))
+
+        def trim_input(input_i, threads=None):
+            batch_input = input_params['inputs'][input_i]
+            execTrimmomaticParams = dict(batch_input.get('params') or {})
+            execTrimmomaticParams.update({'input_reads_ref': input_refs[input_i],
+                                          'output_ws': input_params['output_ws'],
+                                          'output_reads_name': batch_input['output_reads_name']})
+            if threads:
+                execTrimmomaticParams['threads'] = threads
+            library_ctx = self.library_context(batch_ctx)
+            try:
+                return self.run_library_with_retries(console, library_ctx, execTrimmomaticParams, library_retries), None
+            except Exception as e:
+                if not fail_soft:
+                    raise
+                self.log(console, traceback.format_exc())
+                return None, {'input_reads_ref': input_refs[input_i],
+                              'name': input_names[input_i],
+                              'error': str(e),
+                              'attempts': library_retries+1}
+
+        num_threads = int(input_params.get('num_threads') or multiprocessing.cpu_count())
+        library_files = self.get_library_files(wsClient, input_refs)
+        num_threads = self.preflight_scratch(console, library_files, input_refs, input_names, num_threads)
+        scheduler = self.make_library_scheduler(console, [file_bytes for file_bytes, gzipped in library_files],
+                                                num_threads)
+
+        def run_scheduled(input_i):
+            result = trim_input(input_i, threads=scheduler.cores(input_i))
+            if result[0] is not None:
+                scheduler.observe(input_i, self.library_fastq_bytes(result[0], input_refs[input_i]))
+                self.record_core_allocation(scheduler, input_i, result[0], input_refs[input_i])
+            return result
+
+        library_results = scheduler.run(run_scheduled)
+        self.log(console, 'Scheduler peak: '+pformat(scheduler.peak))
+        self.log(console, 'Core allocation: '+pformat(scheduler.allocator.decisions))
+
+        # per-input results, in input order, and one combined report
+        #
+        results = []
+        failed_libraries = []
+        report = ''
+        library_stats = dict()
+        objects_created = []
+        for input_i, (library_retVal, failure) in enumerate(library_results):
+            report += "RUNNING TRIMMOMATIC ON LIBRARY: "+input_refs[input_i]+" "+str(input_names[input_i])+"\n"
+            report += "-----------------------------------------------------------------------------------\n\n"
+            if failure is not None:
+                failed_libraries.append(failure)
+                report += "FAILED AFTER "+str(failure['attempts'])+" ATTEMPTS: "+failure['error']+"\n\n"
+                results.append({'output_filtered_ref': None,
+                                'output_unpaired_fwd_ref': None,
+                                'output_unpaired_rev_ref': None,
+                                'report': '',
+                                'library_stats': {},
+                                'failed_libraries': [failure]})
+                continue
+            report += library_retVal['report']+"\n\n"
+            library_stats.update(library_retVal.get('library_stats', {}))
+            results.append(dict(library_retVal, failed_libraries=[]))
+            for key, description in [('output_filtered_ref', 'Trimmed Reads'),
+                                     ('output_unpaired_fwd_ref', 'Trimmed Unpaired Forward Reads'),
+                                     ('output_unpaired_rev_ref', 'Trimmed Unpaired Reverse Reads')]:
+                if library_retVal.get(key) is not None:
+                    objects_created.append({'ref': library_retVal[key],
+                                            'description': description+' of '+str(input_names[input_i])})
+        if len(failed_libraries) == len(input_refs):
+            raise ValueError ("All "+str(len(failed_libraries))+" libraries failed:\n"+
+                              "\n".join([str(f['input_reads_ref'])+": "+f['error'] for f in failed_libraries]))
+
+        reportObj = {'objects_created': objects_created,
+                     'message': '',
+                     'direct_html': self.trimmomatic_report_html({'report': report,
+                                                                  'library_stats': library_stats,
+                                                                  'failed_libraries': failed_libraries}),
+                     'direct_html_index': 0,
+                     'file_links': [],
+                     'html_links': [],
+                     'workspace_name': input_params['output_ws'],
+                     'report_object_name': 'kb_trimmomatic_report_'+str(uuid.uuid4())
+                     }
+        SERVICE_VER = 'release'
+        reportClient = KBaseReport(self.callbackURL, token=ctx['token'], service_ver=SERVICE_VER)
+        report_info = reportClient.create_extended_report(reportObj)
 
-                retVal['output_filtered_ref'] = None
-            else:
-                output_obj_name = input_params['output_reads_name']
-                self.log(console, 'Uploading trimmed reads: '+output_obj_name)
+        output = {'results': results,
+                  'failed_libraries': failed_libraries,
+                  'report': report,
+                  'report_name': report_info['name'],
+                  'report_ref': report_info['ref']}
+        #END execTrimmomaticBatch
 
-                retVal['output_filtered_ref'] = readsUtils_Client.upload_reads ({ 'wsname': str(input_params['output_ws']),
-                                                                                  'name': output_obj_name,
-                                                                                  # remove sequencing_tech arg once ReadsUtils is updated to accept source_reads_ref
-                                                                                  #'sequencing_tech': sequencing_tech,
-                                                                                  'source_reads_ref': input_params['input_reads_ref'],
-                                                                                  'fwd_file': output_fwd_file_path
-                                                                                  })['obj_ref']
+        # At some point might do deeper type checking...
+        if not isinstance(output, dict):
+            raise ValueError('Method execTrimmomaticBatch return value ' +
+                             'output is not type dict as required.')
+        # return the results
+        return [output]
+    def sweepTrimmomatic(self, ctx, input_params):
+        """
+        :param input_params: instance of type "sweepTrimmomaticInput"
+           (sweepTrimmomatic() ** ** trim one shared subsample of a read
+           library with each of a grid of parameter sets ** to compare
+           survival and read lengths before choosing settings for a full run)
+           -> structure: parameter "input_reads_ref" of type "data_obj_ref",
+           parameter "read_type" of String, parameter "quality_encoding" of
+           String, parameter "sample_reads" of Long, parameter "sample_mode"
+           of String, parameter "num_threads" of Long, parameter "engine" of
+           String, parameter "param_grid" of list of mapping from String to
+           unspecified object
+        :returns: instance of type "sweepTrimmomaticOutput" -> structure:
+           parameter "sampled_reads" of Long, parameter "total_reads" of
+           Long, parameter "results" of list of unspecified object, parameter
+           "report" of String
+        """
+        # ctx is the context object
+        # return variables are: output
+        #BEGIN sweepTrimmomatic
+        console = []
+        self.log(console, 'Running Trimmomatic parameter sweep with parameters: ')
+        self.log(console, "\n"+pformat(input_params))
 
-                # free up disk
-                os.remove(output_fwd_file_path)
+        # param checks
+        required_params = ['input_reads_ref',
+                           'read_type',
+                           'param_grid'
+                          ]
+        for required_param in required_params:
+            if required_param not in input_params or input_params[required_param] == None:
+                raise ValueError ("Must define required param: '"+required_param+"'")
+        if not isinstance(input_params['param_grid'], list) or not input_params['param_grid']:
+            raise ValueError ("param_grid must be a non-empty list of parameter sets")
+
+        quality_encoding = input_params.get('quality_encoding') or 'phred33'
+        candidates = []
+        for param_set in input_params['param_grid']:
+            if not isinstance(param_set, dict):
+                raise ValueError ("param_grid entries must be mappings of trimming params: "+pformat(param_set))
+            candidate_params = dict(param_set)
+            candidate_params['read_type'] = input_params['read_type']
+            candidate_params['quality_encoding'] = quality_encoding
+            self.set_trimming_param_defaults(candidate_params)
+            # validate every candidate before downloading anything
+            self.parse_trimmomatic_steps(candidate_params)
+            candidate_params['engine'] = param_set.get('engine') or input_params.get('engine') or REFERENCE_ENGINE
+            if candidate_params['engine'] not in self.TRIMMING_ENGINES:
+                raise ValueError('engine must be one of '+", ".join(self.TRIMMING_ENGINES))
+            if candidate_params['engine'] != AUTO_ENGINE and candidate_params['engine'] not in self.verified_engines:
+                raise ValueError('The '+candidate_params['engine']+' engine has not been verified against the '+
+                                 'Trimmomatic jar here; verified engines: '+", ".join(self.verified_engines)+
+                                 ' (see verified-engines)')
+            candidates.append((param_set, candidate_params))
 
+        token = ctx['token']
+        wsClient = workspaceService(self.workspaceURL, token=token)
 
-        # return created objects
+        # Determine whether read library is of correct type
         #
-        output = { 'report': report,
-                   'output_filtered_ref': retVal['output_filtered_ref'],
-                   'output_unpaired_fwd_ref': retVal['output_unpaired_fwd_ref'],
-                   'output_unpaired_rev_ref': retVal['output_unpaired_rev_ref']
-                 }
-        #END execTrimmomaticSingleLibrary
+        try:
+            input_reads_obj_info = wsClient.get_object_info_new ({'objects':[{'ref':input_params['input_reads_ref']}]})[0]
+        except Exception as e:
+            raise ValueError('Unable to get read library object from workspace: (' + str(input_params['input_reads_ref']) +')' + str(e))
+        input_reads_obj_type = re.sub ('-[0-9]+\.[0-9]+$', "", input_reads_obj_info[2])  # remove trailing version
+        if input_params['read_type'] == 'PE':
+            acceptable_types = ["KBaseFile.PairedEndLibrary", "KBaseAssembly.PairedEndLibrary"]
+        else:
+            acceptable_types = ["KBaseFile.SingleEndLibrary", "KBaseAssembly.SingleEndLibrary"]
+        if input_reads_obj_type not in acceptable_types:
+            raise ValueError ("Input reads of type: '"+input_reads_obj_type+"' with read_type "+input_params['read_type']+".  Must be one of "+", ".join(acceptable_types))
+
+        scratch_job = self.scratch_manager.job('sweep')
+        try:
+            (readsLibrary_entry, input_cache_key) = self.download_reads_library(console, ctx, input_params['input_reads_ref'],
+                                                                                input_reads_obj_info, scratch_job)
+
+            # Take one subsample, shared by every candidate
+            #
+            reads_files = readsLibrary_entry['files']
+            directions = ['fwd', 'rev'] if input_params['read_type'] == 'PE' else ['fwd']
+            input_file_paths = [reads_files[direction] for direction in directions]
+            sample_reads = int(input_params.get('sample_reads') or self.PREVIEW_DEFAULT_READS)
+            total_reads = get_fastq_index(input_file_paths[0]).total_records
+            self.cache_reads_library(console, input_cache_key, readsLibrary_entry)
+            input_bytes = sum([os.path.getsize(path) for path in input_file_paths])
+            sample_prefix = scratch_job.local_file('sweep', self.local_sample_bytes(input_bytes, total_reads, sample_reads,
+                                                                                    n_outputs=len(candidates)))
+            sample_file_paths = [sample_prefix+'_'+direction+'.fastq' for direction in directions]
+            sample_info = subsample_fastq(input_file_paths, sample_file_paths, sample_reads,
+                                          mode=input_params.get('sample_mode') or 'first', total_reads=total_reads)
+            scratch_job.checkpoint('sampled')
+            scratch_job.remove(*input_file_paths)
+            sampled_reads = sample_info['sampled_reads']
+            if not sampled_reads:
+                raise ValueError('No reads found to sweep in '+str(input_params['input_reads_ref']))
+            self.log(console, 'Sampled '+str(sampled_reads)+' of '+str(sample_info['total_reads'])+' reads')
+
+            if quality_encoding == 'auto':
+                quality_encoding = resolve_quality_encoding([detect_quality_encoding(path) for path in sample_file_paths])
+                self.log(console, 'Using auto-detected quality encoding: '+quality_encoding)
+
+            adapter_detection = None
+            if [1 for param_set, candidate_params in candidates if candidate_params['adapterFa'] == 'auto']:
+                adapter_detection = detect_adapters(sample_file_paths, self.ADAPTER_DIR,
+                                                    read_type=input_params['read_type'],
+                                                    custom_adapter_path=sample_prefix+'_adapters_auto.fa')
+                self.log(console, 'Adapter detection: '+pformat(adapter_detection))
+
+            # each candidate runs on its engine with one thread; auto picks it for the sample and the candidate's steps
+            sample_bytes = sum([os.path.getsize(path) for path in sample_file_paths])
+            for param_set, candidate_params in candidates:
+                candidate_params['quality_encoding'] = quality_encoding
+                if candidate_params['adapterFa'] == 'auto':
+                    candidate_params['adapterFa'] = adapter_detection['adapterFa']
+                    if candidate_params['adapterFa'] is None:
+                        candidate_params['seed_mismatches'] = None
+                        candidate_params['palindrome_clip_threshold'] = None
+                        candidate_params['simple_clip_threshold'] = None
+                candidate_params['trimmomatic_steps'] = self.parse_trimmomatic_steps(candidate_params)
+                candidate_params['engine'] = self.select_trimming_engine(console, candidate_params['engine'], sample_bytes,
+                                                                         quality_encoding,
+                                                                         candidate_params['trimmomatic_steps'], 1)[0]
+                unsupported = self.engines[candidate_params['engine']].unsupported(quality_encoding,
+                                                                                   candidate_params['trimmomatic_steps'])
+                if unsupported is not None:
+                    raise ValueError('The '+candidate_params['engine']+' engine cannot run these steps: '+unsupported)
+
+            # Trim the sample with every candidate in parallel, one thread each
+            #
+            if input_params['read_type'] == 'PE':
+                output_names = ['fwd_paired', 'fwd_unpaired', 'rev_paired', 'rev_unpaired']
+                survivor_field = 'Both Surviving'
+            else:
+                output_names = ['fwd']
+                survivor_field = 'Surviving'
+
+            def run_candidate(candidate_i):
+                param_set, candidate_params = candidates[candidate_i]
+                output_file_paths = [sample_prefix+'_'+str(candidate_i)+'_trimm_'+name+'.fastq' for name in output_names]
+                start_time = time.time()
+                outputlines = self.run_trimming_engine(None, candidate_params['engine'], input_params['read_type'],
+                                                       quality_encoding, sample_file_paths, output_file_paths,
+                                                       candidate_params['trimmomatic_steps'], threads=1)[0]
+                seconds = time.time() - start_time
+                counts = self.parse_trimmomatic_stats("\n".join(outputlines), input_params['read_type'])
+                length_stats = dict()
+                for name, path in zip(output_names, output_file_paths):
+                    if os.path.isfile(path):
+                        qc = compute_fastq_qc(path, quality_encoding)
+                        length_stats[name] = {'read_count': qc['read_count'],
+                                              'mean_length': qc['mean_length'],
+                                              'length_histogram': qc['length_histogram']}
+                        scratch_job.remove(path)
+                return {'params': param_set,
+                        'engine': candidate_params['engine'],
+                        'trimmomatic_steps': candidate_params['trimmomatic_steps'].strip(),
+                        'counts': counts,
+                        'survival': round(float(counts[survivor_field]) / sampled_reads, 4),
+                        'outputs': length_stats,
+                        'seconds': round(seconds, 2)}
+
+            num_threads = int(input_params.get('num_threads') or multiprocessing.cpu_count())
+            sweep_pool = ThreadPool(max(1, min(num_threads, len(candidates))))
+            try:
+                results = sweep_pool.map(run_candidate, range(len(candidates)))
+            finally:
+                sweep_pool.close()
+            if adapter_detection is not None and adapter_detection['method'] == 'custom':
+                scratch_job.remove(adapter_detection['adapterFa'])
+        finally:
+            scratch_job.close()
+
+        # comparison table
+        first_output = output_names[0]
+        report = "\t".join(['#', 'survival', first_output+'_mean_length', 'seconds', 'engine', 'steps']) + "\n"
+        for result_i, result in enumerate(results):
+            report += "\t".join([str(result_i + 1),
+                                 '%.2f%%' % (100.0 * result['survival']),
+                                 '%.1f' % result['outputs'].get(first_output, {}).get('mean_length', 0.0),
+                                 str(result['seconds']),
+                                 result['engine'],
+                                 result['trimmomatic_steps']]) + "\n"
+        self.log(console, report)
+
+        output = {'sampled_reads': sampled_reads,
+                  'total_reads': sample_info['total_reads'],
+                  'results': results,
+                  'report': report}
+        #END sweepTrimmomatic
 
         # At some point might do deeper type checking...
         if not isinstance(output, dict):
-            raise ValueError('Method execTrimmomaticSingleLibrary return value ' +
+            raise ValueError('Method sweepTrimmomatic return value ' +
                              'output is not type dict as required.')
         # return the results
         return [output]
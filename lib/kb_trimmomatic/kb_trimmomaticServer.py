@@ -345,6 +345,14 @@ class Application(object):
                              name='kb_trimmomatic.execTrimmomaticSingleLibrary',
                              types=[dict])
         self.method_authentication['kb_trimmomatic.execTrimmomaticSingleLibrary'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_trimmomatic.execTrimmomaticBatch,
+                             name='kb_trimmomatic.execTrimmomaticBatch',
+                             types=[dict])
+        self.method_authentication['kb_trimmomatic.execTrimmomaticBatch'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_trimmomatic.sweepTrimmomatic,
+                             name='kb_trimmomatic.sweepTrimmomatic',
+                             types=[dict])
+        self.method_authentication['kb_trimmomatic.sweepTrimmomatic'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_trimmomatic.status,
                              name='kb_trimmomatic.status',
                              types=[dict])
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from kb_trimmomatic.Utils.AdapterUtil import (detect_adapters, packed_kmers, decode_kmer,
+                                              reverse_complement, read_fasta)
+
+TRUSEQ3_PE = ">PrefixPE/1\nTACACTCTTTCCCTACACGACGCTCTTCCGATCT\n>PrefixPE/2\nGTGACTGGAGTTCAGACGTGTGCTCTTCCGATCT\n"
+TRUSEQ3_SE = ">TruSeq3_IndexedAdapter\nAGATCGGAAGAGCACACGTCTGAACTCCAGTCAC\n>TruSeq3_UniversalAdapter\nAGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGTA\n"
+NEXTERA_READTHROUGH = 'CTGTCTCTTATACACATCTCCGAGCCCACGAGAC'
+NEXTERA_READTHROUGH_2 = 'CTGTCTCTTATACACATCTGACGCTGCCGACGA'
+REPEAT = 'GATTACAGGCATGAGCCACC'
+
+
+class AdapterUtilTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.adapter_dir = os.path.join(cls.tmp_dir, 'adapters')
+        os.mkdir(cls.adapter_dir)
+        with open(os.path.join(cls.adapter_dir, 'TruSeq3-PE.fa'), 'w') as fh:
+            fh.write(TRUSEQ3_PE)
+        with open(os.path.join(cls.adapter_dir, 'TruSeq3-SE.fa'), 'w') as fh:
+            fh.write(TRUSEQ3_SE)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def reads(self, adapter, n_reads=2000, fraction=0.2, read_length=100, repeat=None):
+        # random reads, a fraction of them running into adapter read-through (or carrying repeat at the
+        # same place, followed by more random sequence); the same seed gives mates the same inserts
+        rng = random.Random(7)
+        for i in range(n_reads):
+            seq = "".join([rng.choice('ACGT') for _ in range(read_length)])
+            if rng.random() < fraction:
+                insert = rng.randint(40, read_length - 20)
+                if adapter:
+                    seq = (seq[:insert] + adapter * 3)[:read_length]
+                elif repeat:
+                    seq = seq[:insert] + repeat + seq[insert + len(repeat):]
+                    seq = seq[:read_length]
+            yield '@r' + str(i) + '\n' + seq + '\n+\n' + 'I' * read_length + '\n'
+
+    def write_reads(self, name, adapter, **kwargs):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as fh:
+            fh.writelines(self.reads(adapter, **kwargs))
+        return path
+
+    def test_packed_kmers(self):
+        kmers, valid = packed_kmers([b'ACGTAC', b'ACNTACG'], k=3)
+        self.assertEqual(kmers.shape, (2, 5))
+        self.assertEqual(decode_kmer(kmers[0, 0], 3), 'ACG')
+        self.assertEqual(decode_kmer(kmers[1, 4], 3), 'ACG')
+        self.assertEqual(valid.tolist(), [[True, True, True, True, False],
+                                          [False, False, False, True, True]])
+
+    def test_reverse_complement(self):
+        self.assertEqual(reverse_complement('AACGTN'), 'NACGTT')
+
+    def test_detect_truseq(self):
+        path = self.write_reads('truseq.fq', reverse_complement('GTGACTGGAGTTCAGACGTGTGCTCTTCCGATCT'))
+        detection = detect_adapters([path], self.adapter_dir, read_type='PE')
+        self.assertEqual(detection['method'], 'library')
+        self.assertEqual(detection['adapterFa'], 'TruSeq3-PE.fa')
+        self.assertTrue(detection['adapter_file_scores']['TruSeq3-PE.fa'] > 0.1)
+        # SE libraries prefer the SE file on a tie
+        self.assertEqual(detect_adapters([path], self.adapter_dir, read_type='SE')['adapterFa'], 'TruSeq3-SE.fa')
+
+    def test_detect_nothing(self):
+        path = self.write_reads('clean.fq', None)
+        detection = detect_adapters([path], self.adapter_dir, custom_adapter_path=os.path.join(self.tmp_dir, 'none.fa'))
+        self.assertEqual(detection['method'], 'none')
+        self.assertEqual(detection['adapterFa'], None)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'none.fa')))
+
+    def test_detect_custom(self):
+        path = self.write_reads('nextera.fq', NEXTERA_READTHROUGH)
+        custom_path = os.path.join(self.tmp_dir, 'custom.fa')
+        detection = detect_adapters([path], self.adapter_dir, custom_adapter_path=custom_path)
+        self.assertEqual(detection['method'], 'custom')
+        self.assertEqual(detection['adapterFa'], custom_path)
+        custom_seqs = [seq for name, seq in read_fasta(custom_path)]
+        self.assertTrue(len(custom_seqs) >= 1)
+        self.assertTrue(len(custom_seqs[0]) >= 20)
+        self.assertIn(custom_seqs[0][:12], NEXTERA_READTHROUGH * 3)
+
+    def check_paired_custom(self, detection, custom_path):
+        self.assertEqual(detection['method'], 'custom')
+        records = read_fasta(custom_path)
+        self.assertEqual([name for name, seq in records], ['PrefixAuto1/1', 'PrefixAuto1/2'])
+        self.assertEqual(detection['custom_names'], ['PrefixAuto1/1', 'PrefixAuto1/2'])
+        # the prefixes are the reverse complements of the read-through, ending where the insert starts
+        fwd_seq, rev_seq = [reverse_complement(seq) for name, seq in records][::-1]
+        self.assertTrue(len(fwd_seq) >= 20 and len(rev_seq) >= 20)
+        self.assertIn(fwd_seq[:12], NEXTERA_READTHROUGH * 3)
+        self.assertIn(rev_seq[:12], NEXTERA_READTHROUGH_2 * 3)
+
+    def test_detect_custom_paired(self):
+        fwd_path = self.write_reads('nextera_1.fq', NEXTERA_READTHROUGH)
+        rev_path = self.write_reads('nextera_2.fq', NEXTERA_READTHROUGH_2)
+        custom_path = os.path.join(self.tmp_dir, 'custom_paired.fa')
+        detection = detect_adapters([fwd_path, rev_path], self.adapter_dir, custom_adapter_path=custom_path)
+        self.check_paired_custom(detection, custom_path)
+
+    def test_detect_custom_interleaved(self):
+        path = os.path.join(self.tmp_dir, 'nextera_interleaved.fq')
+        with open(path, 'w') as fh:
+            for fwd, rev in zip(self.reads(NEXTERA_READTHROUGH), self.reads(NEXTERA_READTHROUGH_2)):
+                fh.write(fwd + rev)
+        custom_path = os.path.join(self.tmp_dir, 'custom_interleaved.fa')
+        detection = detect_adapters([path], self.adapter_dir, custom_adapter_path=custom_path, interleaved=True)
+        self.check_paired_custom(detection, custom_path)
+
+    def test_repeat_is_not_an_adapter(self):
+        # overrepresented, but the reads carrying it go on into different sequence
+        path = self.write_reads('repeat.fq', None, repeat=REPEAT)
+        custom_path = os.path.join(self.tmp_dir, 'repeat.fa')
+        detection = detect_adapters([path], self.adapter_dir, custom_adapter_path=custom_path)
+        self.assertEqual(detection['method'], 'none')
+        self.assertTrue(len(detection['top_kmers']) > 0)
+        self.assertFalse(os.path.exists(custom_path))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from kb_trimmomatic.Utils.CoreAllocator import CoreAllocator
+from kb_trimmomatic.Utils.LibraryScheduler import LibraryScheduler, MEMORY_PER_LIBRARY
+from kb_trimmomatic.Utils.TrimmingEngines import JarEngine, ChunkedEngine, NativeEngine
+
+MB = 1024 * 1024
+
+
+class CoreAllocatorTest(unittest.TestCase):
+
+    def test_shares(self):
+        # two huge libraries and eight small ones on 16 cores
+        allocator = CoreAllocator(16, [400.0, 400.0] + [25.0] * 8)
+        self.assertEqual(allocator.acquire(0), 6)
+        self.assertEqual(allocator.acquire(1), 6)
+        self.assertEqual([allocator.acquire(i) for i in range(2, 6)], [1, 1, 1, 1])
+        self.assertEqual(allocator.free_cores(), 0)
+
+        # a huge library finishing frees its cores for the next ones, which get a bigger share of what is left
+        allocator.release(0)
+        allocator.release(2)
+        self.assertEqual(allocator.free_cores(), 7)
+        self.assertEqual(allocator.acquire(6), 1)
+        self.assertEqual(allocator.cores(6), 1)
+        self.assertEqual(allocator.decision(6)['free_cores'], 7)
+        self.assertEqual(len(allocator.decisions), 7)
+
+    def test_limits(self):
+        # never more than the free cores or max_library_cores, never less than one
+        allocator = CoreAllocator(32, [1000.0, 1.0], max_library_cores=8)
+        self.assertEqual(allocator.acquire(0), 8)
+        allocator = CoreAllocator(2, [10.0, 10.0, 10.0])
+        self.assertEqual([allocator.acquire(i) for i in range(3)], [1, 1, 1])
+        self.assertEqual(allocator.free_cores(), -1)
+
+    def test_scheduler(self):
+        # a library only starts with a free core, and is told how many it has
+        allocator = CoreAllocator(4, [40.0, 10.0, 10.0, 10.0, 10.0, 10.0])
+        scheduler = LibraryScheduler([40 * MB] + [10 * MB] * 5, 10 ** 12, 100 * MEMORY_PER_LIBRARY, 6,
+                                     allocator=allocator)
+        lock = threading.Lock()
+        in_use = []
+
+        def run_library(library_i):
+            with lock:
+                in_use.append(sum(allocator.allocated.values()))
+            time.sleep(0.02)
+            return scheduler.cores(library_i)
+
+        cores = scheduler.run(run_library)
+        self.assertEqual(cores[0], 2)
+        self.assertTrue(all([n_cores >= 1 for n_cores in cores]))
+        self.assertTrue(max(in_use) <= 4)
+        self.assertEqual(allocator.allocated, {})
+        self.assertEqual(len(allocator.decisions), 6)
+
+    def test_engine_threads(self):
+        jar = JarEngine('java -jar trimmomatic.jar')
+        plan = jar.plan('SE', 'phred33', ['in.fq'], ['out.fq'], 'MINLEN:36', input_bytes=10 * MB, threads=4)
+        self.assertIn('SE -threads 4 -phred33', jar.command_line(plan))
+        self.assertEqual(plan['workers'], 4)
+        plan = jar.plan('SE', 'phred33', ['in.fq'], ['out.fq'], 'MINLEN:36')
+        self.assertNotIn('-threads', jar.command_line(plan))
+
+        chunked = ChunkedEngine()
+        self.assertEqual(chunked.workers(3), 3)
+        self.assertTrue(chunked.estimate_seconds(100 * MB, threads=4) < chunked.estimate_seconds(100 * MB, threads=1))
+        self.assertEqual(NativeEngine().workers(4), 1)
+
+        # measured throughput is kept per worker
+        jar.record(100 * MB, jar.startup_seconds + 10.0, 4)
+        self.assertEqual(jar.throughput(4), 10.0 * MB)
+        self.assertEqual(jar.throughput(1), 2.5 * MB)
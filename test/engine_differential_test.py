@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Differential test and benchmark of the trimming engines against the Trimmomatic jar
+
+Random and adversarial FASTQ inputs, single and paired end, in both phred
+encodings, are trimmed with step strings built by parse_trimmomatic_steps()
+(so every step it can emit is covered) by the reference jar and by every
+other engine in the registry. The output files must match the jar's record
+for record, and the read counts must match the jar's summary line. Paired end
+inputs are also trimmed from one interleaved file, by every engine and to an
+interleaved paired output where the engine can write one, and compared with
+the jar's split run. Reads/sec, and input bytes/sec per worker (the unit of
+the engines' default throughputs), per engine and layout are printed at the
+end.
+
+Runs offline inside the module image, and fails when java or the jar is not
+available; set TRIMMOMATIC_JAR to point at a different copy of the jar and
+BENCHMARK_READS to change the size of the random libraries. With
+WRITE_JAR_FIXTURES set to a directory (data/jar_parity from the test
+directory), the jar's runs on the adversarial library are kept there, with
+their inputs, step strings and counts, as the fixtures jar_parity_test.py
+checks the native engines against where the jar isn't available, and the
+benchmark numbers go to benchmark.json beside them.
+"""
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import unittest
+
+from kb_trimmomatic.Utils.AdapterUtil import reverse_complement
+from kb_trimmomatic.Utils.FastqIO import read_fastq_batches
+from kb_trimmomatic.Utils.TrimmingEngines import make_engines
+
+TRIMMOMATIC_JAR = os.environ.get('TRIMMOMATIC_JAR', '/kb/module/Trimmomatic-0.36/trimmomatic-0.36.jar')
+BENCHMARK_READS = int(os.environ.get('BENCHMARK_READS', '40000'))
+WRITE_JAR_FIXTURES = os.environ.get('WRITE_JAR_FIXTURES')
+FIXTURE_MANIFEST = 'manifest.json'
+BENCHMARK_FILE = 'benchmark.json'
+FIXTURE_ADAPTER_DIR = '{adapter_dir}'
+PHRED_OFFSETS = {'phred33': 33, 'phred64': 64}
+MAX_QUALITY = 40
+
+# trimming params as the UI sends them; each set turns into a step string via parse_trimmomatic_steps()
+STEP_PARAMS = [
+    {'leading_min_quality': 3, 'trailing_min_quality': 3, 'sliding_window_size': 4,
+     'sliding_window_min_quality': 15, 'min_length': 36},
+    {'crop_length': 80, 'head_crop_length': 5, 'min_length': 20},
+    {'head_crop_length': 10, 'leading_min_quality': 30, 'trailing_min_quality': 30,
+     'sliding_window_size': 1, 'sliding_window_min_quality': 30, 'min_length': 1},
+    {'sliding_window_size': 50, 'sliding_window_min_quality': 20},
+    {'adapterFa': 'ADAPTERS', 'seed_mismatches': 2, 'palindrome_clip_threshold': 30, 'simple_clip_threshold': 10,
+     'sliding_window_size': 4, 'sliding_window_min_quality': 15, 'min_length': 36},
+    {'adapterFa': 'ADAPTERS', 'seed_mismatches': 0, 'palindrome_clip_threshold': 10, 'simple_clip_threshold': 7,
+     'crop_length': 120, 'leading_min_quality': 3, 'trailing_min_quality': 3},
+]
+ADAPTER_FILES = {'PE': 'TruSeq3-PE-2.fa', 'SE': 'TruSeq3-SE.fa'}
+PREFIX_FWD = 'TACACTCTTTCCCTACACGACGCTCTTCCGATCT'
+PREFIX_REV = 'GTGACTGGAGTTCAGACGTGTGCTCTTCCGATCT'
+
+
+def java_available():
+    return any([os.access(os.path.join(path, 'java'), os.X_OK)
+                for path in os.environ.get('PATH', '').split(os.pathsep)])
+
+
+def random_quality(rng, length, profile):
+    if profile == 'high':
+        return [rng.randint(30, MAX_QUALITY) for _ in range(length)]
+    if profile == 'low':
+        return [rng.randint(0, 5) for _ in range(length)]
+    if profile == 'extremes':
+        return [rng.choice([0, MAX_QUALITY]) for _ in range(length)]
+    # degrading towards the 3' end, like a real run
+    return [max(0, min(MAX_QUALITY, int(38 - 30.0 * i / max(length, 1) + rng.gauss(0, 6)))) for i in range(length)]
+
+
+def random_pairs(rng, n_pairs, read_length=150):
+    # (fwd seq, fwd quals, rev seq, rev quals): mostly random inserts, some shorter than the read
+    pairs = []
+    for _ in range(n_pairs):
+        insert_length = rng.choice([rng.randint(20, read_length - 10), rng.randint(read_length, 500)])
+        insert = "".join([rng.choice('ACGT') for _ in range(insert_length)])
+        fwd = (insert + reverse_complement(PREFIX_REV) + 'A' * read_length)[:read_length]
+        rev = (reverse_complement(insert) + reverse_complement(PREFIX_FWD) + 'A' * read_length)[:read_length]
+        profile = rng.choice(['real', 'real', 'real', 'high', 'low', 'extremes'])
+        pairs.append((fwd, random_quality(rng, read_length, profile), rev, random_quality(rng, read_length, profile)))
+    return pairs
+
+
+def adversarial_pairs(rng):
+    # the edge cases of every step: tiny and window-sized reads, all-N and all-low reads, quality
+    # cliffs at every position, adapters starting at every offset, and very long reads
+    pairs = []
+    for length in list(range(1, 12)) + [49, 50, 51, 300]:
+        for profile in ['high', 'low', 'extremes', 'real']:
+            seq = "".join([rng.choice('ACGTN') for _ in range(length)])
+            pairs.append((seq, random_quality(rng, length, profile),
+                          reverse_complement(seq).replace('N', 'A'), random_quality(rng, length, profile)))
+    for length in (20, 100):
+        pairs.append(('N' * length, [MAX_QUALITY] * length, 'N' * length, [0] * length))
+    for cliff in range(0, 100, 7):
+        seq = "".join([rng.choice('ACGT') for _ in range(100)])
+        quals = [MAX_QUALITY] * cliff + [2] * (100 - cliff)
+        pairs.append((seq, quals, reverse_complement(seq), quals[::-1]))
+    for offset in range(0, 100, 3):
+        insert = "".join([rng.choice('ACGT') for _ in range(offset)])
+        fwd = (insert + reverse_complement(PREFIX_REV) + 'A' * 100)[:100]
+        rev = (reverse_complement(insert) + reverse_complement(PREFIX_FWD) + 'A' * 100)[:100]
+        pairs.append((fwd, [MAX_QUALITY] * 100, rev, [MAX_QUALITY] * 100))
+    return pairs
+
+
+def write_fastq(path, reads, phred_offset):
+    with open(path, 'w') as fh:
+        for i, (seq, quals) in enumerate(reads):
+            fh.write('@read' + str(i) + '\n' + seq + '\n+\n' + "".join([chr(q + phred_offset) for q in quals]) + '\n')
+
+
+def read_records(path):
+    if not os.path.isfile(path):
+        return []
+    return [rec for batch in read_fastq_batches(path) for rec in batch]
+
+
+class EngineDifferentialTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not os.path.isfile(TRIMMOMATIC_JAR) or not java_available():
+            raise AssertionError('Trimmomatic jar or java not available: ' + TRIMMOMATIC_JAR)
+        from kb_trimmomatic.kb_trimmomaticImpl import kb_trimmomatic
+        # only the step builder is needed, not a configured service
+        cls.impl = kb_trimmomatic.__new__(kb_trimmomatic)
+        cls.impl.ADAPTER_DIR = os.path.join(os.path.dirname(TRIMMOMATIC_JAR), 'adapters') + os.sep
+        cls.engines = make_engines('java -jar ' + TRIMMOMATIC_JAR)
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.throughput = {}
+        cls.read_counts = {}
+        cls.fixture_cases = []
+
+        rng = random.Random(37)
+        cls.libraries = {'random': random_pairs(rng, BENCHMARK_READS), 'adversarial': adversarial_pairs(rng)}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+        benchmark = {}
+        for name in sorted(cls.throughput):
+            reads, input_bytes, seconds, work_seconds, workers = cls.throughput[name]
+            benchmark[name] = {'reads_per_second': int(reads / seconds if seconds else 0),
+                               'bytes_per_second_per_worker': int(input_bytes / work_seconds / workers
+                                                                  if work_seconds else 0),
+                               'workers': workers}
+        if WRITE_JAR_FIXTURES and cls.fixture_cases:
+            with open(os.path.join(WRITE_JAR_FIXTURES, FIXTURE_MANIFEST), 'w') as fh:
+                json.dump({'jar': os.path.basename(TRIMMOMATIC_JAR),
+                           'cases': sorted(cls.fixture_cases, key=lambda case: case['name'])}, fh, indent=1, sort_keys=True)
+            with open(os.path.join(WRITE_JAR_FIXTURES, BENCHMARK_FILE), 'w') as fh:
+                json.dump({'jar': os.path.basename(TRIMMOMATIC_JAR), 'reads': BENCHMARK_READS, 'engines': benchmark},
+                          fh, indent=1, sort_keys=True)
+        print('\nreads/sec and bytes/sec per worker by engine (all inputs, step sets and encodings):')
+        for name in sorted(benchmark):
+            print('  ' + name.ljust(28) + ' ' + str(benchmark[name]['reads_per_second']).rjust(10) + ' ' +
+                  str(benchmark[name]['bytes_per_second_per_worker']).rjust(12) +
+                  ' (' + str(benchmark[name]['workers']) + ' workers)')
+
+    def inputs(self, library, read_type, quality_encoding):
+        prefix = os.path.join(self.tmp_dir, '_'.join([library, read_type, quality_encoding]))
+        paths = [prefix + '.fwd.fastq'] + ([prefix + '.rev.fastq'] if read_type == 'PE' else [])
+        if not os.path.isfile(paths[0]):
+            pairs = self.libraries[library]
+            write_fastq(paths[0], [(p[0], p[1]) for p in pairs], PHRED_OFFSETS[quality_encoding])
+            if read_type == 'PE':
+                write_fastq(paths[1], [(p[2], p[3]) for p in pairs], PHRED_OFFSETS[quality_encoding])
+            self.read_counts[paths[0]] = len(pairs)
+        return paths
+
+    def interleaved_input(self, library, quality_encoding):
+        path = os.path.join(self.tmp_dir, '_'.join([library, 'PE', quality_encoding]) + '.interleaved.fastq')
+        if not os.path.isfile(path):
+            # each mate named as in the split files
+            with open(path, 'w') as fh:
+                for i, pair in enumerate(self.libraries[library]):
+                    for seq, quals in [(pair[0], pair[1]), (pair[2], pair[3])]:
+                        fh.write('@read' + str(i) + '\n' + seq + '\n+\n' +
+                                 "".join([chr(q + PHRED_OFFSETS[quality_encoding]) for q in quals]) + '\n')
+            self.read_counts[path] = len(self.libraries[library])
+        return [path]
+
+    def step_string(self, params, read_type, quality_encoding):
+        input_params = dict(params, read_type=read_type, quality_encoding=quality_encoding)
+        if input_params.get('adapterFa') == 'ADAPTERS':
+            input_params['adapterFa'] = ADAPTER_FILES[read_type]
+        self.impl.set_trimming_param_defaults(input_params)
+        return self.impl.parse_trimmomatic_steps(input_params)
+
+    def run_engine(self, name, read_type, quality_encoding, input_paths, step_string, tag, layout=None):
+        # layout, for interleaved PE input: 'interleaved' for the paired output interleaved too, otherwise 'split'
+        n_outputs = (3 if layout == 'interleaved' else 4) if read_type == 'PE' else 1
+        output_paths = [os.path.join(self.tmp_dir, tag + '_' + name + '_' + str(i) + '.fastq') for i in range(n_outputs)]
+        engine = self.engines[name]
+        # the jar on one thread, so its bytes/sec per worker compares with the native engine's
+        plan = engine.plan(read_type, quality_encoding, input_paths, output_paths, step_string,
+                           threads=1 if name == 'jar' else None)
+        started = time.time()
+        lines = engine.run(plan, lambda line: None)
+        seconds = time.time() - started
+        key = name + {None: '', 'split': ' interleaved in', 'interleaved': ' interleaved in/out'}[layout]
+        # bytes/sec leaves out the engine's fixed startup, as TrimmingEngine.record() does
+        reads, input_bytes, total_seconds, work_seconds, workers = self.throughput.get(key, (0, 0, 0.0, 0.0,
+                                                                                             plan['workers']))
+        self.throughput[key] = (reads + self.read_counts[input_paths[0]],
+                                input_bytes + sum([os.path.getsize(path) for path in input_paths]),
+                                total_seconds + seconds, work_seconds + max(seconds - engine.startup_seconds, 0.0),
+                                workers)
+        counts = re.search(r'(Input Read.*Dropped: \d+)', "".join(lines)).group(1)
+        return output_paths, re.sub(r' \([\d.]+%\)', '', counts)
+
+    def save_fixture(self, tag, read_type, quality_encoding, input_paths, step_string, output_paths, counts):
+        # keep a jar run for jar_parity_test.py: inputs, adapters and outputs in WRITE_JAR_FIXTURES, the rest in the manifest
+        adapter_dir = os.path.join(WRITE_JAR_FIXTURES, 'adapters')
+        if not os.path.isdir(adapter_dir):
+            os.makedirs(adapter_dir)
+        for adapter_file in set(ADAPTER_FILES.values()):
+            if adapter_file in step_string:
+                shutil.copy(os.path.join(self.impl.ADAPTER_DIR, adapter_file), adapter_dir)
+        for path in input_paths:
+            shutil.copy(path, WRITE_JAR_FIXTURES)
+        outputs = []
+        for i, path in enumerate(output_paths):
+            outputs.append(tag + '_jar_' + str(i) + '.fastq')
+            if os.path.isfile(path):
+                shutil.copy(path, os.path.join(WRITE_JAR_FIXTURES, outputs[-1]))
+            else:
+                open(os.path.join(WRITE_JAR_FIXTURES, outputs[-1]), 'w').close()
+        self.fixture_cases.append({'name': tag,
+                                   'read_type': read_type,
+                                   'quality_encoding': quality_encoding,
+                                   'steps': step_string.replace(self.impl.ADAPTER_DIR, FIXTURE_ADAPTER_DIR + os.sep),
+                                   'inputs': [os.path.basename(path) for path in input_paths],
+                                   'outputs': outputs,
+                                   'counts': counts})
+
+    def check(self, library, read_type, quality_encoding):
+        input_paths = self.inputs(library, read_type, quality_encoding)
+        for params_i, params in enumerate(STEP_PARAMS):
+            step_string = self.step_string(params, read_type, quality_encoding)
+            tag = '_'.join([library, read_type, quality_encoding, str(params_i)])
+            reference_paths, reference_counts = self.run_engine('jar', read_type, quality_encoding,
+                                                                input_paths, step_string, tag)
+            if WRITE_JAR_FIXTURES and library == 'adversarial':
+                self.save_fixture(tag, read_type, quality_encoding, input_paths, step_string, reference_paths,
+                                  reference_counts)
+            for name in sorted(self.engines):
+                if name == 'jar' or self.engines[name].unsupported(quality_encoding, step_string) is not None:
+                    continue
+                output_paths, counts = self.run_engine(name, read_type, quality_encoding, input_paths, step_string, tag)
+                context = name + ' vs jar, ' + tag + ': ' + step_string
+                self.assertEqual(counts, reference_counts, context)
+                for reference_path, output_path in zip(reference_paths, output_paths):
+                    expected = read_records(reference_path)
+                    actual = read_records(output_path)
+                    for expected_record, actual_record in zip(expected, actual):
+                        self.assertEqual(actual_record, expected_record,
+                                         context + ' (' + os.path.basename(reference_path) + ')')
+                    self.assertEqual(len(actual), len(expected), context)
+
+    def check_interleaved(self, library, quality_encoding):
+        # the split jar run is the reference for every engine reading the interleaved file
+        input_paths = self.inputs(library, 'PE', quality_encoding)
+        interleaved_paths = self.interleaved_input(library, quality_encoding)
+        for params_i, params in enumerate(STEP_PARAMS):
+            step_string = self.step_string(params, 'PE', quality_encoding)
+            tag = '_'.join([library, 'PE', quality_encoding, str(params_i)])
+            reference_paths, reference_counts = self.run_engine('jar', 'PE', quality_encoding,
+                                                                input_paths, step_string, tag)
+            reference = [read_records(path) for path in reference_paths]
+            for name in sorted(self.engines):
+                if self.engines[name].unsupported(quality_encoding, step_string) is not None:
+                    continue
+                layouts = ['split'] + (['interleaved'] if self.engines[name].interleaved_output else [])
+                for layout in layouts:
+                    output_paths, counts = self.run_engine(name, 'PE', quality_encoding, interleaved_paths, step_string,
+                                                           tag + '_' + layout, layout=layout)
+                    context = name + ' interleaved ' + layout + ' vs jar, ' + tag + ': ' + step_string
+                    self.assertEqual(counts, reference_counts, context)
+                    outputs = [read_records(path) for path in output_paths]
+                    if layout == 'interleaved':
+                        self.assertEqual(outputs[0][0::2], reference[0], context)
+                        self.assertEqual(outputs[0][1::2], reference[2], context)
+                        self.assertEqual(outputs[1:], [reference[1], reference[3]], context)
+                    else:
+                        self.assertEqual(outputs, reference, context)
+
+    def test_se_phred33(self):
+        for library in ('adversarial', 'random'):
+            self.check(library, 'SE', 'phred33')
+
+    def test_se_phred64(self):
+        for library in ('adversarial', 'random'):
+            self.check(library, 'SE', 'phred64')
+
+    def test_pe_phred33(self):
+        for library in ('adversarial', 'random'):
+            self.check(library, 'PE', 'phred33')
+
+    def test_pe_phred64(self):
+        for library in ('adversarial', 'random'):
+            self.check(library, 'PE', 'phred64')
+
+    def test_pe_interleaved(self):
+        for library in ('adversarial', 'random'):
+            self.check_interleaved(library, 'phred33')
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_trimmomatic.Utils.FastqIO import iter_fastq, read_fastq_batches
+from kb_trimmomatic.Utils.FastqIndex import (build_fastq_index, get_fastq_index, load_fastq_index,
+                                             check_paired_counts, remove_fastq_file, index_path)
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+REV = os.path.join(TEST_DATA_DIR, 'test_quick.rev.fq')
+
+
+def read_all(path):
+    return [rec for batch in read_fastq_batches(path) for rec in batch]
+
+
+class FastqIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fwd = os.path.join(self.tmp_dir, 'fwd.fq')
+        self.rev = os.path.join(self.tmp_dir, 'rev.fq')
+        shutil.copy(FWD, self.fwd)
+        shutil.copy(REV, self.rev)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_offsets(self):
+        records = read_all(self.fwd)
+        index = build_fastq_index(self.fwd, interval=100, block_size=1000)
+        self.assertEqual(index.total_records, 2500)
+        self.assertEqual(len(index.offsets), 25)
+        with open(self.fwd, 'rb') as fh:
+            for j, offset in enumerate(index.offsets):
+                fh.seek(offset)
+                self.assertEqual(fh.readline().rstrip(b'\n'), records[j * 100][0])
+        self.assertEqual(index.seek(250), (int(index.offsets[2]), 50))
+        self.assertEqual(index.seek(2500), (os.path.getsize(self.fwd), 0))
+
+    def test_chunks_cover_file(self):
+        records = read_all(self.fwd)
+        index = build_fastq_index(self.fwd, interval=300)
+        chunks = index.chunks(4)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(sum([c[3] for c in chunks]), 2500)
+        chunked = []
+        for start, end, first, n_records in chunks:
+            chunk_records = [rec for batch in iter_fastq(self.fwd, start=start, end=end) for rec in batch.records()]
+            self.assertEqual(len(chunk_records), n_records)
+            self.assertEqual(chunk_records[0], records[first])
+            chunked += chunk_records
+        self.assertEqual(chunked, records)
+        mapped = [rec for batch in iter_fastq(self.fwd, use_mmap=True, start=chunks[1][0], end=chunks[1][1])
+                  for rec in batch.records()]
+        self.assertEqual(mapped, records[chunks[1][2]:chunks[1][2] + chunks[1][3]])
+
+    def test_sidecar_reuse(self):
+        index = get_fastq_index(self.fwd, interval=500)
+        self.assertTrue(os.path.isfile(index_path(self.fwd)))
+        self.assertEqual(load_fastq_index(self.fwd).total_records, 2500)
+        self.assertTrue(get_fastq_index(self.fwd) is index)
+        # a changed file invalidates the sidecar
+        with open(self.fwd, 'ab') as fh:
+            fh.write(b'@extra\nACGT\n+\nIIII\n')
+        self.assertEqual(load_fastq_index(self.fwd), None)
+        self.assertEqual(get_fastq_index(self.fwd).total_records, 2501)
+        remove_fastq_file(self.fwd)
+        self.assertFalse(os.path.exists(self.fwd) or os.path.exists(index_path(self.fwd)))
+
+    def test_paired_counts(self):
+        self.assertEqual(check_paired_counts(self.fwd, self.rev), 2500)
+        with open(self.rev, 'rb') as fh:
+            lines = fh.readlines()
+        with open(self.rev, 'wb') as fh:
+            fh.write(b''.join(lines[:-4]))
+        with self.assertRaises(ValueError):
+            check_paired_counts(self.fwd, self.rev)
+
+    def test_partial_record(self):
+        path = os.path.join(self.tmp_dir, 'partial.fq')
+        with open(path, 'wb') as fh:
+            fh.write(b'@r1\nACGT\n+\nIIII\n@r2\nAC\n')
+        with self.assertRaises(ValueError):
+            build_fastq_index(path)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import (iter_fastq, read_fastq_batches, write_fastq_batch, gather_fastq_batch,
+                                          SEQ, QUAL, HEADER)
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+
+
+def naive_records(path):
+    with open(path, 'rb') as fh:
+        lines = [line.rstrip(b'\r\n') for line in fh]
+    return [tuple(lines[i:i + 4]) for i in range(0, len(lines), 4)]
+
+
+class FastqIOTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def test_blocks_and_batches(self):
+        expected = naive_records(FWD)
+        for use_mmap in (False, True):
+            for block_size in (1000, 4096, 16 * 1024 * 1024):
+                records = [rec for batch in iter_fastq(FWD, batch_size=77, block_size=block_size, use_mmap=use_mmap)
+                           for rec in batch.records()]
+                self.assertEqual(records, expected)
+        self.assertEqual([rec for batch in read_fastq_batches(FWD, 100) for rec in batch], expected)
+
+    def test_line_endings(self):
+        path = self.write('crlf.fq', b'@r1\r\nACGT\r\n+\r\nIIII\r\n@r2\nAC\n+\nII')
+        batches = list(iter_fastq(path, block_size=7))
+        records = [rec for batch in batches for rec in batch.records()]
+        self.assertEqual(records, [(b'@r1', b'ACGT', b'+', b'IIII'), (b'@r2', b'AC', b'+', b'II')])
+        self.assertEqual(list(iter_fastq(self.write('empty.fq', b''), use_mmap=True)), [])
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            list(iter_fastq(self.write('truncated.fq', b'@r1\nACGT\n+\nIIII\n@r2\nAC\n')))
+        with self.assertRaises(ValueError):
+            list(iter_fastq(self.write('no_at.fq', b'r1\nACGT\n+\nIIII\n')))
+        with self.assertRaises(ValueError):
+            list(iter_fastq(self.write('lengths.fq', b'@r1\nACGT\n+\nIII\n')))
+
+    def test_padded(self):
+        batch = next(iter_fastq(self.write('pad.fq', b'@a\nACGT\n+\nABCD\n@b\nAC\n+\nEF\n')))
+        mat, lengths = batch.padded(SEQ, pad=ord('.'))
+        self.assertEqual([row.tobytes() for row in mat], [b'ACGT', b'AC..'])
+        mat, lengths = batch.padded(QUAL, start=np.array([1, 0]), end=np.array([3, 1]))
+        self.assertEqual(lengths.tolist(), [2, 1])
+        self.assertEqual(mat.tolist(), [[ord('B'), ord('C')], [ord('E'), 0]])
+        self.assertEqual(batch.line(1, HEADER), b'@b')
+
+    def test_write_roundtrip_and_trim(self):
+        batch = next(iter_fastq(FWD, batch_size=10000))
+        out = io.BytesIO()
+        write_fastq_batch(out, batch)
+        with open(FWD, 'rb') as fh:
+            self.assertEqual(out.getvalue(), fh.read())
+
+        rows = np.arange(len(batch)) % 3 == 0
+        starts = np.full(rows.sum(), 2)
+        ends = np.minimum(batch.lengths(SEQ)[rows], 20)
+        out = io.BytesIO()
+        write_fastq_batch(out, batch, rows, starts, ends)
+        expected = b''.join([b'\n'.join((rec[0], rec[1][2:20], rec[2], rec[3][2:20])) + b'\n'
+                             for rec in naive_records(FWD)[::3]])
+        self.assertEqual(out.getvalue(), expected)
+        # gathered a few bytes at a time, the same
+        for chunk_bytes in [1, 7, 100, 10 ** 9]:
+            self.assertEqual(gather_fastq_batch(batch, rows, starts, ends, chunk_bytes=chunk_bytes).tobytes(), expected)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from kb_trimmomatic.Utils.FastqIndex import get_fastq_index, load_fastq_index, index_path
+from kb_trimmomatic.Utils.InputCache import InputCache
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+class InputCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.job_dirs = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def job_dir(self):
+        job_dir = os.path.join(self.tmp_dir, 'job_' + str(len(self.job_dirs)))
+        os.makedirs(job_dir)
+        self.job_dirs.append(job_dir)
+        return job_dir
+
+    def download(self, job_dir, name='test_quick'):
+        # what download_reads leaves in scratch: the two mates, indexed
+        files = {}
+        for direction in ['fwd', 'rev']:
+            files[direction] = os.path.join(job_dir, name + '.' + direction + '.fastq')
+            shutil.copy(os.path.join(TEST_DATA_DIR, 'test_quick.' + direction + '.fq'), files[direction])
+            get_fastq_index(files[direction])
+        return files
+
+    def test_hit(self):
+        cache = InputCache(self.cache_dir, 10 ** 9)
+        self.assertEqual(cache.get('1/2/3', self.job_dir()), None)
+        files = self.download(self.job_dir())
+        cache.put('1/2/3', files, {'sequencing_tech': 'Illumina'})
+
+        # the job removing its files leaves the cached links
+        for path in files.values():
+            os.remove(path)
+        target_dir = self.job_dir()
+        cached_files, info = cache.get('1/2/3', target_dir)
+        self.assertEqual(info, {'sequencing_tech': 'Illumina'})
+        self.assertEqual(sorted(cached_files.keys()), ['fwd', 'rev'])
+        for direction, path in cached_files.items():
+            self.assertEqual(os.path.dirname(path), target_dir)
+            with open(path) as fh, open(os.path.join(TEST_DATA_DIR, 'test_quick.' + direction + '.fq')) as expected:
+                self.assertEqual(fh.read(), expected.read())
+            # linked, not copied, and the index came along still valid
+            self.assertTrue(os.stat(path).st_nlink >= 2)
+            self.assertTrue(os.path.isfile(index_path(path)))
+            self.assertEqual(load_fastq_index(path).total_records, 2500)
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+        # another version of the object is another entry
+        self.assertEqual(cache.get('1/2/4', self.job_dir()), None)
+
+    def test_checksum(self):
+        cache = InputCache(self.cache_dir, 10 ** 9)
+        files = self.download(self.job_dir())
+        cache.put('1/2/3', files)
+        with open(files['fwd'], 'a') as fh:
+            fh.write('@corrupt\n')
+        target_dir = self.job_dir()
+        self.assertEqual(cache.get('1/2/3', target_dir), None)
+        self.assertEqual(cache.stats['checksum_failures'], 1)
+        self.assertEqual(cache.size(), 0)
+        # the links made for the check are gone too
+        self.assertEqual(os.listdir(target_dir), [])
+
+    def test_lru_eviction(self):
+        files = self.download(self.job_dir())
+        entry_bytes = sum([os.path.getsize(path) for path in files.values()])
+        cache = InputCache(self.cache_dir, 2 * entry_bytes)
+        cache.put('1/1/1', files)
+        time.sleep(0.01)
+        cache.put('1/2/1', files)
+        time.sleep(0.01)
+        self.assertNotEqual(cache.get('1/1/1', self.job_dir()), None)
+        time.sleep(0.01)
+        cache.put('1/3/1', files)
+
+        # 1/2/1 was used least recently
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.size(), 2 * entry_bytes)
+        self.assertEqual(cache.get('1/2/1', self.job_dir()), None)
+        self.assertNotEqual(cache.get('1/1/1', self.job_dir()), None)
+        self.assertNotEqual(cache.get('1/3/1', self.job_dir()), None)
+
+        # an entry bigger than the whole budget isn't kept
+        small_cache = InputCache(os.path.join(self.tmp_dir, 'small_cache'), entry_bytes // 2)
+        small_cache.put('1/1/1', files)
+        self.assertEqual(small_cache.size(), 0)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_trimmomatic.Utils.FastqIO import read_fastq_batches
+from kb_trimmomatic.Utils.Interleaved import iter_interleaved, check_interleaved_count, MateStreams
+from kb_trimmomatic.Utils.NativeTrimmer import run_native_trimmomatic
+from kb_trimmomatic.Utils.ParallelTrimmer import run_parallel_trimmomatic
+from kb_trimmomatic.Utils.QCUtil import compute_fastq_qc
+from kb_trimmomatic.Utils.TrimmingEngines import JarEngine, NativeEngine
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+REV = os.path.join(TEST_DATA_DIR, 'test_quick.rev.fq')
+STEPS = 'HEADCROP:2 LEADING:3 TRAILING:3 SLIDINGWINDOW:4:20 CROP:200 MINLEN:36'
+
+
+def read_records(path):
+    return [rec for batch in read_fastq_batches(path) for rec in batch]
+
+
+def write_records(path, records):
+    with open(path, 'wb') as fh:
+        for rec in records:
+            fh.write(b'\n'.join(rec) + b'\n')
+
+
+def interleave(fwd_records, rev_records):
+    return [rec for pair in zip(fwd_records, rev_records) for rec in pair]
+
+
+class InterleavedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.interleaved = os.path.join(self.tmp_dir, 'reads.inter.fastq')
+        write_records(self.interleaved, interleave(read_records(FWD), read_records(REV)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def outputs(self, prefix, n):
+        return [os.path.join(self.tmp_dir, prefix + str(i) + '.fq') for i in range(n)]
+
+    def test_iter_interleaved(self):
+        self.assertEqual(check_interleaved_count(self.interleaved), 2500)
+        fwd, rev = [], []
+        for fwd_batch, rev_batch in iter_interleaved(self.interleaved, batch_records=600):
+            self.assertEqual(len(fwd_batch), len(rev_batch))
+            fwd += fwd_batch.records()
+            rev += rev_batch.records()
+        self.assertEqual(fwd, read_records(FWD))
+        self.assertEqual(rev, read_records(REV))
+
+        odd = os.path.join(self.tmp_dir, 'odd.fastq')
+        write_records(odd, read_records(FWD)[:3])
+        with self.assertRaises(ValueError):
+            check_interleaved_count(odd)
+
+    def test_native_layouts(self):
+        split = self.outputs('split', 4)
+        split_lines = run_native_trimmomatic('PE', 'phred33', [FWD, REV], split, STEPS)
+
+        # interleaved input, the usual four outputs
+        from_interleaved = self.outputs('from_interleaved', 4)
+        lines = run_native_trimmomatic('PE', 'phred33', [self.interleaved], from_interleaved, STEPS)
+        self.assertEqual(lines[-2], split_lines[-2])
+        for expected, actual in zip(split, from_interleaved):
+            self.assertEqual(read_records(actual), read_records(expected))
+
+        # interleaved input and paired output, serial and on worker processes
+        for name, run in [('native', run_native_trimmomatic), ('chunked', run_parallel_trimmomatic)]:
+            interleaved = self.outputs(name + '_interleaved', 3)
+            kwargs = {'batch_records': 600, 'n_workers': 2} if name == 'chunked' else {}
+            qc = {}
+            lines = run('PE', 'phred33', [self.interleaved], interleaved, STEPS, qc=qc, **kwargs)
+            self.assertEqual(lines[-2], split_lines[-2], name)
+            self.assertEqual(read_records(interleaved[0]), interleave(read_records(split[0]), read_records(split[2])))
+            self.assertEqual(read_records(interleaved[1]), read_records(split[1]))
+            self.assertEqual(read_records(interleaved[2]), read_records(split[3]))
+            self.assertEqual(qc['inputs'], [compute_fastq_qc(self.interleaved)], name)
+            self.assertEqual(qc['outputs'], [compute_fastq_qc(path) for path in interleaved], name)
+
+        with self.assertRaises(ValueError):
+            run_native_trimmomatic('PE', 'phred33', [FWD, REV], self.outputs('bad', 3), STEPS)
+
+    def test_mate_streams(self):
+        expected = []
+        for path in [FWD, REV]:
+            write_records(os.path.join(self.tmp_dir, 'expected.fq'), read_records(path))
+            with open(os.path.join(self.tmp_dir, 'expected.fq'), 'rb') as fh:
+                expected.append(fh.read())
+
+        # a sequential reader of two files gets the mates through the pipes, one after the other
+        with MateStreams(self.interleaved, self.tmp_dir) as streams:
+            for path, mate in zip(streams.paths, expected):
+                self.assertFalse(os.path.isfile(path))
+                with open(path, 'rb') as fh:
+                    self.assertEqual(fh.read(), mate)
+        for path in streams.paths:
+            self.assertFalse(os.path.exists(path))
+
+        # a reader that never opens the pipes doesn't leave the feeding threads hanging
+        with MateStreams(self.interleaved, self.tmp_dir) as streams:
+            pass
+
+    def test_engine_layouts(self):
+        native = NativeEngine()
+        self.assertTrue(native.interleaved_output)
+        plan = native.plan('PE', 'phred33', [self.interleaved], self.outputs('plan', 3), STEPS)
+        self.assertEqual(len(plan['outputs']), 3)
+        jar = JarEngine('java -jar trimmomatic.jar')
+        with self.assertRaises(ValueError):
+            jar.plan('PE', 'phred33', [self.interleaved], self.outputs('plan', 3), STEPS)
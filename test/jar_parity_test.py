@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Native engines against saved runs of the Trimmomatic jar
+
+test/data/jar_parity holds runs of the jar (0.36, in the module image) on the
+adversarial library of engine_differential_test.py: inputs, adapter files,
+step strings, outputs and summary counts, written there with
+WRITE_JAR_FIXTURES=test/data/jar_parity. Every native engine has to reproduce
+them record for record, with or without java. The adversarial library holds
+reads shorter than, as long as and just longer than each SLIDINGWINDOW
+window, so the jar decides how those are trimmed. Missing fixtures, or
+fixtures that don't cover every step set, read type and encoding of the
+differential test, are a failure: the native engines are not verified
+without them.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from kb_trimmomatic.Utils.FastqIO import read_fastq_batches
+from kb_trimmomatic.Utils.ParallelTrimmer import run_parallel_trimmomatic
+from kb_trimmomatic.Utils.TrimmingEngines import NativeEngine, ChunkedEngine
+
+from engine_differential_test import STEP_PARAMS, PHRED_OFFSETS
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'jar_parity')
+FIXTURE_MANIFEST = 'manifest.json'
+FIXTURE_ADAPTER_DIR = '{adapter_dir}'
+
+
+def read_records(path):
+    if not os.path.isfile(path):
+        return []
+    return [rec for batch in read_fastq_batches(path) for rec in batch]
+
+
+class JarParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        manifest_path = os.path.join(FIXTURE_DIR, FIXTURE_MANIFEST)
+        cls.cases = []
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as fh:
+                cls.cases = json.load(fh)['cases']
+        cls.engines = {'native': NativeEngine(), 'chunked': ChunkedEngine(n_workers=2)}
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_fixtures_cover_differential_test(self):
+        self.assertTrue(self.cases, 'No jar fixtures in ' + FIXTURE_DIR +
+                        ': write them with engine_differential_test.py and WRITE_JAR_FIXTURES in the module image')
+        expected = set(['_'.join(['adversarial', read_type, quality_encoding, str(params_i)])
+                        for read_type in ('SE', 'PE') for quality_encoding in PHRED_OFFSETS
+                        for params_i in range(len(STEP_PARAMS))])
+        self.assertEqual(set([case['name'] for case in self.cases]), expected)
+        for case in self.cases:
+            for name in case['inputs'] + case['outputs']:
+                self.assertTrue(os.path.isfile(os.path.join(FIXTURE_DIR, name)), name)
+
+    def supported_cases(self):
+        # (case, step string with the fixture adapter dir, input paths) for each case the native engines can run
+        self.assertTrue(self.cases, 'No jar fixtures in ' + FIXTURE_DIR)
+        for case in self.cases:
+            step_string = case['steps'].replace(FIXTURE_ADAPTER_DIR, os.path.join(FIXTURE_DIR, 'adapters'))
+            if self.engines['native'].unsupported(case['quality_encoding'], step_string) is not None:
+                continue
+            yield case, step_string, [os.path.join(FIXTURE_DIR, name) for name in case['inputs']]
+
+    def output_paths(self, case, tag):
+        return [os.path.join(self.tmp_dir, case['name'] + '_' + tag + '_' + str(i) + '.fastq')
+                for i in range(len(case['outputs']))]
+
+    def check_against_jar(self, case, lines, output_paths, context):
+        counts = re.search(r'(Input Read.*Dropped: \d+)', "".join(lines)).group(1)
+        self.assertEqual(re.sub(r' \([\d.]+%\)', '', counts), case['counts'], context)
+        for expected_name, output_path in zip(case['outputs'], output_paths):
+            expected = read_records(os.path.join(FIXTURE_DIR, expected_name))
+            actual = read_records(output_path)
+            for expected_record, actual_record in zip(expected, actual):
+                self.assertEqual(actual_record, expected_record, context + ' (' + expected_name + ')')
+            self.assertEqual(len(actual), len(expected), context + ' (' + expected_name + ')')
+
+    def test_native_engines(self):
+        for case, step_string, input_paths in self.supported_cases():
+            for name in sorted(self.engines):
+                output_paths = self.output_paths(case, name)
+                plan = self.engines[name].plan(case['read_type'], case['quality_encoding'], input_paths, output_paths,
+                                               step_string)
+                lines = self.engines[name].run(plan, lambda line: None)
+                self.check_against_jar(case, lines, output_paths,
+                                       name + ' vs jar, ' + case['name'] + ': ' + case['steps'])
+
+    def test_chunked_pipeline_small_ring(self):
+        # many small batches over several workers and a ring of few slots, so batches finish out of
+        # order and slots are reused; the output must still be the jar's, in the jar's order
+        for case, step_string, input_paths in self.supported_cases():
+            output_paths = self.output_paths(case, 'small_ring')
+            lines = run_parallel_trimmomatic(case['read_type'], case['quality_encoding'], input_paths, output_paths,
+                                             step_string, n_workers=3, batch_records=8, n_slots=3)
+            self.check_against_jar(case, lines, output_paths,
+                                   'chunked (3 workers, 3 slots) vs jar, ' + case['name'] + ': ' + case['steps'])
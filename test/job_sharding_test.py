@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_trimmomatic.baseclient import BaseClient
+from kb_trimmomatic.Utils.JobSharding import (plan_shards, balance_shards, shard_batch_params, unpack_batch_output,
+                                              CHILD_JOB_OVERHEAD_SECONDS, CHILD_JOB_METHOD)
+from kb_trimmomatic.Utils.NativeTrimmer import run_native_trimmomatic
+
+from local_callback_server import LocalCallbackServer
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+STEPS = 'LEADING:3 TRAILING:3 SLIDINGWINDOW:4:15 MINLEN:36'
+GB = 1024 ** 3
+
+
+def trim_batch(params):
+    # what a child execTrimmomaticBatch job does, minus the workspace: output_ws stands for a directory
+    results = []
+    for batch_input in params['inputs']:
+        if batch_input['input_reads_ref'] == 'corrupt':
+            if not params.get('fail_soft'):
+                raise ValueError('corrupt library')
+            failure = {'input_reads_ref': 'corrupt', 'name': 'corrupt', 'error': 'corrupt library',
+                       'attempts': params.get('library_retries', 0) + 1}
+            results.append({'output_filtered_ref': None, 'report': '', 'failed_libraries': [failure]})
+            continue
+        output_path = os.path.join(params['output_ws'], batch_input['output_reads_name'])
+        lines = run_native_trimmomatic(batch_input['params']['read_type'], 'phred33', [FWD], [output_path], STEPS)
+        results.append({'output_filtered_ref': output_path, 'report': "".join(lines), 'failed_libraries': []})
+    return {'results': results}
+
+
+class JobShardingTest(unittest.TestCase):
+
+    def test_plan_shards(self):
+        # small sets stay in this job: child job overhead outweighs the trimming
+        shards, estimate = plan_shards([10 * 1024 * 1024] * 20, 8)
+        self.assertEqual(shards, [])
+        self.assertTrue(estimate['sharded_seconds'] > estimate['local_seconds'])
+        self.assertEqual(plan_shards([GB] * 20, 1)[0], [])
+
+        # four huge libraries and many small ones over four slots: one huge library per shard
+        library_bytes = [20 * GB] * 4 + [GB] * 40
+        shards, estimate = plan_shards(library_bytes, 4)
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(sorted([shard[0] for shard in shards]), [0, 1, 2, 3])
+        self.assertEqual(sorted([i for shard in shards for i in shard]), list(range(len(library_bytes))))
+        self.assertEqual([len(shard) for shard in shards], [11, 11, 11, 11])
+        self.assertTrue(estimate['sharded_seconds'] < estimate['local_seconds'] / 3)
+
+    def test_balance_shards(self):
+        shards, shard_seconds = balance_shards([100.0, 80.0, 60.0, 50.0, 10.0], 2, job_overhead_seconds=0.0)
+        self.assertEqual(shards, [[0, 3], [1, 2, 4]])
+        self.assertEqual(shard_seconds, [150.0, 150.0])
+        shards, shard_seconds = balance_shards([100.0, 80.0], 2)
+        self.assertEqual(shard_seconds, [100.0 + CHILD_JOB_OVERHEAD_SECONDS, 80.0 + CHILD_JOB_OVERHEAD_SECONDS])
+        # one child job per shard, so the overhead is paid once however many libraries it carries
+        shards, shard_seconds = balance_shards([10.0] * 6, 2, job_overhead_seconds=60.0)
+        self.assertEqual(shard_seconds, [90.0, 90.0])
+
+    def test_shard_batch_params(self):
+        library_params = [{'input_reads_ref': '1/2/3', 'output_ws': 'ws', 'output_reads_name': 'a_trimm',
+                           'read_type': 'SE', 'min_length': 36},
+                          {'input_reads_ref': '1/4/1', 'output_ws': 'ws', 'output_reads_name': 'b_trimm',
+                           'read_type': 'SE', 'min_length': 36}]
+        batch_params = shard_batch_params(library_params, 'ws', fail_soft=True, library_retries=2)
+        self.assertEqual(batch_params, {'inputs': [{'input_reads_ref': '1/2/3', 'output_reads_name': 'a_trimm',
+                                                    'params': {'read_type': 'SE', 'min_length': 36}},
+                                                   {'input_reads_ref': '1/4/1', 'output_reads_name': 'b_trimm',
+                                                    'params': {'read_type': 'SE', 'min_length': 36}}],
+                                        'output_ws': 'ws', 'fail_soft': 1, 'library_retries': 2})
+        self.assertEqual(library_params[0]['output_ws'], 'ws')
+        with self.assertRaises(ValueError):
+            unpack_batch_output(None, ['1/2/3'])
+        with self.assertRaises(ValueError):
+            unpack_batch_output({'results': [{}]}, ['1/2/3', '1/4/1'])
+
+
+class LocalCallbackServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = LocalCallbackServer({CHILD_JOB_METHOD: trim_batch})
+        self.server.start()
+        self.client = BaseClient(self.server.url, token='token', async_job_check_time_ms=10,
+                                 async_job_check_max_time_ms=100)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def library_params(self, refs):
+        return [{'input_reads_ref': ref, 'output_ws': self.tmp_dir, 'output_reads_name': 'lib' + str(i) + '.fq',
+                 'read_type': 'SE'} for i, ref in enumerate(refs)]
+
+    def test_run_job(self):
+        # one child job for the whole shard, unpacked into a result per library
+        refs = ['1/2/3', '1/4/1', '1/5/2']
+        batch_params = shard_batch_params(self.library_params(refs), self.tmp_dir)
+        results = unpack_batch_output(self.client.run_job(CHILD_JOB_METHOD, [batch_params]), refs)
+        self.assertEqual(len(self.server.submitted), 1)
+        self.assertEqual(self.server.submitted[0][0], CHILD_JOB_METHOD)
+        for i, (result, failure) in enumerate(results):
+            self.assertEqual(failure, None)
+            self.assertEqual(result['output_filtered_ref'], os.path.join(self.tmp_dir, 'lib' + str(i) + '.fq'))
+            self.assertIn('Input Reads: 2500', result['report'])
+            self.assertTrue(os.path.getsize(result['output_filtered_ref']) > 0)
+
+        # a fail-soft child reports the libraries it gave up on
+        refs = ['1/2/3', 'corrupt']
+        batch_params = shard_batch_params(self.library_params(refs), self.tmp_dir, fail_soft=True, library_retries=1)
+        results = unpack_batch_output(self.client.run_job(CHILD_JOB_METHOD, [batch_params]), refs)
+        self.assertNotEqual(results[0][0], None)
+        self.assertEqual(results[1], (None, {'input_reads_ref': 'corrupt', 'name': 'corrupt',
+                                             'error': 'corrupt library', 'attempts': 2}))
+
+        # a failed child job finishes without a result
+        batch_params = shard_batch_params(self.library_params(refs), self.tmp_dir)
+        self.assertEqual(self.client.run_job(CHILD_JOB_METHOD, [batch_params]), None)
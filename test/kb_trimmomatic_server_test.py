@@ -57,6 +57,8 @@ class kb_trimmomaticTest(unittest.TestCase):
 
         cls.wsClient = workspaceService(cls.wsURL, token=token)
         cls.serviceImpl = kb_trimmomatic(cls.cfg)
+        # the native engines as a deployment that has verified them against the jar
+        cls.verifiedServiceImpl = kb_trimmomatic(dict(cls.cfg, **{'verified-engines': 'native,chunked'}))
 
 
     @classmethod
@@ -84,6 +86,9 @@ class kb_trimmomaticTest(unittest.TestCase):
     def getImpl(self):
         return self.__class__.serviceImpl
 
+    def getVerifiedImpl(self):
+        return self.__class__.verifiedServiceImpl
+
     def getContext(self):
         return self.__class__.ctx
 
@@ -841,3 +846,599 @@ class kb_trimmomaticTest(unittest.TestCase):
         self.assertIn('Input Reads', report_obj['data']['direct_html'])
         self.assertIn('Surviving', report_obj['data']['direct_html'])
         self.assertIn('Dropped', report_obj['data']['direct_html'])
+
+    ### TEST 8: run Trimmomatic with read QC on a paired end library
+    #
+    def test_execTrimmomatic_PairedEndLibrary_QC(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_PairedEndLibrary_QC()")
+        print ("==================================================\n\n")
+
+        # figure out where the test data lives
+        pe_lib_info = self.getPairedEndLibInfo('test_quick')
+        pprint(pe_lib_info)
+
+        # run method
+        output_name = 'output_trim_qc.PElib'
+        input_ref = str(pe_lib_info[6])+'/'+str(pe_lib_info[0])
+        params = {
+            'input_reads_ref': input_ref,
+            'output_ws': pe_lib_info[7],
+            'output_reads_name': output_name,
+            'read_type': 'PE',
+            'quality_encoding': 'phred33',
+            'sliding_window_size': 4,
+            'sliding_window_min_quality': 15,
+            'leading_min_quality': 3,
+            'trailing_min_quality': 3,
+            'min_length': 36,
+            'run_qc': 1
+        }
+
+        result = self.getImpl().execTrimmomatic(self.getContext(),params)[0]
+        print('RESULT:')
+        pprint(result['report'])
+
+        # check the qc stats
+        qc = result['library_stats'][input_ref]['qc']
+        self.assertEqual(qc['input_fwd']['read_count'], 2500)
+        self.assertEqual(qc['input_rev']['read_count'], 2500)
+        self.assertIn('output_fwd_paired', qc)
+        self.assertEqual(qc['output_fwd_paired']['read_count'], qc['output_rev_paired']['read_count'])
+        self.assertTrue(len(qc['input_fwd']['per_position_mean_quality']) > 0)
+
+    ### TEST 9: preview Trimmomatic on a subsample of a paired end library
+    #
+    def test_execTrimmomatic_PairedEndLibrary_preview(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_PairedEndLibrary_preview()")
+        print ("======================================================\n\n")
+
+        # figure out where the test data lives
+        pe_lib_info = self.getPairedEndLibInfo('test_quick')
+        pprint(pe_lib_info)
+
+        # run method
+        output_name = 'output_trim_preview.PElib'
+        input_ref = str(pe_lib_info[6])+'/'+str(pe_lib_info[0])
+        params = {
+            'input_reads_ref': input_ref,
+            'output_ws': pe_lib_info[7],
+            'output_reads_name': output_name,
+            'read_type': 'PE',
+            'quality_encoding': 'phred33',
+            'sliding_window_size': 4,
+            'sliding_window_min_quality': 15,
+            'min_length': 36,
+            'preview': 1,
+            'preview_reads': 500
+        }
+
+        result = self.getImpl().execTrimmomatic(self.getContext(),params)[0]
+        print('RESULT:')
+        pprint(result['report'])
+
+        # nothing saved, predictions scaled up to the full library
+        self.assertEqual(result['output_filtered_ref'], None)
+        self.assertEqual(result['output_unpaired_fwd_ref'], None)
+        preview = result['library_stats'][input_ref]['preview']
+        self.assertEqual(preview['sampled_reads'], 500)
+        self.assertEqual(preview['total_reads'], 2500)
+        self.assertEqual(preview['predicted_counts']['Input Read Pairs'], 2500)
+        # timed on the engine a full run would use
+        self.assertEqual(preview['engine'], 'jar')
+        self.assertIn('Input Read Pairs: 2500', result['report'])
+        with self.assertRaises(Exception):
+            self.wsClient.get_object_info([{'ref': pe_lib_info[7] + '/' + output_name + '_paired'}], 1)
+
+
+    ### TEST 10: sweep trimming parameters on a subsample of a paired end library
+    #
+    def test_sweepTrimmomatic_PairedEndLibrary(self):
+
+        print ("\n\nRUNNING: test_sweepTrimmomatic_PairedEndLibrary()")
+        print ("======================================================\n\n")
+
+        # figure out where the test data lives
+        pe_lib_info = self.getPairedEndLibInfo('test_quick')
+        pprint(pe_lib_info)
+
+        # run method
+        params = {
+            'input_reads_ref': str(pe_lib_info[6])+'/'+str(pe_lib_info[0]),
+            'read_type': 'PE',
+            'quality_encoding': 'phred33',
+            'sample_reads': 1000,
+            'param_grid': [{'sliding_window_size': 4, 'sliding_window_min_quality': window_quality, 'min_length': 36}
+                           for window_quality in [10, 15, 20, 30]]
+        }
+
+        result = self.getImpl().sweepTrimmomatic(self.getContext(),params)[0]
+        print('RESULT:')
+        pprint(result['report'])
+
+        self.assertEqual(result['sampled_reads'], 1000)
+        self.assertEqual(len(result['results']), 4)
+        self.assertEqual(result['results'][0]['counts']['Input Read Pairs'], 1000)
+        self.assertIn('SLIDINGWINDOW:4:15', result['results'][1]['trimmomatic_steps'])
+        # a stricter window never keeps more pairs
+        survival = [r['survival'] for r in result['results']]
+        self.assertEqual(survival, sorted(survival, reverse=True))
+        self.assertIn('fwd_paired', result['results'][0]['outputs'])
+        self.assertEqual([r['engine'] for r in result['results']], ['jar'] * 4)
+
+        # candidates run on the engine they ask for, here where the native engines are verified
+        params['engine'] = 'native'
+        params['param_grid'][1]['engine'] = 'chunked'
+        native_result = self.getVerifiedImpl().sweepTrimmomatic(self.getContext(),params)[0]
+        self.assertEqual([r['engine'] for r in native_result['results']], ['native', 'chunked', 'native', 'native'])
+        self.assertEqual([r['counts'] for r in native_result['results']], [r['counts'] for r in result['results']])
+
+
+    ### TEST 11: native engine on a paired end library
+    #
+    def test_execTrimmomatic_PairedEndLibrary_native_engine(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_PairedEndLibrary_native_engine()")
+        print ("======================================================\n\n")
+
+        # figure out where the test data lives
+        pe_lib_info = self.getPairedEndLibInfo('test_quick')
+        pprint(pe_lib_info)
+
+        # run method
+        output_name = 'output_trim_native.PElib'
+        params = {
+            'input_reads_ref': str(pe_lib_info[6])+'/'+str(pe_lib_info[0]),
+            'output_ws': pe_lib_info[7],
+            'output_reads_name': output_name,
+            'read_type': 'PE',
+            'quality_encoding': 'phred33',
+            'leading_min_quality': 3,
+            'trailing_min_quality': 3,
+            'sliding_window_size': 4,
+            'sliding_window_min_quality': 15,
+            'min_length': 36,
+            'engine': 'native'
+        }
+
+        # not selectable until verified against the jar
+        if 'native' not in self.getImpl().verified_engines:
+            with self.assertRaises(ValueError):
+                self.getImpl().execTrimmomatic(self.getContext(),params)
+
+        result = self.getVerifiedImpl().execTrimmomatic(self.getContext(),params)[0]
+        print('RESULT:')
+        pprint(result)
+
+        self.assertIn('Input Read Pairs: 2500', result['report'])
+        paired_info = self.wsClient.get_object_info([{'ref': pe_lib_info[7] + '/' + output_name + '_paired'}], 1)[0]
+        self.assertEqual(paired_info[2].split('-')[0], 'KBaseFile.PairedEndLibrary')
+
+        # adapter clipping only runs on the jar
+        params['output_reads_name'] = 'output_trim_native_clip.PElib'
+        params['adapterFa'] = 'TruSeq3-PE.fa'
+        params['seed_mismatches'] = 2
+        params['palindrome_clip_threshold'] = 30
+        params['simple_clip_threshold'] = 10
+        with self.assertRaises(ValueError):
+            self.getVerifiedImpl().execTrimmomatic(self.getContext(),params)
+        params['engine'] = 'auto'
+        result = self.getVerifiedImpl().execTrimmomatic(self.getContext(),params)[0]
+        pprint(result)
+        self.assertIn('Input Read Pairs: 2500', result['report'])
+        self.assertEqual(result['library_stats'][params['input_reads_ref']]['engine']['engine'], 'jar')
+
+
+    ### TEST 12: chunked native engine on a paired end library
+    #
+    def test_execTrimmomatic_PairedEndLibrary_chunked_engine(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_PairedEndLibrary_chunked_engine()")
+        print ("======================================================\n\n")
+
+        # figure out where the test data lives
+        pe_lib_info = self.getPairedEndLibInfo('test_quick')
+        pprint(pe_lib_info)
+
+        # run method
+        output_name = 'output_trim_chunked.PElib'
+        params = {
+            'input_reads_ref': str(pe_lib_info[6])+'/'+str(pe_lib_info[0]),
+            'output_ws': pe_lib_info[7],
+            'output_reads_name': output_name,
+            'read_type': 'PE',
+            'quality_encoding': 'phred33',
+            'leading_min_quality': 3,
+            'trailing_min_quality': 3,
+            'sliding_window_size': 4,
+            'sliding_window_min_quality': 15,
+            'min_length': 36,
+            'engine': 'chunked'
+        }
+
+        result = self.getVerifiedImpl().execTrimmomatic(self.getContext(),params)[0]
+        print('RESULT:')
+        pprint(result)
+
+        self.assertIn('Input Read Pairs: 2500', result['report'])
+        self.assertNotEqual(result['output_filtered_ref'], None)
+        self.assertEqual(result['library_stats'][params['input_reads_ref']]['engine']['engine'], 'chunked')
+
+
+    ### TEST 13: engine auto-selection on a small single end library
+    #
+    def test_execTrimmomatic_SingleEndLibrary_auto_engine(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_SingleEndLibrary_auto_engine()")
+        print ("=========================================================\n\n")
+
+        # figure out where the test data lives
+        se_lib_info = self.getSingleEndLibInfo('test_quick')
+        pprint(se_lib_info)
+
+        # run method
+        params = {
+            'input_reads_ref': str(se_lib_info[6])+'/'+str(se_lib_info[0]),
+            'output_ws': se_lib_info[7],
+            'output_reads_name': 'output_trim_auto.SElib',
+            'read_type': 'SE',
+            'quality_encoding': 'phred33',
+            'sliding_window_size': 4,
+            'sliding_window_min_quality': 15,
+            'min_length': 36,
+            'engine': 'auto'
+        }
+
+        result = self.getImpl().execTrimmomatic(self.getContext(),params)[0]
+        print('RESULT:')
+        pprint(result)
+
+        # with no engine verified against the jar, auto keeps to the jar
+        engine_stats = result['library_stats'][params['input_reads_ref']]['engine']
+        self.assertEqual(engine_stats['requested'], 'auto')
+        self.assertEqual(engine_stats['engine'], 'jar')
+        self.assertIn('native', engine_stats['estimated_seconds'])
+        self.assertIn('Input Reads: 2500', result['report'])
+
+        # where they are verified, this small library goes to the native engine from the first job, on the
+        # size from the object before the download
+        params['output_reads_name'] = 'output_trim_auto_verified.SElib'
+        result = self.getVerifiedImpl().execTrimmomatic(self.getContext(),params)[0]
+        pprint(result)
+        engine_stats = result['library_stats'][params['input_reads_ref']]['engine']
+        self.assertEqual(engine_stats['engine'], 'native')
+        self.assertTrue(engine_stats['estimated_input_bytes'] > 0)
+        self.assertIn('Input Reads: 2500', result['report'])
+
+
+    ### TEST 14: re-running a reads set reuses the libraries the first run finished
+    #
+    def test_execTrimmomatic_SingleEndLibrary_ReadsSet_resume(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_SingleEndLibrary_ReadsSet_resume()")
+        print ("===============================================================\n\n")
+
+        # figure out where the test data lives
+        se_lib_set_info = self.getSingleEndLib_SetInfo(['test_quick','small_2'])
+        pprint(se_lib_set_info)
+
+        # run method
+        params = {
+            'input_reads_ref': str(se_lib_set_info[6])+'/'+str(se_lib_set_info[0]),
+            'output_ws': se_lib_set_info[7],
+            'output_reads_name': 'output_trim_resume.SElib',
+            'read_type': 'SE',
+            'quality_encoding': 'phred33',
+            'sliding_window_size': 4,
+            'sliding_window_min_quality': 15,
+            'min_length': 36
+        }
+
+        first = self.getImpl().execTrimmomatic(self.getContext(),dict(params))[0]
+        pprint(first)
+        manifest_dir = os.path.join(self.getImpl().scratch, self.getImpl().MANIFEST_DIR)
+        manifests = [name for name in os.listdir(manifest_dir) if name.endswith('.json')]
+        self.assertTrue(len(manifests) >= 1)
+
+        # the second run skips every library and only saves the sets again
+        second = self.getImpl().execTrimmomatic(self.getContext(),dict(params))[0]
+        pprint(second)
+        self.assertEqual(second['library_stats'], first['library_stats'])
+        self.assertNotEqual(second['output_filtered_ref'], None)
+        self.assertEqual(self.getContext().get('run_manifest'), None)
+
+
+    ### TEST 15: with fail_soft, a library that keeps failing is left out of the output sets
+    #
+    def test_execTrimmomatic_SingleEndLibrary_ReadsSet_fail_soft(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_SingleEndLibrary_ReadsSet_fail_soft()")
+        print ("===============================================================\n\n")
+
+        # figure out where the test data lives
+        se_lib_set_info = self.getSingleEndLib_SetInfo(['test_quick','small_2'])
+        pprint(se_lib_set_info)
+
+        # the first library of the set fails on every attempt
+        impl = self.getImpl()
+        run_library = impl.execTrimmomaticSingleLibrary
+        attempts = {}
+        def failing_library(ctx, input_params):
+            ref = input_params['input_reads_ref']
+            if not attempts or ref in attempts:
+                attempts[ref] = attempts.get(ref, 0) + 1
+                raise ValueError('corrupt library: ' + str(ref))
+            return run_library(ctx, input_params)
+
+        # run method
+        params = {
+            'input_reads_ref': str(se_lib_set_info[6])+'/'+str(se_lib_set_info[0]),
+            'output_ws': se_lib_set_info[7],
+            'output_reads_name': 'output_trim_fail_soft.SElib',
+            'read_type': 'SE',
+            'quality_encoding': 'phred33',
+            'min_length': 36,
+            'fail_soft': 1,
+            'library_retries': 1
+        }
+        impl.execTrimmomaticSingleLibrary = failing_library
+        impl.RETRY_BACKOFF_SECONDS = 0
+        try:
+            result = impl.execTrimmomatic(self.getContext(),params)[0]
+            with self.assertRaises(ValueError):
+                impl.execTrimmomatic(self.getContext(),dict(params, fail_soft=0))
+        finally:
+            del impl.execTrimmomaticSingleLibrary
+            del impl.RETRY_BACKOFF_SECONDS
+        pprint(result)
+
+        self.assertEqual(len(result['failed_libraries']), 1)
+        failure = result['failed_libraries'][0]
+        self.assertEqual(failure['attempts'], 2)
+        # two attempts in each run; the second run resumed the other library from the manifest
+        self.assertEqual(attempts[failure['input_reads_ref']], 4)
+        self.assertIn('corrupt library', failure['error'])
+        self.assertIn('FAILED AFTER 2 ATTEMPTS', result['report'])
+        self.assertNotEqual(result['output_filtered_ref'], None)
+        self.assertEqual(len(result['library_stats']), 1)
+
+
+    ### TEST 16: a reads set sharded over child jobs through the callback server
+    #
+    def test_execTrimmomatic_SingleEndLibrary_ReadsSet_child_jobs(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_SingleEndLibrary_ReadsSet_child_jobs()")
+        print ("===============================================================\n\n")
+
+        # figure out where the test data lives
+        se_lib_set_info = self.getSingleEndLib_SetInfo(['test_quick','small_2'])
+        pprint(se_lib_set_info)
+
+        # run method
+        params = {
+            'input_reads_ref': str(se_lib_set_info[6])+'/'+str(se_lib_set_info[0]),
+            'output_ws': se_lib_set_info[7],
+            'output_reads_name': 'output_trim_child_jobs.SElib',
+            'read_type': 'SE',
+            'quality_encoding': 'phred33',
+            'min_length': 40,
+            'max_child_jobs': 2
+        }
+        # the test libraries are far too small to be worth a child job at the real overhead
+        impl = self.getImpl()
+        impl.CHILD_JOB_OVERHEAD_SECONDS = 0
+        try:
+            result = impl.execTrimmomatic(self.getContext(),params)[0]
+        finally:
+            del impl.CHILD_JOB_OVERHEAD_SECONDS
+        pprint(result)
+
+        self.assertNotEqual(result['output_filtered_ref'], None)
+        self.assertEqual(len(result['library_stats']), 2)
+        self.assertEqual(result['report'].count('RUNNING TRIMMOMATIC ON LIBRARY'), 2)
+
+
+    ### TEST 17: a batch of libraries with their own params, one combined report
+    #
+    def test_execTrimmomaticBatch(self):
+
+        print ("\n\nRUNNING: test_execTrimmomaticBatch()")
+        print ("===============================================================\n\n")
+
+        # figure out where the test data lives
+        se_lib_info = self.getSingleEndLibInfo('test_quick')
+        pe_lib_info = self.getPairedEndLibInfo('test_quick')
+        pprint(se_lib_info)
+
+        # run method
+        params = {
+            'output_ws': se_lib_info[7],
+            'inputs': [
+                {'input_reads_ref': str(se_lib_info[6])+'/'+str(se_lib_info[0]),
+                 'output_reads_name': 'output_trim_batch.SElib',
+                 'params': {'read_type': 'SE', 'quality_encoding': 'phred33', 'min_length': 36}},
+                {'input_reads_ref': str(pe_lib_info[6])+'/'+str(pe_lib_info[0]),
+                 'output_reads_name': 'output_trim_batch.PElib',
+                 'params': {'read_type': 'PE', 'quality_encoding': 'phred33',
+                            'sliding_window_size': 4, 'sliding_window_min_quality': 15, 'min_length': 36}},
+                {'input_reads_ref': str(se_lib_info[6])+'/'+str(se_lib_info[0]),
+                 'output_reads_name': 'output_trim_batch_bad.SElib',
+                 'params': {'read_type': 'SE', 'quality_encoding': 'phred66'}}
+            ],
+            'num_threads': 2,
+            'fail_soft': 1,
+            'library_retries': 0
+        }
+        result = self.getImpl().execTrimmomaticBatch(self.getContext(),params)[0]
+        pprint(result)
+
+        self.assertEqual(len(result['results']), 3)
+        self.assertNotEqual(result['results'][0]['output_filtered_ref'], None)
+        self.assertNotEqual(result['results'][1]['output_filtered_ref'], None)
+        self.assertEqual(result['results'][2]['output_filtered_ref'], None)
+        self.assertEqual(len(result['failed_libraries']), 1)
+        self.assertEqual(result['report'].count('RUNNING TRIMMOMATIC ON LIBRARY'), 3)
+        self.assertIn('Input Reads: 2500', result['report'])
+        self.assertIn('Input Read Pairs: 2500', result['report'])
+        self.assertNotEqual(result['report_ref'], None)
+
+
+    ### TEST 18: a reads set that can't fit in scratch fails before anything is downloaded
+    #
+    def test_execTrimmomatic_SingleEndLibrary_ReadsSet_scratch_preflight(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_SingleEndLibrary_ReadsSet_scratch_preflight()")
+        print ("===============================================================\n\n")
+
+        # figure out where the test data lives
+        se_lib_set_info = self.getSingleEndLib_SetInfo(['test_quick','small_2'])
+        pprint(se_lib_set_info)
+
+        impl = self.getImpl()
+        run_library = impl.execTrimmomaticSingleLibrary
+        started = []
+        def counted_library(ctx, input_params):
+            started.append(input_params['input_reads_ref'])
+            return run_library(ctx, input_params)
+
+        # run method
+        params = {
+            'input_reads_ref': str(se_lib_set_info[6])+'/'+str(se_lib_set_info[0]),
+            'output_ws': se_lib_set_info[7],
+            'output_reads_name': 'output_trim_preflight.SElib',
+            'read_type': 'SE',
+            'quality_encoding': 'phred33',
+            'min_length': 36,
+            'fail_soft': 1
+        }
+        scratch_limit_bytes = impl.scratch_limit_bytes
+        impl.execTrimmomaticSingleLibrary = counted_library
+        impl.scratch_limit_bytes = 1000
+        try:
+            with self.assertRaisesRegexp(ValueError, 'Not enough scratch space'):
+                impl.execTrimmomatic(self.getContext(),params)
+        finally:
+            del impl.execTrimmomaticSingleLibrary
+            impl.scratch_limit_bytes = scratch_limit_bytes
+        self.assertEqual(started, [])
+
+
+    ### TEST 19: data that doesn't get trimmed is copied, not uploaded again
+    #
+    def test_runTrimmomatic_SingleEndLibrary_no_trimming_copy(self):
+        print("\n\nRUNNING: test_runTrimmomatic_SingleEndLibrary_no_trimming_copy")
+        print("---------------------------------------------------------\n\n")
+
+        # figure out where the test data lives
+        se_lib_info = self.getSingleEndLibInfo('small_no_trim')
+        pprint(se_lib_info)
+        input_reads_ref = str(se_lib_info[6])+'/'+str(se_lib_info[0])
+
+        params = {
+            'input_reads_ref': input_reads_ref,
+            'output_ws': se_lib_info[7],
+            'output_reads_name': 'output_no_trim_copy.SElib',
+            'read_type': 'SE',
+            'quality_encoding': 'phred33',
+            'leading_min_quality': 3,
+            'trailing_min_quality': 3,
+            'min_length': 36,
+            'no_trim_output': 'copy'
+        }
+        result = self.getImpl().execTrimmomaticSingleLibrary(self.getContext(),params)[0]
+        pprint(result)
+        self.assertEqual(result['library_stats'][input_reads_ref]['untrimmed'], 'copy')
+
+        # the copy is a new object with the input's data
+        info_list = self.wsClient.get_object_info([{'ref':result['output_filtered_ref']}], 1)
+        self.assertEqual(info_list[0][1], 'output_no_trim_copy.SElib')
+        self.assertEqual(info_list[0][2].split('-')[0], 'KBaseFile.SingleEndLibrary')
+        input_data = self.wsClient.get_objects([{'ref': input_reads_ref}])[0]['data']
+        output_data = self.wsClient.get_objects([{'ref': result['output_filtered_ref']}])[0]['data']
+        self.assertEqual(output_data['lib']['file']['id'], input_data['lib']['file']['id'])
+
+        # reuse hands back the input itself
+        params['no_trim_output'] = 'reuse'
+        result = self.getImpl().execTrimmomaticSingleLibrary(self.getContext(),params)[0]
+        self.assertEqual(result['output_filtered_ref'], input_reads_ref)
+
+
+    ### TEST 20: a Paired End Library reads set with the unpaired reads merged, and small unpaired outputs left out
+    #
+    def test_execTrimmomatic_PairedEndLibrary_ReadsSet_merge_unpaired(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_PairedEndLibrary_ReadsSet_merge_unpaired()")
+        print ("========================================================\n\n")
+
+        # figure out where the test data lives
+        pe_lib_set_info = self.getPairedEndLib_SetInfo(['test_quick','small_2'])
+        pprint(pe_lib_set_info)
+
+        # run method
+        output_name = 'output_trim_merged.PElib'
+        params = {
+            'input_reads_ref': str(pe_lib_set_info[6])+'/'+str(pe_lib_set_info[0]),
+            'output_ws': pe_lib_set_info[7],
+            'output_reads_name': output_name,
+            'read_type': 'PE',
+            'quality_encoding': 'phred33',
+            'min_length': 36,
+            'merge_unpaired': 1
+        }
+        result = self.getImpl().execTrimmomatic(self.getContext(),params)[0]
+        pprint(result)
+
+        # one unpaired set of SingleEndLibraries, and no reverse set
+        self.assertEqual(result['output_unpaired_rev_ref'], None)
+        info_list = self.wsClient.get_object_info([{'ref':pe_lib_set_info[7] + '/' + output_name + '_trimm_unpaired'}], 1)
+        self.assertEqual(info_list[0][2].split('-')[0],'KBaseSets.ReadsSet')
+        for lib_stats in result['library_stats'].values():
+            self.assertTrue(lib_stats['unpaired']['merged'])
+
+        # too few unpaired reads to save any
+        params['output_reads_name'] = 'output_trim_no_unpaired.PElib'
+        params['min_unpaired_reads'] = 1000000
+        result = self.getImpl().execTrimmomatic(self.getContext(),params)[0]
+        self.assertEqual(result['output_unpaired_fwd_ref'], None)
+        self.assertEqual(result['output_unpaired_rev_ref'], None)
+        self.assertNotEqual(result['output_filtered_ref'], None)
+
+
+    ### TEST 21: a Paired End Library trimmed from its interleaved reads, by the jar and by the native engine
+    #
+    def test_execTrimmomatic_PairedEndLibrary_interleaved(self):
+
+        print ("\n\nRUNNING: test_execTrimmomatic_PairedEndLibrary_interleaved()")
+        print ("========================================================\n\n")
+
+        # figure out where the test data lives
+        pe_lib_info = self.getPairedEndLibInfo('test_quick')
+        pprint(pe_lib_info)
+
+        # run method, with the mates split as usual for the counts to compare against
+        params = {
+            'input_reads_ref': str(pe_lib_info[6])+'/'+str(pe_lib_info[0]),
+            'output_ws': pe_lib_info[7],
+            'output_reads_name': 'output_trim_split.PElib',
+            'read_type': 'PE',
+            'quality_encoding': 'phred33',
+            'min_length': 36,
+            'engine': 'jar'
+        }
+        split_result = self.getImpl().execTrimmomatic(self.getContext(),params)[0]
+        split_stats = split_result['library_stats'][params['input_reads_ref']]
+
+        params['interleaved'] = 1
+        for engine, output_layout in [('jar', 'split'), ('native', 'interleaved')]:
+            params['engine'] = engine
+            params['output_reads_name'] = 'output_trim_interleaved_'+engine+'.PElib'
+            result = self.getVerifiedImpl().execTrimmomatic(self.getContext(),params)[0]
+            pprint(result)
+            lib_stats = result['library_stats'][params['input_reads_ref']]
+            self.assertEqual(lib_stats['engine']['layout'], {'input': 'interleaved', 'output': output_layout})
+            self.assertEqual(result['report'], split_result['report'])
+
+            info_list = self.wsClient.get_object_info([{'ref':result['output_filtered_ref']}], 1)
+            self.assertEqual(info_list[0][2].split('-')[0],'KBaseFile.PairedEndLibrary')
+        self.assertEqual(split_stats['engine']['layout'], {'input': 'split', 'output': 'split'})
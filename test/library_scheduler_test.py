@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from kb_trimmomatic.Utils.LibraryScheduler import LibraryScheduler, projected_scratch_bytes, DEFAULT_FASTQ_RATIO, \
+    MEMORY_PER_LIBRARY
+
+MB = 1024 * 1024
+MEMORY = 100 * MEMORY_PER_LIBRARY
+
+
+class Recorder(object):
+    # a stand-in library run that records start order and the estimated scratch in use at each start
+
+    def __init__(self, scheduler, seconds=0.02):
+        self.scheduler = scheduler
+        self.seconds = seconds
+        self.started = []
+        self.in_use = []
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, library_i):
+        with self.lock:
+            self.running.add(library_i)
+            self.started.append(library_i)
+            self.in_use.append(sum([self.scheduler.estimate(i)[0] for i in self.running]))
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running.remove(library_i)
+        return library_i * 10
+
+
+class LibrarySchedulerTest(unittest.TestCase):
+
+    def test_largest_first(self):
+        scheduler = LibraryScheduler([10 * MB, 30 * MB, 20 * MB, 5 * MB], 10 ** 12, MEMORY, 1)
+        recorder = Recorder(scheduler, seconds=0)
+        self.assertEqual(scheduler.run(recorder), [0, 10, 20, 30])
+        self.assertEqual(recorder.started, [1, 2, 0, 3])
+
+    def test_limits(self):
+        library_bytes = [40 * MB, 30 * MB, 30 * MB, 10 * MB, 10 * MB, 10 * MB, 5 * MB]
+        scratch_limit = int(2 * DEFAULT_FASTQ_RATIO * 60 * MB)
+        scheduler = LibraryScheduler(library_bytes, scratch_limit, MEMORY, 4)
+        recorder = Recorder(scheduler)
+        self.assertEqual(scheduler.run(recorder), [i * 10 for i in range(len(library_bytes))])
+        self.assertTrue(max(recorder.in_use) <= scratch_limit)
+        self.assertTrue(scheduler.peak['scratch'] <= scratch_limit)
+        self.assertTrue(scheduler.peak['running'] >= 2)
+
+        # memory limits too: one engine at a time
+        scheduler = LibraryScheduler(library_bytes, 10 ** 12, MEMORY_PER_LIBRARY, 4)
+        scheduler.run(Recorder(scheduler))
+        self.assertEqual(scheduler.peak['running'], 1)
+
+    def test_oversized_library(self):
+        # bigger than the limit on its own: runs by itself instead of waiting forever
+        messages = []
+        scheduler = LibraryScheduler([500 * MB, 10 * MB, 10 * MB], 200 * MB, MEMORY, 3, log=messages.append)
+        recorder = Recorder(scheduler)
+        self.assertEqual(scheduler.run(recorder), [0, 10, 20])
+        self.assertEqual(recorder.started[0], 0)
+        self.assertEqual(recorder.in_use[0], scheduler.estimate(0)[0])
+        self.assertTrue(any(['alone exceeds the limits' in message for message in messages]))
+
+    def test_observed_ratio(self):
+        scheduler = LibraryScheduler([100 * MB, 100 * MB], 10 ** 12, MEMORY, 1)
+        self.assertEqual(scheduler.estimate(1)[0], int(100 * MB * DEFAULT_FASTQ_RATIO * 2))
+        scheduler.observe(0, 250 * MB)
+        self.assertEqual(scheduler.fastq_ratio(), 2.5)
+        self.assertEqual(scheduler.estimate(1)[0], int(100 * MB * 2.5 * 2))
+
+    def test_error_stops_scheduling(self):
+        started = []
+
+        def run_library(library_i):
+            started.append(library_i)
+            if library_i == 0:
+                raise ValueError('corrupt library')
+            return library_i
+
+        scheduler = LibraryScheduler([50 * MB, 10 * MB, 10 * MB, 10 * MB], 10 ** 12, MEMORY, 1)
+        with self.assertRaises(ValueError):
+            scheduler.run(run_library)
+        self.assertEqual(started, [0])
+
+    def test_projected_scratch_bytes(self):
+        # FASTQ plus worst-case outputs as large
+        self.assertEqual(projected_scratch_bytes(100 * MB), int(100 * MB * DEFAULT_FASTQ_RATIO * 2))
+        self.assertEqual(projected_scratch_bytes(100 * MB, 1.0), 200 * MB)
+        self.assertEqual(projected_scratch_bytes(100 * MB, 1.0, output_ratio=0.0), 100 * MB)
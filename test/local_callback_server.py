@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the SDK callback server's job API, for testing child jobs
+
+Serves the two calls BaseClient.run_job() makes: <module>._<method>_submit
+starts the method in a local process and returns a job id, and
+<module>._check_job returns the job state, with the method's result once
+the process has finished. Methods are plain functions taking the call's
+params, registered by 'module.method' name.
+
+    server = LocalCallbackServer({'kb_trimmomatic.execTrimmomaticBatch': trim_batch})
+    server.start()
+    BaseClient(server.url).run_job('kb_trimmomatic.execTrimmomaticBatch', [params])
+    server.stop()
+"""
+import json
+import multiprocessing
+import threading
+import traceback
+import uuid
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # py2
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # py3
+    from socketserver import ThreadingMixIn
+
+
+def _run_method(method, params, conn):
+    try:
+        conn.send({'result': [method(*params)]})
+    except Exception as e:
+        conn.send({'result': None,
+                   'error': {'name': type(e).__name__, 'code': -32000, 'message': str(e),
+                             'error': traceback.format_exc()}})
+    conn.close()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalCallbackServer(object):
+
+    def __init__(self, methods):
+        self.methods = methods
+        self.jobs = {}
+        self.submitted = []
+        self._lock = threading.Lock()
+        self._server = None
+        self.url = None
+
+    def start(self):
+        callback_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                status, body = callback_server.handle(request)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('content-type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:' + str(self._server.server_address[1])
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        for process, conn, state in self.jobs.values():
+            process.join()
+
+    def handle(self, request):
+        module, method = request['method'].split('.')
+        if method == '_check_job':
+            return 200, {'version': '1.1', 'id': request['id'], 'result': [self.check_job(request['params'][0])]}
+        if method.startswith('_') and method.endswith('_submit'):
+            name = module + '.' + method[1:-len('_submit')]
+            if name in self.methods:
+                return 200, {'version': '1.1', 'id': request['id'],
+                             'result': [self.submit_job(name, request['params'])]}
+        return 500, {'version': '1.1', 'id': request['id'],
+                     'error': {'name': 'JSONRPCError', 'code': -32601, 'message': 'Unknown method ' + request['method']}}
+
+    def submit_job(self, name, params):
+        job_id = str(uuid.uuid4())
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_method, args=(self.methods[name], params, child_conn))
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self.jobs[job_id] = (process, parent_conn, {'finished': 0})
+            self.submitted.append((name, params))
+        return job_id
+
+    def check_job(self, job_id):
+        with self._lock:
+            process, conn, state = self.jobs[job_id]
+            if not state['finished'] and conn.poll():
+                state.update(conn.recv())
+                state['finished'] = 1
+                process.join()
+            return dict(state)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import read_fastq_batches
+from kb_trimmomatic.Utils.QCUtil import compute_fastq_qc
+from kb_trimmomatic.Utils.NativeTrimmer import (parse_steps, quality_matrix, trim_intervals,
+                                                run_native_trimmomatic)
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+REV = os.path.join(TEST_DATA_DIR, 'test_quick.rev.fq')
+
+
+def read_all(path):
+    return [rec for batch in read_fastq_batches(path) for rec in batch]
+
+
+def reference_trim(steps, seq, qual, phred_offset=33):
+    # one read at a time, written out the way Trimmomatic's trimmers walk a record
+    quals = [0 if base == 'N' else ord(q) - phred_offset for base, q in zip(seq, qual)]
+    start, end = 0, len(quals)
+    for name, args in steps:
+        if name == 'CROP':
+            end = min(end, start + args[0])
+        elif name == 'HEADCROP':
+            if end - start <= args[0]:
+                return None
+            start += args[0]
+        elif name == 'MINLEN':
+            if end - start < args[0]:
+                return None
+        elif name == 'LEADING':
+            while start < end and quals[start] < args[0]:
+                start += 1
+            if start == end:
+                return None
+        elif name == 'TRAILING':
+            while end > start and quals[end - 1] < args[0]:
+                end -= 1
+            if start == end:
+                return None
+        elif name == 'SLIDINGWINDOW':
+            window, min_quality = args
+            sub = quals[start:end]
+            keep = len(sub)
+            if len(sub) < window:
+                if sum(sub) * window < window * min_quality * len(sub):
+                    return None
+            else:
+                total = sum(sub[:window])
+                if total < window * min_quality:
+                    return None
+                for i in range(len(sub) - window):
+                    total = total - sub[i] + sub[i + window]
+                    if total < window * min_quality:
+                        keep = i + window
+                        break
+            while keep > 0 and sub[keep - 1] < min_quality:
+                keep -= 1
+            if not keep:
+                return None
+            end = start + keep
+    return start, end
+
+
+class NativeTrimmerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def check_against_reference(self, step_string, records, phred_offset=33):
+        steps = parse_steps(step_string)
+        seq_mat, scores, lengths = quality_matrix([r[1] for r in records], [r[3] for r in records], phred_offset)
+        start, end, keep = trim_intervals(steps, scores, lengths)
+        for i, rec in enumerate(records):
+            expected = reference_trim(steps, rec[1].decode('ascii'), rec[3].decode('ascii'), phred_offset)
+            got = (int(start[i]), int(end[i])) if keep[i] else None
+            self.assertEqual(got, expected, step_string + ' read ' + str(i))
+
+    def test_parse_steps(self):
+        self.assertEqual(parse_steps('LEADING:3 SLIDINGWINDOW:4:15 MINLEN:0 '),
+                         [('LEADING', [3]), ('SLIDINGWINDOW', [4, 15]), ('MINLEN', [0])])
+        with self.assertRaises(ValueError):
+            parse_steps('AVGQUAL:20')
+        with self.assertRaises(ValueError):
+            parse_steps('ILLUMINACLIP:TruSeq3-PE.fa:2:30:10')
+        with self.assertRaises(ValueError):
+            parse_steps('SLIDINGWINDOW:4')
+
+    def test_steps_match_reference(self):
+        records = read_all(FWD)[:500]
+        rng = random.Random(3)
+        # add some short reads, N runs and low quality stretches
+        for i in range(200):
+            length = rng.randint(0, 30)
+            seq = "".join([rng.choice('ACGTN') for _ in range(length)])
+            qual = "".join([chr(33 + rng.choice([2, 2, 10, 20, 30, 40])) for _ in range(length)])
+            records.append((b'@x' + str(i).encode('ascii'), seq.encode('ascii'), b'+', qual.encode('ascii')))
+        for step_string in ['LEADING:3 TRAILING:3 SLIDINGWINDOW:4:15 MINLEN:36',
+                            'CROP:50 HEADCROP:5 LEADING:20 TRAILING:25',
+                            'SLIDINGWINDOW:10:30 MINLEN:20',
+                            'HEADCROP:0 LEADING:0 TRAILING:0 SLIDINGWINDOW:0:0 MINLEN:0',
+                            'TRAILING:38 SLIDINGWINDOW:1:35 CROP:10']:
+            self.check_against_reference(step_string, records)
+
+    def test_quality_matrix_zeroes_ns(self):
+        seq_mat, scores, lengths = quality_matrix([b'ANC', b'A'], [b'III', b'5'])
+        self.assertEqual(scores.tolist(), [[40, 0, 40], [20, 0, 0]])
+        self.assertEqual(lengths.tolist(), [3, 1])
+
+    def test_run_paired(self):
+        outputs = [os.path.join(self.tmp_dir, name + '.fq') for name in ['fp', 'fu', 'rp', 'ru']]
+        totals = {}
+        qc = {}
+        lines = run_native_trimmomatic('PE', 'phred33', [FWD, REV], outputs,
+                                       'LEADING:3 TRAILING:3 SLIDINGWINDOW:4:15 MINLEN:36', batch_size=300,
+                                       totals=totals, qc=qc)
+        self.assertEqual(lines[-1], 'TrimmomaticPE: Completed successfully')
+        stats_line = lines[-2]
+        self.assertTrue(stats_line.startswith('Input Read Pairs: 2500 Both Surviving: '))
+
+        fwd_paired = read_all(outputs[0])
+        rev_paired = read_all(outputs[2])
+        self.assertEqual(len(fwd_paired), len(rev_paired))
+        self.assertEqual([r[0].split()[0] for r in fwd_paired][:5], [r[0].split()[0] for r in rev_paired][:5])
+        n_out = sum([len(read_all(path)) for path in outputs])
+        self.assertIn('Both Surviving: ' + str(len(fwd_paired)) + ' ', stats_line)
+        self.assertEqual(n_out, 2 * len(fwd_paired) + len(read_all(outputs[1])) + len(read_all(outputs[3])))
+        for rec in fwd_paired:
+            self.assertEqual(len(rec[1]), len(rec[3]))
+            self.assertTrue(len(rec[1]) >= 36)
+        self.assertEqual(totals['input'], 2500)
+        self.assertEqual(totals['both'], len(fwd_paired))
+        self.assertEqual(totals['input_bases'], sum([len(r[1]) for path in [FWD, REV] for r in read_all(path)]))
+        self.assertEqual(totals['surviving_bases'], sum([len(r[1]) for path in outputs for r in read_all(path)]))
+        # QC from the trimmed batches is the QC of the files
+        self.assertEqual(qc['inputs'], [compute_fastq_qc(FWD), compute_fastq_qc(REV)])
+        self.assertEqual(qc['outputs'], [compute_fastq_qc(path) for path in outputs])
+
+    def test_run_single_batches_agree(self):
+        out_a = os.path.join(self.tmp_dir, 'se_a.fq')
+        out_b = os.path.join(self.tmp_dir, 'se_b.fq')
+        lines_a = run_native_trimmomatic('SE', 'phred33', [FWD], [out_a], 'SLIDINGWINDOW:4:20 MINLEN:50')
+        lines_b = run_native_trimmomatic('SE', 'phred33', [FWD], [out_b], 'SLIDINGWINDOW:4:20 MINLEN:50', batch_size=7)
+        self.assertEqual(lines_a[-2], lines_b[-2])
+        with open(out_a, 'rb') as fh_a, open(out_b, 'rb') as fh_b:
+            self.assertEqual(fh_a.read(), fh_b.read())
+        self.assertTrue(lines_a[-2].startswith('Input Reads: 2500 Surviving: '))
+
+    def test_untrimmed_totals(self):
+        # steps that keep every read whole keep every base
+        totals = {}
+        run_native_trimmomatic('SE', 'phred33', [FWD], [os.path.join(self.tmp_dir, 'whole.fq')], 'MINLEN:1',
+                               totals=totals)
+        self.assertEqual(totals['both'], 2500)
+        self.assertEqual(totals['surviving_bases'], totals['input_bases'])
+
+    def test_paired_count_mismatch(self):
+        short_rev = os.path.join(self.tmp_dir, 'short_rev.fq')
+        with open(REV, 'rb') as src, open(short_rev, 'wb') as dst:
+            dst.write(b''.join(src.readlines()[:40]))
+        outputs = [os.path.join(self.tmp_dir, name + '_bad.fq') for name in ['fp', 'fu', 'rp', 'ru']]
+        with self.assertRaises(ValueError):
+            run_native_trimmomatic('PE', 'phred33', [FWD, short_rev], outputs, 'MINLEN:36')
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from kb_trimmomatic.Utils.NativeTrimmer import run_native_trimmomatic
+from kb_trimmomatic.Utils.ParallelTrimmer import run_parallel_trimmomatic, ring_bytes_limit, MAX_RING_BYTES
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+REV = os.path.join(TEST_DATA_DIR, 'test_quick.rev.fq')
+STEPS = 'HEADCROP:2 LEADING:3 TRAILING:3 SLIDINGWINDOW:4:20 CROP:200 MINLEN:36'
+
+
+def read_bytes(path):
+    with open(path, 'rb') as fh:
+        return fh.read()
+
+
+class ParallelTrimmerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fwd = os.path.join(self.tmp_dir, 'fwd.fq')
+        self.rev = os.path.join(self.tmp_dir, 'rev.fq')
+        shutil.copy(FWD, self.fwd)
+        shutil.copy(REV, self.rev)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def outputs(self, prefix, n):
+        return [os.path.join(self.tmp_dir, prefix + str(i) + '.fq') for i in range(n)]
+
+    def test_pe_matches_native(self):
+        serial = self.outputs('serial', 4)
+        parallel = self.outputs('parallel', 4)
+        serial_totals = {}
+        serial_qc = {}
+        serial_lines = run_native_trimmomatic('PE', 'phred33', [self.fwd, self.rev], serial, STEPS,
+                                              totals=serial_totals, qc=serial_qc)
+        # small batches and few slots, so batches finish out of order and slots are reused
+        parallel_totals = {}
+        parallel_qc = {}
+        parallel_lines = run_parallel_trimmomatic('PE', 'phred33', [self.fwd, self.rev], parallel, STEPS,
+                                                  n_workers=3, batch_records=300, n_slots=4, totals=parallel_totals,
+                                                  qc=parallel_qc)
+        self.assertEqual(parallel_totals, serial_totals)
+        # the workers' QC, merged
+        self.assertEqual(parallel_qc, serial_qc)
+        for serial_path, parallel_path in zip(serial, parallel):
+            self.assertEqual(read_bytes(serial_path), read_bytes(parallel_path))
+        self.assertEqual(parallel_lines[-2:], serial_lines[-2:])
+        self.assertTrue(parallel_lines[2].startswith('Pipeline: 3 worker processes'))
+        self.assertTrue(parallel_lines[3].startswith('Pipeline utilization: reader '))
+
+    def test_output_order(self):
+        # batches of very different cost over several workers and a ring of few slots: later, cheaper
+        # batches finish first, and the writer must still keep input order
+        path = os.path.join(self.tmp_dir, 'ordered.fq')
+        with open(path, 'wb') as fh:
+            for i in range(2000):
+                length = 2000 if (i // 50) % 4 == 0 else 40
+                fh.write(b'@' + str(i).encode('ascii') + b'\n' + b'ACGT' * (length // 4) + b'\n+\n' +
+                         b'I' * (length - 3) + b'###\n')
+        serial = self.outputs('serial', 1)
+        parallel = self.outputs('parallel', 1)
+        run_native_trimmomatic('SE', 'phred33', [path], serial, 'TRAILING:3 MINLEN:1')
+        lines = run_parallel_trimmomatic('SE', 'phred33', [path], parallel, 'TRAILING:3 MINLEN:1',
+                                         n_workers=4, batch_records=50, n_slots=4)
+        self.assertTrue(lines[2].startswith('Pipeline: 4 worker processes'))
+        with open(parallel[0], 'rb') as fh:
+            names = [line[1:].strip() for i, line in enumerate(fh) if i % 4 == 0]
+        self.assertEqual(names, [str(i).encode('ascii') for i in range(2000)])
+        self.assertEqual(read_bytes(serial[0]), read_bytes(parallel[0]))
+
+    def test_se_without_final_newline(self):
+        with open(self.fwd, 'rb') as fh:
+            data = fh.read().rstrip(b'\n')
+        with open(self.fwd, 'wb') as fh:
+            fh.write(data)
+        serial = self.outputs('serial', 1)
+        parallel = self.outputs('parallel', 1)
+        serial_lines = run_native_trimmomatic('SE', 'phred33', [self.fwd], serial, STEPS)
+        parallel_lines = run_parallel_trimmomatic('SE', 'phred33', [self.fwd], parallel, STEPS,
+                                                  n_workers=2, batch_records=700)
+        self.assertEqual(read_bytes(serial[0]), read_bytes(parallel[0]))
+        self.assertEqual(parallel_lines[-2:], serial_lines[-2:])
+
+    def test_empty_and_errors(self):
+        empty = os.path.join(self.tmp_dir, 'empty.fq')
+        open(empty, 'wb').close()
+        lines = run_parallel_trimmomatic('SE', 'phred33', [empty], self.outputs('empty', 1), STEPS, n_workers=2)
+        self.assertIn('Input Reads: 0 ', lines[-2])
+        with self.assertRaises(ValueError):
+            run_parallel_trimmomatic('SE', 'solexa', [self.fwd], self.outputs('bad', 1), STEPS)
+        with open(self.rev, 'ab') as fh:
+            fh.write(b'@extra\nACGT\n+\nIIII\n')
+        with self.assertRaises(ValueError):
+            run_parallel_trimmomatic('PE', 'phred33', [self.fwd, self.rev], self.outputs('bad', 4), STEPS)
+
+    def test_threaded_caller(self):
+        # with another thread running the pipeline forks its workers from a helper process
+        serial = self.outputs('serial', 4)
+        parallel = self.outputs('parallel', 4)
+        serial_totals = {}
+        serial_qc = {}
+        serial_lines = run_native_trimmomatic('PE', 'phred33', [self.fwd, self.rev], serial, STEPS,
+                                              totals=serial_totals, qc=serial_qc)
+        parallel_totals = {}
+        parallel_qc = {}
+        done = threading.Event()
+        thread = threading.Thread(target=done.wait)
+        thread.start()
+        try:
+            parallel_lines = run_parallel_trimmomatic('PE', 'phred33', [self.fwd, self.rev], parallel, STEPS,
+                                                      n_workers=2, batch_records=700, totals=parallel_totals,
+                                                      qc=parallel_qc)
+            with self.assertRaises(ValueError):
+                run_parallel_trimmomatic('SE', 'phred33', [os.path.join(self.tmp_dir, 'missing.fq')],
+                                         self.outputs('missing', 1), STEPS)
+        finally:
+            done.set()
+            thread.join()
+        for serial_path, parallel_path in zip(serial, parallel):
+            self.assertEqual(read_bytes(serial_path), read_bytes(parallel_path))
+        self.assertEqual(parallel_lines[-2:], serial_lines[-2:])
+        self.assertEqual(parallel_totals, serial_totals)
+        self.assertEqual(parallel_qc, serial_qc)
+
+    def test_ring_limit(self):
+        # a ring limit below two slots leaves one slot and one worker
+        serial = self.outputs('serial', 1)
+        parallel = self.outputs('parallel', 1)
+        run_native_trimmomatic('SE', 'phred33', [self.fwd], serial, STEPS)
+        lines = run_parallel_trimmomatic('SE', 'phred33', [self.fwd], parallel, STEPS,
+                                         n_workers=3, batch_records=300, max_ring_bytes=1)
+        self.assertTrue(lines[2].startswith('Pipeline: 1 worker processes'))
+        self.assertEqual(read_bytes(serial[0]), read_bytes(parallel[0]))
+        self.assertTrue(ring_bytes_limit() <= MAX_RING_BYTES)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_trimmomatic.Utils.FastqIO import iter_fastq, read_fastq_batches
+from kb_trimmomatic.Utils.QCUtil import FastqQC, compute_fastq_qc, qc_plots_html
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+class QCUtilTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def write_fastq(self, name, records):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as fh:
+            for i, (seq, qual) in enumerate(records):
+                fh.write('@read' + str(i) + '\n' + seq + '\n+\n' + qual + '\n')
+        return path
+
+    def test_small_metrics(self):
+        path = self.write_fastq('small.fq', [('ACGT', 'IIII'),    # Q40
+                                             ('GGNN', '####'),    # Q2
+                                             ('AC', '5+')])       # Q20, Q10
+        qc = compute_fastq_qc(path, batch_size=2)
+        self.assertEqual(qc['read_count'], 3)
+        self.assertEqual(qc['base_count'], 10)
+        self.assertEqual(qc['mean_length'], 3.33)
+        self.assertEqual(qc['per_position_mean_quality'], [round((40 + 2 + 20) / 3.0, 2), round((40 + 2 + 10) / 3.0, 2), 21.0, 21.0])
+        self.assertEqual(qc['per_position_n_rate'], [0.0, 0.0, 0.5, 0.5])
+        self.assertEqual(qc['n_rate'], 0.2)
+        # GC over called bases: ACGT(2) + GG(2) + AC(1) of 8 called bases
+        self.assertEqual(qc['gc_content'], 0.625)
+        self.assertEqual(qc['length_histogram'], {'lengths': [2, 4], 'counts': [1, 2]})
+        self.assertEqual(qc['gc_histogram'][50], 2)
+        self.assertEqual(qc['gc_histogram'][100], 1)
+
+    def test_phred64(self):
+        path = self.write_fastq('p64.fq', [('ACGT', 'hhhh')])
+        qc = compute_fastq_qc(path, quality_encoding='phred64')
+        self.assertEqual(qc['per_position_mean_quality'], [40.0, 40.0, 40.0, 40.0])
+
+    def test_batches_match_single_pass(self):
+        path = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+        self.assertEqual(compute_fastq_qc(path, batch_size=7), compute_fastq_qc(path, batch_size=100000))
+
+    def test_merge(self):
+        # QC kept per worker and merged is the QC of the whole file
+        path = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+        records = [rec for batch in read_fastq_batches(path) for rec in batch]
+        halves = [self.write_fastq('half' + str(i) + '.fq', [(rec[1].decode('ascii'), rec[3].decode('ascii'))
+                                                              for rec in records[i::2]])
+                  for i in range(2)]
+        merged = FastqQC()
+        for half in halves:
+            qc = FastqQC()
+            for batch in iter_fastq(half):
+                qc.add_fastq_batch(batch)
+            merged.merge(qc)
+        self.assertEqual(merged.summary(), compute_fastq_qc(path))
+
+    def test_empty(self):
+        summary = FastqQC().summary()
+        self.assertEqual(summary['read_count'], 0)
+        self.assertEqual(summary['mean_length'], 0.0)
+
+    def test_plots(self):
+        qc = compute_fastq_qc(os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq'))
+        html = qc_plots_html({'input_fwd': qc, 'output_fwd': qc})
+        self.assertIn('<svg', html)
+        self.assertIn('Per-position mean quality', html)
+        self.assertEqual(qc_plots_html({}), '')
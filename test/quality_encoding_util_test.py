@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_trimmomatic.Utils.QualityEncodingUtil import detect_quality_encoding, resolve_quality_encoding
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+class QualityEncodingUtilTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        # phred64 copy of the phred33 test data
+        cls.phred64_path = os.path.join(cls.tmp_dir, 'test_quick.phred64.fq')
+        with open(os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')) as src, open(cls.phred64_path, 'w') as dst:
+            for line_i, line in enumerate(src):
+                if line_i % 4 == 3:
+                    line = "".join([chr(ord(c) + 31) for c in line.rstrip('\n')]) + '\n'
+                dst.write(line)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_phred33(self):
+        detection = detect_quality_encoding(os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq'))
+        self.assertEqual(detection['encoding'], 'phred33')
+        self.assertEqual(detection['records_sampled'], 2500)
+
+    def test_phred64(self):
+        self.assertEqual(detect_quality_encoding(self.phred64_path)['encoding'], 'phred64')
+
+    def test_bounded_sample(self):
+        detection = detect_quality_encoding(os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq'), max_bytes=5000)
+        self.assertTrue(0 < detection['records_sampled'] < 2500)
+        detection = detect_quality_encoding(os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq'), max_records=10)
+        self.assertEqual(detection['records_sampled'], 10)
+
+    def test_ambiguous(self):
+        path = os.path.join(self.tmp_dir, 'ambiguous.fq')
+        with open(path, 'w') as fh:
+            fh.write('@r1\nACGT\n+\nDEFG\n')
+        self.assertEqual(detect_quality_encoding(path)['encoding'], None)
+        self.assertEqual(resolve_quality_encoding([detect_quality_encoding(path)]), 'phred33')
+
+    def test_mates_must_agree(self):
+        fwd = detect_quality_encoding(os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq'))
+        rev = detect_quality_encoding(self.phred64_path)
+        with self.assertRaises(ValueError):
+            resolve_quality_encoding([fwd, rev])
+        self.assertEqual(resolve_quality_encoding([rev, {'encoding': None}]), 'phred64')
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_trimmomatic.Utils.RunManifest import RunManifest, manifest_key
+
+INPUTS = {'input_reads_ref': '1/2/3',
+          'members': ['1/4/1', '1/5/1', '1/6/1'],
+          'output_ws': 'ws',
+          'output_reads_name': 'trimmed',
+          'params': {'read_type': 'PE', 'min_length': 36}}
+
+
+class RunManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.manifest_dir = os.path.join(self.tmp_dir, 'run_manifests')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resume(self):
+        manifest = RunManifest.open(self.manifest_dir, INPUTS)
+        self.assertTrue(os.path.isfile(manifest.path))
+        result = {'output_filtered_ref': '1/7/1', 'output_unpaired_fwd_ref': None,
+                  'output_unpaired_rev_ref': None, 'report': 'Input Read Pairs: 10', 'library_stats': {}}
+        manifest.set_state('1/4/1', 'started')
+        manifest.set_state('1/4/1', 'downloaded')
+        manifest.set_state('1/4/1', 'trimmed', {'engine': 'native'})
+        manifest.complete('1/4/1', result)
+        manifest.set_state('1/5/1', 'downloaded')
+
+        # a re-run with the same inputs sees the first library as done, the second as unfinished
+        resumed = RunManifest.open(self.manifest_dir, dict(INPUTS))
+        self.assertEqual(resumed.path, manifest.path)
+        self.assertEqual(resumed.completed('1/4/1'), result)
+        self.assertEqual(resumed.libraries['1/4/1']['details'], {'engine': 'native'})
+        self.assertEqual(resumed.completed('1/5/1'), None)
+        self.assertEqual(resumed.state('1/5/1'), 'downloaded')
+        self.assertEqual(resumed.state('1/6/1'), None)
+        # a library a fail-soft run gave up on is run again
+        resumed.set_state('1/6/1', 'failed', {'error': 'corrupt', 'attempts': 3})
+        self.assertEqual(resumed.completed('1/6/1'), None)
+        self.assertEqual(RunManifest.open(self.manifest_dir, INPUTS).state('1/6/1'), 'failed')
+        resumed.finish({'output_filtered_ref': '1/8/1'})
+        with open(manifest.path) as fh:
+            self.assertEqual(json.load(fh)['finished']['outputs'], {'output_filtered_ref': '1/8/1'})
+
+    def test_key_covers_params(self):
+        changed = dict(INPUTS, params={'read_type': 'PE', 'min_length': 50})
+        self.assertNotEqual(manifest_key(changed), manifest_key(INPUTS))
+        manifest = RunManifest.open(self.manifest_dir, INPUTS)
+        manifest.complete('1/4/1', {'output_filtered_ref': '1/7/1'})
+        other = RunManifest.open(self.manifest_dir, changed)
+        self.assertEqual(other.completed('1/4/1'), None)
+
+    def test_damaged_manifest(self):
+        manifest = RunManifest.open(self.manifest_dir, INPUTS)
+        with open(manifest.path, 'w') as fh:
+            fh.write('{"version": 1, "libra')
+        self.assertEqual(RunManifest.open(self.manifest_dir, INPUTS).libraries, {})
+        with self.assertRaises(ValueError):
+            manifest.set_state('1/4/1', 'finished')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from kb_trimmomatic.Utils.ScratchManager import ScratchManager, JOBS_DIR, LOCK_FILE, NEW_PREFIX, NEW_DIR_GRACE_SECONDS
+
+
+def write_file(path, n_bytes):
+    with open(path, 'w') as f:
+        f.write('@' * n_bytes)
+    return path
+
+
+class ScratchManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.tmpfs = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+        shutil.rmtree(self.tmpfs)
+
+    def test_job(self):
+        manager = ScratchManager(self.scratch, tmpfs_dir=None)
+        job = manager.job('library')
+        other_job = manager.job('library')
+        self.assertNotEqual(job.path, other_job.path)
+        self.assertEqual(os.path.dirname(job.path), os.path.join(self.scratch, JOBS_DIR))
+
+        # a download somewhere else in scratch moves into the job
+        download = write_file(os.path.join(self.scratch, 'reads.fastq'), 1000)
+        reads = job.adopt(download)
+        self.assertEqual(os.path.dirname(reads), job.path)
+        self.assertFalse(os.path.exists(download))
+        self.assertEqual(job.checkpoint('downloaded'), 1000)
+
+        output = write_file(job.file('reads_trimm.fastq'), 500)
+        self.assertEqual(job.checkpoint('trimmed'), 1500)
+        job.remove(reads)
+        self.assertEqual(job.checkpoint('uploaded'), 500)
+        stats = job.stats()
+        self.assertEqual(stats['peak_bytes'], 1500)
+        self.assertEqual(stats['removed_bytes'], 1000)
+        self.assertEqual([checkpoint['stage'] for checkpoint in stats['checkpoints']],
+                         ['downloaded', 'trimmed', 'uploaded'])
+
+        # closing removes whatever is left, even after a failure
+        with self.assertRaises(ValueError):
+            with other_job:
+                write_file(other_job.file('partial.fastq'), 10)
+                raise ValueError('upload failed')
+        self.assertFalse(os.path.exists(other_job.path))
+        job.close()
+        self.assertFalse(os.path.exists(output))
+        self.assertEqual(os.listdir(manager.jobs_dir), [])
+
+    def test_clean_orphans(self):
+        manager = ScratchManager(self.scratch, tmpfs_dir=self.tmpfs)
+        live_job = manager.job('library')
+        live_job.local_file('preview', 100)
+        orphan_dir = os.path.join(manager.jobs_dir, 'library_killed')
+        os.makedirs(orphan_dir)
+        write_file(os.path.join(orphan_dir, LOCK_FILE), 0)
+        write_file(os.path.join(orphan_dir, 'reads.fastq'), 100)
+        tmpfs_orphan_dir = os.path.join(manager.tmpfs_jobs_dir, 'sweep_killed')
+        os.makedirs(tmpfs_orphan_dir)
+        # a job directory another run is creating is left alone, one a killed run was creating isn't
+        new_dir = os.path.join(manager.jobs_dir, NEW_PREFIX + 'library_starting')
+        os.makedirs(new_dir)
+        stale_new_dir = os.path.join(manager.jobs_dir, NEW_PREFIX + 'library_killed_starting')
+        os.makedirs(stale_new_dir)
+        stale_time = time.time() - 2 * NEW_DIR_GRACE_SECONDS
+        os.utime(stale_new_dir, (stale_time, stale_time))
+
+        self.assertEqual(sorted(ScratchManager(self.scratch, tmpfs_dir=self.tmpfs).clean_orphans()),
+                         sorted([orphan_dir, tmpfs_orphan_dir, stale_new_dir]))
+        self.assertTrue(os.path.isdir(new_dir))
+        self.assertTrue(os.path.isdir(live_job.path))
+        self.assertTrue(os.path.isdir(live_job.tmpfs_path))
+        live_job.close()
+
+    def test_tmpfs(self):
+        manager = ScratchManager(self.scratch, tmpfs_dir=self.tmpfs)
+        job = manager.job('preview')
+        sample = job.local_file('preview', 1000)
+        self.assertEqual(os.path.dirname(sample), job.tmpfs_path)
+        self.assertEqual(manager.tmpfs_reserved, 1000)
+        write_file(sample + '_fwd.fastq', 1000)
+        self.assertEqual(job.checkpoint('sampled'), 1000)
+
+        # too big for the tmpfs: the job's scratch directory instead
+        stat = os.statvfs(self.tmpfs)
+        self.assertEqual(os.path.dirname(job.local_file('huge', stat.f_blocks * stat.f_frsize)), job.path)
+        job.close()
+        self.assertEqual(manager.tmpfs_reserved, 0)
+        self.assertEqual(os.listdir(manager.tmpfs_jobs_dir), [])
+
+        # no tmpfs at all
+        job = ScratchManager(self.scratch, tmpfs_dir=os.path.join(self.tmpfs, 'missing')).job()
+        self.assertEqual(os.path.dirname(job.local_file('preview', 10)), job.path)
+        job.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from kb_trimmomatic.Utils.FastqIO import read_fastq_batches, count_fastq_records
+from kb_trimmomatic.Utils.FastqIndex import get_fastq_index
+from kb_trimmomatic.Utils.SubsampleUtil import subsample_fastq, sample_records
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+REV = os.path.join(TEST_DATA_DIR, 'test_quick.rev.fq')
+
+
+def read_all(path):
+    return [rec for batch in read_fastq_batches(path) for rec in batch]
+
+
+class SubsampleUtilTest(unittest.TestCase):
+
+    def setUp(self):
+        # copies, so the indexes written next to the inputs stay out of test/data
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fwd = os.path.join(self.tmp_dir, 'fwd.fq')
+        self.rev = os.path.join(self.tmp_dir, 'rev.fq')
+        shutil.copy(FWD, self.fwd)
+        shutil.copy(REV, self.rev)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def out_paths(self, name, n=2):
+        return [os.path.join(self.tmp_dir, name + '_' + str(i) + '.fq') for i in range(n)]
+
+    def test_count_records(self):
+        self.assertEqual(count_fastq_records(FWD), 2500)
+        self.assertEqual(count_fastq_records(FWD, block_size=1000), 2500)
+
+    def test_first(self):
+        out_paths = self.out_paths('first')
+        info = subsample_fastq([self.fwd, self.rev], out_paths, 100, mode='first', batch_size=33)
+        self.assertEqual(info['sampled_reads'], 100)
+        self.assertEqual(read_all(out_paths[0]), read_all(FWD)[:100])
+        self.assertEqual(read_all(out_paths[1]), read_all(REV)[:100])
+
+    def test_random_keeps_mates_in_sync(self):
+        out_paths = self.out_paths('random')
+        info = subsample_fastq([self.fwd, self.rev], out_paths, 500, mode='random', batch_size=100)
+        self.assertEqual(info['total_reads'], 2500)
+        self.assertEqual(info['sampled_reads'], 500)
+        fwd = read_all(out_paths[0])
+        rev = read_all(out_paths[1])
+        self.assertEqual(len(fwd), 500)
+        self.assertEqual([rec[0].split()[0] for rec in fwd], [rec[0].split()[0] for rec in rev])
+        all_fwd = read_all(FWD)
+        self.assertTrue(all([rec in all_fwd for rec in fwd[:20]]))
+
+    def test_random_seeks_with_index(self):
+        # with a fine index only the stretches holding drawn records are read, even when the
+        # mates are indexed at different intervals
+        get_fastq_index(self.fwd, interval=100)
+        get_fastq_index(self.rev, interval=64)
+        out_paths = self.out_paths('seek')
+        info = subsample_fastq([self.fwd, self.rev], out_paths, 5, mode='random', batch_size=7, seed=3)
+        self.assertEqual(info['sampled_reads'], 5)
+        self.assertTrue(info['scanned_reads'] <= 5 * 100)
+        picked = sample_records(np.random.RandomState(3), 2500, 5)
+        self.assertEqual(read_all(out_paths[0]), [read_all(FWD)[i] for i in picked])
+        self.assertEqual(read_all(out_paths[1]), [read_all(REV)[i] for i in picked])
+
+    def test_more_than_available(self):
+        out_paths = self.out_paths('all', 1)
+        info = subsample_fastq([self.fwd], out_paths, 10 ** 6)
+        self.assertEqual(info['sampled_reads'], 2500)
+        with open(FWD, 'rb') as a, open(out_paths[0], 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_bad_mode(self):
+        with self.assertRaises(ValueError):
+            subsample_fastq([self.fwd], self.out_paths('bad', 1), 10, mode='middle')
+
+    def test_random_all(self):
+        out_paths = self.out_paths('random_all', 1)
+        info = subsample_fastq([self.fwd], out_paths, 10 ** 6, mode='random')
+        self.assertEqual(info['sampled_reads'], 2500)
+        self.assertEqual(read_all(out_paths[0]), read_all(FWD))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from kb_trimmomatic.Utils.NativeTrimmer import run_native_trimmomatic
+from kb_trimmomatic.Utils.TrimmingEngines import (make_engines, choose_engine, JarEngine, NativeEngine,
+                                                  ChunkedEngine, MIN_MEASURED_BYTES)
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FWD = os.path.join(TEST_DATA_DIR, 'test_quick.fwd.fq')
+REV = os.path.join(TEST_DATA_DIR, 'test_quick.rev.fq')
+STEPS = 'LEADING:3 TRAILING:3 SLIDINGWINDOW:4:15 MINLEN:36'
+
+
+def read_bytes(path):
+    with open(path, 'rb') as fh:
+        return fh.read()
+
+
+class TrimmingEnginesTest(unittest.TestCase):
+
+    def setUp(self):
+        # copies, so the indexes written next to the inputs stay out of test/data
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fwd = os.path.join(self.tmp_dir, 'fwd.fq')
+        self.rev = os.path.join(self.tmp_dir, 'rev.fq')
+        shutil.copy(FWD, self.fwd)
+        shutil.copy(REV, self.rev)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def outputs(self, prefix, n):
+        return [os.path.join(self.tmp_dir, prefix + str(i) + '.fq') for i in range(n)]
+
+    def test_choose_by_size(self):
+        engines = {'jar': JarEngine('java -jar trimmomatic.jar'),
+                   'native': NativeEngine(),
+                   'chunked': ChunkedEngine(n_workers=16)}
+        verified = ('jar', 'native', 'chunked')
+        # from the default throughputs, before anything has been measured
+        name, estimates = choose_engine(engines, 1024 * 1024, 'phred33', STEPS, verified=verified)
+        self.assertEqual(name, 'native')
+        self.assertEqual(sorted(estimates.keys()), ['chunked', 'jar', 'native'])
+        name, estimates = choose_engine(engines, 20 * 1024 ** 3, 'phred33', STEPS, verified=verified)
+        self.assertEqual(name, 'chunked')
+        self.assertTrue(estimates['chunked'] < estimates['jar'])
+        # the jar on as many threads as the chunked engine has workers still pays the JVM startup
+        name, estimates = choose_engine(engines, 20 * 1024 ** 3, 'phred33', STEPS, threads=16, verified=verified)
+        self.assertEqual(name, 'chunked')
+        # with no throughput for the jar there is nothing to compare with: the jar
+        engines['jar'].bytes_per_second = None
+        name, estimates = choose_engine(engines, 1024 * 1024, 'phred33', STEPS, verified=verified)
+        self.assertEqual(name, 'jar')
+        self.assertEqual(estimates['jar'], 'not measured')
+        engines['jar'].record(100 * 1024 * 1024, engines['jar'].startup_seconds + 10.0)
+        name, estimates = choose_engine(engines, 1024 * 1024, 'phred33', STEPS, verified=verified)
+        self.assertEqual(name, 'native')
+        # steps only the jar can run
+        name, estimates = choose_engine(engines, 10 * 1024 * 1024, 'phred33', STEPS + ' TOPHRED64', verified=verified)
+        self.assertEqual(name, 'jar')
+        self.assertTrue(estimates['native'].startswith('unsupported'))
+        # engines not verified against the jar are never picked
+        name, estimates = choose_engine(engines, 20 * 1024 ** 3, 'phred33', STEPS)
+        self.assertEqual(name, 'jar')
+        self.assertEqual(estimates['chunked'], 'not verified against the jar')
+        # adapter clipping only runs on the jar
+        clip_steps = 'ILLUMINACLIP:TruSeq3-SE.fa:2:30:10 ' + STEPS
+        name, estimates = choose_engine(engines, 20 * 1024 ** 3, 'phred33', clip_steps, verified=verified)
+        self.assertEqual(name, 'jar')
+        self.assertEqual(estimates['chunked'],
+                         'unsupported: Trimming step not supported by the native engine: ILLUMINACLIP:TruSeq3-SE.fa:2:30:10')
+
+    def test_measured_throughput(self):
+        engines = make_engines('java -jar trimmomatic.jar')
+        verified = ('jar', 'native', 'chunked')
+        native = engines['native']
+        native.record(MIN_MEASURED_BYTES // 2, 100.0)  # too small to count
+        self.assertEqual(native.measured_bytes_per_second, None)
+        engines['jar'].record(100 * 1024 * 1024, engines['jar'].startup_seconds + 10.0)
+        # the native engine turns out to be slow on this node, so the jar wins
+        native.record(100 * 1024 * 1024, 1000.0)
+        engines['chunked'].record(100 * 1024 * 1024, 1000.0)
+        name, estimates = choose_engine(engines, 100 * 1024 * 1024, 'phred33', STEPS, verified=verified)
+        self.assertEqual(name, 'jar')
+
+    def test_plan_and_run(self):
+        engine = NativeEngine()
+        outputs = self.outputs('native', 4)
+        plan = engine.plan('PE', 'phred33', [self.fwd, self.rev], outputs, STEPS, input_bytes=1000)
+        self.assertEqual(plan['engine'], 'native')
+        self.assertEqual(plan['inputs'], [self.fwd, self.rev])
+        logged = []
+        lines = engine.run(plan, logged.append)
+        self.assertEqual(logged, lines)
+        self.assertIn('Input Read Pairs: 2500', lines[-2])
+        self.assertEqual(sorted(plan['stats'].keys()),
+                         ['bytes_per_second', 'input_bases', 'input_bytes', 'seconds', 'surviving_bases'])
+
+        reference = self.outputs('reference', 4)
+        run_native_trimmomatic('PE', 'phred33', [self.fwd, self.rev], reference, STEPS)
+        chunked = ChunkedEngine(n_workers=2)
+        chunked_outputs = self.outputs('chunked', 4)
+        chunked_plan = chunked.plan('PE', 'phred33', [self.fwd, self.rev], chunked_outputs, STEPS)
+        chunked.run(chunked_plan, logged.append)
+        self.assertEqual(chunked_plan['stats']['surviving_bases'], plan['stats']['surviving_bases'])
+        for reference_path, chunked_path in zip(reference, chunked_outputs):
+            self.assertEqual(read_bytes(reference_path), read_bytes(chunked_path))
+
+        with self.assertRaises(ValueError):
+            engine.plan('SE', 'phred33', [self.fwd], outputs[:1], 'TOPHRED33')
+
+    def test_jar_command(self):
+        # a stand-in for the jar that prints a Trimmomatic summary line
+        engine = JarEngine(sys.executable + ' -c "print(\'Input Reads: 4 Surviving: 3 (75.00%) Dropped: 1 (25.00%)\')"')
+        plan = engine.plan('SE', 'phred33', [self.fwd], self.outputs('jar', 1), STEPS)
+        self.assertIn(' SE -phred33 ' + self.fwd + ' ', engine.command_line(plan))
+        logged = []
+        # the extra arguments go to the stand-in's sys.argv
+        lines = engine.run(plan, logged.append)
+        self.assertIn('Input Reads: 4', lines[0])
+        self.assertEqual(logged[-1], 'return code: 0\n')
+        failing = JarEngine(sys.executable + ' -c "import sys; sys.exit(3)"')
+        with self.assertRaises(ValueError):
+            failing.run(failing.plan('SE', 'phred33', [self.fwd], self.outputs('jar', 1), STEPS), logged.append)